@@ -49,8 +49,9 @@ def create_app(config_class=None):
     os.makedirs(data_dir, exist_ok=True)
     app.config['DATA_DIR'] = data_dir
     
-    # 配置SQLAlchemy
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(data_dir, 'app.db')
+    # 配置SQLAlchemy: 设置了 DATABASE_URL 时使用该数据库，否则使用数据目录下的SQLite
+    from app.utils.db_engine import configure_database, init_engine
+    configure_database(app, data_dir)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     if config_class is None:
@@ -63,12 +64,16 @@ def create_app(config_class=None):
     except OSError:
         pass
     
-    # 初始化数据库
+    # 初始化数据库，SQLite连接启用WAL等设置
     db.init_app(app)
+    init_engine(app, db)
     
     # 创建数据库表
     with app.app_context():
         db.create_all()
+        # 为已有的表补充新增的列
+        from app.utils.db import upgrade_schema
+        upgrade_schema()
     
     # 启用CORS，允许所有来源的跨域请求
     CORS(app, resources={r"/*": {
@@ -81,6 +86,30 @@ def create_app(config_class=None):
     from app.api import register_blueprints
     register_blueprints(app)
     
+    # 绑定交易规则缓存的后台刷新
+    from app.services import symbol_metadata
+    symbol_metadata.init_app(app)
+    
+    # 清理上次运行遗留的后台任务
+    from app.services import job_queue
+    job_queue.init_app(app)
+    
+    # 手续费日汇总: 注册重建命令，首次启动时根据已有记录生成
+    from app.services import fee_rollup
+    fee_rollup.init_app(app)
+    
+    # 网格监控: 接管上次运行遗留的RUNNING网格，核对挂单后继续监控
+    from app.services import grid_monitor
+    grid_monitor.init_app(app)
+    
+    # API密钥健康检查: 后台定期探测子账号密钥，结果供子账号详情接口读取
+    from app.services import key_health
+    key_health.init_app(app)
+    
+    # 子账号目录: 绑定后台刷新线程，子账号列表和详情接口读取本地表
+    from app.services import subaccount_directory
+    subaccount_directory.init_app(app)
+    
     # 定义根路由
     @app.route('/')
     def index():
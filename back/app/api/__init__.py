@@ -19,6 +19,8 @@ def register_blueprints(app):
     from app.api.margin import margin_bp
     from app.api.account import account_bp
     from app.api.binance import binance_bp
+    from app.api.jobs import jobs_bp
+    from app.api.history import history_bp
     
     # 注册蓝图
     app.register_blueprint(auth_bp)
@@ -34,6 +36,8 @@ def register_blueprints(app):
     app.register_blueprint(margin_bp)
     app.register_blueprint(account_bp)
     app.register_blueprint(binance_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(history_bp)
 
     # 创建一个catch-all路由，确保所有请求都被拦截和处理
     @app.route('/', defaults={'path': ''})
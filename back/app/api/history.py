@@ -0,0 +1,132 @@
+import logging
+from flask import Blueprint, jsonify, request
+from app.utils.auth import token_required
+from app.services.trade_history import (
+    TRADE_MARKETS, clamp_page_size, format_local_time, parse_local_date,
+    query_orders, query_trades, serialize_trade
+)
+
+logger = logging.getLogger(__name__)
+history_bp = Blueprint('history', __name__, url_prefix='/api/history')
+
+
+def _split_param(name):
+    """解析逗号分隔的查询参数"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _side_param():
+    side = request.args.get('side')
+    return side.upper() if side else None
+
+
+@history_bp.route('/trades', methods=['GET'])
+@token_required
+def get_trades(current_user):
+    """
+    查询本地同步的成交记录(游标分页，按成交时间倒序)
+
+    查询参数:
+    - email: 子账号邮箱(必填)
+    - market: 市场，margin / um / cm，多个用逗号分隔，默认全部
+    - symbol: 交易对(可选)
+    - side: BUY / SELL(可选)
+    - startDate / endDate: 本地日期 YYYY-MM-DD(可选)
+    - cursor: 上一页返回的 nextCursor，为空时查询第一页
+    - limit: 每页数量，默认20，最多500
+    """
+    email = request.args.get('email')
+    if not email:
+        return jsonify({
+            'success': False,
+            'error': '请提供子账号邮箱参数'
+        }), 400
+
+    markets = _split_param('market')
+    if markets and any(market not in TRADE_MARKETS for market in markets):
+        return jsonify({
+            'success': False,
+            'error': f"不支持的市场: {request.args.get('market')}"
+        }), 400
+
+    limit = clamp_page_size(request.args.get('limit'))
+    try:
+        trades, next_cursor = query_trades(
+            email,
+            markets=markets,
+            symbol=request.args.get('symbol'),
+            side=_side_param(),
+            start=parse_local_date(request.args.get('startDate')),
+            end=parse_local_date(request.args.get('endDate'), end=True),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'data': {
+            'records': [serialize_trade(trade) for trade in trades],
+            'nextCursor': next_cursor,
+            'limit': limit
+        }
+    })
+
+
+@history_bp.route('/orders', methods=['GET'])
+@token_required
+def get_orders(current_user):
+    """
+    查询本地订单记录(游标分页，按创建时间倒序)
+
+    查询参数:
+    - email: 子账号邮箱(可选)
+    - symbol: 交易对(可选)
+    - status: 订单状态，多个用逗号分隔(可选)，如 NEW,PARTIALLY_FILLED
+    - side: BUY / SELL(可选)
+    - grid_id: 网格ID(可选)
+    - startDate / endDate: 本地日期 YYYY-MM-DD(可选)
+    - cursor: 上一页返回的 nextCursor，为空时查询第一页
+    - limit: 每页数量，默认20，最多500
+    """
+    statuses = _split_param('status')
+    limit = clamp_page_size(request.args.get('limit'))
+    try:
+        orders, next_cursor = query_orders(
+            email=request.args.get('email'),
+            symbol=request.args.get('symbol'),
+            statuses=[status.upper() for status in statuses] if statuses else None,
+            side=_side_param(),
+            grid_id=request.args.get('grid_id'),
+            start=parse_local_date(request.args.get('startDate')),
+            end=parse_local_date(request.args.get('endDate'), end=True),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    records = []
+    for order in orders:
+        record = order.to_dict()
+        record['local_time'] = format_local_time(order.created_at)
+        records.append(record)
+
+    return jsonify({
+        'success': True,
+        'data': {
+            'records': records,
+            'nextCursor': next_cursor,
+            'limit': limit
+        }
+    })
@@ -0,0 +1,162 @@
+import json
+import logging
+import time
+from flask import Blueprint, jsonify, request, Response, stream_with_context
+from sqlalchemy import or_
+from app.models import db
+from app.models.job import BackgroundJob
+from app.services.job_queue import get_job_queue
+from app.utils.auth import token_required
+
+logger = logging.getLogger(__name__)
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+# SSE连接无状态变化时发送心跳的间隔(秒)
+STREAM_HEARTBEAT_INTERVAL = 15
+# 任务不在本进程内存中时轮询数据库的间隔(秒)
+STREAM_POLL_INTERVAL = 1
+
+
+def _visible(user_id, current_user):
+    """用户只能查看自己提交的任务；没有提交用户的系统任务(如成交后台同步)对已登录用户可见"""
+    return user_id is None or user_id == current_user.id
+
+
+def _load_job(job_id, current_user, include_results=True):
+    """优先读取本进程中的实时状态，不存在时读取数据库记录；任务不存在或无权查看时返回None"""
+    state = get_job_queue().get_state(job_id)
+    if state is not None:
+        return state.to_dict(include_results) if _visible(state.user_id, current_user) else None
+
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or not _visible(job.user_id, current_user):
+        return None
+    return job.to_dict(include_results)
+
+
+@jobs_bp.route('', methods=['GET'])
+@token_required
+def list_jobs(current_user):
+    """
+    查询当前用户提交的后台任务列表(包含没有提交用户的系统任务)
+
+    查询参数:
+    - type: 任务类型(可选)
+    - status: 任务状态(可选)，pending / running / succeeded / failed
+    - limit: 返回数量，默认20，最多100
+    """
+    query = BackgroundJob.query.filter(or_(
+        BackgroundJob.user_id == current_user.id,
+        BackgroundJob.user_id.is_(None)
+    ))
+    if request.args.get('type'):
+        query = query.filter_by(job_type=request.args['type'])
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    jobs = query.order_by(BackgroundJob.created_at.desc()).limit(limit).all()
+
+    queue = get_job_queue()
+    data = []
+    for job in jobs:
+        state = queue.get_state(job.id)
+        data.append(state.to_dict(False) if state is not None else job.to_dict(False))
+
+    return jsonify({
+        'success': True,
+        'data': data,
+        'queue': queue.status()
+    })
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+@token_required
+def get_job(current_user, job_id):
+    """
+    查询后台任务状态、进度和结果
+
+    返回的 results 为已完成项的结果，result 为任务结束后的最终结果
+    """
+    job = _load_job(job_id, current_user)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': '任务不存在'
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'data': job
+    })
+
+
+@jobs_bp.route('/<job_id>/stream', methods=['GET'])
+@token_required
+def stream_job(current_user, job_id):
+    """
+    以SSE方式推送后台任务状态
+
+    事件:
+    - progress: 状态或进度变化，data 为任务状态(不含结果)，new_results 为自上次推送以来新完成项的结果
+    - done: 任务结束，data 为完整的任务状态和最终结果
+    """
+    if _load_job(job_id, current_user, include_results=False) is None:
+        return jsonify({
+            'success': False,
+            'error': '任务不存在'
+        }), 404
+
+    def event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+    def generate():
+        sent_results = 0
+        version = None
+        last_sent = time.time()
+
+        while True:
+            state = get_job_queue().get_state(job_id)
+            if state is not None:
+                # 本进程执行的任务，等待内存状态变化
+                if version is not None:
+                    state.wait(version, STREAM_HEARTBEAT_INTERVAL)
+                version = state.version
+                job = state.to_dict()
+            else:
+                # 其他进程执行的任务，轮询数据库
+                if version is not None:
+                    time.sleep(STREAM_POLL_INTERVAL)
+                db.session.expire_all()
+                record = db.session.get(BackgroundJob, job_id)
+                if record is None:
+                    yield event('done', {'id': job_id, 'status': BackgroundJob.FAILED, 'error': '任务不存在'})
+                    return
+                job = record.to_dict()
+                changed = (job['status'], job['completed'], job['total'])
+                if changed == version:
+                    if time.time() - last_sent >= STREAM_HEARTBEAT_INTERVAL:
+                        last_sent = time.time()
+                        yield ': heartbeat\n\n'
+                    continue
+                version = changed
+
+            if job['status'] in BackgroundJob.FINISHED_STATUSES:
+                yield event('done', job)
+                return
+
+            results = job.pop('results')
+            job.pop('result', None)
+            job['new_results'] = results[sent_results:]
+            sent_results = len(results)
+            last_sent = time.time()
+            yield event('progress', job)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
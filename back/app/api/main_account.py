@@ -3,6 +3,7 @@ import json
 from flask import Blueprint, request, jsonify, current_app
 from app.utils.auth import token_required
 from app.services.binance_client import BinanceClient
+from app.services.price_cache import get_prices
 from app.models.user import User, APIKey
 from app.models.account import SubAccountAPISettings
 
@@ -80,15 +81,12 @@ def get_master_account_assets(current_user):
         account_data = account_response.get('data', {})
         balances = account_data.get('balances', [])
         
-        # 获取所有交易对的价格以计算USDT价值
-        price_response = client._send_request('GET', '/api/v3/ticker/price')
+        # 从价格缓存获取所有交易对的价格以计算USDT价值
+        cached_prices, price_meta = get_prices('spot')
         
-        if not price_response.get('success'):
-            logger.warning(f"获取价格信息失败: {price_response.get('error')}")
-            prices = {}
-        else:
-            price_data = price_response.get('data', [])
-            prices = {item['symbol']: float(item['price']) for item in price_data}
+        if not cached_prices:
+            logger.warning("获取价格信息失败: 价格缓存不可用")
+        prices = {symbol: float(price) for symbol, price in cached_prices.items()}
         
         # 获取BTC/USDT价格
         btc_usdt_price = prices.get('BTCUSDT', 0)
@@ -157,7 +155,8 @@ def get_master_account_assets(current_user):
             "data": {
                 "assets": processed_assets,
                 "totalValue": total_usdt_value,
-                "btcValue": total_btc_value
+                "btcValue": total_btc_value,
+                "priceAgeMs": price_meta['age_ms'] if price_meta else None
             }
         })
         
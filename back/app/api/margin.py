@@ -69,8 +69,7 @@ def get_margin_orders():
         
         # 构建API请求参数 - 确保参数格式正确
         params = {
-            'symbol': symbol,
-            'recvWindow': 60000
+            'symbol': symbol
         }
         
         # 添加可选参数
@@ -231,8 +230,7 @@ def get_margin_trades():
         
         # 构建API请求参数 - 确保参数格式正确
         params = {
-            'symbol': symbol,
-            'recvWindow': 60000
+            'symbol': symbol
         }
         
         # 添加可选参数（若提供）
@@ -1,35 +1,16 @@
 import logging
 from flask import Blueprint, request, jsonify, redirect, url_for
 from app.utils.auth import token_required
-from app.services.binance_client import BinanceClient
+from app.services.batch_executor import run_batch, resolve_concurrency
+from app.services.client_registry import get_client_registry
+from app.services.price_cache import get_price
+from app.services.leverage_cache import ensure_leverage
 import time
 
 # 修改蓝图定义，添加URL前缀
 market_bp = Blueprint('market', __name__, url_prefix='/api/market')
 logger = logging.getLogger(__name__)
 
-def get_subaccount_api_keys(email):
-    """
-    获取子账号API密钥
-    
-    参数:
-    - email: 子账号邮箱
-    
-    返回:
-    - (api_key, api_secret): 子账号API密钥对
-    """
-    from app.services.binance_client import get_sub_account_api_credentials
-    
-    # 从数据库获取子账号API密钥
-    api_key, api_secret = get_sub_account_api_credentials(email)
-    
-    if not api_key or not api_secret:
-        logger.error(f"未找到子账号 {email} 的API密钥设置，无法进行交易")
-        return None, None
-        
-    logger.info(f"已获取子账号 {email} 的API密钥设置，将使用子账号自己的API密钥进行交易")
-    return api_key, api_secret
-
 @market_bp.route('/trade', methods=['POST'])
 @token_required
 def execute_trade(current_user):
@@ -117,17 +98,14 @@ def execute_trade(current_user):
         # 如果use_subaccount_api为True，强制使用子账号API
         if use_subaccount_api:
             logger.info(f"按前端要求强制使用子账号API: {email}")
-            api_key, api_secret = get_subaccount_api_keys(email)
+            client = get_client_registry().get_client(email)
             
-            if not api_key or not api_secret:
+            if client is None:
                 return jsonify({
                     "success": False,
                     "error": f"未找到子账号 {email} 的API密钥设置"
                 }), 400
                 
-            client = BinanceClient(api_key, api_secret)
-            client.is_subaccount = True
-            client.subaccount_email = email
             logger.info(f"成功创建子账号 {email} 的API客户端")
         else:
             # 使用原来的客户端获取逻辑
@@ -233,11 +211,9 @@ def execute_trade(current_user):
                     else:
                         leverage_symbol = symbol
                         
+                    # 已知杠杆与目标相同时跳过设置
                     logger.info(f"设置{leverage_symbol}币本位合约杠杆倍数为: {leverage}x")
-                    leverage_result = client.set_coin_futures_leverage(
-                        symbol=leverage_symbol,
-                        leverage=leverage
-                    )
+                    leverage_result = ensure_leverage(client, email, leverage_symbol, leverage, 'cm')
                     logger.info(f"设置杠杆倍数结果: {leverage_result}")
                 except Exception as e:
                     logger.warning(f"设置杠杆倍数失败: {e}，将继续使用默认杠杆倍数")
@@ -333,8 +309,11 @@ def execute_batch_trade(current_user):
         "useSubAccountApi": 是否强制使用子账号API (可选，布尔值),
         "useAsset": 使用的资产 (自定义参数，不直接传递给API),
         "margin_accounts": ["杠杆账户邮箱1", "杠杆账户邮箱2", ...],
-        "leverage": 杠杆倍数 (可选，整数)
+        "leverage": 杠杆倍数 (可选，整数),
+        "concurrency": 并发下单数 (可选，整数，默认使用配置 BATCH_TRADE_CONCURRENCY)
     }
+    
+    返回结果中的 latency 字段包含并发数、总耗时以及首个与最后一个账号下单响应之间的时间差(毫秒)
     """
     data = request.json
     if not data:
@@ -406,172 +385,115 @@ def execute_batch_trade(current_user):
             "error": "必须提供交易数量(quantity)或交易金额(quoteOrderQty)参数中的至少一个"
         }), 400
     
-    # 处理结果
-    batch_result = []
-    success_count = 0
-    fail_count = 0
+    # U本位合约只提供了金额时，在并发下单前统一换算一次数量，保证所有账号使用同一价格
+    if market_type == 'portfolio_margin_um' and not quantity and quote_order_qty:
+        try:
+            ticker = get_price(symbol, 'spot')
+            
+            if ticker:
+                current_price = float(ticker['price'])
+                if current_price > 0:
+                    # 计算数量
+                    calculated_quantity = float(quote_order_qty) / current_price
+                    # 简单取整处理
+                    quantity = str(round(calculated_quantity, 8))
+                    logger.info(f"按USDT金额交易: 交易对={symbol}, 金额={quote_order_qty}USDT, 当前价格={current_price}, 计算数量={quantity}")
+        except Exception as e:
+            logger.error(f"计算交易数量出错: {str(e)}")
     
-    # 批量执行交易
-    for email in accounts:
+    def place_for_account(email):
+        """为单个子账号下单，返回该账号的结果"""
         try:
-            # 获取子账号API密钥
-            api_key, api_secret = get_subaccount_api_keys(email)
+            # 使用客户端注册表中缓存的子账号客户端(已标记为子账号API)
+            client = get_client_registry().get_client(email)
             
-            if not api_key or not api_secret:
-                batch_result.append({
+            if client is None:
+                return {
                     'email': email,
                     'symbol': symbol,
                     'success': False,
-                    'error': "未找到子账号API密钥设置"
-                })
-                fail_count += 1
-                continue
-            
-            # 创建客户端并强制标记为子账号API
-            client = BinanceClient(api_key, api_secret)
-            client.is_subaccount = True
-            client.subaccount_email = email
+                    'error': "未找到子账号API密钥设置或密钥格式无效"
+                }
             
             logger.info(f"批量交易: 强制使用子账号 {email} 的API密钥执行交易, 市场类型: {market_type}")
             
-            # 构建通用请求参数
-            params = {
-                'symbol': symbol,
-                'side': side,
-                'type': order_type,
-            }
-            
-            # 优化参数，确保格式正确
-            trade_params = {
-                'symbol': symbol,
-                'side': side,
-                'order_type': order_type,
-                'price': price if order_type == 'LIMIT' else None,
-                'time_in_force': data.get('timeInForce', 'GTC') if order_type == 'LIMIT' else None
-            }
-            
-            # 添加数量参数 - 优先使用quantity，其次使用quoteOrderQty
-            if quantity:
-                # 确保quantity是字符串格式
-                trade_params['quantity'] = str(quantity)
-                logger.info(f"使用数量参数: quantity={trade_params['quantity']}")
-            elif quote_order_qty:
-                # 确保quoteOrderQty是字符串格式
-                trade_params['quoteOrderQty'] = str(quote_order_qty)
-                logger.info(f"使用金额参数: quoteOrderQty={trade_params['quoteOrderQty']}")
-            
-            # 根据不同市场类型执行交易
             if market_type == 'portfolio_margin':
                 # 统一账户杠杆交易
-                # 使用封装好的方法下单
-                local_result = client.place_portfolio_margin_order(**trade_params)
-                
-                batch_result.append({
-                    'email': email,
+                trade_params = {
                     'symbol': symbol,
-                    'success': local_result.get('success', False),
-                    'data': local_result.get('data'),
-                    'error': local_result.get('error')
-                })
-                
-                if local_result.get('success', False):
-                    success_count += 1
-                else:
-                    fail_count += 1
-                
-                # 跳过下面的处理，直接处理下一个订单
-                continue
-                
-            elif market_type == 'portfolio_margin_um':
-                # 统一账户UM合约交易
+                    'side': side,
+                    'order_type': order_type,
+                    'price': price if order_type == 'LIMIT' else None,
+                    'time_in_force': data.get('timeInForce', 'GTC') if order_type == 'LIMIT' else None
+                }
                 
-                # 添加合约特有参数
-                if data.get('reduceOnly'):
-                    params['reduceOnly'] = 'true'
+                # 添加数量参数 - 优先使用quantity，其次使用quoteOrderQty
+                if quantity:
+                    trade_params['quantity'] = str(quantity)
+                elif quote_order_qty:
+                    trade_params['quoteOrderQty'] = str(quote_order_qty)
                 
-                # 检查quantity是否存在，这是必须的
-                if not quantity and quote_order_qty:
-                    # 如果只提供了quoteOrderQty，需要计算quantity
-                    try:
-                        # 获取当前价格，计算数量
-                        ticker_response = client._send_request(
-                            'GET', 
-                            '/api/v3/ticker/price', 
-                            params={'symbol': symbol}
-                        )
-                        
-                        if ticker_response.get('success'):
-                            current_price = float(ticker_response.get('data', {}).get('price', 0))
-                            if current_price > 0:
-                                # 计算数量
-                                calculated_quantity = float(quote_order_qty) / current_price
-                                # 简单取整处理
-                                quantity = str(round(calculated_quantity, 8))
-                                logger.info(f"按USDT金额交易: 交易对={symbol}, 金额={quote_order_qty}USDT, 当前价格={current_price}, 计算数量={quantity}")
-                    except Exception as e:
-                        logger.error(f"计算交易数量出错: {str(e)}")
+                result = client.place_portfolio_margin_order(**trade_params)
                 
-                # 如果仍然没有quantity，则报错
+            else:
+                # 统一账户UM合约交易，数量已在下单前统一计算
                 if not quantity:
-                    batch_result.append({
+                    return {
                         'email': email,
                         'symbol': symbol,
                         'success': False,
                         'error': "必须提供交易数量(quantity)"
-                    })
-                    fail_count += 1
-                    continue
+                    }
                 
-                # 优化参数，确保格式正确
                 trade_params = {
                     'symbol': symbol,
                     'side': side,
                     'order_type': order_type,
-                    'quantity': quantity,  # 确保quantity存在
+                    'quantity': quantity,
                     'price': price if order_type == 'LIMIT' else None,
                     'time_in_force': data.get('timeInForce', 'GTC') if order_type == 'LIMIT' else None
                 }
                 
-                # 将其他参数添加到trade_params
-                for key, value in params.items():
-                    if key not in ['symbol', 'side', 'type', 'quantity', 'price', 'timeInForce', 'quoteOrderQty']:
-                        trade_params[key] = value
+                # 添加合约特有参数
+                if data.get('reduceOnly'):
+                    trade_params['reduceOnly'] = 'true'
+                
+                # 指定了杠杆倍数时先设置，已知杠杆与目标相同时跳过
+                if leverage is not None:
+                    leverage_result = ensure_leverage(client, email, symbol, leverage, 'um')
+                    if not leverage_result.get('success'):
+                        logger.warning(f"子账号 {email} 设置杠杆倍数失败: {leverage_result.get('error')}，将使用当前杠杆倍数下单")
                 
                 # 调用U本位合约下单接口
                 result = client.place_portfolio_margin_order_um(**trade_params)
-                
-                batch_result.append({
-                    'email': email,
-                    'symbol': symbol,
-                    'success': result.get('success', False),
-                    'data': result.get('data'),
-                    'error': result.get('error')
-                })
-                
-                if result.get('success', False):
-                    success_count += 1
-                else:
-                    fail_count += 1
-            else:
-                # 不支持的市场类型
-                batch_result.append({
-                    'email': email,
-                    'symbol': symbol,
-                    'success': False,
-                    "error": f"不支持的市场类型: {market_type}，系统已升级为仅支持统一账户交易"
-                })
-                fail_count += 1
-                continue
+            
+            return {
+                'email': email,
+                'symbol': symbol,
+                'success': result.get('success', False),
+                'data': result.get('data'),
+                'error': result.get('error')
+            }
                 
         except Exception as e:
             error_msg = str(e)
             logger.exception(f"为账号 {email} 执行交易时出错: {error_msg}")
-            batch_result.append({
+            return {
                 "email": email,
                 "success": False,
                 "error": error_msg
-            })
-            fail_count += 1
+            }
+    
+    # 并发执行交易，结果顺序与accounts一致；请求频率由客户端内的调度器控制
+    concurrency = resolve_concurrency(
+        data.get('concurrency'),
+        service='papi',
+        task_count=len(accounts)
+    )
+    batch_result, latency = run_batch(accounts, place_for_account, concurrency)
+    
+    success_count = sum(1 for item in batch_result if item.get('success'))
+    fail_count = len(batch_result) - success_count
     
     return jsonify({
         "success": True,
@@ -580,6 +502,7 @@ def execute_batch_trade(current_user):
             "success_count": success_count,
             "fail_count": fail_count,
             "results": batch_result,
+            "latency": latency,
             "request": {
                 "marketType": market_type,
                 "symbol": symbol,
@@ -622,35 +545,17 @@ def get_ticker(current_user):
             
         logger.info(f"获取交易对 {symbol} 价格, 市场类型: {market_type}, 子账号: {email}")
         
-        # 创建客户端
-        client = None
-        if email:
-            # 尝试获取子账号API密钥
-            from app.services.binance_client import get_client_by_email
-            client = get_client_by_email(email)
-            
-        # 如果没有提供email或找不到子账号API密钥，使用主账号API
-        if not client:
-            from app.services.binance_client import get_binance_client
-            client = get_binance_client(current_user.id)
-            
-        # 如果仍然没有客户端（API密钥不可用），则创建无API密钥的客户端
-        if not client:
-            logger.warning(f"无法获取有效的API客户端，使用无密钥客户端获取公开数据")
-            client = BinanceClient('', '')
-        
         # 标准化市场类型
         market_type = market_type.lower()
         
         # 市场类型映射
         coin_futures_types = ['coin_futures', 'dcoin_futures', 'coin-futures', 'delivery', 'delivery_futures']
         usdt_futures_types = ['futures', 'usdt_futures', 'usdt-futures', 'portfolio_margin_um', 'um']
-        portfolio_margin_types = ['portfolio_margin', 'portfolio', 'margin']
         
-        # 根据市场类型选择不同的API端点
+        # 根据市场类型选择价格缓存 - 价格为公开数据，无需使用子账号或主账号API
         if market_type in coin_futures_types:
             # 币本位合约
-            endpoint = 'dapi/v1/ticker/price'
+            price_market = 'cm'
             
             # 如果symbol不包含D（币本位标识），且不是特定指数，添加永续后缀
             if 'USDT' in symbol and '_' not in symbol and 'PERP' not in symbol:
@@ -658,60 +563,34 @@ def get_ticker(current_user):
                 base_asset = symbol.replace('USDT', '')
                 symbol = f"{base_asset}USD_PERP"  # 币本位永续合约的格式
                 logger.info(f"转换为币本位合约格式: {symbol}")
-                
-            params = {'symbol': symbol}
-            logger.info(f"使用币本位合约API查询价格，端点: {endpoint}, 参数: {params}")
-            result = client._send_request('GET', endpoint, params=params)
             
         elif market_type in usdt_futures_types:
             # U本位合约
-            endpoint = 'fapi/v1/ticker/price'
-            params = {'symbol': symbol}
-            logger.info(f"使用U本位合约API查询价格，端点: {endpoint}, 参数: {params}")
-            result = client._send_request('GET', endpoint, params=params)
-            
-        elif market_type in portfolio_margin_types:
-            # 统一账户/杠杆交易
-            endpoint = 'api/v3/ticker/price'
-            params = {'symbol': symbol}
-            logger.info(f"使用统一账户API查询价格，端点: {endpoint}, 参数: {params}")
-            result = client._send_request('GET', endpoint, params=params)
+            price_market = 'um'
             
         else:
-            # 默认使用现货市场
-            params = {'symbol': symbol}
-            endpoint = 'api/v3/ticker/price'
-            logger.info(f"使用现货API查询价格，端点: {endpoint}, 参数: {params}")
-            result = client._send_request('GET', endpoint, params=params)
-            
-        if not result.get('success'):
-            logger.error(f"获取 {symbol} 价格失败: {result.get('error')}")
-            return jsonify(result), 400
-            
-        # 记录结果
-        logger.info(f"获取 {symbol} 价格成功: {result.get('data')}")
+            # 统一账户/杠杆交易和现货市场均使用现货价格
+            price_market = 'spot'
+        
+        ticker = get_price(symbol, price_market)
+        if not ticker:
+            logger.error(f"获取 {symbol} 价格失败")
+            return jsonify({
+                "success": False,
+                "error": f"获取 {symbol} 价格失败"
+            }), 400
+        
+        result = {'success': True, 'data': ticker}
             
         # 尝试获取交易对的基础货币价格（如果需要）
         # 例如：如果请求BTCUSD但需要BTCUSDT价格
         if 'USDT' not in symbol and market_type == 'spot':
-            try:
-                # 构建USDT交易对并获取价格
-                base_asset = symbol.split('USD')[0]
-                if base_asset:
-                    usdt_symbol = f"{base_asset}USDT"
-                    
-                    logger.info(f"尝试获取基础资产 {base_asset} 的USDT价格，使用交易对 {usdt_symbol}")
-                    
-                    usdt_params = {'symbol': usdt_symbol}
-                    usdt_result = client._send_request('GET', endpoint, params=usdt_params)
-                    
-                    if usdt_result.get('success'):
-                        # 将USDT价格添加到结果中
-                        result['data']['usdt_price'] = usdt_result['data']['price']
-                        logger.info(f"获取 {usdt_symbol} 价格成功: {usdt_result['data']['price']}")
-            except Exception as e:
-                logger.warning(f"获取USDT价格时出错 (非严重): {str(e)}")
-                # 忽略此错误，不影响主流程
+            base_asset = symbol.split('USD')[0]
+            if base_asset:
+                usdt_ticker = get_price(f"{base_asset}USDT", 'spot')
+                if usdt_ticker:
+                    # 将USDT价格添加到结果中
+                    result['data']['usdt_price'] = usdt_ticker['price']
         
         return jsonify(result)
         
@@ -748,38 +627,28 @@ def get_binance_ticker_price(current_user):
             
         logger.info(f"获取币安实时价格: {symbol}")
         
-        # 创建无API密钥的客户端获取公开数据
-        from app.services.binance_client import BinanceClient
-        client = BinanceClient('', '')
-        
-        # 根据交易对确定市场类型
-        endpoint = 'api/v3/ticker/price'  # 默认使用现货API
-        params = {'symbol': symbol}
+        # 根据交易对确定市场类型，默认使用现货价格
+        price_markets = ['spot', 'um']
         
         # 检查是否为期货交易对
         if 'PERP' in symbol:
             # 币本位合约
-            endpoint = 'dapi/v1/ticker/price'
+            price_markets = ['cm']
         elif symbol.endswith('USDT') and any(c in symbol for c in ['BTC', 'ETH', 'BNB']):
-            # 常见的U本位合约交易对
-            # 尝试U本位合约API
-            endpoint = 'fapi/v1/ticker/price'
+            # 常见的U本位合约交易对，U本位合约查询失败时尝试现货
+            price_markets = ['um', 'spot']
         
-        logger.info(f"使用API查询实时价格，端点: {endpoint}, 参数: {params}")
-        result = client._send_request('GET', endpoint, params=params)
+        # 从价格缓存读取，第一个市场没有该交易对时尝试其他市场
+        ticker = None
+        for price_market in price_markets:
+            ticker = get_price(symbol, price_market)
+            if ticker:
+                break
         
-        if not result.get('success'):
-            # 如果第一次尝试失败，尝试其他市场类型
-            if endpoint == 'fapi/v1/ticker/price':
-                # 尝试现货市场
-                endpoint = 'api/v3/ticker/price'
-                logger.info(f"U本位合约查询失败，尝试现货API，端点: {endpoint}")
-                result = client._send_request('GET', endpoint, params=params)
-            elif endpoint == 'api/v3/ticker/price':
-                # 尝试U本位合约
-                endpoint = 'fapi/v1/ticker/price'
-                logger.info(f"现货API查询失败，尝试U本位合约API，端点: {endpoint}")
-                result = client._send_request('GET', endpoint, params=params)
+        if ticker:
+            result = {'success': True, 'data': ticker}
+        else:
+            result = {'success': False, 'error': f"未找到交易对 {symbol} 的价格"}
         
         if not result.get('success'):
             logger.error(f"获取 {symbol} 实时价格失败: {result.get('error')}")
@@ -2,7 +2,9 @@ from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime
 import logging
 import time
-from app.services.binance_client import BinanceClient, get_sub_account_api_credentials
+from app.services.binance_client import get_client_by_email
+from app.services.price_cache import get_price
+from app.services.job_queue import background_job, report_progress
 from app.models.account import SubAccountAPISettings
 from binance.exceptions import BinanceAPIException
 from app.api.auth import login_required, authenticated_user
@@ -12,6 +14,7 @@ logger = logging.getLogger(__name__)
 portfolio_bp = Blueprint('portfolio', __name__, url_prefix='/api/portfolio')
 
 @portfolio_bp.route('/cm/grid-trade', methods=['POST'])
+@background_job('portfolio.cm_grid_trade')
 def cm_grid_trade():
     """
     统一账户下的币本位合约网格交易
@@ -26,9 +29,10 @@ def cm_grid_trade():
         "leverage": "杠杆倍数",
         "single_amount": "单笔数量",
         "orders_count": "订单数量",
-        "interval": "时间间隔(秒)",
+        "interval": "时间间隔(秒，已不再使用，下单频率由客户端统一控制)",
         "contract_type": "合约类型(coin_futures)",
-        "both_sides": "是否同时建立多空仓位"
+        "both_sides": "是否同时建立多空仓位",
+        "async": "是否提交为后台任务(可选)，通过 /api/jobs/<id> 查询进度"
     }
     """
     try:
@@ -46,7 +50,6 @@ def cm_grid_trade():
         price = float(data.get('price'))
         single_amount = float(data.get('single_amount'))
         orders_count = int(data.get('orders_count'))
-        interval = int(data.get('interval', 5))
         leverage = int(data.get('leverage', 1))
         both_sides = data.get('both_sides', True)
         
@@ -61,82 +64,68 @@ def cm_grid_trade():
             return jsonify({"success": False, "message": "订单数量必须大于0"})
         
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({
                 "success": False,
                 "message": "子账号API未配置或不可用"
             })
         
-        client = BinanceClient(api_key, api_secret)
-        
         # 尝试使用统一账户API创建网格订单
         try:
-            # 创建多个订单
-            created_orders = []
+            # 所有网格订单通过批量下单接口提交，每个请求最多5个订单
+            sides = ["BUY", "SELL"] if both_sides else ["BUY"]
+            orders = [
+                {
+                    "symbol": symbol,
+                    "side": side,
+                    "type": "LIMIT",
+                    "quantity": single_amount,
+                    "price": price,
+                    "timeInForce": "GTC"
+                }
+                for _ in range(orders_count)
+                for side in sides
+            ]
             
-            # 计算总订单数
-            total_orders = orders_count
+            report_progress(total=len(orders))
+            batch_result = client.place_batch_orders('cm', orders, portfolio_margin=True)
             
-            for i in range(total_orders):
-                if both_sides:
-                    # 买入订单（多仓）
-                    buy_order = client.cm_new_order(
-                        symbol=symbol,
-                        side="BUY",
-                        type="LIMIT",
-                        quantity=single_amount,
-                        price=price,
-                        timeInForce="GTC"
-                    )
-                    created_orders.append({
-                        "side": "BUY",
-                        "order_id": buy_order.get('orderId'),
-                        "price": price,
-                        "quantity": single_amount
-                    })
-                    
-                    # 卖出订单（空仓）
-                    sell_order = client.cm_new_order(
-                        symbol=symbol,
-                        side="SELL",
-                        type="LIMIT",
-                        quantity=single_amount,
-                        price=price,
-                        timeInForce="GTC"
-                    )
+            created_orders = []
+            failed_orders = []
+            for order, result in zip(orders, batch_result.get('data') or []):
+                if result.get('success'):
                     created_orders.append({
-                        "side": "SELL",
-                        "order_id": sell_order.get('orderId'),
+                        "side": order['side'],
+                        "order_id": result['data'].get('orderId'),
                         "price": price,
                         "quantity": single_amount
                     })
+                    report_progress(dict(created_orders[-1], success=True))
                 else:
-                    # 只创建买入订单
-                    buy_order = client.cm_new_order(
-                        symbol=symbol,
-                        side="BUY",
-                        type="LIMIT",
-                        quantity=single_amount,
-                        price=price,
-                        timeInForce="GTC"
-                    )
-                    created_orders.append({
-                        "side": "BUY",
-                        "order_id": buy_order.get('orderId'),
+                    failed_orders.append({
+                        "side": order['side'],
                         "price": price,
-                        "quantity": single_amount
+                        "quantity": single_amount,
+                        "error": result.get('error')
                     })
-                
-                # 添加时间间隔
-                if i < total_orders - 1:
-                    time.sleep(interval)
+                    report_progress(dict(failed_orders[-1], success=False))
+            
+            if not created_orders:
+                return jsonify({
+                    "success": False,
+                    "message": f"创建网格订单失败: {batch_result.get('error')}",
+                    "data": {
+                        "failed_orders": failed_orders
+                    }
+                })
             
             return jsonify({
                 "success": True,
-                "message": f"成功创建{len(created_orders)}个网格订单",
+                "message": f"成功创建{len(created_orders)}个网格订单" + (f"，{len(failed_orders)}个失败" if failed_orders else ""),
                 "data": {
-                    "orders": created_orders
+                    "orders": created_orders,
+                    "failed_orders": failed_orders
                 }
             })
         
@@ -161,6 +150,55 @@ def cm_grid_trade():
             "message": f"创建网格交易失败: {str(e)}"
         })
 
+def _place_buy_sell_orders(client, market, buy_order_params, sell_order_params):
+    """
+    通过一次批量下单请求提交多仓和空仓订单
+    
+    参数:
+    - client: 子账号客户端
+    - market: um 或 cm
+    - buy_order_params: 多仓订单参数(可选)
+    - sell_order_params: 空仓订单参数(可选)
+    
+    返回:
+    - (buy_result, sell_result): 每个结果为 {'success', 'data'|'error'}，未提供的订单为None
+    """
+    legs = []
+    for side, params, default_position_side in (('BUY', buy_order_params, 'LONG'), ('SELL', sell_order_params, 'SHORT')):
+        if not params:
+            continue
+        
+        order_type = params.get('type', 'LIMIT')
+        order = {
+            'symbol': params.get('symbol'),
+            'side': side,
+            'type': order_type,
+            'quantity': params.get('quantity')
+        }
+        if order_type == 'LIMIT':
+            order['price'] = params.get('price')
+            order['timeInForce'] = params.get('timeInForce', 'GTC')
+        
+        # U本位默认双向持仓，币本位仅在指定时传入持仓方向
+        if market == 'um':
+            order['positionSide'] = params.get('positionSide', default_position_side)
+        elif params.get('positionSide'):
+            order['positionSide'] = params['positionSide']
+        
+        legs.append((side, order))
+    
+    if not legs:
+        return None, None
+    
+    response = client.place_batch_orders(market, [order for _, order in legs], portfolio_margin=True)
+    results = response.get('data') or [{'success': False, 'error': response.get('error')} for _ in legs]
+    
+    by_side = {side: result for (side, _), result in zip(legs, results)}
+    for side, result in by_side.items():
+        logger.info(f"{'多仓' if side == 'BUY' else '空仓'}下单结果: {result}")
+    
+    return by_side.get('BUY'), by_side.get('SELL')
+
 @portfolio_bp.route('/um/new-order', methods=['POST'])
 def um_new_order():
     """
@@ -199,15 +237,13 @@ def um_new_order():
         orders = data.get('orders')
         
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({
                 "success": False,
                 "error": "子账号API未配置或不可用"
             })
         
-        client = BinanceClient(api_key, api_secret)
-        
         # 直接设置为双向持仓模式，不再检测
         is_dual_side_position = True
         logger.info("默认使用双向持仓模式处理订单")
@@ -249,14 +285,10 @@ def um_new_order():
         if symbol:
             try:
                 # 获取最新标记价格
-                mark_price_params = {
-                    'symbol': symbol,
-                    'timestamp': int(time.time() * 1000)
-                }
-                mark_price_response = client._send_request('GET', '/fapi/v1/premiumIndex', params=mark_price_params)
+                mark_price_info = get_price(symbol, 'mark_um')
                 
-                if mark_price_response.get('success'):
-                    mark_price = mark_price_response.get('data', {}).get('markPrice')
+                if mark_price_info:
+                    mark_price = mark_price_info.get('price')
                     logger.info(f"获取交易对 {symbol} 最新标记价: {mark_price}")
                     
                     # 对标记价进行精度控制 - 四舍五入保留2位小数
@@ -285,110 +317,14 @@ def um_new_order():
                                 sell_order_params['timeInForce'] = 'GTC'
                                 logger.info(f"将空仓市价单转换为限价单，价格: {mark_price}")
                 else:
-                    logger.warning(f"获取标记价格失败: {mark_price_response.get('error')}")
+                    logger.warning(f"获取 {symbol} 标记价格失败")
             except Exception as e:
                 logger.error(f"获取标记价格出错: {str(e)}")
             
-        # 使用并行执行方式同时提交买单和卖单
-        import threading
-        import queue
-        
-        order_results = queue.Queue()
-        
-        def execute_buy_order():
-            """执行买单的线程函数"""
-            try:
-                if not buy_order_params:
-                    order_results.put(("buy", None))
-                    return
-                
-                # 准备下单参数
-                order_params = {
-                    'symbol': buy_order_params.get('symbol'),
-                    'side': 'BUY',
-                    'order_type': buy_order_params.get('type', 'LIMIT'),
-                    'quantity': buy_order_params.get('quantity'),
-                    'price': buy_order_params.get('price'),
-                    'time_in_force': buy_order_params.get('timeInForce', 'GTC')
-                }
-                
-                # 添加持仓方向参数 - 双向持仓模式
-                position_side = buy_order_params.get('positionSide', 'LONG')
-                order_params['position_side'] = position_side
-                logger.info(f"多仓下单使用持仓方向: {position_side}")
-                
-                result = client.place_portfolio_margin_order_um(**order_params)
-                logger.info(f"多仓下单结果: {result}")
-                order_results.put(("buy", result))
-            except Exception as e:
-                logger.error(f"多仓下单失败: {str(e)}")
-                error_result = {
-                    "success": False,
-                    "error": f"API错误: {str(e)}"
-                }
-                order_results.put(("buy", error_result))
-        
-        def execute_sell_order():
-            """执行卖单的线程函数"""
-            try:
-                if not sell_order_params:
-                    order_results.put(("sell", None))
-                    return
-                
-                # 准备下单参数
-                order_params = {
-                    'symbol': sell_order_params.get('symbol'),
-                    'side': 'SELL',
-                    'order_type': sell_order_params.get('type', 'LIMIT'),
-                    'quantity': sell_order_params.get('quantity'),
-                    'price': sell_order_params.get('price'),
-                    'time_in_force': sell_order_params.get('timeInForce', 'GTC')
-                }
-                
-                # 添加持仓方向参数 - 双向持仓模式
-                position_side = sell_order_params.get('positionSide', 'SHORT')
-                order_params['position_side'] = position_side
-                logger.info(f"空仓下单使用持仓方向: {position_side}")
-                
-                result = client.place_portfolio_margin_order_um(**order_params)
-                logger.info(f"空仓下单结果: {result}")
-                order_results.put(("sell", result))
-            except Exception as e:
-                logger.error(f"空仓下单失败: {str(e)}")
-                error_result = {
-                    "success": False,
-                    "error": f"API错误: {str(e)}"
-                }
-                order_results.put(("sell", error_result))
-        
-        # 创建并启动线程
-        buy_thread = threading.Thread(target=execute_buy_order)
-        sell_thread = threading.Thread(target=execute_sell_order)
-        
-        # 记录开始时间
+        # 买单和卖单通过一次批量下单请求同时提交
         parallel_start_time = time.time()
-        logger.info("开始并行执行买单和卖单")
-        
-        # 启动线程
-        buy_thread.start()
-        sell_thread.start()
-        
-        # 等待两个线程都完成
-        buy_thread.join()
-        sell_thread.join()
-        
-        # 记录结束时间
+        buy_order_result, sell_order_result = _place_buy_sell_orders(client, 'um', buy_order_params, sell_order_params)
         parallel_end_time = time.time()
-        logger.info("买单和卖单并行执行完成")
-        
-        # 获取结果
-        results = {}
-        while not order_results.empty():
-            order_type, result = order_results.get()
-            results[order_type] = result
-        
-        buy_order_result = results.get("buy")
-        sell_order_result = results.get("sell")
         
         # 记录并行执行的详细日志
         log_parallel_execution("UM", parallel_start_time, parallel_end_time, buy_order_result, sell_order_result)
@@ -454,15 +390,13 @@ def cm_new_order():
         orders = data.get('orders')
         
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({
                 "success": False,
                 "error": "子账号API未配置或不可用"
             })
         
-        client = BinanceClient(api_key, api_secret)
-        
         # 直接设置为双向持仓模式，不再检测
         is_dual_side_position = True
         logger.info("默认使用双向持仓模式处理订单")
@@ -504,14 +438,10 @@ def cm_new_order():
         if symbol:
             try:
                 # 获取最新标记价格 - 币本位使用/dapi/v1/premiumIndex接口
-                mark_price_params = {
-                    'symbol': symbol,
-                    'timestamp': int(time.time() * 1000)
-                }
-                mark_price_response = client._send_request('GET', '/dapi/v1/premiumIndex', params=mark_price_params)
+                mark_price_info = get_price(symbol, 'mark_cm')
                 
-                if mark_price_response.get('success'):
-                    mark_price = mark_price_response.get('data', {}).get('markPrice')
+                if mark_price_info:
+                    mark_price = mark_price_info.get('price')
                     logger.info(f"获取交易对 {symbol} 最新标记价: {mark_price}")
                     
                     # 对标记价进行精度控制 - 四舍五入保留2位小数
@@ -540,116 +470,14 @@ def cm_new_order():
                                 sell_order_params['timeInForce'] = 'GTC'
                                 logger.info(f"将空仓市价单转换为限价单，价格: {mark_price}")
                 else:
-                    logger.warning(f"获取标记价格失败: {mark_price_response.get('error')}")
+                    logger.warning(f"获取 {symbol} 标记价格失败")
             except Exception as e:
                 logger.error(f"获取标记价格出错: {str(e)}")
             
-        # 使用并行执行方式同时提交买单和卖单
-        import threading
-        import queue
-        
-        order_results = queue.Queue()
-        
-        def execute_buy_order():
-            """执行买单的线程函数"""
-            try:
-                if not buy_order_params:
-                    order_results.put(("buy", None))
-                    return
-                
-                result = client.cm_new_order(
-                    symbol=buy_order_params.get('symbol'),
-                    side='BUY',
-                    type=buy_order_params.get('type', 'LIMIT'),
-                    quantity=buy_order_params.get('quantity'),
-                    price=buy_order_params.get('price'),
-                    timeInForce=buy_order_params.get('timeInForce', 'GTC')
-                )
-                
-                if isinstance(result, dict) and result.get('orderId'):
-                    buy_order_success = True
-                else:
-                    buy_order_success = False
-                    
-                formatted_result = {
-                    "success": buy_order_success,
-                    "data": result
-                }
-                
-                logger.info(f"多仓下单结果: {formatted_result}")
-                order_results.put(("buy", formatted_result))
-            except Exception as e:
-                logger.error(f"多仓下单失败: {str(e)}")
-                error_result = {
-                    "success": False,
-                    "error": f"多仓下单异常: {str(e)}"
-                }
-                order_results.put(("buy", error_result))
-        
-        def execute_sell_order():
-            """执行卖单的线程函数"""
-            try:
-                if not sell_order_params:
-                    order_results.put(("sell", None))
-                    return
-                
-                result = client.cm_new_order(
-                    symbol=sell_order_params.get('symbol'),
-                    side='SELL',
-                    type=sell_order_params.get('type', 'LIMIT'),
-                    quantity=sell_order_params.get('quantity'),
-                    price=sell_order_params.get('price'),
-                    timeInForce=sell_order_params.get('timeInForce', 'GTC')
-                )
-                
-                if isinstance(result, dict) and result.get('orderId'):
-                    sell_order_success = True
-                else:
-                    sell_order_success = False
-                    
-                formatted_result = {
-                    "success": sell_order_success,
-                    "data": result
-                }
-                
-                logger.info(f"空仓下单结果: {formatted_result}")
-                order_results.put(("sell", formatted_result))
-            except Exception as e:
-                logger.error(f"空仓下单失败: {str(e)}")
-                error_result = {
-                    "success": False,
-                    "error": f"空仓下单异常: {str(e)}"
-                }
-                order_results.put(("sell", error_result))
-        
-        # 创建并启动线程
-        buy_thread = threading.Thread(target=execute_buy_order)
-        sell_thread = threading.Thread(target=execute_sell_order)
-        
-        # 记录开始时间
+        # 买单和卖单通过一次批量下单请求同时提交
         parallel_start_time = time.time()
-        logger.info("开始并行执行币本位合约买单和卖单")
-        
-        # 启动线程
-        buy_thread.start()
-        sell_thread.start()
-        
-        # 等待两个线程都完成
-        buy_thread.join()
-        sell_thread.join()
-        
-        # 记录结束时间
+        buy_order_result, sell_order_result = _place_buy_sell_orders(client, 'cm', buy_order_params, sell_order_params)
         parallel_end_time = time.time()
-        logger.info("币本位合约买单和卖单并行执行完成")
-        
-        # 获取结果
-        results = {}
-        while not order_results.empty():
-            order_type, result = order_results.get()
-            results[order_type] = result
-        
-        buy_order_result = results.get("buy")
-        sell_order_result = results.get("sell")
         
         # 记录并行执行的详细日志
         log_parallel_execution("CM", parallel_start_time, parallel_end_time, buy_order_result, sell_order_result)
@@ -689,10 +517,9 @@ def auto_collection():
         if not email:
             return jsonify({"success": False, "error": "缺少必填参数: email"}), 400
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({"success": False, "error": "子账号API未配置或不可用"}), 400
-        client = BinanceClient(api_key, api_secret)
         # 实际调用币安资金归集API（如无则mock）
         try:
             # 假设BinanceClient有auto_collection方法
@@ -733,15 +560,13 @@ def repay_futures_switch():
         log_info(f"设置子账号 {email} 还款模式为{'自动' if auto_repay else '手动'}还款")
         
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({
                 "success": False,
                 "error": "子账号API未配置或不可用"
             })
         
-        client = BinanceClient(api_key, api_secret)
-        
         # 准备请求参数
         params = {
             'autoRepay': 'true' if auto_repay else 'false',
@@ -798,20 +623,15 @@ def get_repay_futures_switch():
         log_info(f"查询子账号 {email} 的合约还款模式")
         
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({
                 "success": False,
                 "error": "子账号API未配置或不可用"
             }), 400
         
-        client = BinanceClient(api_key, api_secret)
-        
-        # 准备请求参数
-        params = {
-            'timestamp': int(time.time() * 1000),
-            'recvWindow': 60000
-        }
+        # 准备请求参数，时间戳和接收窗口由客户端统一添加
+        params = {}
         
         try:
             # 调用币安API查询还款模式
@@ -879,20 +699,16 @@ def repay_futures_negative_balance():
         log_info(f"为子账号 {email} 执行合约负余额还款，币种: {coin}, 全额还款: {all_debt}")
         
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({
                 "success": False,
                 "error": "子账号API未配置或不可用"
             }), 400
         
-        client = BinanceClient(api_key, api_secret)
-        
         # 准备请求参数
         params = {
-            'coin': coin,
-            'timestamp': int(time.time() * 1000),
-            'recvWindow': 60000
+            'coin': coin
         }
         
         # 如果不是全额还款，添加金额参数
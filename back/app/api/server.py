@@ -3,6 +3,10 @@ import requests
 from datetime import datetime
 from flask import Blueprint, jsonify, current_app, redirect, url_for, request
 from app.services.binance_client import get_binance_client
+from app.services.rate_limiter import get_rate_governor
+from app.services.http_transport import SERVICES
+from app.services.user_stream import get_user_stream_manager
+from app.services.price_cache import get_price_cache
 
 server_bp = Blueprint('server', __name__, url_prefix='/api/server')
 
@@ -196,4 +200,70 @@ def sync_binance_time():
         return jsonify({
             "success": False,
             "error": f"同步币安服务器时间异常: {str(e)}"
-        }), 500 
\ No newline at end of file
+        }), 500
+
+@server_bp.route('/rate-limits', methods=['GET'])
+def get_rate_limits():
+    """
+    获取币安请求频率剩余额度
+    
+    查询参数:
+    - email: 子账号邮箱 (可选，提供时返回该账号的下单剩余次数)
+    
+    返回:
+        - data: 每个服务的权重上限、剩余权重、下单窗口剩余次数及暂停剩余秒数
+    """
+    try:
+        email = request.args.get('email')
+        governor = get_rate_governor()
+        
+        return jsonify({
+            'success': True,
+            'data': [governor.headroom(service, email) for service in SERVICES]
+        })
+    except Exception as e:
+        current_app.logger.error(f"获取请求频率额度失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'获取请求频率额度失败: {str(e)}'
+        }), 500
+
+@server_bp.route('/user-streams', methods=['GET'])
+def get_user_streams():
+    """
+    获取用户数据流连接状态
+    
+    返回:
+        - data: 每条数据流的账号、市场、是否已连接、最后推送时间及重连次数
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': get_user_stream_manager().status()
+        })
+    except Exception as e:
+        current_app.logger.error(f"获取用户数据流状态失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'获取用户数据流状态失败: {str(e)}'
+        }), 500
+
+@server_bp.route('/price-cache', methods=['GET'])
+def get_price_cache_status():
+    """
+    获取行情价格缓存状态
+    
+    返回:
+        - data: 每个市场缓存的交易对数量、更新时间及已缓存时长
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': get_price_cache().status()
+        })
+    except Exception as e:
+        current_app.logger.error(f"获取行情价格缓存状态失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'获取行情价格缓存状态失败: {str(e)}'
+        }), 500
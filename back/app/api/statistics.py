@@ -3,8 +3,11 @@ from datetime import datetime, timedelta
 from sqlalchemy import func, desc
 from app.models import db
 import logging
-from app.models.trading import FeeRecord, TradeHistory, MarginTrade
+from app.models.trading import FeeRecord, FeeRollup, TradeHistory, MarginTrade, TradeSyncState
 from app.utils.auth import token_required
+from app.services.job_queue import background_job
+from app.services.fee_rollup import rollup_query
+from app.services.trade_sync import SYNC_MARKETS, get_trade_sync
 
 logger = logging.getLogger(__name__)
 statistics_bp = Blueprint('statistics', __name__, url_prefix='/api/statistics')
@@ -99,46 +102,38 @@ def get_fees_summary(current_user):
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date', datetime.now().strftime('%Y-%m-%d'))
     
-    # 构建基础查询
-    query = FeeRecord.query
-    
-    # 根据参数过滤
-    if email:
-        query = query.filter(FeeRecord.email == email)
-    
-    if start_date:
-        start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-        query = query.filter(FeeRecord.trade_time >= start_dt)
-    
-    if end_date:
-        end_dt = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-        query = query.filter(FeeRecord.trade_time < end_dt)
+    # 从手续费日汇总读取，不再扫描手续费记录表
+    query = rollup_query(
+        email=email,
+        start_date=datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None,
+        end_date=datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+    )
     
     # 按资产类型分组统计总手续费
     fee_by_asset = query.with_entities(
-        FeeRecord.fee_asset,
-        func.sum(FeeRecord.fee_amount).label('total_fee')
-    ).group_by(FeeRecord.fee_asset).all()
+        FeeRollup.fee_asset,
+        func.sum(FeeRollup.fee_amount).label('total_fee')
+    ).group_by(FeeRollup.fee_asset).all()
     
     # 按交易类型分组统计
     fee_by_source = query.with_entities(
-        FeeRecord.source,
-        func.sum(FeeRecord.fee_amount).label('total_fee'),
-        FeeRecord.fee_asset
-    ).group_by(FeeRecord.source, FeeRecord.fee_asset).all()
+        FeeRollup.source,
+        func.sum(FeeRollup.fee_amount).label('total_fee'),
+        FeeRollup.fee_asset
+    ).group_by(FeeRollup.source, FeeRollup.fee_asset).all()
     
     # 如果有指定子账户，获取其详细统计
     account_stats = None
     if email:
         daily_fees = query.with_entities(
-            func.date(FeeRecord.trade_time).label('date'),
-            func.sum(FeeRecord.fee_amount).label('total_fee'),
-            FeeRecord.fee_asset
+            FeeRollup.day.label('date'),
+            func.sum(FeeRollup.fee_amount).label('total_fee'),
+            FeeRollup.fee_asset
         ).group_by(
-            func.date(FeeRecord.trade_time),
-            FeeRecord.fee_asset
+            FeeRollup.day,
+            FeeRollup.fee_asset
         ).order_by(
-            func.date(FeeRecord.trade_time)
+            FeeRollup.day
         ).all()
         
         account_stats = {
@@ -179,36 +174,123 @@ def get_fees_summary(current_user):
     
     return jsonify(result)
 
-@statistics_bp.route('/fees/sync', methods=['POST'])
+@statistics_bp.route('/fees/trend', methods=['GET'])
 @token_required
-def sync_fees():
-    """同步指定账户的手续费数据"""
-    data = request.json
-    email = data.get('email')
+def get_fees_trend(current_user):
+    """
+    获取每日手续费趋势(读取手续费日汇总)
     
-    if not email:
+    查询参数:
+    - email: 子账号邮箱(可选)，默认全部子账号
+    - source: 手续费来源(可选)，MARGIN / UM / CM
+    - start_date: 开始日期 YYYY-MM-DD(可选)，默认结束日期前30天
+    - end_date: 结束日期 YYYY-MM-DD(可选)，默认今天
+    """
+    try:
+        end_day = datetime.strptime(request.args.get('end_date', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d').date()
+        start_date = request.args.get('start_date')
+        start_day = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else end_day - timedelta(days=29)
+    except ValueError:
         return jsonify({
             'success': False,
-            'error': '请提供子账户邮箱'
+            'error': '日期格式错误，应为 YYYY-MM-DD'
         }), 400
     
-    # 这里应该是调用币安API获取最新手续费数据的逻辑
-    # 由于实际调用需要账户API Key等敏感信息，这里只模拟同步成功
+    rows = rollup_query(
+        email=request.args.get('email'),
+        source=request.args.get('source'),
+        start_date=start_day,
+        end_date=end_day
+    ).with_entities(
+        FeeRollup.day,
+        FeeRollup.fee_asset,
+        func.sum(FeeRollup.fee_amount).label('total_fee'),
+        func.sum(FeeRollup.record_count).label('record_count')
+    ).group_by(FeeRollup.day, FeeRollup.fee_asset).order_by(FeeRollup.day).all()
     
     return jsonify({
         'success': True,
         'data': {
-            'message': f'账户 {email} 的手续费数据同步已启动，请稍后查看结果'
+            'trend': [
+                {
+                    'date': item.day.isoformat(),
+                    'fee_asset': item.fee_asset,
+                    'fee_amount': float(item.total_fee or 0),
+                    'record_count': int(item.record_count or 0)
+                } for item in rows
+            ],
+            'period': {
+                'start_date': start_day.isoformat(),
+                'end_date': end_day.isoformat()
+            }
         }
     })
 
+@statistics_bp.route('/fees/sync', methods=['POST'])
+@token_required
+@background_job('statistics.fees_sync')
+def sync_fees(current_user):
+    """
+    从币安增量同步子账号的成交和手续费记录
+    
+    请求体:
+    {
+        "email": "子账号邮箱",  # 或 "emails": ["子账号邮箱1", ...]
+        "markets": ["margin", "um", "cm"],  # 可选，默认全部
+        "symbols": ["BTCUSDT", ...],  # 可选，默认已同步过的交易对和交易对列表
+        "async": true  # 可选，提交为后台任务，通过 /api/jobs/<id> 查询进度
+    }
+    """
+    data = request.json or {}
+    emails = data.get('emails') or ([data['email']] if data.get('email') else [])
+    
+    if not emails:
+        return jsonify({
+            'success': False,
+            'error': '请提供子账户邮箱'
+        }), 400
+    
+    markets = data.get('markets')
+    if markets and any(market not in SYNC_MARKETS for market in markets):
+        return jsonify({
+            'success': False,
+            'error': f"不支持的市场，可选: {', '.join(SYNC_MARKETS)}"
+        }), 400
+    
+    result = get_trade_sync().sync_accounts(emails, markets=markets, symbols=data.get('symbols'))
+    summary = result['data']
+    result['message'] = f"同步完成，新增成交 {summary['inserted']} 笔，失败 {summary['failed']} 项"
+    return jsonify(result)
+
+@statistics_bp.route('/fees/sync-status', methods=['GET'])
+@token_required
+def get_fee_sync_status(current_user):
+    """
+    获取成交同步进度
+    
+    查询参数:
+    - email: 子账号邮箱(可选)
+    - market: 市场(可选)，margin / um / cm
+    """
+    query = TradeSyncState.query
+    if request.args.get('email'):
+        query = query.filter(TradeSyncState.email == request.args['email'])
+    if request.args.get('market'):
+        query = query.filter(TradeSyncState.market == request.args['market'])
+    
+    states = query.order_by(TradeSyncState.email, TradeSyncState.market, TradeSyncState.symbol).all()
+    return jsonify({
+        'success': True,
+        'data': [state.to_dict() for state in states]
+    })
+
 @statistics_bp.route('/fees/accounts', methods=['GET'])
 @token_required
 def get_fee_accounts(current_user):
     """获取有手续费记录的所有子账户"""
-    accounts = FeeRecord.query.with_entities(
-        FeeRecord.email
-    ).distinct().all()
+    accounts = FeeRollup.query.with_entities(
+        FeeRollup.email
+    ).distinct().order_by(FeeRollup.email).all()
     
     return jsonify({
         'success': True,
@@ -12,6 +12,9 @@ from app.models.account import SubAccountAPISettings
 from app.utils.auth import token_required
 from . import subaccounts_bp
 from app.services.binance_client import BinanceClient, get_main_account_api_credentials
+from app.services.client_registry import get_client_registry
+from app.services.job_queue import background_job, ProgressList
+from app.services.key_health import get_key_health
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -212,6 +215,8 @@ def save_api_key(current_user):
             setting.updated_at = datetime.now()
             
             db.session.commit()
+            get_client_registry().invalidate(email)
+            get_key_health().invalidate(email)
             logger.info(f"更新子账号 {email} 的API设置")
             
             return jsonify({
@@ -236,6 +241,8 @@ def save_api_key(current_user):
             
             db.session.add(new_setting)
             db.session.commit()
+            get_client_registry().invalidate(email)
+            get_key_health().invalidate(email)
             logger.info(f"创建子账号 {email} 的API设置")
             
             return jsonify({
@@ -276,6 +283,8 @@ def delete_api_key(current_user, email):
         # 删除记录
         db.session.delete(setting)
         db.session.commit()
+        get_client_registry().invalidate(email)
+        get_key_health().invalidate(email)
         logger.info(f"删除子账号 {email} 的API设置")
         
         return jsonify({
@@ -318,48 +327,44 @@ def diagnose_api():
         api_key = data.get('api_key')
         api_secret = data.get('api_secret')
         
-        # 如果没有提供API密钥，则尝试从数据库获取
-        if not api_key or not api_secret:
-            # 从数据库获取API设置
-            setting = SubAccountAPISettings.query.filter_by(email=email).first()
+        if api_key and api_secret:
+            # 诊断请求中提供的密钥
+            client = BinanceClient(api_key, api_secret)
+        else:
+            # 没有提供API密钥，则使用已保存设置对应的客户端
+            client = get_client_registry().get_client(email)
             
-            if not setting or not setting.api_key or not setting.api_secret:
+            if client is None:
                 return jsonify({
                     'success': False,
                     'error': f"未找到子账号 {email} 的有效API设置，请提供API密钥或先保存设置"
                 }), 400
-                
-            api_key = setting.api_key
-            api_secret = setting.api_secret
         
         # 开始诊断
         logger.info(f"开始诊断子账号 {email} 的API设置")
         
-        # 创建客户端
-        client = BinanceClient(api_key, api_secret)
-        
         # 测试1: 获取账户信息
         logger.info("测试1: 获取账户信息")
         account_info_result = client.get_account_info()
         test1_success = account_info_result.get('success', False)
         test1_error = account_info_result.get('error', '')
         
-        # 测试2: 获取余额
+        # 测试2: 获取余额(使用测试1的账户信息，不重复请求)
         logger.info("测试2: 获取账户余额")
-        balance_result = client.get_account_balance()
+        balance_result = client.get_account_balance(account_info_result)
         test2_success = balance_result.get('success', False)
         test2_error = balance_result.get('error', '')
         
         # 测试3: 获取交易权限
         logger.info("测试3: 获取交易权限")
-        permissions_result = client.check_trade_permission()
+        permissions_result = client.check_trade_permission(account_info_result)
         test3_success = permissions_result.get('success', False)
         test3_error = permissions_result.get('error', '')
         
         # 汇总诊断结果
         diagnosis = {
             'email': email,
-            'api_key_masked': api_key[:8] + '*' * 8 if api_key else '',
+            'api_key_masked': client.api_key[:8] + '*' * 8 if client.api_key else '',
             'tests': [
                 {
                     'name': '账户信息',
@@ -522,13 +527,17 @@ def generate_api_name():
 
 
 @subaccounts_bp.route('/batch-test-keys', methods=['POST'])
+@background_job('subaccounts.batch_test_keys')
 def batch_test_api_keys():
     """
     批量测试子账号API密钥
     
     请求体:
     {
-        "emails": ["子账号邮箱1", "子账号邮箱2", ...]
+        "emails": ["子账号邮箱1", "子账号邮箱2", ...],
+        "concurrency": 10, # 可选，并发数
+        "maxAge": 60, # 可选，复用该秒数内的检查结果，默认全部重新探测
+        "async": true # 可选，提交为后台任务，通过 /api/jobs/<id> 查询进度
     }
     """
     try:
@@ -541,67 +550,15 @@ def batch_test_api_keys():
                 'error': "请提供子账号邮箱列表"
             }), 400
             
-        results = []
-        
-        # 测试每个子账号的API密钥
-        for email in emails:
-            # 从数据库获取API设置
-            setting = SubAccountAPISettings.query.filter_by(email=email).first()
-            
-            if not setting or not setting.api_key or not setting.api_secret:
-                results.append({
-                    'email': email,
-                    'success': False,
-                    'status': 'NOT_CONFIGURED',
-                    'message': "未找到API设置"
-                })
-                continue
-                
-            # 创建客户端
-            client = BinanceClient(setting.api_key, setting.api_secret)
-            
-            try:
-                # 测试API连接
-                account_info = client.get_account_info()
-                
-                if account_info.get('success'):
-                    results.append({
-                        'email': email,
-                        'success': True,
-                        'status': 'WORKING',
-                        'message': "API密钥工作正常",
-                        'account_details': {
-                            'makerCommission': account_info.get('data', {}).get('makerCommission'),
-                            'takerCommission': account_info.get('data', {}).get('takerCommission'),
-                            'canTrade': account_info.get('data', {}).get('canTrade', False),
-                            'canDeposit': account_info.get('data', {}).get('canDeposit', False),
-                            'canWithdraw': account_info.get('data', {}).get('canWithdraw', False)
-                        }
-                    })
-                else:
-                    error_msg = account_info.get('error', '未知错误')
-                    
-                    status = 'ERROR'
-                    if 'Invalid API-key' in str(error_msg):
-                        status = 'INVALID_KEY'
-                    elif 'signature' in str(error_msg).lower():
-                        status = 'INVALID_SECRET'
-                    elif 'permission' in str(error_msg).lower():
-                        status = 'INSUFFICIENT_PERMISSIONS'
-                        
-                    results.append({
-                        'email': email,
-                        'success': False,
-                        'status': status,
-                        'message': error_msg
-                    })
-            except Exception as e:
-                results.append({
-                    'email': email,
-                    'success': False,
-                    'status': 'ERROR',
-                    'message': str(e)
-                })
+        progress = ProgressList(total=len(emails))
+        
+        # 并发探测，结果同时写入健康状态表
+        results = get_key_health().check(
+            emails,
+            concurrency=data.get('concurrency'),
+            max_age=data.get('maxAge'),
+            on_result=progress.append
+        )
                 
         # 汇总结果
         success_count = len([r for r in results if r.get('success')])
@@ -799,6 +756,8 @@ def update_api_key(current_user, email):
         setting.updated_at = datetime.now()
         
         db.session.commit()
+        get_client_registry().invalidate(email)
+        get_key_health().invalidate(email)
         logger.info(f"更新子账号 {email} 的API设置")
         
         return jsonify({
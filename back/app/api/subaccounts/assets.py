@@ -1,12 +1,21 @@
+import json
 import time
 import logging
-from flask import request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, jsonify, current_app, Response, stream_with_context
 from app.models.account import SubAccountAPISettings
 from . import subaccounts_bp
-from app.services.binance_client import BinanceClient, get_binance_client, get_client_by_email, get_sub_account_api_credentials
+from app.services.binance_client import get_binance_client, get_client_by_email
+from app.services.batch_executor import run_batch, iter_batch, resolve_concurrency
+from app.services.rate_limiter import estimate_weight
+from app.services.job_queue import background_job, ProgressList
+from app.services.transfer_planner import execute_transfers
 
 logger = logging.getLogger(__name__)
 
+# 子账号现货资产汇总接口每页数量
+SPOT_SUMMARY_PAGE_SIZE = 20
+
 @subaccounts_bp.route('/transfer', methods=['POST'])
 def transfer_funds():
     """
@@ -62,15 +71,13 @@ def transfer_funds():
         # 从子账号到主账号
         if from_email and not to_email:
             # 使用子账号自己的API凭证
-            sub_api_key, sub_api_secret = get_sub_account_api_credentials(from_email)
-            if not sub_api_key or not sub_api_secret:
+            sub_client = get_client_by_email(from_email)
+            if sub_client is None:
                 logger.error(f"子账号 {from_email} 未配置API密钥")
                 return jsonify({
                     "success": False, 
                             "error": f"子账号 {from_email} 未配置API密钥，无法执行向主账号的转账"
                         })
-            # 使用子账号客户端
-            sub_client = BinanceClient(sub_api_key, sub_api_secret)
             # 构建请求参数
             params = {
                 'asset': asset,
@@ -160,6 +167,75 @@ def transfer_funds():
         })
 
 
+def _summarize_balances(assets_data):
+    """
+    过滤余额为0的资产并计算BTC、USDT数量
+
+    返回:
+    - (non_zero_balances, btc_value, usdt_value)
+    """
+    # 如果资产列表是对象而非数组，进行转换
+    if isinstance(assets_data, dict):
+        assets_data = assets_data.get('balances', [])
+
+    non_zero_balances = []
+    btc_value = 0
+    usdt_value = 0
+
+    for balance in assets_data or []:
+        free = float(balance.get('free', '0'))
+        locked = float(balance.get('locked', '0'))
+        if free > 0 or locked > 0:
+            non_zero_balances.append({
+                'asset': balance.get('asset', ''),
+                'free': balance.get('free', '0'),
+                'locked': balance.get('locked', '0'),
+                'total': free + locked
+            })
+            if balance.get('asset') == 'BTC':
+                btc_value += free + locked
+            elif balance.get('asset') == 'USDT':
+                usdt_value += free + locked
+
+    return non_zero_balances, btc_value, usdt_value
+
+
+def _fetch_spot_summary(client, recv_window):
+    """
+    分页获取全部子账号的现货资产汇总
+
+    返回:
+    - dict: {'success': True, 'data': {邮箱: BTC总值}} 或 {'success': False, 'error': ...}
+    """
+    totals = {}
+    page = 1
+
+    while True:
+        response = client._send_request('GET', '/sapi/v1/sub-account/spotSummary', signed=True, params={
+            'page': page,
+            'size': SPOT_SUMMARY_PAGE_SIZE,
+            'recvWindow': recv_window
+        })
+        if not response.get('success'):
+            return {'success': False, 'error': response.get('error', '获取子账号现货资产汇总失败')}
+
+        data = response.get('data') or {}
+        # 兼容新旧两种返回格式
+        sub_accounts = data.get('spotSubUserAssetBtcVoList') or data.get('subAccountList') or []
+        for sub_account in sub_accounts:
+            email = sub_account.get('email')
+            if email:
+                totals[email] = float(sub_account.get('totalAsset', sub_account.get('totalAssetOfBtc', '0')) or 0)
+
+        total_count = data.get('totalCount')
+        if len(sub_accounts) < SPOT_SUMMARY_PAGE_SIZE or (total_count is not None and len(totals) >= int(total_count)):
+            break
+        page += 1
+
+    logger.info(f"获取子账号现货资产汇总完成，共 {len(totals)} 个子账号，{page} 页")
+    return {'success': True, 'data': totals}
+
+
 @subaccounts_bp.route('/batch-balance', methods=['POST'])
 def get_batch_balance():
     """
@@ -169,8 +245,15 @@ def get_batch_balance():
     {
         "user_id": 用户ID,
         "emails": ["子账号邮箱1", "子账号邮箱2", ...],
-        "recvWindow": 接收窗口时间(可选，默认10000)
+        "recvWindow": 接收窗口时间(可选，默认10000),
+        "concurrency": 并发查询数(可选，默认使用配置 BATCH_TRADE_CONCURRENCY),
+        "stream": 是否流式返回(可选，默认false)
     }
+    
+    说明:
+    - 现货资产汇总在开始时分页获取一次，详细资产查询失败的子账号共用该汇总结果
+    - stream为true时以 application/x-ndjson 逐行返回，每个子账号查询完成即返回一行
+      {"type": "result", "index": 序号, ...}，最后一行为 {"type": "summary", ...}
     """
     start_time = time.time()
     try:
@@ -178,6 +261,7 @@ def get_batch_balance():
         emails = data.get('emails', [])
         recv_window = data.get('recvWindow', 10000)  # 增加默认接收窗口时间
         user_id = data.get('user_id') or data.get('userId')  # 兼容两种参数名
+        stream = bool(data.get('stream', False))
 
         logger.info(f"正在批量获取子账号余额信息，邮箱数量：{len(emails)}, 用户ID: {user_id}")
 
@@ -194,131 +278,33 @@ def get_batch_balance():
                 "success": False,
                 "error": "主账号API未配置或不可用"
             }), 400
-        
-        results = []
-        balances = []  # 新增返回值，前端期望的格式
-        successful_count = 0
-        failed_count = 0
 
-        # 处理每个子账号
-        for email in emails:
+        # 现货资产汇总只获取一次，与详细资产查询同时进行，查询失败的子账号共用
+        app = current_app._get_current_object()
+
+        def load_summary():
+            with app.app_context():
+                return _fetch_spot_summary(client, recv_window)
+
+        summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='spot-summary')
+        summary_future = summary_executor.submit(load_summary)
+        summary_executor.shutdown(wait=False)
+
+        def query_email(email):
             email_start_time = time.time()
-            
-            # 使用子账号资产查询API
-            logger.info(f"使用子账号资产查询API获取子账号 {email} 的余额信息")
-            
-            # 构建API请求参数
             params = {
                 'email': email,
                 'recvWindow': recv_window
             }
-            
-            # 调用子账号资产查询API
-            endpoint = '/sapi/v3/sub-account/assets'
-            
-            response = client._send_request('GET', endpoint, signed=True, params=params)
-            
-            if response.get('success'):
-                assets_data = response.get('data', {}).get('balances', [])
-                
-                # 过滤掉余额为0的资产
-                non_zero_balances = []
-                for balance in assets_data:
-                    free = float(balance.get('free', '0'))
-                    locked = float(balance.get('locked', '0'))
-                    if free > 0 or locked > 0:
-                        non_zero_balances.append({
-                            'asset': balance.get('asset', ''),
-                            'free': balance.get('free', '0'),
-                            'locked': balance.get('locked', '0'),
-                            'total': free + locked
-                        })
-                
-                # 计算BTC和USDT总值
-                btc_value = 0
-                usdt_value = 0
-                
-                for asset_balance in non_zero_balances:
-                    if asset_balance['asset'] == 'BTC':
-                        btc_value += asset_balance['total']
-                    elif asset_balance['asset'] == 'USDT':
-                        usdt_value += asset_balance['total']
-                
-                processing_time = time.time() - email_start_time
-                logger.info(f"成功获取子账号 {email} 的余额信息: {len(non_zero_balances)}个资产，耗时: {processing_time:.2f}秒")
-                
-                # 添加到结果列表
-                result_item = {
-                    "email": email,
-                    "success": True,
-                    "balances": non_zero_balances,
-                    "count": len(non_zero_balances),
-                    "btcVal": str(btc_value),
-                    "usdtVal": str(usdt_value),
-                    "message": f"查询成功: BTC={btc_value}, USDT={usdt_value}",
-                    "processingTime": round(processing_time, 2)
-                }
-                
-                results.append(result_item)
-                
-                # 为前端提供兼容格式
-                balances.append({
-                    "email": email,
-                    "btcVal": str(btc_value),
-                    "usdtVal": str(usdt_value),
-                    "assets": non_zero_balances
-                })
-                
-                successful_count += 1
-            else:
-                # 如果第一个API调用失败，尝试使用备用API
-                logger.warning(f"子账号资产查询API失败，尝试使用子账号现货资产查询API")
-                
-                # 构建备用API请求参数
-                backup_params = {
-                    'email': email,
-                    'recvWindow': recv_window
-                }
-                
-                # 调用子账号现货资产查询API
-                backup_endpoint = '/sapi/v1/sub-account/assets'
-                
-                backup_response = client._send_request('GET', backup_endpoint, signed=True, params=backup_params)
-                
-                if backup_response.get('success'):
-                    assets_data = backup_response.get('data', [])
-                    
-                    # 如果资产列表是对象而非数组，进行转换
-                    if isinstance(assets_data, dict) and 'balances' in assets_data:
-                        assets_data = assets_data.get('balances', [])
-                    
-                    # 过滤掉余额为0的资产
-                    non_zero_balances = []
-                    for balance in assets_data:
-                        free = float(balance.get('free', '0'))
-                        locked = float(balance.get('locked', '0'))
-                        if free > 0 or locked > 0:
-                            non_zero_balances.append({
-                            'asset': balance.get('asset', ''),
-                            'free': balance.get('free', '0'),
-                            'locked': balance.get('locked', '0'),
-                                'total': free + locked
-                            })
-                    
-                    # 计算BTC和USDT总值
-                    btc_value = 0
-                    usdt_value = 0
-                    
-                    for asset_balance in non_zero_balances:
-                        if asset_balance['asset'] == 'BTC':
-                            btc_value += asset_balance['total']
-                        elif asset_balance['asset'] == 'USDT':
-                            usdt_value += asset_balance['total']
-                    
+
+            # 依次尝试子账号资产查询API和子账号现货资产查询API
+            for endpoint in ('/sapi/v3/sub-account/assets', '/sapi/v1/sub-account/assets'):
+                response = client._send_request('GET', endpoint, signed=True, params=params)
+                if response.get('success'):
+                    non_zero_balances, btc_value, usdt_value = _summarize_balances(response.get('data', {}))
                     processing_time = time.time() - email_start_time
-                    logger.info(f"成功获取子账号 {email} 的余额信息(备用API): {len(non_zero_balances)}个资产，耗时: {processing_time:.2f}秒")
-                    
-                    result_item = {
+                    logger.info(f"成功获取子账号 {email} 的余额信息({endpoint}): {len(non_zero_balances)}个资产，耗时: {processing_time:.2f}秒")
+                    return {
                         "email": email,
                         "success": True,
                         "balances": non_zero_balances,
@@ -328,103 +314,83 @@ def get_batch_balance():
                         "message": f"查询成功: BTC={btc_value}, USDT={usdt_value}",
                         "processingTime": round(processing_time, 2)
                     }
-                    
+                logger.warning(f"子账号 {email} 资产查询失败({endpoint}): {response.get('error')}")
+
+            # 两种API都失败，使用现货资产汇总
+            summary = summary_future.result()
+            if not summary.get('success'):
+                error_msg = summary.get('error')
+                logger.error(f"获取子账号 {email} 余额汇总信息失败: {error_msg}")
+                return {"email": email, "success": False, "error": error_msg, "message": error_msg}
+
+            if email not in summary['data']:
+                logger.error(f"在资产汇总中未找到子账号 {email} 的信息")
+                return {
+                    "email": email,
+                    "success": False,
+                    "error": "在资产汇总中未找到该子账号的信息",
+                    "message": "在资产汇总中未找到该子账号的信息"
+                }
+
+            total_asset_btc = summary['data'][email]
+            processing_time = time.time() - email_start_time
+            logger.info(f"成功获取子账号 {email} 的余额汇总信息，BTC总值: {total_asset_btc}，耗时: {processing_time:.2f}秒")
+            return {
+                "email": email,
+                "success": True,
+                "balances": [],  # 此API不提供详细资产列表
+                "count": 0,
+                "btcVal": str(total_asset_btc),
+                "usdtVal": "0",  # 此API不提供USDT值
+                "message": f"查询汇总成功: BTC={total_asset_btc}",
+                "processingTime": round(processing_time, 2)
+            }
+
+        concurrency = resolve_concurrency(
+            data.get('concurrency'), service='sapi', task_count=len(emails),
+            weight_per_task=estimate_weight('/sapi/v3/sub-account/assets'))
+
+        def summary_of(results):
+            successful_count = sum(1 for item in results if item.get('success'))
+            total_time = time.time() - start_time
+            logger.info(
+                f"批量获取所有子账号({len(emails)})余额信息完成，成功: {successful_count}，失败: {len(results) - successful_count}，并发: {concurrency}，总耗时: {total_time:.2f}秒")
+            return {
+                "total": len(emails),
+                "successful": successful_count,
+                "failed": len(results) - successful_count,
+                "concurrency": concurrency
+            }, round(total_time, 2)
+
+        if stream:
+            def generate():
+                results = []
+                for index, result_item in iter_batch(emails, query_email, concurrency):
                     results.append(result_item)
-                    
-                    balances.append({
-                        "email": email,
-                        "btcVal": str(btc_value),
-                        "usdtVal": str(usdt_value),
-                        "assets": non_zero_balances
-                    })
-                    
-                    successful_count += 1
-                else:
-                    # 如果两个API都失败，尝试第三种备用方法
-                    logger.warning(f"两种API都失败，尝试使用子账号现货资产汇总API")
-                    
-                    # 调用子账号现货资产汇总API
-                    summary_endpoint = '/sapi/v1/sub-account/spotSummary'
-                    summary_params = {
-                        'recvWindow': recv_window
-                    }
-                    
-                    summary_response = client._send_request('GET', summary_endpoint, signed=True, params=summary_params)
-                    
-                    if summary_response.get('success'):
-                        summary_data = summary_response.get('data', {})
-                        sub_accounts = summary_data.get('subAccountList', [])
-                        
-                        # 查找特定子账号的数据
-                        target_account = None
-                        for sub_account in sub_accounts:
-                            if sub_account.get('email') == email:
-                                target_account = sub_account
-                                break
-                        
-                        if target_account:
-                            total_asset_btc = float(target_account.get('totalAssetOfBtc', '0'))
-                            
-                            processing_time = time.time() - email_start_time
-                            logger.info(f"成功获取子账号 {email} 的余额汇总信息，BTC总值: {total_asset_btc}，耗时: {processing_time:.2f}秒")
-                            
-                            result_item = {
-                                "email": email,
-                                "success": True,
-                                "balances": [],  # 此API不提供详细资产列表
-                                "count": 0,
-                                "btcVal": str(total_asset_btc),
-                                "usdtVal": "0",  # 此API不提供USDT值
-                                "message": f"查询汇总成功: BTC={total_asset_btc}",
-                                "processingTime": round(processing_time, 2)
-                            }
-                            
-                            results.append(result_item)
-                            
-                            balances.append({
-                                "email": email,
-                                "btcVal": str(total_asset_btc),
-                                "usdtVal": "0",
-                                "assets": []
-                            })
-                            
-                            successful_count += 1
-                        else:
-                            logger.error(f"在资产汇总中未找到子账号 {email} 的信息")
-                            results.append({
-                                "email": email,
-                                "success": False,
-                                "error": "在资产汇总中未找到该子账号的信息",
-                                "message": "在资产汇总中未找到该子账号的信息"
-                            })
-                            failed_count += 1
-                    else:
-                        error_msg = summary_response.get('error', '获取子账号现货资产汇总失败')
-                        logger.error(f"获取子账号 {email} 余额汇总信息失败: {error_msg}")
+                    yield json.dumps(dict(result_item, type='result', index=index), ensure_ascii=False) + '\n'
+                summary, total_time = summary_of(results)
+                yield json.dumps({"type": "summary", "success": True, "summary": summary, "processingTime": total_time}, ensure_ascii=False) + '\n'
 
-                        results.append({
-                            "email": email,
-                            "success": False,
-                            "error": error_msg,
-                            "message": error_msg
-                        })
-                        failed_count += 1
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-        total_time = time.time() - start_time
-        logger.info(
-            f"批量获取所有子账号({len(emails)})余额信息完成，成功: {successful_count}，失败: {failed_count}，总耗时: {total_time:.2f}秒")
+        results, _ = run_batch(emails, query_email, concurrency)
+
+        # 为前端提供兼容格式
+        balances = [{
+            "email": item['email'],
+            "btcVal": item['btcVal'],
+            "usdtVal": item['usdtVal'],
+            "assets": item['balances']
+        } for item in results if item.get('success')]
 
+        summary, total_time = summary_of(results)
         return jsonify({
             "success": True,
             "results": results,  # 前端期望的结构
             "balances": balances,  # 前端期望的结构
             "data": results,     # 保持兼容性
-            "summary": {
-                "total": len(emails),
-                "successful": successful_count,
-                "failed": failed_count
-            },
-            "processingTime": round(total_time, 2)
+            "summary": summary,
+            "processingTime": total_time
         })
         
     except Exception as e:
@@ -438,6 +404,7 @@ def get_batch_balance():
 
 
 @subaccounts_bp.route('/batch-transfer', methods=['POST'])
+@background_job('subaccounts.batch_transfer')
 def batch_transfer():
     """
     批量转账功能
@@ -481,8 +448,15 @@ def batch_transfer():
             "toEmail": "目标子账号邮箱",
             "asset": "资产",
             "amounts": ["金额1", "金额2", ...]
-        }
+        },
+        "checkBalance": true, # 可选，执行前查询转出账号余额，余额不足的转账直接拒绝，默认true
+        "concurrency": 10, # 可选，并发执行的账号分组数
+        "async": true # 可选，提交为后台任务，通过 /api/jobs/<id> 查询进度
     }
+    
+    说明:
+    - 同一对账号之间同一资产的相反方向转账合并为一笔净额转账
+    - 转出账号相同的转账依次执行，不同账号的转账并发执行
     """
     try:
         data = request.json
@@ -497,29 +471,27 @@ def batch_transfer():
             }), 400
         
         mode = data.get('mode', '简化')
-        results = []
-        
-        if mode == '简化':
-            # 简化模式：主账号<->多个子账号
-            process_simplified_transfers(client, data, results)
-        elif mode == '自定义':
-            # 自定义转账模式：多个转账对
-            process_custom_transfers(client, data, results)
-        elif mode == '一对多':
-            # 一对多模式：一个子账号向多个子账号转账
-            process_one_to_many_transfer(client, data, results)
-        elif mode == '多对一':
-            # 多对一模式：多个子账号向一个子账号转账
-            process_many_to_one_transfer(client, data, results)
-        else:
+        entries = collect_transfer_entries(mode, data)
+        if entries is None:
             return jsonify({
                 "success": False,
                 "error": f"不支持的转账模式: {mode}"
             }), 400
         
+        # 整体预检和轧差后并发执行，结果按完成先后报告给后台任务
+        progress = ProgressList(total=len(entries))
+        ledger = execute_transfers(
+            client,
+            entries,
+            check_balance=data.get('checkBalance', True),
+            concurrency=data.get('concurrency'),
+            on_result=progress.append
+        )
+        results = ledger['results']
+        
         # 统计成功和失败数量
-        success_count = len([r for r in results if r.get('success')])
-        fail_count = len(results) - success_count
+        success_count = ledger['success']
+        fail_count = ledger['fail']
         
         return jsonify({
             "success": True,
@@ -527,7 +499,12 @@ def batch_transfer():
                 "results": results,
                 "total": len(results),
                 "success": success_count,
-                "fail": fail_count
+                "fail": fail_count,
+                "legs": ledger['legs'],
+                "transfers": ledger['transfers'],
+                "netted": ledger['netted'],
+                "rejected": ledger['rejected'],
+                "timings": ledger['timings']
             },
             "success_count": success_count,  # 添加这两个字段以兼容前端
             "fail_count": fail_count,        # 添加这两个字段以兼容前端
@@ -551,382 +528,59 @@ def batch_transfer():
         })
 
 
-def process_simplified_transfers(client, data, results):
-    """处理简化批量转账模式"""
-    transfers = data.get('transfers', [])
-    
-    for transfer in transfers:
-        email = transfer.get('email')
-        asset = transfer.get('asset')
-        amount = transfer.get('amount')
-        transfer_type = transfer.get('transferType')
-        
-        # 验证参数
-        if not email or not asset or not amount:
-            results.append({
-                "email": email or "未知",
-                "success": False,
-                "message": "缺少必要参数: email, asset, amount"
-            })
-            continue
-        
-        # 确保金额是字符串格式，币安API要求
-        if not isinstance(amount, str):
-            amount = str(amount)
-        
-        try:
-            # 从子账号到主账号
-            if transfer_type == 'FROM_SUBACCOUNT':
-                process_sub_to_master_transfer(email, asset, amount, results)
-            # 从主账号到子账号
-            else:  # transfer_type == 'TO_SUBACCOUNT'
-                process_master_to_sub_transfer(client, email, asset, amount, results)
-        except Exception as e:
-            logger.exception(f"处理转账时出错: {str(e)}")
-            results.append({
-                "email": email,
-                "asset": asset,
-                "amount": amount,
-                "success": False,
-                "message": f"处理异常: {str(e)}"
-            })
-
-
-def process_sub_to_master_transfer(email, asset, amount, results):
-    """处理从子账号到主账号的转账"""
-    # 使用子账号自己的API凭证
-    sub_api_key, sub_api_secret = get_sub_account_api_credentials(email)
-    if not sub_api_key or not sub_api_secret:
-        results.append({
-            "email": email,
-            "success": False,
-            "message": f"子账号 {email} 未配置API密钥，无法执行向主账号的转账"
-        })
-        return
-        
-    # 使用子账号客户端
-    sub_client = BinanceClient(sub_api_key, sub_api_secret)
-    
-    # 构建请求参数
-    params = {
-        'asset': asset,
-        'amount': amount,
-        'timestamp': int(time.time() * 1000)
-    }
-    
-    logger.info(f"子账号 {email} 向主账号转账参数: {params}")
-    
-    # 调用子账号向主账号转账的专用API
-    response = sub_client._send_request(
-        'POST', 
-        '/sapi/v1/sub-account/transfer/subToMaster', 
-        signed=True, 
-        params=params
-    )
-    
-    if response.get('success'):
-        results.append({
-            "email": email,
-            "fromEmail": email,
-            "toEmail": "主账号",
-            "asset": asset,
-            "amount": amount,
-            "success": True,
-            "message": "转账成功",
-            "txID": response.get('data', {}).get('txID')
-        })
-    else:
-        results.append({
-            "email": email,
-            "fromEmail": email,
-            "toEmail": "主账号",
-            "asset": asset,
-            "amount": amount,
-            "success": False,
-            "message": response.get('error', "转账失败")
-        })
-
-
-def process_master_to_sub_transfer(client, email, asset, amount, results):
-    """处理从主账号到子账号的转账"""
-    # 使用主账号API
-    response = client.sub_account_transfer(
-        from_email='', 
-        to_email=email, 
-        asset=asset,
-        amount=amount,
-        transfer_type='MASTER_TO_SUB'
-    )
-    
-    if response.get('success'):
-        results.append({
-            "email": email,
-            "fromEmail": "主账号",
-            "toEmail": email,
-            "asset": asset,
-            "amount": amount,
-            "success": True,
-            "message": "转账成功",
-            "txID": response.get('data', {}).get('txID')
-        })
-    else:
-        results.append({
-            "email": email,
-            "fromEmail": "主账号",
-            "toEmail": email,
-            "asset": asset,
-            "amount": amount,
-            "success": False,
-            "message": response.get('error', "转账失败")
-        })
-
+def collect_transfer_entries(mode, data):
+    """
+    将各批量转账模式的请求转换为统一的转账列表，邮箱为空表示主账号
 
-def process_custom_transfers(client, data, results):
-    """处理自定义多笔转账"""
-    transfers = data.get('transfers', [])
-    
-    for transfer in transfers:
-        from_email = transfer.get('fromEmail')
-        to_email = transfer.get('toEmail')
-        asset = transfer.get('asset')
-        amount = transfer.get('amount')
-        
-        # 验证参数
-        if not asset or not amount:
-            results.append({
-                "fromEmail": from_email or "主账号",
-                "toEmail": to_email or "主账号",
-                "success": False,
-                "message": "缺少必要参数: asset, amount"
-            })
-            continue
-        
-        # 确保金额是字符串格式
-        if not isinstance(amount, str):
-            amount = str(amount)
-            
-        # 至少一个邮箱必须提供
-        if not from_email and not to_email:
-            results.append({
-                "fromEmail": "未提供",
-                "toEmail": "未提供",
-                "success": False,
-                "message": "源账号和目标账号邮箱不能为空"
-            })
-            continue
-        
-        try:
-            response = None
-            # 从子账号到主账号 (toEmail为空)
-            if from_email and not to_email:
-                process_transfer_from_sub_to_master(from_email, asset, amount, results)
-            # 从主账号到子账号 (fromEmail为空)
-            elif not from_email and to_email:
-                process_transfer_from_master_to_sub(client, to_email, asset, amount, results)
-            # 子账号之间转账
-            elif from_email and to_email:
-                process_transfer_between_subs(client, from_email, to_email, asset, amount, results)
-        except Exception as e:
-            results.append({
-                "fromEmail": from_email or "主账号",
-                "toEmail": to_email or "主账号",
-                "asset": asset,
-                "amount": amount,
-                "success": False,
-                "message": str(e)
+    返回:
+    - list: [{"fromEmail", "toEmail", "asset", "amount", ...}]，模式不支持时返回None
+    """
+    if mode == '简化':
+        # 简化模式：主账号<->多个子账号
+        entries = []
+        for transfer in data.get('transfers') or []:
+            email = transfer.get('email')
+            if transfer.get('transferType') == 'FROM_SUBACCOUNT':
+                from_email, to_email = email, None
+            else:  # transfer_type == 'TO_SUBACCOUNT'
+                from_email, to_email = None, email
+            entries.append({
+                "email": email or "未知",
+                "fromEmail": from_email,
+                "toEmail": to_email,
+                "asset": transfer.get('asset'),
+                "amount": transfer.get('amount')
             })
-
-
-def process_transfer_from_sub_to_master(from_email, asset, amount, results):
-    """处理从子账号到主账号的转账"""
-    # 使用子账号自己的API凭证
-    sub_api_key, sub_api_secret = get_sub_account_api_credentials(from_email)
-    if not sub_api_key or not sub_api_secret:
-        results.append({
-            "fromEmail": from_email,
-            "toEmail": "主账号",
-            "asset": asset,
-            "amount": amount,
-            "success": False,
-            "message": f"子账号 {from_email} 未配置API密钥，无法执行向主账号的转账"
-        })
-        return
-        
-    # 使用子账号客户端
-    sub_client = BinanceClient(sub_api_key, sub_api_secret)
-    
-    # 构建请求参数
-    params = {
-        'asset': asset,
-        'amount': amount,
-        'timestamp': int(time.time() * 1000)
-    }
-    
-    logger.info(f"子账号 {from_email} 向主账号转账参数: {params}")
-    
-    # 调用子账号向主账号转账的专用API
-    response = sub_client._send_request(
-        'POST', 
-        '/sapi/v1/sub-account/transfer/subToMaster', 
-        signed=True, 
-        params=params
-    )
-    
-    if response.get('success'):
-        results.append({
-            "fromEmail": from_email,
-            "toEmail": "主账号",
-            "asset": asset,
-            "amount": amount,
-            "success": True,
-            "message": "转账成功",
-            "txID": response.get('data', {}).get('txID')
-        })
-    else:
-        results.append({
-            "fromEmail": from_email,
-            "toEmail": "主账号",
-            "asset": asset,
-            "amount": amount,
-            "success": False,
-            "message": response.get('error', "转账失败")
-        })
-
-
-def process_transfer_from_master_to_sub(client, to_email, asset, amount, results):
-    """处理从主账号到子账号的转账"""
-    # 使用主账号API
-    response = client.sub_account_transfer(
-        from_email='', 
-        to_email=to_email, 
-        asset=asset,
-        amount=amount,
-        transfer_type='MASTER_TO_SUB'
-    )
-    
-    if response.get('success'):
-        results.append({
-            "fromEmail": "主账号",
-            "toEmail": to_email,
-            "asset": asset,
-            "amount": amount,
-            "success": True,
-            "message": "转账成功",
-            "txID": response.get('data', {}).get('txID')
-        })
-    else:
-        results.append({
-            "fromEmail": "主账号",
+        return entries
+
+    if mode == '自定义':
+        # 自定义转账模式：多个转账对
+        return [{
+            "fromEmail": transfer.get('fromEmail'),
+            "toEmail": transfer.get('toEmail'),
+            "asset": transfer.get('asset'),
+            "amount": transfer.get('amount')
+        } for transfer in data.get('transfers') or []]
+
+    if mode == '一对多':
+        # 一对多模式：一个子账号(为空时为主账号)向多个子账号转账
+        return [{
+            "fromEmail": data.get('fromEmail'),
             "toEmail": to_email,
-            "asset": asset,
-            "amount": amount,
-            "success": False,
-            "message": response.get('error', "转账失败")
-        })
-
+            "asset": data.get('asset'),
+            "amount": data.get('amount')
+        } for to_email in data.get('toEmails') or []]
 
-def process_transfer_between_subs(client, from_email, to_email, asset, amount, results):
-    """处理子账号之间的转账"""
-    # 使用主账号API
-    response = client.sub_account_transfer(
-        from_email=from_email,
-        to_email=to_email,
-        asset=asset,
-        amount=amount,
-        transfer_type='SUB_TO_SUB'
-    )
-    
-    if response.get('success'):
-        results.append({
-            "fromEmail": from_email,
-            "toEmail": to_email,
-            "asset": asset,
-            "amount": amount,
-            "success": True,
-            "message": "转账成功",
-            "txID": response.get('data', {}).get('txID')
-        })
-    else:
-        results.append({
+    if mode == '多对一':
+        # 多对一模式：多个子账号向一个子账号(为空时为主账号)转账
+        return [{
             "fromEmail": from_email,
-            "toEmail": to_email,
-            "asset": asset,
-            "amount": amount,
-            "success": False,
-            "message": response.get('error', "转账失败")
-        })
-
+            "toEmail": data.get('toEmail'),
+            "asset": data.get('asset'),
+            "amount": data.get('amount')
+        } for from_email in data.get('fromEmails') or []]
 
-def process_one_to_many_transfer(client, data, results):
-    """处理一对多转账"""
-    from_email = data.get('fromEmail')
-    to_emails = data.get('toEmails', [])
-    asset = data.get('asset')
-    amount = data.get('amount')
-    
-    # 验证参数
-    if not asset or not amount or not to_emails:
-        return False
-    
-    # 确保金额是字符串格式
-    if not isinstance(amount, str):
-        amount = str(amount)
-    
-    for to_email in to_emails:
-        try:
-            # 从主账号到子账号 (fromEmail为空)
-            if not from_email:
-                process_transfer_from_master_to_sub(client, to_email, asset, amount, results)
-            # 子账号之间转账
-            else:
-                process_transfer_between_subs(client, from_email, to_email, asset, amount, results)
-        except Exception as e:
-            results.append({
-                "fromEmail": from_email or "主账号",
-                "toEmail": to_email,
-                "asset": asset,
-                "amount": amount,
-                "success": False,
-                "message": str(e)
-            })
-    
-    return True
-
-
-def process_many_to_one_transfer(client, data, results):
-    """处理多对一转账"""
-    from_emails = data.get('fromEmails', [])
-    to_email = data.get('toEmail')
-    asset = data.get('asset')
-    amount = data.get('amount')
-    
-    # 验证参数
-    if not asset or not amount or not from_emails:
-        return False
-    
-    # 确保金额是字符串格式
-    if not isinstance(amount, str):
-        amount = str(amount)
-    
-    for from_email in from_emails:
-        try:
-            # 从子账号到主账号 (toEmail为空)
-            if not to_email:
-                process_transfer_from_sub_to_master(from_email, asset, amount, results)
-            # 子账号之间转账
-            else:
-                process_transfer_between_subs(client, from_email, to_email, asset, amount, results)
-        except Exception as e:
-            results.append({
-                "fromEmail": from_email,
-                "toEmail": to_email or "主账号",
-                "asset": asset,
-                "amount": amount,
-                "success": False,
-                "message": str(e)
-            })
-    
-    return True
+    return None
 
 
 @subaccounts_bp.route('/batch-spot-futures-transfer', methods=['POST'])
@@ -8,6 +8,10 @@ from app.models import db
 from app.services.binance_client import BinanceClient
 from . import subaccounts_bp
 from app.services.binance_client import get_binance_client
+from app.services.client_registry import get_client_registry
+from app.services.job_queue import background_job, report_progress
+from app.services.key_health import get_key_health
+from app.services.subaccount_directory import get_subaccount_directory, load_extra
 from app.utils.auth import token_required
 from app.models.account import SubAccountAPISettings
 from app.api.auth import authenticated_user
@@ -25,6 +29,8 @@ def get_subaccounts():
     查询参数:
     - page: 页码，默认1
     - limit: 每页数量，默认10
+    - search: (可选)邮箱关键字
+    - refresh: (可选)为 true 时先从币安重新同步子账号目录
     - user_id: (可选)用户ID或邮箱，如果不提供则尝试从token获取
                可以传入数字ID或邮箱地址，系统会自动处理
     """
@@ -71,70 +77,40 @@ def get_subaccounts():
     
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 10, type=int)
+    search = request.args.get('search', '').strip()
+    refresh = request.args.get('refresh', 'false').lower() == 'true'
     
-    logger.info(f"正在获取子账号列表，页码：{page}，每页数量：{limit}，user_id: {user_id}")
+    logger.info(f"正在获取子账号列表，页码：{page}，每页数量：{limit}，搜索：{search}，user_id: {user_id}")
     
-    result = client.get_sub_accounts(page, limit)
+    # 子账号从本地目录读取，表中没有记录或要求刷新时才请求币安
+    directory = get_subaccount_directory()
+    sync_result = directory.sync(client) if refresh else directory.ensure_synced(client)
+    if not sync_result.get('success'):
+        logger.error(f"API请求失败: {sync_result.get('error')}")
+        return jsonify({
+            "success": False,
+            "error": sync_result.get('error')
+        })
     
-    # 日志记录API响应时间和结果
+    # 为每个子账号添加API密钥状态字段
+    registry = get_client_registry()
+    subaccounts_list = []
+    for subaccount in directory.list_accounts(client, page, limit, search or None):
+        account, _ = load_extra(subaccount)
+        api_key, api_secret = registry.get_credentials(subaccount.email)
+        account['has_api_key'] = bool(api_key and api_secret)
+        account['api_key'] = api_key
+        account['api_secret_masked'] = '******' if api_secret else None
+        subaccounts_list.append(account)
+    
+    # 日志记录响应时间和结果
     elapsed = time.time() - start_time
-    logger.info(f"获取子账号列表API响应时间：{elapsed:.2f}秒")
+    logger.info(f"获取子账号列表响应时间：{elapsed:.2f}秒，返回 {len(subaccounts_list)} 个子账号")
     
-    if result.get('success') and 'data' in result:
-        # 规范化数据结构
-        # 检查返回的数据结构，确保包含子账号列表，并放入subaccounts字段中
-        data = result['data']
-        
-        # 处理不同的响应结构
-        subaccounts_list = []
-        if isinstance(data, list):
-            # 如果data直接是列表，将整个列表视为子账号列表
-            subaccounts_list = data
-            logger.info(f"API返回列表结构，获取到 {len(subaccounts_list)} 个子账号")
-        elif isinstance(data, dict):
-            # 如果data是字典，检查可能的子账号列表字段
-            if 'subAccounts' in data:
-                subaccounts_list = data.pop('subAccounts')
-                logger.info(f"获取到 {len(subaccounts_list)} 个子账号")
-            elif 'subAccountList' in data:
-                # 另一种可能的字段名
-                subaccounts_list = data.pop('subAccountList')
-                logger.info(f"从subAccountList获取到 {len(subaccounts_list)} 个子账号")
-            elif 'subaccounts' in data:
-                # 如果已经有subaccounts字段
-                subaccounts_list = data['subaccounts']
-                logger.info(f"从subaccounts获取到 {len(subaccounts_list)} 个子账号")
-            elif not any(key for key in data.keys() if 'account' in key.lower() or 'list' in key.lower()):
-                # 如果没有明显包含子账号的字段，将整个对象包装成列表
-                logger.warning(f"API返回数据没有明确的子账号字段: {list(data.keys())}")
-                subaccounts_list = [data]
-        else:
-            # 如果是其他类型，记录警告并返回空列表
-            logger.warning(f"API返回的数据格式无法识别: {type(data).__name__}")
-            subaccounts_list = []
-            
-        # 为每个子账号添加API密钥状态字段
-        enriched_subaccounts = []
-        for account in subaccounts_list:
-            if isinstance(account, dict) and 'email' in account:
-                email = account['email']
-                # 查询数据库获取API设置
-                api_setting = SubAccountAPISettings.query.filter_by(email=email).first()
-                # 添加API状态字段
-                account['has_api_key'] = bool(api_setting and api_setting.api_key and api_setting.api_secret)
-                account['api_key'] = api_setting.api_key if api_setting else None
-                account['api_secret_masked'] = '******' if (api_setting and api_setting.api_secret) else None
-                enriched_subaccounts.append(account)
-            else:
-                enriched_subaccounts.append(account)
-                
-        # 更新结果
-        result['data'] = enriched_subaccounts
-    else:
-        error_msg = result.get('error', '未知错误')
-        logger.error(f"API请求失败: {error_msg}")
-    
-    return jsonify(result)
+    return jsonify({
+        "success": True,
+        "data": subaccounts_list
+    })
 
 
 @subaccounts_bp.route('/', methods=['POST'])
@@ -231,10 +207,14 @@ def create_subaccount():
             if not options_result.get('success'):
                 logger.warning(f"为子账号 {email} 开通期权功能失败: {options_result.get('error')}")
     
+    if result.get('success'):
+        get_subaccount_directory().request_refresh(client)
+    
     return jsonify(result)
 
 
 @subaccounts_bp.route('/batch', methods=['POST'])
+@background_job('subaccounts.batch_create')
 def batch_create_subaccounts():
     """
     批量创建子账号
@@ -245,7 +225,8 @@ def batch_create_subaccounts():
         "prefix": "账号前缀",
         "count": 创建数量,
         "accountType": "账号类型",
-        "features": ["futures", "margin", "options"] # 可选功能列表
+        "features": ["futures", "margin", "options"], # 可选功能列表
+        "async": true # 可选，提交为后台任务，通过 /api/jobs/<id> 查询进度
     }
     """
     # 从请求数据中获取user_id
@@ -324,6 +305,7 @@ def batch_create_subaccounts():
     # 批量创建子账号
     results = []
     successful_accounts = []
+    report_progress(total=len(account_names))
     
     for name in account_names:
         logger.info(f"正在创建子账号: {name}")
@@ -361,12 +343,21 @@ def batch_create_subaccounts():
                 options_result = client.enable_subaccount_options(email)
                 if not options_result.get('success'):
                     logger.warning(f"为子账号 {email} 开通期权功能失败: {options_result.get('error')}")
+        
+        report_progress({
+            "name": name,
+            "success": bool(result.get('success')),
+            "email": (result.get('data') or {}).get('email') if result.get('success') else None,
+            "error": result.get('error')
+        })
     
     # 统计成功和失败的数量
     success_count = sum(1 for r in results if r["result"]["success"]
                         and "data" in r["result"] and "email" in r["result"]["data"])
     
     logger.info(f"批量创建完成，成功: {success_count}/{count}")
+    if success_count:
+        get_subaccount_directory().request_refresh(client)
     
     return jsonify({
         "success": True,
@@ -445,17 +436,17 @@ def get_batch_details():
     请求体:
     {
         "emails": ["子账号邮箱1", "子账号邮箱2", ...],
-        "recvWindow": 接收窗口时间(可选，默认5000),
-        "user_id": 用户ID(可选)
+        "user_id": 用户ID(可选),
+        "refresh": true # 可选，先从币安重新同步子账号目录
     }
     """
     start_time = time.time()
     try:
-        from app.models.account import SubAccountAPISettings
+        # API设置从客户端注册表读取，不再逐个查询数据库
+        registry = get_client_registry()
         
         data = request.json
         emails = data.get('emails', [])
-        recv_window = data.get('recvWindow', 5000)
         user_id = data.get('user_id')
 
         logger.info(f"正在批量获取子账号详细信息，邮箱数量：{len(emails)}, 用户ID：{user_id}")
@@ -479,117 +470,26 @@ def get_batch_details():
         successful_count = 0
         failed_count = 0
 
-        # 首先获取所有子账号的基本信息列表
-        list_params = {
-            'recvWindow': recv_window
-        }
-        
-        # 调用子账号列表API获取所有子账号信息
-        list_endpoint = '/sapi/v1/sub-account/list'
-        
-        list_response = client._send_request('GET', list_endpoint, signed=True, params=list_params)
-        
-        # 检查响应类型并安全处理
-        if not isinstance(list_response, dict):
-            logger.error(f"获取子账号列表返回非字典响应: {list_response}")
+        # 子账号信息和功能状态从本地目录一次查询，有未知邮箱时最多重新同步一次
+        directory = get_subaccount_directory()
+        sync_result = directory.sync(client) if data.get('refresh') else directory.ensure_synced(client)
+        if not sync_result.get('success'):
+            logger.error(f"同步子账号目录失败: {sync_result.get('error')}")
             return jsonify({
                 "success": False,
-                "error": f"获取子账号列表失败: 不期望的响应格式 ({type(list_response).__name__})"
+                "error": sync_result.get('error')
             }), 500
+        subaccounts = directory.get_accounts(client, emails)
         
-        if not list_response.get('success'):
-            error_msg = list_response.get('error', '未知错误')
-            logger.error(f"获取子账号列表失败: {error_msg}")
-            return jsonify({
-                "success": False,
-                "error": f"获取子账号列表失败: {error_msg}"
-            }), 500
-        
-        # 安全获取子账号列表数据
-        list_data = list_response.get('data')
-        if not isinstance(list_data, list):
-            # 如果data不是列表，可能是API返回格式发生变化
-            if isinstance(list_data, dict) and 'subAccountList' in list_data:
-                all_subaccounts = list_data.get('subAccountList', [])
-            else:
-                logger.error(f"子账号列表格式异常: {list_data}")
-                all_subaccounts = []
-        else:
-            all_subaccounts = list_data
-            
-        # 创建一个邮箱到账号信息的映射
-        email_to_account = {}
-        
-        for account in all_subaccounts:
-            if isinstance(account, dict):
-                email = account.get('email', '')
-                if email:
-                    email_to_account[email] = account
-        
-        # 获取所有子账号功能状态信息
-        status_params = {
-            'recvWindow': recv_window
-        }
-        
-        status_endpoint = '/sapi/v1/sub-account/status'
-        
-        status_response = client._send_request('GET', status_endpoint, signed=True, params=status_params)
-        
-        # 创建一个邮箱到功能状态的映射
-        email_to_status = {}
-        
-        # 安全处理状态响应
-        if isinstance(status_response, dict) and status_response.get('success'):
-            status_data = status_response.get('data')
-            if isinstance(status_data, list):
-                status_list = status_data
-            else:
-                # 如果data不是列表，可能包含在下一级字段
-                status_list = status_data.get('statusList', []) if isinstance(status_data, dict) else []
-                
-            for status in status_list:
-                if isinstance(status, dict):
-                    email = status.get('email', '')
-                    if email:
-                        email_to_status[email] = status
-        else:
-            error_msg = status_response.get('error', '未知错误') if isinstance(status_response, dict) else str(status_response)
-            logger.warning(f"获取子账号功能状态失败: {error_msg}")
+        # API密钥健康状态读取后台检查的结果，不实时请求子账号API
+        key_health = get_key_health().get_health(emails)
         
         # 处理请求的每个子账号
         for email in emails:
             email_start_time = time.time()
             
-            # 从已获取的数据中查找子账号信息
-            account_info = email_to_account.get(email, {})
-            status_info = email_to_status.get(email, {})
-            
-            if not account_info:
-                # 如果在主查询中找不到，尝试单独查询该子账号
-                try:
-                    single_params = {
-                        'email': email,
-                        'recvWindow': recv_window
-                    }
-                    
-                    single_endpoint = '/sapi/v1/sub-account/status'
-                    single_response = client._send_request('GET', single_endpoint, signed=True, params=single_params)
-                    
-                    if isinstance(single_response, dict) and single_response.get('success'):
-                        single_data = single_response.get('data')
-                        if isinstance(single_data, list) and len(single_data) > 0:
-                            # 找到了指定的子账号
-                            status_info = single_data[0]
-                            account_info = {
-                                'email': email,
-                                'activated': True  # 假设存在的账号是已激活的
-                            }
-                        else:
-                            logger.warning(f"单独查询子账号 {email} 状态返回空数据")
-                    else:
-                        logger.warning(f"单独查询子账号 {email} 失败")
-                except Exception as single_err:
-                    logger.error(f"单独查询子账号 {email} 出错: {str(single_err)}")
+            subaccount = subaccounts.get(email)
+            account_info, status_info = load_extra(subaccount) if subaccount is not None else ({}, {})
             
             if not account_info:
                 logger.warning(f"未找到子账号 {email} 的基本信息")
@@ -603,8 +503,7 @@ def get_batch_details():
                 continue
                 
             # 获取子账号的API设置信息
-            api_setting = SubAccountAPISettings.query.filter_by(email=email).first()
-            has_api = bool(api_setting and api_setting.api_key and api_setting.api_secret)
+            has_api = registry.has_credentials(email)
                 
             # 安全获取子账号ID
             sub_id = ''
@@ -621,17 +520,19 @@ def get_batch_details():
                 "mobile": account_info.get('mobile', '') if isinstance(account_info, dict) else '',
                 "isFreeze": account_info.get('isFreeze', False) if isinstance(account_info, dict) else False,
                 "isManaged": account_info.get('isManaged', False) if isinstance(account_info, dict) else False,
-                "hasApiKey": has_api
+                "hasApiKey": has_api,
+                "apiKeyHealthy": key_health[email]['healthy'] if has_api and email in key_health else None,
+                "apiKeyHealth": key_health.get(email) if has_api else None
             }
             
-            # 添加功能状态信息（如果有）
+            # 添加功能状态信息（如果有），开通状态使用同步时解析的标志
             if status_info and isinstance(status_info, dict):
                 detail.update({
-                    "enableMargin": status_info.get('enableMargin', False),
-                    "enableFutures": status_info.get('enableFutures', False),
+                    "enableMargin": status_info.get('enableMargin', subaccount.is_margin_enabled),
+                    "enableFutures": status_info.get('enableFutures', subaccount.is_futures_enabled),
                     "marginLevel": status_info.get('marginLevel', 0),
-                    "marginEnable": status_info.get('marginEnable', False),
-                    "futuresEnable": status_info.get('futuresEnable', False)
+                    "marginEnable": status_info.get('marginEnable', subaccount.is_margin_enabled),
+                    "futuresEnable": status_info.get('futuresEnable', subaccount.is_futures_enabled)
                 })
                 
             processing_time = time.time() - email_start_time
@@ -348,9 +348,7 @@ def get_cm_trades():
                 
                 # 构建API请求参数 - 使用CM账户成交历史接口
                 params = {
-                    'symbol': symbol,
-                    'recvWindow': 60000,  # 增加接收窗口时间
-                    'timestamp': int(time.time() * 1000)
+                    'symbol': symbol
                 }
                 
                 # 添加其他可选参数
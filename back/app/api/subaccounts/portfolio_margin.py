@@ -1,9 +1,16 @@
 import logging
 import json
 import math
+import time
+from decimal import Decimal, ROUND_DOWN
 from flask import request, jsonify, current_app
 from app.utils.auth import token_required
 from app.services.binance_client import get_client_by_email
+from app.services.async_binance_client import AsyncBinanceClient
+from app.services.batch_executor import iter_batch, run_async_batch, resolve_concurrency
+from app.services.job_queue import background_job, ProgressList
+from app.services.leverage_cache import ensure_leverage, fetch_leverage, get_leverage_cache
+from app.services.symbol_metadata import get_symbol_info
 from app.models.account import SubAccountAPISettings
 from . import subaccounts_bp
 
@@ -845,6 +852,12 @@ def change_um_leverage(current_user):
             endpoint = '/papi/v1/um/leverage'  # 币安调整UM杠杆倍数API端点
             result = client._send_request('POST', endpoint, params=params, signed=True)
             
+            # 更新已知杠杆，后续带leverage参数的下单可跳过设置
+            if result.get('success'):
+                get_leverage_cache().set(email, 'um', symbol, leverage)
+            else:
+                get_leverage_cache().invalidate(email, 'um', symbol)
+            
             # 记录并返回成功响应
             logger.info(f"成功调整子账号 {email} 的 {symbol} 杠杆倍数为 {leverage}")
             return jsonify({
@@ -869,6 +882,7 @@ def change_um_leverage(current_user):
 
 @subaccounts_bp.route('/portfolio-margin/um/batch-leverage', methods=['POST'])
 @token_required
+@background_job('subaccounts.batch_leverage')
 def batch_change_um_leverage(current_user):
     """
     批量设置多个子账号的U本位合约杠杆倍数
@@ -878,7 +892,9 @@ def batch_change_um_leverage(current_user):
         "emails": ["子账号1邮箱", "子账号2邮箱", ...],
         "symbol": "交易对，例如BTCUSDT",
         "leverage": 整数杠杆倍数(1-125),
-        "contractType": "合约类型，UM(U本位)或CM(币本位)"
+        "contractType": "合约类型，UM(U本位)或CM(币本位)",
+        "concurrency": 10,  # 可选，并发数
+        "async": true # 可选，提交为后台任务，通过 /api/jobs/<id> 查询进度
     }
     """
     try:
@@ -921,58 +937,61 @@ def batch_change_um_leverage(current_user):
         
         logger.info(f"准备为{len(emails)}个子账号批量设置{contract_type}合约杠杆倍数")
         
-        # 结果存储
-        results = []
-        success_count = 0
-        failed_count = 0
+        market = contract_type.lower()
+        if contract_type == 'CM' and symbol.endswith('USDT'):
+            # 将BTCUSDT转换为BTCUSD_PERP格式
+            symbol = symbol.replace('USDT', 'USD_PERP')
         
-        # 逐个处理子账号
-        for email in emails:
-            try:
-                # 获取子账号客户端
-                client = get_client_by_email(email)
-                
-                if not client:
-                    failed_count += 1
-                    results.append({
-                        "email": email,
-                        "success": False,
-                        "error": "无法获取API客户端"
-                    })
-                    continue
-                
-                # 根据合约类型选择不同的API端点和函数
-                if contract_type == 'UM':
-                    # U本位合约
-                    result = client.set_um_leverage(symbol, leverage)
-                else:
-                    # 币本位合约
-                    # 对于币本位合约，可能需要调整交易对格式
-                    cm_symbol = symbol
-                    if symbol.endswith('USDT'):
-                        # 将BTCUSDT转换为BTCUSD_PERP格式
-                        cm_symbol = symbol.replace('USDT', 'USD_PERP')
-                        
-                    result = client.set_coin_futures_leverage(cm_symbol, leverage)
-                
-                # 记录成功
-                success_count += 1
-                results.append({
+        def apply_leverage(email):
+            """查询子账号当前杠杆，与目标不同时才设置"""
+            client = get_client_by_email(email)
+            if not client:
+                return {
                     "email": email,
-                    "success": True,
-                    "data": result
-                })
+                    "success": False,
+                    "error": "无法获取API客户端"
+                }
+            
+            current = get_leverage_cache().get(email, market, symbol)
+            if current is None:
+                current = fetch_leverage(client, email, symbol, market)
+            result = ensure_leverage(client, email, symbol, leverage, market, current=current)
+            if not result.get('success'):
+                logger.error(f"为子账号 {email} 设置杠杆倍数失败: {result.get('error')}")
+                return {
+                    "email": email,
+                    "success": False,
+                    "previous": current,
+                    "error": result.get('error')
+                }
+            if result.get('skipped'):
+                logger.info(f"子账号 {email} 的{contract_type}合约杠杆倍数已为 {leverage}，跳过设置")
+            else:
                 logger.info(f"成功为子账号 {email} 设置{contract_type}合约杠杆倍数 {leverage}")
-
-            except Exception as e:
-                        error_msg = str(e)
-                        failed_count += 1
-                        results.append({
-                            "email": email,
-                            "success": False,
-                            "error": error_msg
-                        })
-                        logger.error(f"为子账号 {email} 设置杠杆倍数失败: {error_msg}")
+            return {
+                "email": email,
+                "success": True,
+                "skipped": result.get('skipped'),
+                "previous": current,
+                "data": result
+            }
+        
+        # 各账号并发查询并设置，请求频率由客户端内的调度器控制
+        concurrency = resolve_concurrency(
+            data.get('concurrency'),
+            service='papi',
+            task_count=len(emails),
+            weight_per_task=5
+        )
+        progress = ProgressList(total=len(emails))
+        results = [None] * len(emails)
+        for index, result in iter_batch(emails, apply_leverage, concurrency):
+            results[index] = result
+            progress.append(result)
+        
+        success_count = sum(1 for result in results if result.get('success'))
+        failed_count = len(results) - success_count
+        skipped_count = sum(1 for result in results if result.get('skipped'))
         
         # 返回批量处理结果
         return jsonify({
@@ -981,9 +1000,10 @@ def batch_change_um_leverage(current_user):
                 "results": results,
                 "success_count": success_count,
                 "failed_count": failed_count,
+                "skipped_count": skipped_count,
                 "total": len(emails)
             },
-            "message": f"批量设置杠杆倍数完成: 成功 {success_count} 个, 失败 {failed_count} 个"
+            "message": f"批量设置杠杆倍数完成: 成功 {success_count} 个(其中 {skipped_count} 个无需修改), 失败 {failed_count} 个"
         })
         
     except Exception as e:
@@ -1187,4 +1207,236 @@ def close_portfolio_margin_cm_position(current_user):
         return jsonify({
             "success": False,
             "error": f"平仓币本位合约持仓异常: {str(e)}"
-        }), 500 
\ No newline at end of file
+        }), 500
+
+# ========== 多账号批量平仓 ==========
+
+# 各合约类型的账户(持仓)接口和下单接口
+FLATTEN_ENDPOINTS = {
+    'UM': ('/papi/v1/um/account', '/papi/v1/um/order', 'um'),
+    'CM': ('/papi/v1/cm/account', '/papi/v1/cm/order', 'cm')
+}
+
+
+def _close_quantity(position_amt, percentage, symbol_info):
+    """
+    计算平仓数量字符串: 全平时直接使用持仓数量，部分平仓时按数量步长向下取整
+
+    返回:
+    - str 或 None(取整后为0)
+    """
+    amount = abs(Decimal(str(position_amt)))
+    if percentage < 100:
+        amount = amount * Decimal(str(percentage)) / 100
+        if symbol_info and symbol_info.step_size:
+            amount = (amount / symbol_info.step_size).to_integral_value(rounding=ROUND_DOWN) * symbol_info.step_size
+        else:
+            amount = amount.quantize(Decimal('0.00000001'), rounding=ROUND_DOWN)
+    if amount <= 0:
+        return None
+    return format(amount.normalize(), 'f')
+
+
+def build_close_orders(email, contract_type, positions, symbols=None, percentage=100):
+    """
+    根据持仓生成市价平仓订单参数
+
+    参数:
+    - email: 子账号邮箱
+    - contract_type: UM / CM
+    - positions: 账户接口返回的持仓列表
+    - symbols: 只平这些交易对(可选，为空时平全部持仓)
+    - percentage: 平仓比例，100表示全平
+
+    返回:
+    - (orders, skipped): orders 为下单任务列表，skipped 为取整后数量为0的持仓
+    """
+    market = FLATTEN_ENDPOINTS[contract_type][2]
+    orders = []
+    skipped = []
+    for position in positions:
+        symbol = position.get('symbol')
+        position_amt = float(position.get('positionAmt', '0') or 0)
+        if position_amt == 0 or (symbols and symbol not in symbols):
+            continue
+
+        position_side = position.get('positionSide') or 'BOTH'
+        side = 'SELL' if position_amt > 0 else 'BUY'  # 平多用SELL，平空用BUY
+        quantity = _close_quantity(position.get('positionAmt'), percentage, get_symbol_info(symbol, market))
+        if quantity is None:
+            skipped.append({"email": email, "symbol": symbol, "positionSide": position_side, "reason": "平仓数量取整后为0"})
+            continue
+
+        params = {
+            'symbol': symbol,
+            'side': side,
+            'type': 'MARKET',
+            'quantity': quantity
+        }
+        if position_side in ('LONG', 'SHORT'):
+            # 双向持仓模式按持仓方向平仓
+            params['positionSide'] = position_side
+        else:
+            # 单向持仓模式只减仓，避免反向开仓
+            params['reduceOnly'] = 'true'
+
+        orders.append({
+            "email": email,
+            "contractType": contract_type,
+            "positionSide": position_side,
+            "positionAmt": position.get('positionAmt'),
+            "params": params
+        })
+    return orders, skipped
+
+
+@subaccounts_bp.route('/portfolio-margin/flatten', methods=['POST'])
+@token_required
+@background_job('subaccounts.flatten_positions')
+def flatten_portfolio_margin_positions(current_user):
+    """
+    多个子账号统一账户批量平仓: 并发查询U本位/币本位持仓，一次生成全部平仓订单后并发提交
+    
+    持仓查询和平仓下单使用异步客户端在一个事件循环中并发执行，并发数不受线程数限制
+    
+    请求体:
+    {
+        "emails": ["子账号1邮箱", "子账号2邮箱", ...],
+        "symbols": ["BTCUSDT", "BTCUSD_PERP", ...],  # 可选，为空时平全部持仓
+        "contractTypes": ["UM", "CM"],  # 可选，默认两者
+        "percentage": 100,  # 可选，平仓比例，默认全平
+        "concurrency": 10,  # 可选，并发数
+        "async": true # 可选，提交为后台任务，通过 /api/jobs/<id> 查询进度
+    }
+    """
+    try:
+        data = request.json or {}
+        emails = data.get('emails')
+        if not isinstance(emails, list) or len(emails) == 0:
+            return jsonify({
+                "success": False,
+                "error": "emails必须是非空数组"
+            }), 400
+
+        symbols = set(symbol.upper() for symbol in data.get('symbols') or [])
+        contract_types = [item.upper() for item in data.get('contractTypes') or ['UM', 'CM']]
+        if any(item not in FLATTEN_ENDPOINTS for item in contract_types):
+            return jsonify({
+                "success": False,
+                "error": "合约类型必须为UM(U本位)或CM(币本位)"
+            }), 400
+
+        percentage = float(data.get('percentage', 100))
+        if percentage <= 0 or percentage > 100:
+            return jsonify({
+                "success": False,
+                "error": "平仓比例必须在0-100之间"
+            }), 400
+
+        started = time.perf_counter()
+        clients = {}
+        for email in emails:
+            client = get_client_by_email(email)
+            clients[email] = AsyncBinanceClient.from_client(client) if client else None
+        accounts = {
+            email: {"email": email, "success": True, "orders": 0, "filled": 0, "errors": []}
+            for email in emails
+        }
+        for email, client in clients.items():
+            if not client:
+                accounts[email]["success"] = False
+                accounts[email]["errors"].append(f"未找到子账号 {email} 的API密钥")
+
+        # 1. 并发查询所有账号的持仓
+        async def fetch_positions(task):
+            email, contract_type = task
+            response = await clients[email].request('GET', FLATTEN_ENDPOINTS[contract_type][0], signed=True)
+            return {
+                "email": email,
+                "contractType": contract_type,
+                "success": response.get('success', False),
+                "positions": (response.get('data') or {}).get('positions', []) if response.get('success') else [],
+                "error": response.get('error'),
+                "completed_ms": round((time.perf_counter() - started) * 1000, 1)
+            }
+
+        fetch_tasks = [(email, contract_type) for email in emails if clients[email] for contract_type in contract_types]
+        concurrency = resolve_concurrency(data.get('concurrency'), service='papi', task_count=len(fetch_tasks), weight_per_task=5)
+        fetched, fetch_latency = run_async_batch(fetch_tasks, fetch_positions, concurrency)
+
+        # 2. 一次生成全部平仓订单
+        close_orders = []
+        skipped = []
+        for (email, contract_type), result in zip(fetch_tasks, fetched):
+            accounts[email]["completed_ms"] = max(accounts[email].get("completed_ms") or 0, result.get("completed_ms") or 0)
+            if not result.get('success'):
+                accounts[email]["success"] = False
+                accounts[email]["errors"].append(f"获取{contract_type}持仓失败: {result.get('error')}")
+                continue
+            orders, skipped_positions = build_close_orders(
+                email, contract_type, result.get('positions') or [], symbols, percentage)
+            close_orders.extend(orders)
+            skipped.extend(skipped_positions)
+        logger.info(f"批量平仓: 账号={len(emails)}, 平仓订单={len(close_orders)}, 查询持仓耗时={fetch_latency['total_ms']}ms")
+
+        # 3. 并发提交平仓订单(统一账户没有批量下单接口，按订单并发)
+        async def submit_order(order):
+            endpoint = FLATTEN_ENDPOINTS[order["contractType"]][1]
+            response = await clients[order["email"]].request('POST', endpoint, params=order["params"], signed=True)
+            return {
+                "email": order["email"],
+                "contractType": order["contractType"],
+                "symbol": order["params"]["symbol"],
+                "side": order["params"]["side"],
+                "positionSide": order["positionSide"],
+                "amount": order["params"]["quantity"],
+                "success": response.get('success', False),
+                "orderId": (response.get('data') or {}).get('orderId') if response.get('success') else None,
+                "error": response.get('error'),
+                "completed_ms": round((time.perf_counter() - started) * 1000, 1)
+            }
+
+        results = ProgressList(total=len(close_orders))
+        order_latency = None
+        if close_orders:
+            concurrency = resolve_concurrency(data.get('concurrency'), service='papi', task_count=len(close_orders))
+            submitted, order_latency = run_async_batch(close_orders, submit_order, concurrency)
+            for result in submitted:
+                results.append(result)
+
+        # 4. 按账号汇总完成情况和耗时(从请求开始到该账号最后一个请求返回)
+        for result in results:
+            account = accounts[result["email"]]
+            account["orders"] += 1
+            if result["success"]:
+                account["filled"] += 1
+            else:
+                account["success"] = False
+                account["errors"].append(f"{result['symbol']} 平仓失败: {result['error']}")
+            account["completed_ms"] = max(account.get("completed_ms") or 0, result.get("completed_ms") or 0)
+
+        success_count = sum(1 for result in results if result["success"])
+        return jsonify({
+            "success": True,
+            "data": {
+                "results": list(results),
+                "accounts": list(accounts.values()),
+                "skipped": skipped,
+                "total": len(results),
+                "success_count": success_count,
+                "failed_count": len(results) - success_count,
+                "latency": {
+                    "positions": fetch_latency,
+                    "orders": order_latency,
+                    "total_ms": round((time.perf_counter() - started) * 1000, 1)
+                }
+            },
+            "message": f"批量平仓完成: 成功 {success_count} 个, 失败 {len(results) - success_count} 个"
+        })
+
+    except Exception as e:
+        logger.exception(f"批量平仓操作出错: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"批量平仓操作出错: {str(e)}"
+        }), 500
@@ -3,9 +3,20 @@ from datetime import datetime, timedelta
 from app.models import db, GridTrading, OrderHistory, TradeHistory, MarginOrder, MarginTrade, FeeRecord
 import math
 import json
+from sqlalchemy import func
 import logging
 import time
-from app.services.binance_client import BinanceClient, get_sub_account_api_credentials, get_client_by_email
+from app.services.binance_client import get_client_by_email
+from app.services.symbol_metadata import get_symbol_info
+from app.services.grid_monitor import get_grid_monitor
+from app.services.grid_planner import build_price_ladder, plan_grid
+from app.services.price_cache import get_price
+from app.services.user_stream import get_user_stream_manager, get_order_store, FINAL_STATUSES
+from app.services.trade_sync import SYNC_MARKETS, get_trade_sync
+from app.services.client_registry import get_client_registry
+from app.services.fee_rollup import summarize_by_asset
+from app.services.record_writer import get_record_writer
+from app.services.trade_history import clamp_page_size, count_trades, parse_local_date, query_trades, serialize_trade
 from app.models.account import SubAccountAPISettings
 from binance.exceptions import BinanceAPIException
 from binance.client import Client
@@ -70,14 +81,15 @@ def create_grid():
             return jsonify({"success": False, "error": "单笔数量必须大于0"})
         
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({
                 "success": False,
                 "error": "子账号API未配置或不可用"
             }), 400
         
-        client = BinanceClient(api_key, api_secret)
+        # 下单前启动用户数据流，订单状态由推送更新，数据流不可用时监控自动回退为REST查询
+        get_user_stream_manager().ensure_stream(email, client, 'um')
         
         # 创建网格价格点
         grid_prices = calculate_grid_prices(lower_price, upper_price, grid_num, client, symbol)
@@ -91,6 +103,10 @@ def create_grid():
         # 创建网格订单列表
         grid_orders = []
         
+        # 每档使用相同的单笔数量，按交易对精度格式化一次
+        quantity = format_quantity(client, symbol, single_amount)
+        logger.info(f"网格订单数量精度调整: 原始数量={single_amount}, 调整后={quantity}")
+        
         # 处理网格订单
         for i in range(len(grid_prices) - 1):
             # 买入订单价格是下一个网格点
@@ -98,15 +114,6 @@ def create_grid():
             # 卖出订单价格是当前网格点
             sell_price = grid_prices[i + 1]
             
-            # 直接使用指定的单笔数量
-            raw_quantity = single_amount
-            
-            # 使用交易对精度格式化数量
-            quantity = format_quantity(client, symbol, raw_quantity)
-            
-            # 记录日志
-            logger.info(f"网格订单数量精度调整: 原始数量={raw_quantity}, 调整后={quantity}")
-            
             # 创建买入订单
             buy_order = {
                 "email": email,
@@ -200,6 +207,58 @@ def create_grid():
             "error": f"创建网格交易失败: {str(e)}"
         })
 
+@trading_bp.route('/grid/preview', methods=['POST'])
+def preview_grid():
+    """
+    预览网格: 计算价格档位、每档数量和名义价值，列出不满足交易规则的档位，不下单
+    
+    请求参数:
+    {
+        "symbol": "交易对",
+        "upper_price": 上限价格,
+        "lower_price": 下限价格,
+        "grid_num": 网格数量,
+        "mode": "geometric(等比，默认) / arithmetic(等差)",
+        "single_amount": 单笔数量(与total_investment二选一),
+        "total_investment": 总投资额(保证金),
+        "leverage": 杠杆倍数(默认1),
+        "is_bilateral": 是否双向(true/false)
+    }
+    """
+    try:
+        data = request.json or {}
+        
+        required_fields = ['symbol', 'upper_price', 'lower_price', 'grid_num']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({"success": False, "error": f"缺少必填参数: {field}"}), 400
+        
+        symbol = data.get('symbol').upper()
+        single_amount = data.get('single_amount')
+        total_investment = data.get('total_investment')
+        
+        symbol_info = get_symbol_info(symbol, 'um')
+        if symbol_info is None:
+            logger.warning(f"无法获取交易对 {symbol} 的交易规则，预览结果未按交易规则取整")
+        
+        plan = plan_grid(
+            float(data.get('lower_price')),
+            float(data.get('upper_price')),
+            int(data.get('grid_num')),
+            symbol_info=symbol_info,
+            mode=data.get('mode', 'geometric'),
+            single_amount=float(single_amount) if single_amount is not None else None,
+            total_investment=float(total_investment) if total_investment is not None else None,
+            leverage=float(data.get('leverage', 1)),
+            is_bilateral=bool(data.get('is_bilateral', False))
+        )
+        return jsonify({"success": True, "data": plan})
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"预览网格失败: {str(e)}")
+        return jsonify({"success": False, "error": f"预览网格失败: {str(e)}"})
+
 @trading_bp.route('/grid/list', methods=['GET'])
 def list_grids():
     """
@@ -380,15 +439,13 @@ def submit_and_monitor_grid():
             return jsonify({"success": False, "error": "单笔数量必须大于0"})
         
         # 获取API客户端
-        api_key, api_secret = get_sub_account_api_credentials(email)
-        if not api_key or not api_secret:
+        client = get_client_by_email(email)
+        if client is None:
             return jsonify({
                 "success": False,
                 "error": "子账号API未配置或不可用"
             }), 400
         
-        client = BinanceClient(api_key, api_secret)
-        
         # 创建网格价格点
         grid_prices = calculate_grid_prices(lower_price, upper_price, grid_num, client, symbol)
         
@@ -401,6 +458,10 @@ def submit_and_monitor_grid():
         # 创建网格订单列表
         grid_orders = []
         
+        # 每档使用相同的单笔数量，按交易对精度格式化一次
+        quantity = format_quantity(client, symbol, single_amount)
+        logger.info(f"网格订单数量精度调整: 原始数量={single_amount}, 调整后={quantity}")
+        
         # 处理网格订单
         for i in range(len(grid_prices) - 1):
             # 买入订单价格是下一个网格点
@@ -408,15 +469,6 @@ def submit_and_monitor_grid():
             # 卖出订单价格是当前网格点
             sell_price = grid_prices[i + 1]
             
-            # 直接使用指定的单笔数量
-            raw_quantity = single_amount
-            
-            # 使用交易对精度格式化数量
-            quantity = format_quantity(client, symbol, raw_quantity)
-            
-            # 记录日志
-            logger.info(f"网格订单数量精度调整: 原始数量={raw_quantity}, 调整后={quantity}")
-            
             # 创建买入订单
             buy_order = {
                 "email": email,
@@ -496,28 +548,21 @@ def submit_and_monitor_grid():
         # 提交数据库事务
         db.session.commit()
         
-        # 更新网格状态为运行中
+        # 更新网格状态为运行中，同时由本进程的监控调度器认领，避免被其他进程当作无人监控的网格接管
+        monitor = get_grid_monitor()
         new_grid.status = "RUNNING"
+        new_grid.monitor_owner = monitor.owner
+        new_grid.monitor_heartbeat = datetime.utcnow()
         db.session.commit()
         
-        # 异步开始监控订单
-        # 注意：这里使用15秒和5秒的等待时间，所以需要运行一段时间
+        # 加入共享的网格监控调度器，截止时间到达后自动补齐不平衡的订单
         logger.info(f"准备启动网格监控，共有{len(order_pairs)}对订单需要监控")
-        
-        # 启动监控线程
-        import threading
-        monitor_thread = threading.Thread(
-            target=monitor_grid_orders_with_error_handling,
-            args=(client, email, symbol, order_pairs, grid_id),
-            daemon=True
-        )
-        monitor_thread.start()
-        
-        logger.info(f"网格监控线程已启动: grid_id={grid_id}, thread_id={monitor_thread.ident}, 请等待15秒完成首批订单监控")
+        if not monitor.watch(grid_id, client, email, symbol, order_pairs, GRID_MONITOR_ACTIONS):
+            logger.error(f"网格加入监控失败: grid_id={grid_id}")
         
         return jsonify({
             "success": True,
-            "message": "网格交易已提交并开始监控，成交订单将在15秒后检查并补齐不平衡部分",
+            "message": "网格交易已提交并开始监控，未成交订单将在15秒后取消并补齐不平衡部分",
             "data": {
                 "grid_id": grid_id,
                 "grid_orders": submitted_orders,
@@ -532,24 +577,6 @@ def submit_and_monitor_grid():
             "error": f"创建网格交易失败: {str(e)}"
         })
 
-def monitor_grid_orders_with_error_handling(client, email, symbol, order_pairs, grid_id):
-    """添加错误处理的包装函数"""
-    try:
-        logger.info(f"开始监控网格订单: grid_id={grid_id}, 订单对数量={len(order_pairs)}")
-        monitor_grid_orders(client, email, symbol, order_pairs, grid_id)
-        logger.info(f"网格订单监控正常完成: grid_id={grid_id}")
-    except Exception as e:
-        logger.error(f"网格订单监控异常终止: grid_id={grid_id}, 错误={str(e)}", exc_info=True)
-        # 尝试将异常状态记录到数据库
-        try:
-            grid = GridTrading.query.filter_by(grid_id=grid_id).first()
-            if grid:
-                grid.status = "ERROR"
-                grid.close_reason = f"监控异常: {str(e)}"
-                db.session.commit()
-        except Exception as db_error:
-            logger.error(f"更新网格状态失败: {str(db_error)}")
-
 # ========== 辅助函数 ==========
 
 def calculate_grid_prices(lower_price, upper_price, grid_num, client=None, symbol=None):
@@ -566,24 +593,9 @@ def calculate_grid_prices(lower_price, upper_price, grid_num, client=None, symbo
     返回:
     - grid_prices: 网格价格点列表
     """
-    # 计算价格比例
-    ratio = (upper_price / lower_price) ** (1 / (grid_num - 1))
-    
-    # 生成网格价格点
-    grid_prices = []
-    for i in range(grid_num):
-        price = lower_price * (ratio ** i)
-        
-        # 根据交易对精度格式化价格（如果提供了client和symbol）
-        if client and symbol:
-            price = format_price(client, symbol, price)
-        else:
-            # 默认保留8位小数
-            price = round(price, 8)
-            
-        grid_prices.append(price)
-    
-    return grid_prices
+    # 交易规则只查询一次，整组价格按tickSize取整（未提供client和symbol时保留8位小数）
+    symbol_info = get_symbol_info(symbol, 'um') if client and symbol else None
+    return build_price_ladder(lower_price, upper_price, grid_num, symbol_info)
 
 def get_grid_orders(grid_id):
     """
@@ -765,7 +777,7 @@ def place_real_order(client, order_data):
                 grid_id=order_data['grid_id']
             )
             
-            db.session.add(order_record)
+            get_record_writer().add(order_record)
             return {**order_record.to_dict(), 'binance_response': response['data']}
         else:
             logger.error(f"下单失败: {response.get('error')}")
@@ -782,303 +794,18 @@ def place_real_order(client, order_data):
             'order_data': order_data
         }
 
-def monitor_grid_orders(client, email, symbol, order_pairs, grid_id):
-    """
-    监控网格订单状态，实现自动平衡功能
-    
-    - 针对多空订单对，如果一方成交另一方未成交，等待15秒后取消并市价补齐
-    - 如果订单发生错误（拒绝、过期、取消），等待5秒后市价补齐
-    - 每对订单监控将等待至少15秒（或5秒），确保交易所有足够时间处理订单
-    
-    参数:
-    - client: BinanceClient实例
-    - email: 子账号邮箱
-    - symbol: 交易对
-    - order_pairs: 订单对列表
-    - grid_id: 网格ID
-    """
-    try:
-        logger.info(f"开始监控网格订单 grid_id: {grid_id}, 订单对数量: {len(order_pairs)}")
-        logger.info(f"注意: 订单监控将等待15秒(普通订单)或5秒(错误订单)后再处理不平衡情况")
-        
-        # 对每对订单进行监控
-        for pair_index, order_pair in enumerate(order_pairs):
-            logger.info(f"处理第{pair_index+1}对订单 (共{len(order_pairs)}对)")
-            
-            # 双向交易有两个订单，单向只有一个
-            if len(order_pair) == 2:
-                # 双向交易情况
-                buy_order = next((o for o in order_pair if o.get('side') == 'BUY'), None)
-                sell_order = next((o for o in order_pair if o.get('side') == 'SELL'), None)
-                
-                if buy_order and sell_order:
-                    # 监控订单对
-                    logger.info(f"监控买单{buy_order.get('order_id')}和卖单{sell_order.get('order_id')}")
-                    monitor_order_pair(client, email, symbol, buy_order, sell_order, grid_id)
-            
-            elif len(order_pair) == 1:
-                # 单向交易情况，只需监控单个订单的状态
-                order = order_pair[0]
-                logger.info(f"监控单个订单: {order.get('side')}单 {order.get('order_id')}")
-                check_and_handle_single_order_status(client, email, symbol, order, grid_id)
-            
-            logger.info(f"第{pair_index+1}对订单处理完成")
-        
-        # 更新网格状态
-        try:
-            grid = GridTrading.query.filter_by(grid_id=grid_id).first()
-            if grid and grid.status != "ERROR":
-                grid.status = "COMPLETED"
-                db.session.commit()
-                logger.info(f"网格订单监控完成，已更新状态为COMPLETED: grid_id={grid_id}")
-        except Exception as db_error:
-            logger.error(f"更新网格状态失败: {str(db_error)}")
-            
-        logger.info(f"网格订单监控全部完成 grid_id: {grid_id}")
-    except Exception as e:
-        logger.error(f"监控网格订单异常: {str(e)}", exc_info=True)
-
-def monitor_order_pair(client, email, symbol, buy_order, sell_order, grid_id):
-    """监控一对买卖订单，处理不平衡情况
-        
-    - 如果多仓（买单）成交但空仓（卖单）未成交或部分成交，补齐卖单（开仓）
-    - 如果空仓（卖单）成交但多仓（买单）未成交或部分成交，补齐买单（开仓）
-    - 如果订单发生错误或过期，市价补单
-    - 注意：所有操作都是开仓，不是平仓互抵
-    """
-    try:
-        # 查询初始订单状态
-        buy_status = check_order_status(client, symbol, buy_order.get('order_id'))
-        sell_status = check_order_status(client, symbol, sell_order.get('order_id'))
-        
-        logger.info(f"订单对初始状态 - Grid={grid_id}, Buy: {buy_status.get('status')}, Sell: {sell_status.get('status')}")
-        
-        # 记录开始时间
-        start_time = time.time()
-        
-        # 检查订单状态
-        buy_filled = buy_status.get('status') == 'FILLED'
-        sell_filled = sell_status.get('status') == 'FILLED'
-        buy_error = buy_status.get('status') in ['REJECTED', 'EXPIRED', 'CANCELED']
-        sell_error = sell_status.get('status') in ['REJECTED', 'EXPIRED', 'CANCELED']
-        
-        # 设置监控时间
-        monitoring_time = 15  # 常规监控15秒
-        error_monitoring_time = 5  # 错误订单监控5秒
-        
-        # 如果订单已经处于错误状态，设置更短的监控时间
-        if buy_error or sell_error:
-            monitoring_time = error_monitoring_time
-            logger.info(f"检测到错误状态订单，设置{error_monitoring_time}秒监控时间")
-        
-        # 检查一方已成交另一方未成交的情况
-        one_side_filled = (buy_filled and not sell_filled) or (sell_filled and not buy_filled)
-        
-        if one_side_filled or buy_error or sell_error:
-            # 第一次检查就发现不平衡或错误，等待指定时间后继续处理
-            wait_time = monitoring_time
-            logger.info(f"检测到订单不平衡或错误，等待{wait_time}秒后处理")
-            
-            # 等待指定时间
-            time.sleep(wait_time)
-            
-            # 重新检查状态
-            buy_status = check_order_status(client, symbol, buy_order.get('order_id'))
-            sell_status = check_order_status(client, symbol, sell_order.get('order_id'))
-            
-            logger.info(f"等待{wait_time}秒后重新检查 - Buy: {buy_status.get('status')}, Sell: {sell_status.get('status')}")
-            
-            buy_filled = buy_status.get('status') == 'FILLED'
-            sell_filled = sell_status.get('status') == 'FILLED'
-            
-        # 处理逻辑：买单成交但卖单未完全成交（补齐卖单开仓）
-        if buy_filled and not sell_filled:
-            logger.info(f"买单已成交但卖单未成交，取消卖单并市价开仓补齐: {sell_order.get('order_id')}")
-            
-            # 取消卖单
-            cancel_result = cancel_order(client, symbol, sell_order.get('order_id'))
-            logger.info(f"取消卖单结果: {cancel_result}")
-            
-            # 获取最新状态
-            sell_status = check_order_status(client, symbol, sell_order.get('order_id'))
-            
-            # 计算需要补齐的数量
-            executed_qty = float(sell_status.get('executedQty', 0))
-            remaining_qty = float(sell_order.get('amount', 0)) - executed_qty
-            
-            if remaining_qty > 0:
-                logger.info(f"市价卖出开仓补齐: {remaining_qty} {symbol.replace('USDT', '')}")
-                market_sell_result = market_sell(client, email, symbol, remaining_qty, grid_id)
-                logger.info(f"市价卖出开仓结果: {market_sell_result}")
-            else:
-                logger.info(f"卖单已成交数量: {executed_qty}，无需补齐")
-        
-        # 处理逻辑：卖单成交但买单未完全成交（补齐买单开仓）
-        elif sell_filled and not buy_filled:
-            logger.info(f"卖单已成交但买单未成交，取消买单并市价开仓补齐: {buy_order.get('order_id')}")
-            
-            # 取消买单
-            cancel_result = cancel_order(client, symbol, buy_order.get('order_id'))
-            logger.info(f"取消买单结果: {cancel_result}")
-            
-            # 获取最新状态
-            buy_status = check_order_status(client, symbol, buy_order.get('order_id'))
-            
-            # 计算需要补齐的数量
-            executed_qty = float(buy_status.get('executedQty', 0))
-            remaining_qty = float(buy_order.get('amount', 0)) - executed_qty
-            
-            if remaining_qty > 0:
-                logger.info(f"市价买入开仓补齐: {remaining_qty} {symbol.replace('USDT', '')}")
-                market_buy_result = market_buy(client, email, symbol, remaining_qty, grid_id)
-                logger.info(f"市价买入开仓结果: {market_buy_result}")
-            else:
-                logger.info(f"买单已成交数量: {executed_qty}，无需补齐")
-        
-        # 处理逻辑：两个订单都已完成
-        elif buy_filled and sell_filled:
-            logger.info(f"订单对都已成交完成: 买单={buy_status.get('status')}, 卖单={sell_status.get('status')}")
-            return
-        
-        # 处理错误状态的买单
-        if buy_error and not buy_filled:
-            executed_qty = float(buy_status.get('executedQty', 0))
-            remaining_qty = float(buy_order.get('amount', 0)) - executed_qty
-            
-            if remaining_qty > 0:
-                logger.info(f"买单错误状态，市价买入开仓补齐: {remaining_qty} {symbol.replace('USDT', '')}")
-                market_buy_result = market_buy(client, email, symbol, remaining_qty, grid_id)
-                logger.info(f"市价买入开仓结果: {market_buy_result}")
-                    
-        # 处理错误状态的卖单
-        if sell_error and not sell_filled:
-            executed_qty = float(sell_status.get('executedQty', 0))
-            remaining_qty = float(sell_order.get('amount', 0)) - executed_qty
-            
-            if remaining_qty > 0:
-                logger.info(f"卖单错误状态，市价卖出开仓补齐: {remaining_qty} {symbol.replace('USDT', '')}")
-                market_sell_result = market_sell(client, email, symbol, remaining_qty, grid_id)
-                logger.info(f"市价卖出开仓结果: {market_sell_result}")
-        
-        # 处理未完成的订单 - 这是最后的保障检查
-        # 重新获取最新状态
-        buy_status = check_order_status(client, symbol, buy_order.get('order_id'))
-        sell_status = check_order_status(client, symbol, sell_order.get('order_id'))
-        
-        # 处理未完成的买单
-        if buy_status.get('status') == 'NEW':
-            logger.info(f"买单仍未完成，最终取消并开仓补齐: {buy_order.get('order_id')}")
-            cancel_result = cancel_order(client, symbol, buy_order.get('order_id'))
-            
-            # 计算需要补齐的数量
-            buy_status = check_order_status(client, symbol, buy_order.get('order_id'))
-            executed_qty = float(buy_status.get('executedQty', 0))
-            remaining_qty = float(buy_order.get('amount', 0)) - executed_qty
-            
-            if remaining_qty > 0:
-                market_buy_result = market_buy(client, email, symbol, remaining_qty, grid_id)
-                logger.info(f"最终市价买入开仓结果: {market_buy_result}")
-        
-        # 处理未完成的卖单
-        if sell_status.get('status') == 'NEW':
-            logger.info(f"卖单仍未完成，最终取消并开仓补齐: {sell_order.get('order_id')}")
-            cancel_result = cancel_order(client, symbol, sell_order.get('order_id'))
-            
-            # 计算需要补齐的数量
-            sell_status = check_order_status(client, symbol, sell_order.get('order_id'))
-            executed_qty = float(sell_status.get('executedQty', 0))
-            remaining_qty = float(sell_order.get('amount', 0)) - executed_qty
-            
-            if remaining_qty > 0:
-                market_sell_result = market_sell(client, email, symbol, remaining_qty, grid_id)
-                logger.info(f"最终市价卖出开仓结果: {market_sell_result}")
-        
-    except Exception as e:
-        logger.error(f"监控订单对异常: {str(e)}", exc_info=True)
-
-def check_and_handle_single_order_status(client, email, symbol, order, grid_id):
-    """检查并处理单个订单的状态
-        
-    - 如果订单未成交，15秒后检查并取消订单后市价补齐
-    - 如果订单发生错误或过期，5秒后市价补单
-    - 注意：所有操作都是网格开仓，不是平仓
-    """
+def check_order_status(client, symbol, order_id):
+    """检查订单状态，优先读取用户数据流推送的缓存状态"""
     try:
-        # 查询订单状态
-        order_status = check_order_status(client, symbol, order.get('order_id'))
-        logger.info(f"单个订单状态 - Grid={grid_id}, Order={order.get('order_id')}, Status={order_status.get('status')}")
+        account = client.subaccount_email
+        streams = get_user_stream_manager()
         
-        # 记录开始时间
-        start_time = time.time()
+        # 缓存中已是终态，或数据流在线(推送会实时更新缓存)时，无需请求币安
+        if account:
+            cached = streams.store.get(account, symbol, order_id)
+            if cached and (cached.get('status') in FINAL_STATUSES or streams.is_live(account, 'um')):
+                return cached
         
-        # 如果订单已完成
-        if order_status.get('status') == 'FILLED':
-            logger.info(f"单个订单已完成 - Grid: {grid_id}, Order: {order.get('order_id')}")
-            return
-        
-        # 设置监控时间
-        monitoring_time = 15  # 普通订单等待15秒
-        error_time = 5       # 错误订单等待5秒
-        
-        # 确定等待时间
-        wait_time = monitoring_time
-        is_error = order_status.get('status') in ['REJECTED', 'EXPIRED', 'CANCELED']
-        
-        if is_error:
-            wait_time = error_time
-            logger.info(f"检测到错误订单状态: {order_status.get('status')}，等待{wait_time}秒后处理")
-        else:
-            logger.info(f"订单未成交，等待{wait_time}秒后检查")
-        
-        # 等待指定时间
-        time.sleep(wait_time)
-        
-        # 重新检查订单状态
-        order_status = check_order_status(client, symbol, order.get('order_id'))
-        logger.info(f"等待{wait_time}秒后订单状态: {order_status.get('status')}")
-        
-        # 如果订单已成交，无需处理
-        if order_status.get('status') == 'FILLED':
-            logger.info(f"订单已完成，无需补单 - Grid: {grid_id}, Order: {order.get('order_id')}")
-            return
-        
-        # 处理未成交或错误订单
-        # 如果是NEW状态，先尝试取消
-        if order_status.get('status') == 'NEW':
-            logger.info(f"取消未成交订单: {order.get('order_id')}")
-            cancel_result = cancel_order(client, symbol, order.get('order_id'))
-            logger.info(f"取消订单结果: {cancel_result}")
-            
-            # 取消后再次检查状态
-            order_status = check_order_status(client, symbol, order.get('order_id'))
-            
-            # 获取已成交数量
-            executed_qty = float(order_status.get('executedQty', 0))
-            
-            # 计算需要补齐的数量
-            remaining_qty = float(order.get('amount', 0)) - executed_qty
-            
-            if remaining_qty > 0:
-                logger.info(f"订单 {order.get('order_id')} 需要补齐数量: {remaining_qty}, 状态: {order_status.get('status')}")
-                
-                # 根据订单方向决定市价买入或卖出 - 作为开仓操作
-                if order.get('side') == 'BUY':
-                    logger.info(f"市价买入开仓补齐: {remaining_qty} {symbol.replace('USDT', '')}")
-                    market_buy_result = market_buy(client, email, symbol, remaining_qty, grid_id)
-                    logger.info(f"市价买入开仓结果: {market_buy_result}")
-                else:
-                    logger.info(f"市价卖出开仓补齐: {remaining_qty} {symbol.replace('USDT', '')}")
-                    market_sell_result = market_sell(client, email, symbol, remaining_qty, grid_id)
-                    logger.info(f"市价卖出开仓结果: {market_sell_result}")
-            else:
-                logger.info(f"订单 {order.get('order_id')} 已成交数量: {executed_qty}，无需补齐")
-        
-    except Exception as e:
-        logger.error(f"处理单个订单异常: {str(e)}", exc_info=True)
-
-def check_order_status(client, symbol, order_id):
-    """检查订单状态"""
-    try:
         # 构建查询参数
         params = {
             'symbol': symbol,
@@ -1089,6 +816,8 @@ def check_order_status(client, symbol, order_id):
         result = client._send_request('GET', '/fapi/v1/order', signed=True, params=params)
         
         if result.get('success'):
+            if account and isinstance(result.get('data'), dict):
+                streams.store.update(account, result['data'])
             return result.get('data', {})
         else:
             error_msg = result.get('error', '未知错误')
@@ -1115,8 +844,13 @@ def cancel_order(client, symbol, order_id):
         if result.get('success'):
             logger.info(f"成功取消订单: {order_id}")
             
-            # 更新数据库中订单状态
+            # 撤单响应包含订单最新状态，写入缓存供后续查询使用
+            if client.subaccount_email and isinstance(result.get('data'), dict):
+                get_order_store().update(client.subaccount_email, result['data'])
+            
+            # 更新数据库中订单状态，订单记录可能还在批量写入的缓冲区中，先写入
             try:
+                get_record_writer().flush()
                 order = OrderHistory.query.filter_by(order_id=str(order_id)).first()
                 if order:
                     order.status = 'CANCELED'
@@ -1164,11 +898,11 @@ def market_buy(client, email, symbol, quantity, grid_id):
         logger.info(f"市价买入数量精度调整: 原始数量={quantity}, 调整后={formatted_quantity}")
         
         # 获取当前价格以检查名义价值
-        ticker_info = client._send_request('GET', '/fapi/v1/ticker/price', signed=False, params={'symbol': symbol})
-        if not ticker_info.get('success'):
-            logger.warning(f"获取{symbol}价格失败，无法检查名义价值: {ticker_info.get('error')}")
+        ticker_info = get_price(symbol, 'um')
+        if not ticker_info:
+            logger.warning(f"获取{symbol}价格失败，无法检查名义价值")
         else:
-            current_price = float(ticker_info['data']['price'])
+            current_price = float(ticker_info['price'])
             notional_value = formatted_quantity * current_price
             logger.info(f"订单名义价值计算: 数量={formatted_quantity} × 价格={current_price} = {notional_value} USDT")
             
@@ -1194,7 +928,7 @@ def market_buy(client, email, symbol, quantity, grid_id):
         if not response.get('success'):
             logger.warning(f"市价买入失败，尝试不带reduceOnly参数: {response.get('error')}")
             del params['reduceOnly']  # 删除reduceOnly参数
-        response = client._send_request('POST', '/fapi/v1/order', signed=True, params=params)
+            response = client._send_request('POST', '/fapi/v1/order', signed=True, params=params)
         
         if response.get('success'):
             logger.info(f"市价买入成功: {symbol}, 数量: {formatted_quantity}, 响应: {response['data']}")
@@ -1218,8 +952,7 @@ def market_buy(client, email, symbol, quantity, grid_id):
                 remarks="网格开仓-自动买入"
             )
             
-            db.session.add(order_record)
-            db.session.commit()
+            get_record_writer().add(order_record)
             
             return {
                 'success': True,
@@ -1259,11 +992,11 @@ def market_sell(client, email, symbol, quantity, grid_id):
         logger.info(f"市价卖出数量精度调整: 原始数量={quantity}, 调整后={formatted_quantity}")
         
         # 获取当前价格以检查名义价值
-        ticker_info = client._send_request('GET', '/fapi/v1/ticker/price', signed=False, params={'symbol': symbol})
-        if not ticker_info.get('success'):
-            logger.warning(f"获取{symbol}价格失败，无法检查名义价值: {ticker_info.get('error')}")
+        ticker_info = get_price(symbol, 'um')
+        if not ticker_info:
+            logger.warning(f"获取{symbol}价格失败，无法检查名义价值")
         else:
-            current_price = float(ticker_info['data']['price'])
+            current_price = float(ticker_info['price'])
             notional_value = formatted_quantity * current_price
             logger.info(f"订单名义价值计算: 数量={formatted_quantity} × 价格={current_price} = {notional_value} USDT")
             
@@ -1289,7 +1022,7 @@ def market_sell(client, email, symbol, quantity, grid_id):
         if not response.get('success'):
             logger.warning(f"市价卖出失败，尝试不带reduceOnly参数: {response.get('error')}")
             del params['reduceOnly']  # 删除reduceOnly参数
-        response = client._send_request('POST', '/fapi/v1/order', signed=True, params=params)
+            response = client._send_request('POST', '/fapi/v1/order', signed=True, params=params)
         
         if response.get('success'):
             logger.info(f"市价卖出成功: {symbol}, 数量: {formatted_quantity}, 响应: {response['data']}")
@@ -1313,8 +1046,7 @@ def market_sell(client, email, symbol, quantity, grid_id):
                 remarks="网格开仓-自动卖出"
             )
             
-            db.session.add(order_record)
-            db.session.commit()
+            get_record_writer().add(order_record)
             
             return {
                 'success': True,
@@ -1334,6 +1066,14 @@ def market_sell(client, email, symbol, quantity, grid_id):
             'error': str(e)
         }
 
+# 网格监控调度器使用的订单操作
+GRID_MONITOR_ACTIONS = {
+    'check_order_status': check_order_status,
+    'cancel_order': cancel_order,
+    'market_buy': market_buy,
+    'market_sell': market_sell
+}
+
 # ========== 订单历史API ==========
 
 @trading_bp.route('/orders/record', methods=['POST'])
@@ -1411,8 +1151,8 @@ def record_order():
                 created_at=datetime.utcnow(),
                 last_checked=datetime.utcnow(),
             )
-            db.session.add(new_order)
-            db.session.commit()
+            # 新订单由批量写入器写入，缓冲区中同一订单的记录以本次为准
+            get_record_writer().add(new_order)
             return jsonify({
                 "success": True,
                 "message": "订单记录已创建",
@@ -1428,31 +1168,32 @@ def record_order():
 @trading_bp.route('/orders/list', methods=['GET'])
 def get_order_list():
     """
-    获取订单历史列表 - 使用子账号API查询交易历史
+    获取订单历史列表 - 查询本地同步的成交记录
+    
+    不在请求中访问币安: 本地记录超过 TRADE_SYNC_MAX_AGE 秒未同步时提交后台增量同步任务，
+    响应中的 stale、syncedAt 表示数据是否过期和最早的同步时间，syncJobId 可通过 /api/jobs/<id> 查询同步进度
     
     查询参数:
     - page: 页码 (默认1)
     - pageSize: 每页记录数 (默认20)
     - email: 筛选指定子账号
     - symbol: 筛选指定交易对
-    - status: 筛选指定状态
+    - market: 市场，margin / um / cm，默认 margin 和 um
     - startDate: 开始日期 YYYY-MM-DD
     - endDate: 结束日期 YYYY-MM-DD
+    - cursor: 上一页返回的 nextCursor (可选)，传入时忽略 page 且不返回 total
     """
     try:
         # 处理查询参数
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('pageSize', 20))
+        page = max(1, int(request.args.get('page', 1)))
+        page_size = clamp_page_size(request.args.get('pageSize'))
+        cursor = request.args.get('cursor')
         email = request.args.get('email')
         symbol = request.args.get('symbol')
-        status = request.args.get('status')
+        market = request.args.get('market')
         start_date = request.args.get('startDate')
         end_date = request.args.get('endDate')
         
-        # 如果没有提供end_date，使用当前日期
-        if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
-            
         # 验证必要参数
         if not email:
             return jsonify({
@@ -1460,87 +1201,65 @@ def get_order_list():
                 "error": "请提供子账号邮箱参数"
             }), 400
         
-        # 获取子账号的API客户端
-        from app.services.binance_client import get_client_by_email
-        client = get_client_by_email(email)
-        
-        if not client:
+        markets = [market] if market else ['margin', 'um']
+        if any(item not in SYNC_MARKETS for item in markets):
             return jsonify({
                 "success": False,
-                "error": "子账号API未配置或不可用"
+                "error": f"不支持的市场: {market}"
             }), 400
         
-        # 设置参数
-        params = {}
-        if symbol:
-            params['symbol'] = symbol
-        
-        # 添加日期范围查询
-        if start_date:
-            start_timestamp = int(datetime.strptime(start_date, '%Y-%m-%d').timestamp() * 1000)
-            params['startTime'] = start_timestamp
-        
-        if end_date:
-            # 加一天以包含当天
-            end_timestamp = int((datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).timestamp() * 1000)
-            params['endTime'] = end_timestamp
-        
-        # 设置分页
-        params['limit'] = page_size
-        if page > 1 and not status: # 仅在未指定status过滤时使用fromId
-            params['fromId'] = (page - 1) * page_size
-
-        response = None
+        # 只读取本地记录；同步进度过期时提交后台增量同步，本次返回已同步的数据
+        trade_sync = get_trade_sync()
+        symbols = [symbol] if symbol else None
+        sync_status = trade_sync.sync_status([email], markets=markets, symbols=symbols)
+        sync_job = None
+        if sync_status['stale']:
+            sync_job = trade_sync.request_refresh([email], markets=markets, symbols=symbols)
+        sync_errors = sync_status['errors']
+        
+        start_dt = parse_local_date(start_date)
+        end_dt = parse_local_date(end_date, end=True)
+        
+        if cursor:
+            trades, next_cursor = query_trades(
+                email, markets=markets, symbol=symbol, start=start_dt, end=end_dt,
+                cursor=cursor, limit=page_size
+            )
+            total_count = None
+        else:
+            # 兼容按页码翻页: 取前 page*pageSize 行后截取当前页，页码超出范围时不查询
+            total_count = count_trades(email, markets=markets, symbol=symbol, start=start_dt, end=end_dt)
+            trades, next_cursor = [], None
+            if (page - 1) * page_size < total_count:
+                trades, next_cursor = query_trades(
+                    email, markets=markets, symbol=symbol, start=start_dt, end=end_dt,
+                    limit=page * page_size
+                )
+                trades = trades[(page - 1) * page_size:]
         
-        # 优先尝试使用统一账户API获取交易历史
-        try:
-            logger.info(f"尝试使用统一账户API获取子账号 {email} 的交易历史")
-            # 第一种方法：尝试使用统一账户杠杆接口
-            response = client.get_unified_account_trades(**params)
-        
-            # 检查响应
-            if not response or not response.get('success') or not response.get('data'):
-                logger.info(f"统一账户杠杆接口无返回数据，尝试使用UM合约接口")
-                # 第二种方法：尝试使用统一账户UM合约接口
-                response = client.get_um_trades(**params)
-        except Exception as e:
-            logger.error(f"使用统一账户API获取交易历史失败: {str(e)}")
-            response = None
-            
-        # 如果统一账户API都失败，尝试使用传统的U本位合约API
-        if not response or not response.get('success') or not response.get('data'):
-            logger.info(f"尝试使用U本位合约API获取子账号 {email} 的交易历史")
-            u_futures_endpoint = "/fapi/v1/userTrades"
-            response = client._send_request('GET', u_futures_endpoint, signed=True, params=params)
-                
-        if not response or not response.get('success'):
+        if not trades and sync_errors:
             return jsonify({
                 "success": False,
-                "error": response.get('error', '获取交易历史失败')
+                "error": sync_errors[0] or '获取交易历史失败'
             }), 400
         
-        trades_data = response.get('data', [])
-        
-        # 计算总记录数 (可能不准确，因为币安API可能有限制)
-        total_count = len(trades_data)
-        
         # 转换为前端需要的格式
         trade_list = []
-        for trade in trades_data:
-            trade_dict = {
-                "id": trade.get('id'),
-                "orderId": trade.get('orderId'),
-                "symbol": trade.get('symbol'),
-                "side": '买入' if trade.get('isBuyer') else '卖出',
-                "price": trade.get('price'),
-                "qty": trade.get('qty'),
-                "commission": trade.get('commission'),
-                "commissionAsset": trade.get('commissionAsset'),
-                "time": datetime.fromtimestamp(trade.get('time', 0) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
-                "isMaker": trade.get('isMaker'),
-                "isBestMatch": trade.get('isBestMatch'),
-            }
-            trade_list.append(trade_dict)
+        for trade in trades:
+            record = serialize_trade(trade)
+            trade_list.append({
+                "id": record['id'],
+                "orderId": record['orderId'],
+                "symbol": record['symbol'],
+                "market": record['market'],
+                "side": '买入' if record['side'] == 'BUY' else '卖出',
+                "price": record['price'],
+                "qty": record['qty'],
+                "commission": record['commission'],
+                "commissionAsset": record['commissionAsset'],
+                "time": record['localTime'],
+                "isMaker": record['isMaker'],
+            })
         
         return jsonify({
             "success": True,
@@ -1548,9 +1267,19 @@ def get_order_list():
                 "records": trade_list,
                 "total": total_count,
                 "page": page,
-                "pageSize": page_size
+                "pageSize": page_size,
+                "nextCursor": next_cursor,
+                "syncErrors": sync_errors,
+                "stale": sync_status['stale'],
+                "syncedAt": sync_status['syncedAt'],
+                "syncJobId": sync_job.id if sync_job else None
             }
         })
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
     except Exception as e:
         logger.error(f"获取订单历史列表失败: {str(e)}")
         return jsonify({
@@ -1628,109 +1357,47 @@ def get_recent_orders():
 
 # ========== 精度处理辅助函数 ==========
 
-# 缓存交易对精度信息
-symbol_precision_cache = {}
-symbol_price_precision_cache = {}
-
 def get_symbol_precision(client, symbol):
     """
     获取交易对的数量精度
     
     参数:
-    - client: BinanceClient实例
+    - client: BinanceClient实例(保留参数兼容旧调用，交易规则由共享的元数据服务提供)
     - symbol: 交易对符号，如BTCUSDT
     
     返回:
     - quantity_precision: 数量精度
     """
-    global symbol_precision_cache
-    
-    # 检查缓存
-    if symbol in symbol_precision_cache:
-        return symbol_precision_cache[symbol]
-    
     # 默认精度（保守值，如果无法获取精度信息，使用4位小数）
     default_precision = 4
     
-    try:
-        # 获取交易对信息
-        exchange_info = client._send_request('GET', '/fapi/v1/exchangeInfo', signed=False)
-        
-        if exchange_info.get('success'):
-            # 查找当前交易对的精度信息
-            symbol_info = next((s for s in exchange_info['data']['symbols'] if s['symbol'] == symbol), None)
-            
-            if symbol_info:
-                # 尝试获取LOT_SIZE过滤器中的精度信息
-                for filter_item in symbol_info.get('filters', []):
-                    if filter_item.get('filterType') == 'LOT_SIZE':
-                        step_size = float(filter_item.get('stepSize', 1))
-                        if step_size != 0:
-                            precision = len(str(step_size).rstrip('0').split('.')[-1]) if '.' in str(step_size) else 0
-                            # 缓存结果
-                            symbol_precision_cache[symbol] = precision
-                            logger.info(f"获取到交易对 {symbol} 的数量精度: {precision}")
-                            return precision
-        
-        # 如果未找到精度信息，使用默认值
-        logger.warning(f"无法获取交易对 {symbol} 的数量精度信息，使用默认精度: {default_precision}")
-        symbol_precision_cache[symbol] = default_precision
-        return default_precision
+    symbol_info = get_symbol_info(symbol, 'um')
+    if symbol_info and symbol_info.quantity_precision is not None:
+        return symbol_info.quantity_precision
     
-    except Exception as e:
-        logger.error(f"获取交易对数量精度信息异常: {str(e)}")
-        symbol_precision_cache[symbol] = default_precision
-        return default_precision
+    logger.warning(f"无法获取交易对 {symbol} 的数量精度信息，使用默认精度: {default_precision}")
+    return default_precision
 
 def get_price_precision(client, symbol):
     """
     获取交易对的价格精度
     
     参数:
-    - client: BinanceClient实例
+    - client: BinanceClient实例(保留参数兼容旧调用，交易规则由共享的元数据服务提供)
     - symbol: 交易对符号，如BTCUSDT
     
     返回:
     - price_precision: 价格精度
     """
-    global symbol_price_precision_cache
-    
-    # 检查缓存
-    if symbol in symbol_price_precision_cache:
-        return symbol_price_precision_cache[symbol]
-    
     # 默认价格精度（保守值）
     default_precision = 2
     
-    try:
-        # 获取交易对信息
-        exchange_info = client._send_request('GET', '/fapi/v1/exchangeInfo', signed=False)
-        
-        if exchange_info.get('success'):
-            # 查找当前交易对的精度信息
-            symbol_info = next((s for s in exchange_info['data']['symbols'] if s['symbol'] == symbol), None)
-            
-            if symbol_info:
-                # 尝试获取PRICE_FILTER过滤器中的精度信息
-                for filter_item in symbol_info.get('filters', []):
-                    if filter_item.get('filterType') == 'PRICE_FILTER':
-                        tick_size = float(filter_item.get('tickSize', 0.01))
-                        if tick_size != 0:
-                            precision = len(str(tick_size).rstrip('0').split('.')[-1]) if '.' in str(tick_size) else 0
-                            # 缓存结果
-                            symbol_price_precision_cache[symbol] = precision
-                            logger.info(f"获取到交易对 {symbol} 的价格精度: {precision}")
-                            return precision
-        
-        # 如果未找到精度信息，使用默认值
-        logger.warning(f"无法获取交易对 {symbol} 的价格精度信息，使用默认精度: {default_precision}")
-        symbol_price_precision_cache[symbol] = default_precision
-        return default_precision
+    symbol_info = get_symbol_info(symbol, 'um')
+    if symbol_info and symbol_info.price_precision is not None:
+        return symbol_info.price_precision
     
-    except Exception as e:
-        logger.error(f"获取交易对价格精度信息异常: {str(e)}")
-        symbol_price_precision_cache[symbol] = default_precision
-        return default_precision
+    logger.warning(f"无法获取交易对 {symbol} 的价格精度信息，使用默认精度: {default_precision}")
+    return default_precision
 
 def format_quantity(client, symbol, quantity):
     """
@@ -1896,6 +1563,11 @@ def place_margin_order():
         # 创建Binance客户端
         client = Client(api_setting.api_key, api_setting.api_secret)
         
+        # 启动杠杆账户用户数据流，用于接收订单成交推送；不等待连接，数据流未连接时下单后按原方式等待
+        stream_client = get_client_registry().get_client(email)
+        if stream_client is not None:
+            get_user_stream_manager().ensure_stream(email, stream_client, 'margin', wait=0)
+        
         # 获取当前市场价格
         ticker_price = client.get_symbol_ticker(symbol=symbol)
         current_price = float(ticker_price['price'])
@@ -1903,9 +1575,8 @@ def place_margin_order():
         # 计算可以购买/卖出的数量
         quantity = amount / current_price
         
-        # 获取交易对信息，确定小数位数
-        exchange_info = client.get_exchange_info()
-        symbol_info = next((s for s in exchange_info['symbols'] if s['symbol'] == symbol), None)
+        # 获取交易对规则，确定小数位数
+        symbol_info = get_symbol_info(symbol, 'spot')
         
         if not symbol_info:
             return jsonify({
@@ -1913,18 +1584,11 @@ def place_margin_order():
                 'error': f'无法获取交易对 {symbol} 的信息'
             })
         
-        # 查找数量精度规则
-        lot_size_filter = next((f for f in symbol_info['filters'] if f['filterType'] == 'LOT_SIZE'), None)
-        
-        if lot_size_filter:
-            step_size = float(lot_size_filter['stepSize'])
-            precision = 0
-            if step_size < 1:
-                precision = len(str(step_size).split('.')[-1].rstrip('0'))
-            quantity = round(quantity - (quantity % step_size), precision)
+        # 按数量步长向下取整
+        quantity = float(symbol_info.round_quantity(quantity))
         
         # 确保数量满足最小交易量要求
-        min_qty = float(lot_size_filter['minQty']) if lot_size_filter else 0
+        min_qty = float(symbol_info.min_qty or 0)
         if quantity < min_qty:
             return jsonify({
                 'success': False,
@@ -1947,8 +1611,12 @@ def place_margin_order():
         # 不再存储完整的订单信息，仅记录订单ID和基本信息
         # 处理交易费用信息 - 调用API获取交易详情并记录手续费
         try:
-            # 等待短暂时间，确保交易已经处理
-            time.sleep(1)
+            # 等待订单成交推送；数据流不可用时等待短暂时间，确保交易已经处理
+            streams = get_user_stream_manager()
+            if streams.is_live(email, 'margin'):
+                streams.store.wait_for_order(email, symbol, order.get('orderId'), timeout=2)
+            else:
+                time.sleep(1)
             
             # 获取订单信息
             trades = client.get_margin_trades(symbol=symbol)
@@ -1956,21 +1624,8 @@ def place_margin_order():
             # 查找与当前订单相关的交易
             order_trades = [trade for trade in trades if str(trade.get('orderId')) == str(order.get('orderId'))]
             
-            # 记录手续费信息
-            for trade in order_trades:
-                fee_record = FeeRecord(
-                    email=email,
-                    symbol=symbol,
-                    order_id=str(trade.get('orderId')),
-                    fee_amount=float(trade.get('commission', 0)),
-                    fee_asset=trade.get('commissionAsset', ''),
-                    source='MARGIN',
-                    description=f"杠杆{side}单手续费",
-                    trade_time=datetime.fromtimestamp(trade.get('time', 0) / 1000)
-                )
-                db.session.add(fee_record)
-                
-            db.session.commit()
+            # 按成交同步的唯一键写入成交和手续费，之后同步到这些成交时不会重复记录手续费
+            get_trade_sync().record_trades(email, 'margin', order_trades)
             logger.info(f"已记录交易手续费信息: 订单ID={order.get('orderId')}")
             
         except Exception as fee_error:
@@ -2158,12 +1813,20 @@ def get_fee_records():
         # 计算汇总统计
         summary = {}
         if fee_list:
-            # 按资产类型汇总手续费
-            for fee in query.all():  # 获取所有符合条件的记录
-                asset = fee.fee_asset
-                if asset not in summary:
-                    summary[asset] = 0
-                summary[asset] += fee.fee_amount
+            # 按资产类型汇总手续费，未按交易对过滤时直接读取日汇总
+            if symbol:
+                summary = {
+                    asset: float(total or 0) for asset, total in query.order_by(None).with_entities(
+                        FeeRecord.fee_asset, func.sum(FeeRecord.fee_amount)
+                    ).group_by(FeeRecord.fee_asset).all()
+                }
+            else:
+                summary = summarize_by_asset(
+                    email=email,
+                    source=source,
+                    start_date=datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None,
+                    end_date=datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+                )
         
         return jsonify({
             'success': True,
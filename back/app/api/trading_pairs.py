@@ -1,7 +1,7 @@
 from flask import Blueprint, jsonify, request, session
 from app.models import db, TradingPair
 import logging
-from app.services.binance_client import BinanceClient
+from app.services.price_cache import get_prices
 
 logger = logging.getLogger(__name__)
 trading_pairs_bp = Blueprint('trading_pairs', __name__, url_prefix='/api/trading-pairs')
@@ -467,36 +467,27 @@ def get_trading_pairs_with_price():
         
         # 如果获取了交易对，则尝试获取价格信息
         if result:
-            # 创建无API密钥的客户端用于获取公开市场数据
-            client = BinanceClient('', '')
-            
-            # 获取所有交易对的价格信息
-            price_info = {}
-            
-            # 根据市场类型选择不同的API端点
+            # 根据市场类型选择价格缓存
             if market_type in ['futures', 'usdt_futures', 'portfolio_margin_um']:
                 # U本位合约
-                endpoint = '/fapi/v1/ticker/price'
-                res = client._send_request('GET', endpoint)
+                price_market = 'um'
             elif market_type in ['coin_futures', 'delivery']:
                 # 币本位合约
-                endpoint = 'dapi/v1/ticker/price'
-                res = client._send_request('GET', endpoint)
+                price_market = 'cm'
             else:
                 # 默认使用现货
-                endpoint = '/api/v3/ticker/price'
-                res = client._send_request('GET', endpoint)
-                
-            if res.get('success') and res.get('data'):
-                # 处理返回的价格数据
-                prices = res['data'] if isinstance(res['data'], list) else [res['data']]
-                for price_item in prices:
-                    symbol = price_item.get('symbol')
-                    if symbol:
-                        price_info[symbol] = {
-                            'price': price_item.get('price'),
-                            'timestamp': price_item.get('time', None)
-                        }
+                price_market = 'spot'
+            
+            # 从价格缓存获取所有交易对的价格信息
+            prices, price_meta = get_prices(price_market)
+            price_info = {
+                symbol: {
+                    'price': price,
+                    'timestamp': price_meta['updated_at'],
+                    'age_ms': price_meta['age_ms']
+                }
+                for symbol, price in prices.items()
+            }
             
             # 为每个交易对添加价格信息
             for pair in result:
@@ -5,6 +5,7 @@ db = SQLAlchemy()
 
 # 导出所有模型，方便从app.models直接导入
 from app.models.user import User, APIKey
-from app.models.account import SubAccount, OperationLog, Setting
-from app.models.trading import GridTrading, OrderHistory, TradeHistory, MarginOrder, MarginTrade, FeeRecord
-from app.models.trading_pair import TradingPair 
\ No newline at end of file
+from app.models.account import SubAccount, OperationLog, Setting, ApiKeyHealth
+from app.models.trading import GridTrading, OrderHistory, TradeHistory, MarginOrder, MarginTrade, FeeRecord, FeeRollup, TradeSyncState
+from app.models.trading_pair import TradingPair
+from app.models.job import BackgroundJob
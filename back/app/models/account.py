@@ -3,9 +3,12 @@ from app.models import db
 
 class SubAccount(db.Model):
     """
-    子账号模型
+    子账号模型，由子账号目录服务从币安子账号列表同步
     """
     __tablename__ = 'subaccounts'
+    __table_args__ = (
+        db.Index('ix_subaccounts_master_create_time', 'master_account', 'create_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     email = db.Column(db.String(100), unique=True, nullable=False, index=True)
@@ -20,10 +23,10 @@ class SubAccount(db.Model):
     is_margin_enabled = db.Column(db.Boolean, default=False)
     is_options_enabled = db.Column(db.Boolean, default=False)
     
-    # 关联主账号
+    # 关联主账号(主账号API密钥的摘要)
     master_account = db.Column(db.String(100), nullable=True)
     
-    # 额外信息 (JSON格式)
+    # 额外信息 (JSON格式): 币安子账号列表和功能状态接口返回的原始数据
     extra_info = db.Column(db.Text, nullable=True)
 
     def __repr__(self):
@@ -141,4 +144,44 @@ class SubAccountAPISettings(db.Model):
         """
         data = self.to_dict()
         data['api_secret'] = self.api_secret
-        return data 
\ No newline at end of file
+        return data 
+
+class ApiKeyHealth(db.Model):
+    """
+    子账号API密钥健康状态，由密钥健康检查服务定期探测后写入，每个子账号一行
+    """
+    __tablename__ = 'api_key_health'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    email = db.Column(db.String(100), unique=True, nullable=False, index=True)
+    status = db.Column(db.String(30), nullable=False)  # WORKING / INVALID_KEY / INVALID_SECRET / INSUFFICIENT_PERMISSIONS / INVALID_FORMAT / NOT_CONFIGURED / ERROR
+    healthy = db.Column(db.Boolean, nullable=False, default=False)
+    can_trade = db.Column(db.Boolean, nullable=True)
+    can_deposit = db.Column(db.Boolean, nullable=True)
+    can_withdraw = db.Column(db.Boolean, nullable=True)
+    maker_commission = db.Column(db.Float, nullable=True)
+    taker_commission = db.Column(db.Float, nullable=True)
+    message = db.Column(db.Text, nullable=True)
+    latency_ms = db.Column(db.Integer, nullable=True)  # 探测请求耗时(毫秒)
+    checked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<ApiKeyHealth {self.email} {self.status}>"
+
+    def to_dict(self):
+        """
+        转换为字典对象
+        """
+        return {
+            'email': self.email,
+            'status': self.status,
+            'healthy': self.healthy,
+            'canTrade': self.can_trade,
+            'canDeposit': self.can_deposit,
+            'canWithdraw': self.can_withdraw,
+            'makerCommission': self.maker_commission,
+            'takerCommission': self.taker_commission,
+            'message': self.message,
+            'latency_ms': self.latency_ms,
+            'checked_at': self.checked_at.isoformat() if self.checked_at else None
+        }
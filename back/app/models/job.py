@@ -0,0 +1,82 @@
+import json
+from datetime import datetime
+from app.models import db
+
+
+def serialize_job(job, include_results=True):
+    """
+    将后台任务(数据库记录或内存中的任务状态)转换为字典对象
+    """
+    data = {
+        'id': job.id,
+        'type': job.job_type,
+        'status': job.status,
+        'total': job.total,
+        'completed': job.completed,
+        'failed': job.failed,
+        'progress': round(job.completed * 100.0 / job.total, 1) if job.total else None,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+    if include_results:
+        data['results'] = job.results
+        data['result'] = job.result
+    return data
+
+
+class BackgroundJob(db.Model):
+    """
+    后台任务模型，记录批量操作的执行状态、进度和部分结果
+    """
+    __tablename__ = 'background_jobs'
+
+    # 任务状态
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    FINISHED_STATUSES = (SUCCEEDED, FAILED)
+
+    id = db.Column(db.String(32), primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False, index=True)
+    status = db.Column(db.String(20), default=PENDING, index=True)
+    user_id = db.Column(db.Integer, nullable=True)
+
+    # 进度
+    total = db.Column(db.Integer, nullable=True)
+    completed = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+
+    # 请求参数、已完成项的结果和最终结果 (JSON格式)
+    params_json = db.Column(db.Text, nullable=True)
+    results_json = db.Column(db.Text, nullable=True)
+    result_json = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def results(self):
+        return json.loads(self.results_json) if self.results_json else []
+
+    @property
+    def result(self):
+        return json.loads(self.result_json) if self.result_json else None
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+    def __repr__(self):
+        return f"<BackgroundJob {self.job_type}:{self.id} {self.status}>"
+
+    def to_dict(self, include_results=True):
+        """
+        转换为字典对象
+        """
+        return serialize_job(self, include_results)
@@ -25,6 +25,10 @@ class GridTrading(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     closed_at = db.Column(db.DateTime, nullable=True)
     close_reason = db.Column(db.String(100), nullable=True)
+    # 订单监控状态，重启后据此恢复监控
+    monitor_state = db.Column(db.Text, nullable=True)  # JSON 格式的订单对、截止时间和补单进度
+    monitor_owner = db.Column(db.String(100), nullable=True)  # 正在监控该网格的进程
+    monitor_heartbeat = db.Column(db.DateTime, nullable=True)  # 监控进程最近一次续约时间
     
     def __repr__(self):
         return f"<GridTrading {self.grid_id}>"
@@ -51,7 +55,9 @@ class GridTrading(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'closed_at': self.closed_at.isoformat() if self.closed_at else None,
-            'close_reason': self.close_reason
+            'close_reason': self.close_reason,
+            'monitor_owner': self.monitor_owner,
+            'monitor_heartbeat': self.monitor_heartbeat.isoformat() if self.monitor_heartbeat else None
         }
 
 class OrderHistory(db.Model):
@@ -59,6 +65,10 @@ class OrderHistory(db.Model):
     订单历史模型
     """
     __tablename__ = 'order_history'
+    __table_args__ = (
+        db.Index('ix_order_history_email_symbol_created', 'email', 'symbol', 'created_at'),
+        db.Index('ix_order_history_email_created', 'email', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     email = db.Column(db.String(100), nullable=False, index=True)
@@ -108,6 +118,10 @@ class TradeHistory(db.Model):
     交易历史模型
     """
     __tablename__ = 'trade_history'
+    __table_args__ = (
+        db.Index('ix_trade_history_email_symbol_time', 'email', 'symbol', 'trade_time'),
+        db.Index('ix_trade_history_email_time', 'email', 'trade_time'),
+    )
     
     id = db.Column(db.String(64), primary_key=True)
     email = db.Column(db.String(100), nullable=False, index=True)
@@ -120,6 +134,11 @@ class TradeHistory(db.Model):
     commission_asset = db.Column(db.String(20), nullable=False)
     is_maker = db.Column(db.Boolean, default=False)
     trade_time = db.Column(db.DateTime, nullable=False)
+    # 成交同步写入的字段: id 为 "市场:交易对:成交ID:方向"
+    market = db.Column(db.String(10), nullable=True, index=True)  # UM / CM
+    trade_id = db.Column(db.BigInteger, nullable=True)  # 币安成交ID
+    order_id = db.Column(db.String(100), nullable=True, index=True)  # 币安订单ID
+    realized_pnl = db.Column(db.Float, nullable=True)  # 已实现盈亏
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -142,6 +161,10 @@ class TradeHistory(db.Model):
             'commission_asset': self.commission_asset,
             'is_maker': self.is_maker,
             'trade_time': self.trade_time.isoformat() if self.trade_time else None,
+            'market': self.market,
+            'trade_id': self.trade_id,
+            'order_id': self.order_id,
+            'realized_pnl': self.realized_pnl,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -200,6 +223,10 @@ class MarginTrade(db.Model):
     杠杆交易历史记录模型
     """
     __tablename__ = 'margin_trades'
+    __table_args__ = (
+        db.Index('ix_margin_trades_email_symbol_time', 'email', 'symbol', 'trade_time'),
+        db.Index('ix_margin_trades_email_time', 'email', 'trade_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     trade_id = db.Column(db.String(100), nullable=False, unique=True, index=True)
@@ -252,7 +279,7 @@ class FeeRecord(db.Model):
     order_id = db.Column(db.String(100), nullable=True, index=True)  # 相关订单ID
     fee_amount = db.Column(db.Float, nullable=False)  # 手续费金额
     fee_asset = db.Column(db.String(20), nullable=False)  # 手续费资产
-    source = db.Column(db.String(50), nullable=False)  # 手续费来源，例如: 'SPOT', 'MARGIN', 'FUTURES'
+    source = db.Column(db.String(50), nullable=False)  # 手续费来源，例如: 'SPOT', 'MARGIN', 'UM', 'CM'
     description = db.Column(db.String(255), nullable=True)  # 描述信息
     trade_time = db.Column(db.DateTime, nullable=False)  # 交易时间
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # 记录创建时间
@@ -275,4 +302,78 @@ class FeeRecord(db.Model):
             'description': self.description,
             'trade_time': self.trade_time.isoformat() if self.trade_time else None,
             'created_at': self.created_at.isoformat() if self.created_at else None
-        } 
\ No newline at end of file
+        }
+
+class FeeRollup(db.Model):
+    """
+    手续费日汇总模型，按 日期 x 子账号 x 手续费资产 x 来源 累计，写入 FeeRecord 时同步更新
+    """
+    __tablename__ = 'fee_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'email', 'fee_asset', 'source', name='uq_fee_rollup'),
+        db.Index('ix_fee_rollups_email_day', 'email', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    day = db.Column(db.Date, nullable=False, index=True)  # 交易日期，与 FeeRecord.trade_time 的日期一致
+    email = db.Column(db.String(100), nullable=False)  # 子账号邮箱
+    fee_asset = db.Column(db.String(20), nullable=False)  # 手续费资产
+    source = db.Column(db.String(50), nullable=False)  # 手续费来源: MARGIN / UM / CM
+    fee_amount = db.Column(db.Float, nullable=False, default=0)  # 手续费合计
+    record_count = db.Column(db.Integer, nullable=False, default=0)  # 手续费记录数
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<FeeRollup {self.day} {self.email} {self.source} {self.fee_amount} {self.fee_asset}>"
+    
+    def to_dict(self):
+        """
+        转换为字典对象
+        """
+        return {
+            'day': self.day.isoformat() if self.day else None,
+            'email': self.email,
+            'fee_asset': self.fee_asset,
+            'source': self.source,
+            'fee_amount': self.fee_amount,
+            'record_count': self.record_count
+        }
+
+class TradeSyncState(db.Model):
+    """
+    成交同步进度模型，记录每个子账号、市场、交易对已同步到的成交ID
+    """
+    __tablename__ = 'trade_sync_states'
+    __table_args__ = (
+        db.UniqueConstraint('email', 'market', 'symbol', name='uq_trade_sync_state'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    email = db.Column(db.String(100), nullable=False, index=True)
+    market = db.Column(db.String(10), nullable=False)  # margin / um / cm
+    symbol = db.Column(db.String(20), nullable=False)  # 交易对，币本位合约为标的(如BTCUSD)
+    last_trade_id = db.Column(db.BigInteger, nullable=True)  # 已同步的最大成交ID
+    last_trade_time = db.Column(db.DateTime, nullable=True)
+    trade_count = db.Column(db.Integer, default=0)  # 已写入的成交数
+    synced_at = db.Column(db.DateTime, nullable=True)  # 最近一次同步成功的时间
+    error = db.Column(db.Text, nullable=True)  # 最近一次同步的错误信息
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<TradeSyncState {self.email} {self.market}:{self.symbol}>"
+    
+    def to_dict(self):
+        """
+        转换为字典对象
+        """
+        return {
+            'id': self.id,
+            'email': self.email,
+            'market': self.market,
+            'symbol': self.symbol,
+            'last_trade_id': self.last_trade_id,
+            'last_trade_time': self.last_trade_time.isoformat() if self.last_trade_time else None,
+            'trade_count': self.trade_count,
+            'synced_at': self.synced_at.isoformat() if self.synced_at else None,
+            'error': self.error
+        }
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+异步币安API客户端模块
+
+BinanceClient 的每个请求都阻塞一个线程，批量接口可并发驱动的账号数受线程数限制。
+AsyncBinanceClient 提供与 BinanceClient 相同的公开方法和相同的 {'success','data','error'} 返回格式，
+调用时使用 await，可以在一个事件循环中同时等待数百个账号的请求。
+
+说明:
+1. 公开方法直接复用 BinanceClient 的实现，在 greenlet 中运行(与 SQLAlchemy 异步会话复用同步ORM代码的方式相同)，
+   方法内部的 _send_request 调用转为等待 aiohttp 请求，不需要维护两份业务代码；
+   方法内部互相调用时(如 check_trade_permission 调用 get_account_info)直接按同步方式执行；
+   方法内需要的交易规则(首次加载或过期时同步下载exchangeInfo)在线程池中查询，不阻塞事件循环
+2. URL构建、签名、频率控制、时间同步、-1021重试和结果解析与同步客户端一致
+3. 每个事件循环共用一个 aiohttp 连接池，连接数上限由 ASYNC_HTTP_POOL_SIZE 配置
+4. Flask 视图中使用 batch_executor.run_async_batch 创建事件循环并发执行，结束时关闭连接池，
+   目前用于子账号统一账户批量平仓(/subaccounts/portfolio-margin/flatten)的持仓查询和平仓下单
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import sys
+import threading
+import urllib.parse
+import weakref
+
+import aiohttp
+import greenlet
+from flask import current_app, has_app_context
+from yarl import URL
+
+from app.services.binance_client import BinanceClient, REQUEST_TIMEOUT, log_error, log_info, log_warning
+from app.services.http_transport import resolve_service
+from app.services.rate_limiter import count_orders, estimate_weight, get_rate_governor
+from app.services.symbol_metadata import get_symbol_info
+from app.services.time_sync import get_time_sync
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 100
+
+# 只读取本地状态、不发送请求的公开方法，保持同步调用
+LOCAL_METHODS = {'get_timestamp'}
+
+# 事件循环 -> aiohttp.ClientSession
+_sessions = weakref.WeakKeyDictionary()
+_sessions_lock = threading.Lock()
+
+
+def _pool_size():
+    if has_app_context():
+        return current_app.config.get('ASYNC_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)
+    return DEFAULT_POOL_SIZE
+
+
+def get_async_session():
+    """
+    获取当前事件循环共用的 aiohttp 会话，必须在事件循环中调用
+
+    返回:
+    - aiohttp.ClientSession 实例
+    """
+    loop = asyncio.get_running_loop()
+    with _sessions_lock:
+        session = _sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=_pool_size(), ttl_dns_cache=300)
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            )
+            _sessions[loop] = session
+            logger.info(f"创建异步HTTP连接池 - 连接数上限: {connector.limit}")
+        return session
+
+
+async def close_async_session():
+    """关闭当前事件循环的 aiohttp 会话"""
+    loop = asyncio.get_running_loop()
+    with _sessions_lock:
+        session = _sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+class _ClientGreenlet(greenlet.greenlet):
+    """运行同步客户端方法的 greenlet，driver 为事件循环所在的 greenlet"""
+
+    def __init__(self, fn, driver):
+        super().__init__(fn, driver)
+        self.driver = driver
+        # 共享调用方的上下文变量，方法内可以访问 current_app
+        self.gr_context = driver.gr_context
+
+
+def _in_client_greenlet():
+    return isinstance(greenlet.getcurrent(), _ClientGreenlet)
+
+
+def _await(coroutine):
+    """在 _ClientGreenlet 中等待协程完成：切回事件循环执行，结果返回后继续同步代码"""
+    current = greenlet.getcurrent()
+    if not isinstance(current, _ClientGreenlet):
+        coroutine.close()
+        raise RuntimeError("异步客户端的请求只能通过 await 公开方法发起")
+    return current.driver.switch(coroutine)
+
+
+async def _spawn(fn, *args, **kwargs):
+    """在 greenlet 中运行同步函数，函数内通过 _await 交出的协程在当前事件循环中等待"""
+    context = _ClientGreenlet(fn, greenlet.getcurrent())
+    result = context.switch(*args, **kwargs)
+
+    while not context.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = context.throw(*sys.exc_info())
+        else:
+            result = context.switch(value)
+
+    return result
+
+
+def _async_method(method):
+    """将 BinanceClient 的同步方法包装为协程方法"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # 同步方法内部调用其他公开方法时直接执行，不再嵌套 greenlet
+        if _in_client_greenlet():
+            return method(self, *args, **kwargs)
+        return _spawn(method, self, *args, **kwargs)
+
+    return wrapper
+
+
+class AsyncBinanceClient(BinanceClient):
+    """
+    异步币安API客户端，公开方法与 BinanceClient 相同，调用时需要 await
+
+    示例:
+        client = AsyncBinanceClient(api_key, api_secret)
+        result = await client.get_um_trades(symbol='BTCUSDT', limit=100)
+    """
+
+    @classmethod
+    def from_client(cls, client):
+        """
+        根据已有的 BinanceClient 创建异步客户端，保留子账号标识
+
+        参数:
+        - client: BinanceClient 实例
+        """
+        async_client = cls(client.api_key, client.api_secret)
+        async_client.is_subaccount = client.is_subaccount
+        async_client.subaccount_email = client.subaccount_email
+        async_client.proxy = client.proxy
+        async_client.recv_window = client.recv_window
+        return async_client
+
+    async def request(self, method, url, payload=None, signed=False, params=None):
+        """
+        发送API请求到币安，参数和返回值与 BinanceClient._send_request 相同
+        """
+        return await self._send_request_async(method, url, payload=payload, signed=signed, params=params)
+
+    async def sync_time(self):
+        """立即重新同步服务器时间，在线程池中执行，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(get_time_sync().sync, force=True))
+
+    def _send_request(self, method, url, payload=None, signed=False, params=None, _time_retry=True):
+        # 公开方法在 greenlet 中运行，这里等待异步请求完成后把结果交回同步代码
+        return _await(self._send_request_async(method, url, payload, signed, params, _time_retry))
+
+    async def _send_request_async(self, method, url, payload=None, signed=False, params=None, _time_retry=True):
+        if params is not None:
+            payload = params
+
+        url = self._build_url(url)
+
+        if payload is None:
+            payload = {}
+
+        if method not in ('GET', 'POST', 'DELETE', 'PUT'):
+            log_error(f"不支持的请求方法: {method}")
+            return {'success': False, 'error': f"不支持的请求方法: {method}"}
+
+        # 请求频率控制 - 在签名前获取额度，避免等待期间时间戳过期
+        service = resolve_service(url)
+        request_path = urllib.parse.urlsplit(url).path
+        order_count = count_orders(method, request_path, payload)
+        rate_account = self._rate_limit_account()
+        governor = get_rate_governor()
+        if not await governor.acquire_async(service, estimate_weight(request_path, payload), rate_account, order_count):
+            log_error(f"请求频率超出限制，放弃请求: {method} {request_path}")
+            return {'success': False, 'error': f"请求频率超出限制，请稍后重试 ({service})"}
+
+        if signed:
+            # 首次签名前在线程池中完成时间同步，避免阻塞事件循环
+            time_sync = get_time_sync()
+            if not time_sync.attempted:
+                await asyncio.get_running_loop().run_in_executor(None, time_sync.sync)
+            sign_error = self._sign_payload(payload)
+            if sign_error:
+                return sign_error
+
+        # 使用与签名相同的编码方式构建查询字符串，避免 aiohttp 重新编码
+        query = urllib.parse.urlencode(payload)
+        request_url = URL(f"{url}?{query}" if query else url, encoded=True)
+        headers = self._build_headers()
+
+        log_info(f"{method} {url.split('?')[0]}")
+
+        try:
+            session = get_async_session()
+            try:
+                status, response_headers, text = await self._fetch(session, method, request_url, headers, self.proxy)
+            except aiohttp.ClientProxyConnectionError as proxy_error:
+                # 代理连接失败，尝试直接连接
+                log_warning(f"代理连接失败，尝试直接连接: {str(proxy_error)}")
+                status, response_headers, text = await self._fetch(session, method, request_url, headers, None)
+
+            # 根据响应头校准频率控制余量
+            governor.update_from_headers(service, response_headers, rate_account, status)
+
+            if status != 200:
+                log_error(f"响应状态码: {status}")
+
+            try:
+                result = json.loads(text)
+            except json.JSONDecodeError as e:
+                log_error(f"JSON解析错误: {str(e)}, 响应内容: {text[:200]}")
+                return {'success': False, 'error': f"响应格式错误: {str(e)}"}
+
+            # 时间戳超出接收窗口，重新同步服务器时间后使用新时间戳重试一次
+            if signed and _time_retry and self._is_timestamp_error(result):
+                log_warning("请求时间戳超出接收窗口，重新同步服务器时间后重试")
+                await self.sync_time()
+                retry_payload = {k: v for k, v in payload.items() if k not in ('timestamp', 'signature')}
+                return await self._send_request_async(method, url, payload=retry_payload, signed=True, _time_retry=False)
+
+            return self._parse_result(status, result)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log_error(f"请求异常: {str(e) or type(e).__name__}")
+            return {'success': False, 'error': f"网络请求异常: {str(e) or type(e).__name__}"}
+        except Exception as e:
+            log_error(f"未知错误: {str(e)}")
+            return {'success': False, 'error': f"未知错误: {str(e)}"}
+
+    def _symbol_info(self, symbol, market):
+        if not _in_client_greenlet():
+            return super()._symbol_info(symbol, market)
+        # 交易规则可能需要下载，在线程池中查询后把结果交回同步代码
+        call = functools.partial(contextvars.copy_context().run, get_symbol_info, symbol, market)
+        return _await(asyncio.get_running_loop().run_in_executor(None, call))
+
+    def _place_orders_individually(self, endpoint, orders):
+        # 在事件循环中同时发送，不使用线程池
+        async def place_all():
+            return await asyncio.gather(*(
+                self._send_request_async('POST', endpoint, params=dict(params), signed=True) for params in orders
+            ))
+
+        return list(_await(place_all()))
+
+    @staticmethod
+    async def _fetch(session, method, url, headers, proxy):
+        async with session.request(method, url, headers=headers, proxy=proxy) as response:
+            text = await response.text()
+            return response.status, response.headers, text
+
+
+# 为 BinanceClient 的公开方法生成对应的协程方法
+for _name, _attr in list(vars(BinanceClient).items()):
+    if _name.startswith('_') or not callable(_attr) or _name in LOCAL_METHODS or _name in vars(AsyncBinanceClient):
+        continue
+    setattr(AsyncBinanceClient, _name, _async_method(_attr))
+del _name, _attr
+
+
+def get_async_client_by_email(email):
+    """
+    通过子账号邮箱获取异步币安客户端
+
+    参数:
+    - email: 子账号邮箱
+
+    返回:
+    - AsyncBinanceClient 实例或 None
+    """
+    from app.services.binance_client import get_client_by_email
+
+    client = get_client_by_email(email)
+    if client is None:
+        return None
+    return AsyncBinanceClient.from_client(client)
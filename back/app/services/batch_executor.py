@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+批量并发执行模块
+
+为批量交易等需要对多个账号执行相同操作的接口提供有界并发执行器。
+
+说明:
+1. 使用固定大小的线程池并发执行任务，并发数由调用方指定
+2. 每个工作线程都在应用上下文中运行，任务内可以正常访问数据库和配置
+3. run_batch 返回结果与输入顺序一致，不受完成先后影响；iter_batch 按完成先后逐个产出结果，供流式接口使用
+4. 记录每个任务的开始/完成时间，生成首个与最后一个响应之间的延迟报告
+5. 请求频率由 BinanceClient 内的频率调度器统一控制，执行器本身不做限速
+6. gather_batch/run_async_batch 在一个事件循环中并发执行协程任务，配合 AsyncBinanceClient 使用，不受线程数限制
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# 默认并发数
+DEFAULT_CONCURRENCY = 10
+
+
+def resolve_concurrency(requested=None, service=None, task_count=None, weight_per_task=1):
+    """
+    计算实际使用的并发数
+
+    参数:
+    - requested: 请求中指定的并发数(可选)，未指定时使用配置 BATCH_TRADE_CONCURRENCY
+    - service: 任务主要访问的币安服务(可选)，指定后按该服务剩余权重进一步限制并发
+    - task_count: 任务总数(可选)，并发数不超过任务数
+    - weight_per_task: 单个任务消耗的权重
+
+    返回:
+    - int: 并发数，至少为1
+    """
+    config = current_app.config
+    default = config.get('BATCH_TRADE_CONCURRENCY', DEFAULT_CONCURRENCY)
+    maximum = config.get('BATCH_TRADE_MAX_CONCURRENCY', default)
+
+    try:
+        concurrency = int(requested) if requested else int(default)
+    except (TypeError, ValueError):
+        concurrency = int(default)
+
+    concurrency = max(1, min(concurrency, int(maximum)))
+
+    if task_count:
+        concurrency = min(concurrency, task_count)
+
+    if service:
+        from app.services.rate_limiter import get_rate_governor
+        concurrency = get_rate_governor().suggest_concurrency(
+            service, weight_per_task=weight_per_task, maximum=concurrency)
+
+    return max(1, concurrency)
+
+
+def run_batch(items, worker, concurrency=DEFAULT_CONCURRENCY):
+    """
+    并发执行批量任务
+
+    参数:
+    - items: 任务参数列表
+    - worker: 任务函数，接收单个任务参数，返回结果字典
+    - concurrency: 最大并发数
+
+    返回:
+    - (results, report):
+        results - 与 items 顺序一致的结果列表，任务抛出异常时结果为 {'success': False, 'error': ...}
+        report - 延迟报告，包含并发数、总耗时、首个/最后一个响应耗时及两者之差(毫秒)
+    """
+    items = list(items)
+    app = current_app._get_current_object()
+    started = time.perf_counter()
+    timings = [None] * len(items)
+
+    def run_one(index, item):
+        with app.app_context():
+            task_started = time.perf_counter()
+            try:
+                result = worker(item)
+            except Exception as e:
+                logger.exception(f"批量任务执行出错: {str(e)}")
+                result = {'success': False, 'error': str(e)}
+            finished = time.perf_counter()
+            timings[index] = (task_started - started, finished - started)
+            return result
+
+    results = []
+    if items:
+        workers = max(1, min(int(concurrency), len(items)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+            futures = [executor.submit(run_one, index, item) for index, item in enumerate(items)]
+            results = [future.result() for future in futures]
+    else:
+        workers = 0
+
+    return results, _latency_report(results, timings, workers, started)
+
+
+def _latency_report(results, timings, workers, started):
+    """生成延迟报告，并为每个结果补充 latency_ms"""
+    total = time.perf_counter() - started
+    acks = [timing[1] for timing in timings if timing]
+
+    report = {
+        'concurrency': workers,
+        'total_ms': round(total * 1000, 1),
+        'first_ack_ms': round(min(acks) * 1000, 1) if acks else None,
+        'last_ack_ms': round(max(acks) * 1000, 1) if acks else None,
+        'spread_ms': round((max(acks) - min(acks)) * 1000, 1) if acks else None
+    }
+
+    for result, timing in zip(results, timings):
+        if isinstance(result, dict) and timing:
+            result.setdefault('latency_ms', round((timing[1] - timing[0]) * 1000, 1))
+
+    logger.info(f"批量任务完成: 数量={len(results)}, 并发={workers}, 总耗时={report['total_ms']}ms, 首尾响应差={report['spread_ms']}ms")
+    return report
+
+
+def iter_batch(items, worker, concurrency=DEFAULT_CONCURRENCY):
+    """
+    并发执行批量任务，按完成先后逐个产出结果
+
+    参数:
+    - items: 任务参数列表
+    - worker: 任务函数，接收单个任务参数，返回结果字典
+    - concurrency: 最大并发数
+
+    返回:
+    - 生成器，产出 (index, result)，index 为任务在 items 中的位置
+    """
+    items = list(items)
+    if not items:
+        return
+
+    app = current_app._get_current_object()
+
+    def run_one(item):
+        with app.app_context():
+            task_started = time.perf_counter()
+            try:
+                result = worker(item)
+            except Exception as e:
+                logger.exception(f"批量任务执行出错: {str(e)}")
+                result = {'success': False, 'error': str(e)}
+            if isinstance(result, dict):
+                result.setdefault('latency_ms', round((time.perf_counter() - task_started) * 1000, 1))
+            return result
+
+    workers = max(1, min(int(concurrency), len(items)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+        futures = {executor.submit(run_one, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+async def gather_batch(items, worker, concurrency=DEFAULT_CONCURRENCY):
+    """
+    在当前事件循环中并发执行异步批量任务
+
+    参数:
+    - items: 任务参数列表
+    - worker: 协程函数，接收单个任务参数，返回结果字典
+    - concurrency: 同时进行的最大任务数
+
+    返回:
+    - (results, report): 与 run_batch 相同
+    """
+    items = list(items)
+    started = time.perf_counter()
+    timings = [None] * len(items)
+    workers = max(1, min(int(concurrency), len(items))) if items else 0
+    semaphore = asyncio.Semaphore(max(1, workers))
+
+    async def run_one(index, item):
+        async with semaphore:
+            task_started = time.perf_counter()
+            try:
+                result = await worker(item)
+            except Exception as e:
+                logger.exception(f"批量任务执行出错: {str(e)}")
+                result = {'success': False, 'error': str(e)}
+            timings[index] = (task_started - started, time.perf_counter() - started)
+            return result
+
+    results = list(await asyncio.gather(*(run_one(index, item) for index, item in enumerate(items))))
+    return results, _latency_report(results, timings, workers, started)
+
+
+def run_async_batch(items, worker, concurrency=DEFAULT_CONCURRENCY):
+    """
+    在新的事件循环中并发执行异步批量任务，供同步的 Flask 视图调用
+
+    参数:
+    - items: 任务参数列表
+    - worker: 协程函数，通常调用 AsyncBinanceClient 的方法
+    - concurrency: 同时进行的最大任务数
+
+    返回:
+    - (results, report): 与 run_batch 相同
+    """
+    from app.services.async_binance_client import close_async_session
+
+    async def main():
+        try:
+            return await gather_batch(items, worker, concurrency)
+        finally:
+            await close_async_session()
+
+    # asyncio.run 会复制当前上下文，协程内可以正常访问 current_app
+    return asyncio.run(main())
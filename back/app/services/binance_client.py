@@ -23,11 +23,37 @@ import os
 import json
 import urllib.parse
 from flask import current_app
-from app.models.account import SubAccountAPISettings
 from app.models.user import APIKey
+from app.services.http_transport import get_session, resolve_service
+from app.services.rate_limiter import get_rate_governor, estimate_weight, count_orders
+from app.services.symbol_metadata import get_symbol_info
+from app.services.client_registry import get_client_registry
+from app.services.time_sync import get_time_sync
 
 logger = logging.getLogger(__name__)
 
+# 请求超时(秒)
+REQUEST_TIMEOUT = 15
+
+# 合约批量下单接口每个请求最多包含的订单数
+BATCH_ORDER_LIMIT = 5
+
+# 合约批量下单接口，统一账户(papi)没有批量接口，使用单个下单接口
+BATCH_ORDER_ENDPOINTS = {
+    'um': '/fapi/v1/batchOrders',
+    'cm': '/dapi/v1/batchOrders'
+}
+PORTFOLIO_ORDER_ENDPOINTS = {
+    'um': '/papi/v1/um/order',
+    'cm': '/papi/v1/cm/order'
+}
+
+# 自动判断得到的账号下单方式: (账号, 市场) -> 'batch' / 'papi'
+_order_modes = {}
+
+# 统一账户调用 fapi/dapi 时返回的错误码(无权限访问该接口)，只有这些错误才尝试改用统一账户接口
+PORTFOLIO_MARGIN_ERROR_CODES = (-2015, -1002)
+
 # 添加工具函数，限制字符串长度
 def truncate_message(message, max_length=500):
     """
@@ -99,8 +125,8 @@ class BinanceClient:
         # 获取代理设置
         self.proxy = current_app.config.get('BINANCE_PROXY', None)
         
-        # 初始化时间偏移量
-        self.time_offset = 0
+        # 签名请求默认的接收窗口，时间戳由进程共享的时间同步服务校正
+        self.recv_window = current_app.config.get('BINANCE_RECV_WINDOW', 5000)
         
         # 记录API密钥前缀（安全显示）
         key_info = '未提供'
@@ -145,16 +171,17 @@ class BinanceClient:
             log_error(f"生成签名时出错: {str(e)}")
             return ""
     
-    def _send_request(self, method, url, payload=None, signed=False, params=None):
+    def _send_request(self, method, url, payload=None, signed=False, params=None, _time_retry=True):
         """
         发送API请求到币安
         
         参数:
-        - method: 请求方法 (GET, POST, DELETE等)
+        - method: 请求方法 (GET, POST, PUT, DELETE)
         - url: 请求URL或API端点
         - payload: 请求参数 (新格式)
         - signed: 是否需要签名 (旧格式)
         - params: 请求参数 (旧格式)
+        - _time_retry: 时间戳超出接收窗口(-1021)时是否重新同步时间后重试一次
         
         返回:
         - dict: 包含响应数据和结果状态的字典
@@ -165,81 +192,29 @@ class BinanceClient:
         if params is not None:
             payload = params
             
-        # 处理兼容性: 检查url是否为API端点(不含http)，如果是则构建完整URL
-        if not url.startswith('http'):
-            # 判断API端点类型
-            if url.startswith('/'):
-                url = url[1:]
-                
-            # 不同API类型的基础URL
-            if url.startswith('fapi/') or url == 'fapi':
-                # U本位合约
-                url = f"{self.fapi_url}/{url.replace('fapi/', '')}"
-                log_debug(f"构建U本位合约URL: {url}")
-            elif url.startswith('dapi/'):
-                # 币本位合约
-                url = f"https://dapi.binance.com/{url}"
-                log_debug(f"构建币本位合约URL: {url}")
-            elif url.startswith('sapi/'):
-                # SAPI接口
-                url = f"{self.sapi_url}/{url.replace('sapi/', '')}"
-                log_debug(f"构建SAPI接口URL: {url}")
-            elif url.startswith('papi/'):
-                # 统一账户API
-                url = f"{self.papi_url}/{url.replace('papi/', '')}"
-                log_debug(f"构建统一账户API URL: {url}")
-            else:
-                # 现货API
-                if not url.startswith('api/') and not url.startswith('v'):
-                    url = f"{self.base_url}/api/v3/{url}"
-                else:
-                    url = f"{self.base_url}/{url}"
-                log_debug(f"构建现货API URL: {url}")
+        url = self._build_url(url)
         
         # 初始化参数字典
         if payload is None:
             payload = {}
+        
+        # 请求频率控制 - 在签名前获取额度，避免等待期间时间戳过期
+        service = resolve_service(url)
+        request_path = urllib.parse.urlsplit(url).path
+        order_count = count_orders(method, request_path, payload)
+        rate_account = self._rate_limit_account()
+        governor = get_rate_governor()
+        if not governor.acquire(service, estimate_weight(request_path, payload), rate_account, order_count):
+            log_error(f"请求频率超出限制，放弃请求: {method} {request_path}")
+            return {'success': False, 'error': f"请求频率超出限制，请稍后重试 ({service})"}
             
         # 如果需要签名，添加时间戳和生成签名
         if signed:
-            # 确保API密钥存在
-            if not self.api_key or not self.api_secret:
-                log_error("无法发送签名请求：API密钥不完整")
-                return {'success': False, 'error': "API密钥不完整，无法签名请求"}
-                
-            # 添加时间戳参数
-            if 'timestamp' not in payload:
-                payload['timestamp'] = self.get_timestamp()
-                
-            # 添加recvWindow参数（可选）
-            if 'recvWindow' not in payload:
-                payload['recvWindow'] = 60000  # 60秒，根据需要调整
-                
-            # 生成签名
-            try:
-                payload['signature'] = self._generate_signature(payload)
-                
-                if not payload['signature']:
-                    log_error("生成签名失败")
-                    return {'success': False, 'error': "生成签名失败"}
-            except Exception as e:
-                log_error(f"生成签名异常: {str(e)}")
-                return {'success': False, 'error': f"生成签名异常: {str(e)}"}
-            
-        # 为安全起见，不记录完整的API密钥，只记录前6位和后4位
-        masked_key = "未提供API密钥"
-        if self.api_key:
-            masked_key = self.api_key[:6] + "..." + self.api_key[-4:] if len(self.api_key) > 10 else "密钥格式异常"
-        log_debug(f"准备请求 {url}, 方法: {method}, 使用API密钥: {masked_key}")
-        
-        # 设置请求头
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        # 只有在API密钥存在时才添加到头部
-        if self.api_key:
-            headers['X-MBX-APIKEY'] = self.api_key
+            sign_error = self._sign_payload(payload)
+            if sign_error:
+                return sign_error
+            
+        headers = self._build_headers()
         
         # 设置代理
         proxies = None
@@ -251,24 +226,14 @@ class BinanceClient:
             log_debug(f"使用代理: {self.proxy}")
             
         # 设置超时
-        timeout = 15  # 15秒超时
-        
-        # 打印完整的请求信息 (不包含敏感信息)
-        safe_payload = payload.copy()
-        if 'signature' in safe_payload:
-            safe_payload['signature'] = safe_payload['signature'][:10] + '...'
-        
-        if method == 'GET':
-            full_url = f"{url}?{urllib.parse.urlencode(payload)}" if payload else url
-        else:
-            full_url = url
+        timeout = REQUEST_TIMEOUT
             
         # 简化日志输出，只记录基本请求信息
         log_info(f"{method} {url.split('?')[0]}")
         
         try:
-            # 使用请求会话保持连接复用
-            session = requests.Session()
+            # 使用进程级共享的连接池，复用已建立的TCP+TLS连接
+            session = get_session(url, self.proxy)
             
             try:
                 # 发送HTTP请求
@@ -278,12 +243,15 @@ class BinanceClient:
                     response = session.post(url, headers=headers, params=payload, proxies=proxies, timeout=timeout)
                 elif method == 'DELETE':
                     response = session.delete(url, headers=headers, params=payload, proxies=proxies, timeout=timeout)
+                elif method == 'PUT':
+                    response = session.put(url, headers=headers, params=payload, proxies=proxies, timeout=timeout)
                 else:
                     log_error(f"不支持的请求方法: {method}")
                     return {'success': False, 'error': f"不支持的请求方法: {method}"}
             except requests.exceptions.ProxyError as proxy_error:
                 # 代理连接失败，尝试直接连接
                 log_warning(f"代理连接失败，尝试直接连接: {str(proxy_error)}")
+                session = get_session(url)
                 
                 if method == 'GET':
                     response = session.get(url, headers=headers, params=payload, timeout=timeout)
@@ -291,6 +259,11 @@ class BinanceClient:
                     response = session.post(url, headers=headers, params=payload, timeout=timeout)
                 elif method == 'DELETE':
                     response = session.delete(url, headers=headers, params=payload, timeout=timeout)
+                elif method == 'PUT':
+                    response = session.put(url, headers=headers, params=payload, timeout=timeout)
+            
+            # 根据响应头校准频率控制余量
+            governor.update_from_headers(service, response.headers, rate_account, response.status_code)
             
             # 简化响应日志记录
             if response.status_code != 200:
@@ -299,32 +272,19 @@ class BinanceClient:
             # 解析JSON响应
             try:
                 result = response.json()
-                
-                # 打印截取的响应内容
-                if isinstance(result, dict):
-                    # 如果是错误响应，只记录错误信息
-                    if 'code' in result and result['code'] != 200 and result['code'] != 0:
-                        error_msg = result.get('msg', '未知错误')
-                        log_error(f"API错误: 代码={result['code']}, 消息={error_msg}")
-                        
-                        # 检查是否为API-key错误
-                        if result.get('code') in [-2015, -2014]:
-                            log_error("API密钥无效或权限不足")
-                            return {'success': False, 'error': f"API密钥错误: {error_msg}"}
-                        
-                        return {'success': False, 'error': f"API错误: {error_msg}"}
-                elif isinstance(result, list) and len(result) > 0:
-                    # 列表结果只记录长度
-                    log_info(f"列表响应，共{len(result)}项")
-                
-                if response.status_code != 200:
-                    return {'success': False, 'error': f"请求失败: HTTP {response.status_code}"}
-                
-                return {'success': True, 'data': result}
             except json.JSONDecodeError as e:
                 log_error(f"JSON解析错误: {str(e)}, 响应内容: {response.text[:200]}")
                 return {'success': False, 'error': f"响应格式错误: {str(e)}"}
             
+            # 时间戳超出接收窗口，重新同步服务器时间后使用新时间戳重试一次
+            if signed and _time_retry and self._is_timestamp_error(result):
+                log_warning("请求时间戳超出接收窗口，重新同步服务器时间后重试")
+                get_time_sync().sync(force=True)
+                retry_payload = {k: v for k, v in payload.items() if k not in ('timestamp', 'signature')}
+                return self._send_request(method, url, payload=retry_payload, signed=True, _time_retry=False)
+            
+            return self._parse_result(response.status_code, result)
+            
         except requests.exceptions.RequestException as e:
             log_error(f"请求异常: {str(e)}")
             return {'success': False, 'error': f"网络请求异常: {str(e)}"}
@@ -332,83 +292,145 @@ class BinanceClient:
             log_error(f"未知错误: {str(e)}")
             return {'success': False, 'error': f"未知错误: {str(e)}"}
     
+    def _build_url(self, url):
+        """
+        将API端点转换为完整URL，已是完整URL时原样返回
+        """
+        # 处理兼容性: 检查url是否为API端点(不含http)，如果是则构建完整URL
+        if url.startswith('http'):
+            return url
+        
+        # 判断API端点类型
+        if url.startswith('/'):
+            url = url[1:]
+            
+        # 不同API类型的基础URL
+        if url.startswith('fapi/') or url == 'fapi':
+            # U本位合约
+            url = f"{self.fapi_url}/{url.replace('fapi/', '')}"
+            log_debug(f"构建U本位合约URL: {url}")
+        elif url.startswith('dapi/'):
+            # 币本位合约
+            url = f"https://dapi.binance.com/{url}"
+            log_debug(f"构建币本位合约URL: {url}")
+        elif url.startswith('sapi/'):
+            # SAPI接口
+            url = f"{self.sapi_url}/{url.replace('sapi/', '')}"
+            log_debug(f"构建SAPI接口URL: {url}")
+        elif url.startswith('papi/'):
+            # 统一账户API
+            url = f"{self.papi_url}/{url.replace('papi/', '')}"
+            log_debug(f"构建统一账户API URL: {url}")
+        else:
+            # 现货API
+            if not url.startswith('api/') and not url.startswith('v'):
+                url = f"{self.base_url}/api/v3/{url}"
+            else:
+                url = f"{self.base_url}/{url}"
+            log_debug(f"构建现货API URL: {url}")
+        return url
+    
+    def _sign_payload(self, payload):
+        """
+        为请求参数添加时间戳、接收窗口和签名
+        
+        返回:
+        - 签名失败时返回错误结果字典，成功返回None
+        """
+        # 确保API密钥存在
+        if not self.api_key or not self.api_secret:
+            log_error("无法发送签名请求：API密钥不完整")
+            return {'success': False, 'error': "API密钥不完整，无法签名请求"}
+            
+        # 添加时间戳参数
+        if 'timestamp' not in payload:
+            payload['timestamp'] = self.get_timestamp()
+            
+        # 添加recvWindow参数（可选）
+        if 'recvWindow' not in payload:
+            payload['recvWindow'] = self.recv_window
+            
+        # 生成签名
+        try:
+            payload['signature'] = self._generate_signature(payload)
+            
+            if not payload['signature']:
+                log_error("生成签名失败")
+                return {'success': False, 'error': "生成签名失败"}
+        except Exception as e:
+            log_error(f"生成签名异常: {str(e)}")
+            return {'success': False, 'error': f"生成签名异常: {str(e)}"}
+        return None
+    
+    def _build_headers(self):
+        """构建请求头，只有在API密钥存在时才添加到头部"""
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        if self.api_key:
+            headers['X-MBX-APIKEY'] = self.api_key
+        return headers
+    
+    @staticmethod
+    def _is_timestamp_error(result):
+        """响应是否为时间戳超出接收窗口(-1021)"""
+        return isinstance(result, dict) and result.get('code') == -1021
+    
+    def _parse_result(self, status_code, result):
+        """
+        将币安返回的JSON转换为统一的结果字典
+        
+        参数:
+        - status_code: HTTP状态码
+        - result: 解析后的JSON
+        
+        返回:
+        - dict: {'success': True, 'data': ...} 或 {'success': False, 'error': ...}
+        """
+        # 打印截取的响应内容
+        if isinstance(result, dict):
+            # 如果是错误响应，只记录错误信息
+            if 'code' in result and result['code'] != 200 and result['code'] != 0:
+                error_msg = result.get('msg', '未知错误')
+                log_error(f"API错误: 代码={result['code']}, 消息={error_msg}")
+                
+                # 检查是否为API-key错误
+                if result.get('code') in [-2015, -2014]:
+                    log_error("API密钥无效或权限不足")
+                    return {'success': False, 'error': f"API密钥错误: {error_msg}", 'code': result['code']}
+                
+                return {'success': False, 'error': f"API错误: {error_msg}", 'code': result['code']}
+        elif isinstance(result, list) and len(result) > 0:
+            # 列表结果只记录长度
+            log_info(f"列表响应，共{len(result)}项")
+        
+        if status_code != 200:
+            return {'success': False, 'error': f"请求失败: HTTP {status_code}"}
+        
+        return {'success': True, 'data': result}
+    
+    def _rate_limit_account(self):
+        """下单频率按账号计数，优先使用子账号邮箱作为账号标识"""
+        return self.subaccount_email or self.api_key or None
+    
+    @property
+    def time_offset(self):
+        """与币安服务器的时间偏移量(毫秒)，所有客户端共用"""
+        return get_time_sync().offset
+    
     def get_timestamp(self):
         """获取校正后的时间戳"""
-        return int(time.time() * 1000 + self.time_offset)
+        return get_time_sync().now()
     
     def sync_time(self):
         """
-        同步本地时间与币安服务器时间
+        立即重新同步本地时间与币安服务器时间
         
         返回:
-            - 成功时: {'success': True, 'data': {'local_time': 本地时间, 'server_time': 服务器时间, 'offset': 时间偏移}}
+            - 成功时: {'success': True, 'data': {'local_time': 本地时间, 'server_time': 服务器时间, 'offset': 时间偏移, 'rtt': 往返时间}}
             - 失败时: {'success': False, 'error': '错误信息'}
         """
-        try:
-            log_info("开始同步本地时间与币安服务器时间")
-            local_time = int(time.time() * 1000)
-            
-            # 直接构建URL，不使用_send_request方法，避免循环依赖
-            url = f"{self.base_url}/api/v3/time"
-            
-            try:
-                # 简单的GET请求获取服务器时间
-                log_info(f"发送请求到币安时间API: {url}")
-                # 设置超时为5秒，避免长时间等待
-                response = requests.get(url, timeout=5)
-                
-                if response.status_code == 200:
-                    try:
-                        data = response.json()
-                        server_time = data.get('serverTime')
-                        
-                        if server_time:
-                            # 计算时间偏移量
-                            now = int(time.time() * 1000)
-                            self.time_offset = server_time - now
-                            
-                            log_info(f"时间同步成功 - 本地时间: {now}, 服务器时间: {server_time}, 偏移量: {self.time_offset}毫秒")
-                            
-                            return {
-                                'success': True,
-                                'data': {
-                                    'local_time': now,
-                                    'server_time': server_time,
-                                    'offset': self.time_offset,
-                                    'synchronized': True
-                                }
-                            }
-                        else:
-                            log_error("币安返回的响应中不包含serverTime字段")
-                            return {
-                                'success': False,
-                                'error': '币安返回的响应中不包含serverTime字段'
-                            }
-                    except ValueError as json_error:
-                        log_error(f"解析币安时间API响应JSON失败: {str(json_error)}")
-                        return {
-                            'success': False,
-                            'error': f"解析币安时间API响应失败: {str(json_error)}"
-                        }
-                else:
-                    log_error(f"币安时间API请求失败，状态码: {response.status_code}, 响应: {response.text}")
-                    return {
-                        'success': False,
-                        'error': f"币安时间API请求失败，状态码: {response.status_code}"
-                    }
-            except requests.RequestException as req_error:
-                log_error(f"请求币安时间API异常: {str(req_error)}")
-                return {
-                    'success': False,
-                    'error': f"请求币安时间API异常: {str(req_error)}"
-                }
-        except Exception as e:
-            error_msg = str(e)
-            log_error(f"同步时间异常: {error_msg}")
-            return {
-                'success': False,
-                'error': f"同步时间异常: {error_msg}"
-            }
+        return get_time_sync().sync(force=True)
     
     def get_account_info(self):
         """
@@ -433,17 +455,21 @@ class BinanceClient:
                 'error': f"获取账户信息异常: {str(e)}"
             }
     
-    def get_account_balance(self):
+    def get_account_balance(self, account_info=None):
         """
         获取账户余额信息
         
+        参数:
+        - account_info: 已获取的 get_account_info 结果(可选)，为空时重新请求
+        
         返回:
         - 成功时返回{'success': True, 'data': [...]}
         - 失败时返回{'success': False, 'error': '错误信息'}
         """
         try:
             # 获取账户信息，包含余额
-            account_info = self.get_account_info()
+            if account_info is None:
+                account_info = self.get_account_info()
             
             if not account_info.get('success'):
                 return account_info
@@ -468,17 +494,21 @@ class BinanceClient:
                 'error': f"获取账户余额异常: {str(e)}"
             }
             
-    def check_trade_permission(self):
+    def check_trade_permission(self, account_info=None):
         """
         检查是否有交易权限
         
+        参数:
+        - account_info: 已获取的 get_account_info 结果(可选)，为空时重新请求
+        
         返回:
         - 成功时返回{'success': True, 'data': {'canTrade': True/False, ...}}
         - 失败时返回{'success': False, 'error': '错误信息'}
         """
         try:
             # 获取账户信息
-            account_info = self.get_account_info()
+            if account_info is None:
+                account_info = self.get_account_info()
             
             if not account_info.get('success'):
                 return account_info
@@ -488,7 +518,9 @@ class BinanceClient:
             permissions = {
                 'canTrade': data.get('canTrade', False),
                 'canDeposit': data.get('canDeposit', False),
-                'canWithdraw': data.get('canWithdraw', False)
+                'canWithdraw': data.get('canWithdraw', False),
+                'makerCommission': data.get('makerCommission'),
+                'takerCommission': data.get('takerCommission')
             }
             
             return {
@@ -1054,14 +1086,19 @@ class BinanceClient:
             if not quantity and not quoteOrderQty:
                 return {'success': False, 'error': '必须提供交易数量(quantity)或交易金额(quoteOrderQty)参数中的至少一个'}
             
-            # 获取U本位合约交易对精度规则
-            # 由于无法通过普通的exchangeInfo获取PAPI的精度，这里使用一个硬编码的常见精度表
+            # 获取U本位合约交易对精度规则 - 统一账户UM合约与U本位合约使用相同的交易规则
+            symbol_info = self._symbol_info(symbol, 'um')
+            
+            # 交易规则不可用时使用常见精度表兜底
             # 一般来说，主要币种合约的数量精度为3位，价格精度在1-4位
             quantity_precision = 3  # 默认精度
             price_precision = 2     # 默认精度
             
             # 根据常见交易对调整精度
-            if symbol.startswith('BTC'):
+            if symbol_info:
+                quantity_precision = symbol_info.quantity_precision if symbol_info.quantity_precision is not None else quantity_precision
+                price_precision = symbol_info.price_precision if symbol_info.price_precision is not None else price_precision
+            elif symbol.startswith('BTC'):
                 quantity_precision = 3
                 price_precision = 1
             elif symbol.startswith('ETH'):
@@ -1076,16 +1113,22 @@ class BinanceClient:
             
             logger.info(f"使用U本位合约交易对{symbol}的数量精度为{quantity_precision}位小数，价格精度为{price_precision}位小数")
             
-            # 调整数量和价格精度
+            # 调整数量和价格精度 - 有交易规则时按步长取整
             if quantity is not None:
                 original_quantity = quantity
-                quantity = self._format_number_precision(quantity, quantity_precision)
+                if symbol_info:
+                    quantity = symbol_info.format_quantity(quantity)
+                else:
+                    quantity = self._format_number_precision(quantity, quantity_precision)
                 if original_quantity != quantity:
                     logger.info(f"调整数量精度: {original_quantity} -> {quantity}")
             
             if price is not None:
                 original_price = price
-                price = self._format_number_precision(price, price_precision)
+                if symbol_info:
+                    price = symbol_info.format_price(price)
+                else:
+                    price = self._format_number_precision(price, price_precision)
                 if original_price != price:
                     logger.info(f"调整价格精度: {original_price} -> {price}")
             
@@ -1443,9 +1486,6 @@ class BinanceClient:
         - 交易历史记录列表
         """
         try:
-            # 同步服务器时间
-            self.sync_time()
-            
             # 构建请求参数
             params = {}
             
@@ -1472,7 +1512,7 @@ class BinanceClient:
             if recvWindow or kwargs.get('recvWindow'):
                 params['recvWindow'] = recvWindow or kwargs.get('recvWindow')
             else:
-                params['recvWindow'] = 60000  # 默认值
+                params['recvWindow'] = self.recv_window
             
             # 调用统一账户API - 使用papi前缀的正确端点，去掉多余的斜杠
             endpoint = 'papi/v1/margin/myTrades'
@@ -1521,9 +1561,6 @@ class BinanceClient:
         - 交易历史记录列表
         """
         try:
-            # 同步服务器时间
-            self.sync_time()
-            
             # 构建请求参数
             params = {}
             
@@ -1550,7 +1587,7 @@ class BinanceClient:
             if recvWindow or kwargs.get('recvWindow'):
                 params['recvWindow'] = recvWindow or kwargs.get('recvWindow')
             else:
-                params['recvWindow'] = 60000  # 默认值
+                params['recvWindow'] = self.recv_window
             
             # 调用统一账户API - 使用papi前缀的正确端点，去掉多余的斜杠
             endpoint = 'papi/v1/um/userTrades'
@@ -1615,22 +1652,12 @@ class BinanceClient:
         - dict: 过滤器规则
         """
         try:
-            exchange_info = self.get_exchange_info(symbol)
-            if not exchange_info.get('success', False):
-                logger.warning(f"获取交易对{symbol}信息失败: {exchange_info.get('error')}")
-                return None
-                
-            symbols_info = exchange_info.get('data', {}).get('symbols', [])
-            
-            for sym_info in symbols_info:
-                if sym_info.get('symbol') == symbol:
-                    filters = {}
-                    for filter_item in sym_info.get('filters', []):
-                        filter_type = filter_item.get('filterType')
-                        filters[filter_type] = filter_item
-                    
-                    logger.info(f"获取到交易对{symbol}的过滤器规则: {json.dumps(filters, indent=2)}")
-                    return filters
+            # 使用共享的交易规则索引，不再每次下载完整的exchangeInfo
+            symbol_info = self._symbol_info(symbol, 'spot')
+            if symbol_info:
+                filters = symbol_info.to_filters()
+                log_debug(f"获取到交易对{symbol}的过滤器规则: {json.dumps(filters)}")
+                return filters
                     
             logger.warning(f"未找到交易对{symbol}的信息")
             return None
@@ -1686,6 +1713,140 @@ class BinanceClient:
             logger.error(f"币本位合约下单失败: {str(e)}")
             raise e
 
+    def place_batch_orders(self, market, orders, portfolio_margin=None):
+        """
+        合约批量下单，每个请求最多 BATCH_ORDER_LIMIT 个订单，超出时自动分批
+        
+        参数:
+        - market: 合约市场，um(U本位) 或 cm(币本位)
+        - orders: 订单参数列表，字段与币安下单接口相同(symbol, side, type, quantity, price, timeInForce, positionSide等)
+        - portfolio_margin: 是否为统一账户。统一账户没有批量下单接口，改为逐个下单并同时发送；
+                            为None时自动判断: 先使用批量接口，整批因无接口权限被拒绝时尝试统一账户接口，
+                            统一账户接口可用时记住该账号的判断结果，否则返回批量接口的原始错误
+        
+        返回:
+        - dict: {'success': 是否至少有一个订单成功, 'data': 与orders顺序一致的每个订单结果, 'error': 全部失败时的错误信息}
+                每个订单结果为 {'success': True, 'data': 订单信息} 或 {'success': False, 'error': 错误信息}
+        """
+        if market not in BATCH_ORDER_ENDPOINTS:
+            return {'success': False, 'error': f"不支持的批量下单市场: {market}"}
+        if not orders:
+            return {'success': False, 'error': '订单列表为空'}
+        
+        prepared = [self._prepare_batch_order(market, order) for order in orders]
+        mode_key = (self._rate_limit_account(), market)
+        if portfolio_margin is None:
+            mode = _order_modes.get(mode_key)
+        else:
+            mode = 'papi' if portfolio_margin else 'batch'
+        
+        results = [None] * len(prepared)
+        index = 0
+        requests_sent = 0
+        
+        while index < len(prepared):
+            if mode == 'papi':
+                # 统一账户: 剩余订单全部同时发送
+                results[index:] = self._place_orders_individually(PORTFOLIO_ORDER_ENDPOINTS[market], prepared[index:])
+                requests_sent += len(prepared) - index
+                break
+            
+            chunk = prepared[index:index + BATCH_ORDER_LIMIT]
+            response = self._send_request('POST', BATCH_ORDER_ENDPOINTS[market], signed=True, params={
+                'batchOrders': json.dumps(chunk, separators=(',', ':'))
+            })
+            requests_sent += 1
+            
+            if response.get('success') and isinstance(response.get('data'), list):
+                if mode is None:
+                    mode = _order_modes[mode_key] = 'batch'
+                items = response['data']
+                for offset in range(len(chunk)):
+                    item = items[offset] if offset < len(items) else {'code': None, 'msg': '批量下单响应缺少该订单结果'}
+                    results[index + offset] = self._map_batch_order_result(item)
+                index += len(chunk)
+                continue
+            
+            if mode is None and response.get('code') in PORTFOLIO_MARGIN_ERROR_CODES:
+                # 整批因无接口权限被拒绝，可能是统一账户: 剩余订单改用统一账户接口发送
+                logger.info(f"批量下单接口不可用({response.get('error')})，尝试统一账户下单接口")
+                papi_results = self._place_orders_individually(PORTFOLIO_ORDER_ENDPOINTS[market], prepared[index:])
+                requests_sent += len(prepared) - index
+                if any(result.get('success') or result.get('code') not in PORTFOLIO_MARGIN_ERROR_CODES
+                       for result in papi_results):
+                    # 统一账户接口可以访问(订单本身可能因其他原因失败)，记住该账号的下单方式
+                    mode = _order_modes[mode_key] = 'papi'
+                    results[index:] = papi_results
+                else:
+                    # 两种接口都无权限(如密钥无效)，返回批量接口的原始错误，不记录下单方式
+                    results[index:] = [
+                        {'success': False, 'error': response.get('error', '批量下单失败'), 'code': response.get('code')}
+                        for _ in papi_results
+                    ]
+                break
+            
+            for offset in range(len(chunk)):
+                results[index + offset] = {'success': False, 'error': response.get('error', '批量下单失败')}
+            index += len(chunk)
+        
+        succeeded = sum(1 for result in results if result.get('success'))
+        logger.info(f"批量下单完成: 市场={market}, 方式={mode}, 订单数={len(prepared)}, 成功={succeeded}, 请求数={requests_sent}")
+        
+        response = {'success': succeeded > 0, 'data': results}
+        if not succeeded:
+            response['error'] = next((result.get('error') for result in results if result.get('error')), '批量下单失败')
+        return response
+    
+    def _symbol_info(self, symbol, market):
+        """查询交易规则，异步客户端中改为在线程池中执行"""
+        return get_symbol_info(symbol, market)
+
+    def _prepare_batch_order(self, market, order):
+        """
+        整理单个批量订单参数: 去掉空值，按交易规则格式化数量和价格，所有值转换为字符串
+        """
+        params = {key: value for key, value in order.items() if value is not None and value != ''}
+        symbol = str(params.get('symbol', '')).upper()
+        params['symbol'] = symbol
+        
+        symbol_info = self._symbol_info(symbol, market)
+        if symbol_info:
+            if 'quantity' in params:
+                params['quantity'] = symbol_info.format_quantity(params['quantity'])
+            if 'price' in params:
+                params['price'] = symbol_info.format_price(params['price'])
+        
+        if params.get('type', 'LIMIT') == 'LIMIT':
+            params.setdefault('timeInForce', 'GTC')
+        
+        return {key: str(value) for key, value in params.items()}
+    
+    @staticmethod
+    def _map_batch_order_result(item):
+        """将批量下单响应中的单个元素转换为统一的结果字典"""
+        if isinstance(item, dict) and 'code' in item and 'orderId' not in item:
+            return {'success': False, 'error': f"API错误: {item.get('msg', '未知错误')}", 'code': item.get('code')}
+        return {'success': True, 'data': item}
+    
+    def _place_orders_individually(self, endpoint, orders):
+        """
+        使用单个下单接口同时发送多个订单
+        
+        返回:
+        - list: 与orders顺序一致的结果
+        """
+        from app.services.batch_executor import run_batch, resolve_concurrency
+        
+        results, _ = run_batch(
+            orders,
+            lambda params: self._send_request('POST', endpoint, signed=True, params=dict(params)),
+            concurrency=resolve_concurrency(len(orders), task_count=len(orders))
+        )
+        # 与批量接口的结果格式保持一致
+        for result in results:
+            result.pop('latency_ms', None)
+        return results
+
     def set_coin_futures_leverage(self, symbol, leverage):
         """
         设置币本位合约杠杆倍数
@@ -1814,42 +1975,8 @@ def get_client_by_email(email, user_id=None):
         log_warning("未提供子账号邮箱，无法获取API客户端")
         return None
     
-    # 使用子账号邮箱查询API设置，不使用user_id字段
-    api_setting = SubAccountAPISettings.query.filter_by(email=email).first()
-        
-    if api_setting and api_setting.api_key and api_setting.api_secret:
-        # 清理API密钥，移除可能的空格、换行符和其他不可见字符
-        api_key = api_setting.api_key.strip()
-        api_secret = api_setting.api_secret.strip()
-        
-        # 验证API密钥格式
-        if not api_key or len(api_key) < 10:
-            log_error(f"子账号 {email} 的API密钥格式无效（长度不足）")
-            return None
-            
-        if not api_secret or len(api_secret) < 10:
-            log_error(f"子账号 {email} 的API密钥Secret格式无效（长度不足）")
-            return None
-            
-        # 验证仅包含字母和数字
-        import re
-        if not re.match(r'^[A-Za-z0-9]+$', api_key):
-            log_error(f"子账号 {email} 的API密钥格式无效（包含非法字符）")
-            return None
-            
-        if not re.match(r'^[A-Za-z0-9]+$', api_secret):
-            log_error(f"子账号 {email} 的API密钥Secret格式无效（包含非法字符）")
-            return None
-            
-        log_info(f"找到子账号 {email} 的API设置，使用子账号自己的API密钥初始化客户端")
-        # 返回初始化的客户端
-        client = BinanceClient(api_key, api_secret)
-        client.is_subaccount = True  # 标记这是子账号API客户端
-        client.subaccount_email = email  # 记录子账号邮箱
-        return client
-    else:
-        log_error(f"未找到子账号 {email} 的API设置或API设置不完整，无法使用子账号API")
-        return None
+    # 从客户端注册表获取，凭证只加载和校验一次，客户端按邮箱复用
+    return get_client_registry().get_client(email)
 
 def get_binance_client(user_id=None):
     """
@@ -1969,12 +2096,12 @@ def get_sub_account_api_credentials(email):
             log_warning("未提供子账号邮箱，无法获取API凭证")
             return None, None
         
-        # 查询子账号API设置
-        api_setting = SubAccountAPISettings.query.filter_by(email=email).first()
+        # 从客户端注册表读取已缓存的API设置
+        api_key, api_secret = get_client_registry().get_credentials(email)
         
-        if api_setting and api_setting.api_key and api_setting.api_secret:
+        if api_key and api_secret:
             log_info(f"找到子账号 {email} 的API凭证")
-            return api_setting.api_key, api_setting.api_secret
+            return api_key, api_secret
         else:
             log_warning(f"未找到子账号 {email} 的API凭证")
             return None, None
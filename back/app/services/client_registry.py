@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+子账号API客户端注册表模块
+
+集中管理子账号API凭证和 BinanceClient 实例，避免每个请求、每个子账号都查询一次数据库、
+重复校验密钥格式并新建客户端。
+
+说明:
+1. 一次查询加载全部子账号API设置，加载时完成格式校验
+2. 客户端按子账号邮箱缓存，首次使用时创建，之后复用(包括其时间偏移量)
+3. 凭证每隔 CLIENT_REGISTRY_TTL 秒重新加载一次，以便获取其他进程写入的修改
+4. /subaccounts/api-keys 的新增、修改、删除接口会调用 invalidate 立即使对应缓存失效
+"""
+
+import logging
+import re
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9]+$')
+
+
+class CredentialEntry:
+    """
+    单个子账号的API凭证
+    """
+
+    __slots__ = ('email', 'api_key', 'api_secret', 'error')
+
+    def __init__(self, email, api_key, api_secret):
+        self.email = email
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.error = validate_credentials(api_key, api_secret)
+
+    @property
+    def valid(self):
+        return self.error is None
+
+
+def validate_credentials(api_key, api_secret):
+    """
+    校验API密钥格式
+
+    返回:
+    - str: 格式无效时的原因，有效时返回None
+    """
+    api_key = (api_key or '').strip()
+    api_secret = (api_secret or '').strip()
+
+    if len(api_key) < 10:
+        return 'API密钥格式无效（长度不足）'
+    if len(api_secret) < 10:
+        return 'API密钥Secret格式无效（长度不足）'
+    if not KEY_PATTERN.match(api_key):
+        return 'API密钥格式无效（包含非法字符）'
+    if not KEY_PATTERN.match(api_secret):
+        return 'API密钥Secret格式无效（包含非法字符）'
+    return None
+
+
+class ClientRegistry:
+    """
+    子账号API凭证和客户端缓存，进程内共享一个实例
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+
+        self._entries = {}
+        self._clients = {}
+        self._loaded_at = 0
+        self._lock = threading.RLock()
+
+    def get_credentials(self, email):
+        """
+        获取子账号API凭证(未经格式校验的原始值)
+
+        返回:
+        - (api_key, api_secret)，未配置时为 (None, None)
+        """
+        entry = self._entry(email)
+        if entry is None:
+            return None, None
+        return entry.api_key, entry.api_secret
+
+    def has_credentials(self, email):
+        """子账号是否已配置API密钥"""
+        return self._entry(email) is not None
+
+    def get_client(self, email):
+        """
+        获取子账号的 BinanceClient
+
+        返回:
+        - BinanceClient 实例，未配置API密钥或密钥格式无效时返回None
+        """
+        with self._lock:
+            client = self._clients.get(email)
+            if client is not None and not self._expired():
+                return client
+
+            entry = self._entry(email)
+            if entry is None:
+                logger.error(f"未找到子账号 {email} 的API设置或API设置不完整，无法使用子账号API")
+                return None
+            if not entry.valid:
+                logger.error(f"子账号 {email} 的{entry.error}")
+                return None
+
+            client = self._clients.get(email)
+            if client is None:
+                from app.services.binance_client import BinanceClient
+                client = BinanceClient(entry.api_key.strip(), entry.api_secret.strip())
+                client.is_subaccount = True  # 标记这是子账号API客户端
+                client.subaccount_email = email  # 记录子账号邮箱
+                self._clients[email] = client
+            return client
+
+    def invalidate(self, email=None):
+        """
+        使缓存失效，下次访问时重新加载凭证
+
+        参数:
+        - email: 子账号邮箱，为空时清空全部客户端
+        """
+        with self._lock:
+            if email is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(email, None)
+            self._loaded_at = 0
+        logger.info(f"子账号API客户端缓存已失效: {email or '全部'}")
+
+    def status(self):
+        """返回缓存状态"""
+        with self._lock:
+            return {
+                'credentials': len(self._entries),
+                'invalid': sorted(email for email, entry in self._entries.items() if not entry.valid),
+                'clients': len(self._clients),
+                'age_seconds': round(time.time() - self._loaded_at, 1) if self._loaded_at else None
+            }
+
+    def _expired(self):
+        return time.time() - self._loaded_at > self.ttl
+
+    def _entry(self, email):
+        if not email:
+            return None
+        with self._lock:
+            if self._expired():
+                self._load()
+            return self._entries.get(email)
+
+    def _load(self):
+        from app.models.account import SubAccountAPISettings
+
+        entries = {}
+        for setting in SubAccountAPISettings.query.all():
+            if setting.email and setting.api_key and setting.api_secret:
+                entries[setting.email] = CredentialEntry(setting.email, setting.api_key, setting.api_secret)
+
+        # 凭证已变化的客户端需要重新创建
+        for email, client in list(self._clients.items()):
+            entry = entries.get(email)
+            if entry is None or not entry.valid or \
+                    (client.api_key, client.api_secret) != (entry.api_key.strip(), entry.api_secret.strip()):
+                self._clients.pop(email, None)
+
+        self._entries = entries
+        self._loaded_at = time.time()
+        logger.info(f"已加载子账号API凭证 {len(entries)} 个")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_client_registry():
+    """
+    获取进程级共享的子账号客户端注册表，首次调用时读取应用配置
+    """
+    global _registry
+
+    if _registry is not None:
+        return _registry
+
+    with _registry_lock:
+        if _registry is None:
+            ttl = DEFAULT_TTL
+            if has_app_context():
+                ttl = current_app.config.get('CLIENT_REGISTRY_TTL', DEFAULT_TTL)
+            _registry = ClientRegistry(ttl=ttl)
+        return _registry
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+手续费日汇总模块
+
+手续费统计接口不再每次对 fee_records 全表分组，而是读取按 日期 x 子账号 x 手续费资产 x 来源 累计的 FeeRollup。
+
+说明:
+1. 写入手续费记录统一通过 record_fees，在同一事务内累加到汇总表，提交后两者保持一致
+2. 汇总日期取 FeeRecord.trade_time 的日期，与原来按 date(trade_time) 分组的结果相同
+3. 汇总表为空而手续费记录不为空时(升级后首次启动)自动重建；数据修复或补录后可执行
+   flask rebuild-fee-rollups [--email 邮箱] [--start YYYY-MM-DD] [--end YYYY-MM-DD] 重建
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, func, insert, literal, select
+
+from app.models import db
+from app.models.trading import FeeRecord, FeeRollup
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_KEY = ['day', 'email', 'fee_asset', 'source']
+
+
+def record_fees(rows):
+    """
+    写入手续费记录并累加到日汇总，不提交事务
+
+    参数:
+    - rows: FeeRecord 字段字典列表
+    """
+    if not rows:
+        return
+    db.session.execute(insert(FeeRecord), rows)
+    apply_to_rollups(rows)
+
+
+def apply_to_rollups(rows):
+    """
+    将手续费记录累加到日汇总，不提交事务
+
+    参数:
+    - rows: 包含 email / fee_asset / source / fee_amount / trade_time 的字典列表
+    """
+    totals = defaultdict(lambda: [0.0, 0])
+    for row in rows:
+        key = (row['trade_time'].date(), row['email'], row['fee_asset'], row['source'])
+        totals[key][0] += row['fee_amount'] or 0
+        totals[key][1] += 1
+    if not totals:
+        return
+
+    now = datetime.utcnow()
+    rollups = [
+        dict(zip(ROLLUP_KEY, key), fee_amount=amount, record_count=count, updated_at=now)
+        for key, (amount, count) in totals.items()
+    ]
+
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        statement = dialect_insert(FeeRollup)
+        statement = statement.on_conflict_do_update(
+            index_elements=ROLLUP_KEY,
+            set_={
+                'fee_amount': FeeRollup.fee_amount + statement.excluded.fee_amount,
+                'record_count': FeeRollup.record_count + statement.excluded.record_count,
+                'updated_at': statement.excluded.updated_at
+            }
+        )
+        db.session.execute(statement, rollups)
+        return
+
+    # 其他数据库: 逐条查询后更新或插入
+    for rollup in rollups:
+        existing = FeeRollup.query.filter_by(**{column: rollup[column] for column in ROLLUP_KEY}).first()
+        if existing:
+            existing.fee_amount += rollup['fee_amount']
+            existing.record_count += rollup['record_count']
+        else:
+            db.session.add(FeeRollup(**rollup))
+    db.session.flush()
+
+
+def rollup_query(email=None, source=None, start_date=None, end_date=None):
+    """
+    构建按条件过滤的日汇总查询
+
+    参数:
+    - email: 子账号邮箱(可选)
+    - source: 手续费来源(可选)
+    - start_date: 开始日期(可选，date类型，包含)
+    - end_date: 结束日期(可选，date类型，包含)
+    """
+    query = FeeRollup.query
+    if email:
+        query = query.filter(FeeRollup.email == email)
+    if source:
+        query = query.filter(FeeRollup.source == source)
+    if start_date:
+        query = query.filter(FeeRollup.day >= start_date)
+    if end_date:
+        query = query.filter(FeeRollup.day <= end_date)
+    return query
+
+
+def summarize_by_asset(email=None, source=None, start_date=None, end_date=None):
+    """
+    按手续费资产汇总
+
+    返回:
+    - dict: 资产 -> 手续费合计
+    """
+    rows = rollup_query(email, source, start_date, end_date).with_entities(
+        FeeRollup.fee_asset,
+        func.sum(FeeRollup.fee_amount)
+    ).group_by(FeeRollup.fee_asset).all()
+    return {asset: float(total or 0) for asset, total in rows}
+
+
+def rebuild_rollups(email=None, start_date=None, end_date=None):
+    """
+    根据手续费记录重建日汇总，并提交事务
+
+    参数:
+    - email: 只重建该子账号(可选)
+    - start_date: 开始日期(可选，date类型，包含)
+    - end_date: 结束日期(可选，date类型，包含)
+
+    返回:
+    - int: 重建后的汇总行数
+    """
+    day = func.date(FeeRecord.trade_time)
+    conditions = []
+    rollup_conditions = []
+    if email:
+        conditions.append(FeeRecord.email == email)
+        rollup_conditions.append(FeeRollup.email == email)
+    if start_date:
+        conditions.append(FeeRecord.trade_time >= datetime.combine(start_date, datetime.min.time()))
+        rollup_conditions.append(FeeRollup.day >= start_date)
+    if end_date:
+        conditions.append(FeeRecord.trade_time < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+        rollup_conditions.append(FeeRollup.day <= end_date)
+
+    source = select(
+        day,
+        FeeRecord.email,
+        FeeRecord.fee_asset,
+        FeeRecord.source,
+        func.sum(FeeRecord.fee_amount),
+        func.count(),
+        literal(datetime.utcnow())
+    ).where(*conditions).group_by(day, FeeRecord.email, FeeRecord.fee_asset, FeeRecord.source)
+
+    try:
+        db.session.execute(delete(FeeRollup).where(*rollup_conditions))
+        result = db.session.execute(insert(FeeRollup).from_select(
+            ROLLUP_KEY + ['fee_amount', 'record_count', 'updated_at'], source
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"手续费日汇总已重建: {result.rowcount} 行")
+    return result.rowcount
+
+
+def init_app(app):
+    """
+    注册重建命令，汇总表为空时根据已有手续费记录重建
+    """
+    @app.cli.command('rebuild-fee-rollups')
+    @click.option('--email', default=None, help='只重建指定子账号')
+    @click.option('--start', 'start_date', default=None, help='开始日期 YYYY-MM-DD')
+    @click.option('--end', 'end_date', default=None, help='结束日期 YYYY-MM-DD')
+    def rebuild_fee_rollups_command(email, start_date, end_date):
+        """根据手续费记录重建手续费日汇总"""
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+        count = rebuild_rollups(email, start_date, end_date)
+        click.echo(f"手续费日汇总已重建: {count} 行")
+
+    with app.app_context():
+        try:
+            if db.session.query(FeeRollup.id).first() is None and db.session.query(FeeRecord.id).first() is not None:
+                rebuild_rollups()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"重建手续费日汇总失败: {e}")
@@ -0,0 +1,848 @@
+# -*- coding: utf-8 -*-
+"""
+网格订单监控调度模块
+
+用一个调度线程和固定大小的工作线程池监控所有运行中网格的挂单，替代"每个网格一个线程、每对订单sleep等待"的方式。
+
+说明:
+1. 所有网格按下一次检查时间放入同一个优先队列(堆)，调度线程只在最早的到期时间唤醒
+2. 每次检查按网格批量获取订单状态: 用户数据流在线时直接读取推送缓存；
+   否则一次 openOrders 获取仍在挂单的订单，已不在挂单列表中的订单用一次 allOrders 获取最终状态
+3. 每对订单有独立的截止时间: 普通订单下单后15秒，出现拒绝/过期/取消等错误状态后5秒；
+   截止时间到达时取消未成交订单并按剩余数量市价补齐，不再等待其他订单对
+4. 订单对全部处理完成后网格状态更新为COMPLETED；网格被手动关闭(CLOSED)后停止监控
+5. 撤单、市价补单等操作由调用方通过 actions 传入，本模块只负责调度和状态判断
+6. 监控状态(订单对、截止时间、补单进度)保存在 GridTrading.monitor_state 中，每次检查时续约 monitor_owner；
+   进程重启或监控进程退出(续约超过 GRID_MONITOR_LEASE_TTL 秒)后，RUNNING 网格由启动的进程接管，
+   按(子账号, 交易对)一次 openOrders 核对订单状态后继续监控
+7. 市价补单前后分别记录进度；接管时发现补单已发出但结果未记录的订单不再补单，避免重复下单
+8. 撤单后订单仍在挂单、或市价补单失败时不标记完成，错误写入监控状态，error_timeout 秒后重试，
+   超过 MAX_REBALANCE_ATTEMPTS 次后放弃并将网格标记为ERROR
+9. 没有订单对的网格不会被判定为完成: 接管时无法从监控状态和订单历史恢复订单对的网格，按网格价格匹配
+   当前挂单恢复；挂单查询失败时暂不接管，仍无法恢复时标记为ERROR
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+
+from app.services.user_stream import get_user_stream_manager
+
+logger = logging.getLogger(__name__)
+
+# 默认配置
+DEFAULT_WORKERS = 4
+DEFAULT_POLL_INTERVAL = 3
+DEFAULT_ORDER_TIMEOUT = 15
+DEFAULT_ERROR_TIMEOUT = 5
+DEFAULT_LEASE_TTL = 30
+
+# 单个订单撤单/市价补单的最多尝试次数
+MAX_REBALANCE_ATTEMPTS = 5
+
+# 订单状态分类
+FILLED_STATUSES = ('FILLED',)
+OPEN_STATUSES = ('NEW', 'PARTIALLY_FILLED')
+ERROR_STATUSES = ('REJECTED', 'EXPIRED', 'CANCELED', 'EXPIRED_IN_MATCH')
+
+
+class WatchedOrder:
+    """
+    被监控的单个网格订单
+    """
+
+    __slots__ = ('order_id', 'side', 'amount', 'status', 'executed_qty', 'compensating', 'compensated',
+                 'attempts', 'error')
+
+    def __init__(self, order_id, side, amount, status='NEW', executed_qty=0.0, compensating=False, compensated=False,
+                 attempts=0, error=None):
+        self.order_id = str(order_id)
+        self.side = side
+        self.amount = float(amount or 0)
+        self.status = status or 'NEW'
+        self.executed_qty = float(executed_qty or 0)
+        # 市价补单: 已开始(下单前记录) / 已完成
+        self.compensating = compensating
+        self.compensated = compensated
+        # 撤单/补单失败的次数和最近一次错误
+        self.attempts = int(attempts or 0)
+        self.error = error
+
+    def to_state(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(**{key: value for key, value in state.items() if key in cls.__slots__})
+
+    @property
+    def filled(self):
+        return self.status in FILLED_STATUSES
+
+    @property
+    def errored(self):
+        return self.status in ERROR_STATUSES
+
+    @property
+    def remaining(self):
+        return max(0.0, self.amount - self.executed_qty)
+
+    @property
+    def unresolved(self):
+        """放弃重试后仍未成交也未补齐"""
+        return self.error is not None and not self.filled and not self.compensated
+
+
+class WatchedPair:
+    """
+    一对(或单个)网格订单及其处理截止时间
+    """
+
+    __slots__ = ('orders', 'deadline', 'error_deadline', 'done')
+
+    def __init__(self, orders, deadline, error_deadline=None, done=False):
+        self.orders = orders
+        self.deadline = deadline
+        self.error_deadline = error_deadline
+        self.done = done
+
+    def to_state(self):
+        return {
+            'orders': [order.to_state() for order in self.orders],
+            'deadline': self.deadline,
+            'error_deadline': self.error_deadline,
+            'done': self.done
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(
+            [WatchedOrder.from_state(order) for order in state.get('orders') or []],
+            state.get('deadline') or time.time(),
+            state.get('error_deadline'),
+            bool(state.get('done'))
+        )
+
+
+class GridWatch:
+    """
+    单个网格的监控状态
+    """
+
+    def __init__(self, grid_id, client, email, symbol, pairs, actions):
+        self.grid_id = grid_id
+        self.client = client
+        self.email = email
+        self.symbol = symbol
+        self.pairs = pairs
+        self.actions = actions
+
+    def orders(self):
+        for pair in self.pairs:
+            if not pair.done:
+                for order in pair.orders:
+                    yield order
+
+    def next_deadline(self):
+        deadlines = [min(pair.deadline, pair.error_deadline or pair.deadline) for pair in self.pairs if not pair.done]
+        return min(deadlines) if deadlines else None
+
+    def to_state(self):
+        return json.dumps({'pairs': [pair.to_state() for pair in self.pairs]})
+
+    def unresolved_error(self):
+        """返回放弃补齐的订单错误汇总，没有时返回None"""
+        errors = [f"{order.order_id}: {order.error}" for pair in self.pairs for order in pair.orders if order.unresolved]
+        return f"补齐失败 {'; '.join(errors)}" if errors else None
+
+
+class GridMonitor:
+    """
+    网格订单监控调度器，进程内共享一个实例
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 order_timeout=DEFAULT_ORDER_TIMEOUT, error_timeout=DEFAULT_ERROR_TIMEOUT,
+                 lease_ttl=DEFAULT_LEASE_TTL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.order_timeout = order_timeout
+        self.error_timeout = error_timeout
+        self.lease_ttl = lease_ttl
+        # 本进程的监控标识，写入 GridTrading.monitor_owner
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._app = None
+        self._heap = []
+        self._counter = itertools.count()
+        self._grids = {}
+        self._condition = threading.Condition()
+        self._executor = None
+        self._scheduler = None
+
+    # ---------- 对外接口 ----------
+
+    def watch(self, grid_id, client, email, symbol, order_pairs, actions):
+        """
+        开始监控一个网格的订单
+
+        参数:
+        - grid_id: 网格ID
+        - client: 子账号的 BinanceClient 实例
+        - email: 子账号邮箱
+        - symbol: 交易对
+        - order_pairs: 订单对列表，每项为包含1个或2个订单字典的列表(需包含 order_id / side / amount)
+        - actions: 订单操作函数字典，包含 cancel_order / market_buy / market_sell / check_order_status
+
+        返回:
+        - bool: 是否已加入监控，网格已由其他进程监控时返回False
+        """
+        now = time.time()
+        pairs = []
+        for order_pair in order_pairs:
+            orders = [
+                WatchedOrder(order.get('order_id'), order.get('side'), order.get('amount'),
+                             order.get('status'), order.get('executed_qty'))
+                for order in order_pair
+                if order.get('order_id')  # 下单失败的订单没有订单号，不参与监控
+            ]
+            if orders:
+                pairs.append(WatchedPair(orders, now + self.order_timeout))
+
+        watch = GridWatch(grid_id, client, email, symbol, pairs, actions)
+        if not self._save_state(watch, claim=True, new=True):
+            logger.warning(f"网格已由其他进程监控或不是RUNNING状态，不加入监控: grid_id={grid_id}")
+            return False
+
+        with self._condition:
+            self._ensure_started()
+            self._grids[grid_id] = watch
+            self._schedule(grid_id, now)
+
+        logger.info(f"网格加入监控队列: grid_id={grid_id}, 订单对数量={len(pairs)}")
+        return True
+
+    def unwatch(self, grid_id):
+        """停止监控指定网格"""
+        with self._condition:
+            return self._grids.pop(grid_id, None) is not None
+
+    def stats(self):
+        """返回当前监控状态"""
+        with self._condition:
+            return {
+                'grids': len(self._grids),
+                'pending_pairs': sum(
+                    1 for watch in self._grids.values() for pair in watch.pairs if not pair.done),
+                'queued': len(self._heap),
+                'workers': self.workers,
+                'owner': self.owner
+            }
+
+    def start(self, app):
+        """
+        绑定应用并启动调度，立即接管无人监控的RUNNING网格，之后每 lease_ttl 秒检查一次
+        """
+        with self._condition:
+            self._app = app
+            self._ensure_started()
+            self._schedule(None, time.time())
+
+    # ---------- 调度 ----------
+
+    def _ensure_started(self):
+        # 工作线程在 start() 绑定的应用或首次提交监控的应用上下文中运行
+        if self._app is None:
+            self._app = current_app._get_current_object()
+
+        if self._scheduler is not None and self._scheduler.is_alive():
+            return
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='grid-monitor')
+        self._scheduler = threading.Thread(target=self._run, name='grid-monitor-scheduler', daemon=True)
+        self._scheduler.start()
+        logger.info(f"网格监控调度器已启动，工作线程数: {self.workers}")
+
+    def _schedule(self, grid_id, when):
+        heapq.heappush(self._heap, (when, next(self._counter), grid_id))
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+
+                when, _, grid_id = self._heap[0]
+                delay = when - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+                if grid_id is None:
+                    # 接管检查
+                    self._executor.submit(self._adopt)
+                    self._schedule(None, time.time() + self.lease_ttl)
+                    continue
+                watch = self._grids.get(grid_id)
+
+            if watch is not None:
+                self._executor.submit(self._process, watch)
+
+    def _process(self, watch):
+        with self._app.app_context():
+            try:
+                finished = self._check_grid(watch)
+            except Exception as e:
+                logger.error(f"网格订单监控异常: grid_id={watch.grid_id}, 错误={str(e)}", exc_info=True)
+                self._finish_grid(watch, error=str(e))
+                return
+
+            if finished:
+                self._finish_grid(watch, error=watch.unresolved_error())
+                return
+
+            next_check = time.time() + self.poll_interval
+            deadline = watch.next_deadline()
+            if deadline is not None:
+                next_check = min(next_check, deadline)
+
+            with self._condition:
+                if watch.grid_id in self._grids:
+                    self._schedule(watch.grid_id, next_check)
+
+    # ---------- 检查与补齐 ----------
+
+    def _check_grid(self, watch):
+        """
+        检查网格所有未完成订单对，返回是否已全部处理完成
+        """
+        from app.models import GridTrading
+
+        grid = GridTrading.query.filter_by(grid_id=watch.grid_id).first()
+        if grid is not None and grid.status == 'CLOSED':
+            logger.info(f"网格已关闭，停止监控: grid_id={watch.grid_id}")
+            self.unwatch(watch.grid_id)
+            self._release(watch.grid_id)
+            return False
+
+        if not watch.pairs:
+            # 没有订单对时无法判断订单是否完成，不能标记为COMPLETED
+            self._finish_grid(watch, error="没有可监控的网格订单")
+            return False
+
+        # 续约，网格已被其他进程接管时停止监控
+        if not self._save_state(watch):
+            logger.warning(f"网格已由其他进程监控，停止本进程监控: grid_id={watch.grid_id}")
+            self.unwatch(watch.grid_id)
+            return False
+
+        changed = self._refresh_statuses(watch)
+
+        now = time.time()
+        for pair in watch.pairs:
+            if pair.done:
+                continue
+
+            if all(order.filled for order in pair.orders):
+                pair.done = True
+                changed = True
+                continue
+
+            if pair.error_deadline is None and any(order.errored for order in pair.orders):
+                pair.error_deadline = now + self.error_timeout
+                changed = True
+                logger.info(f"检测到错误状态订单，{self.error_timeout}秒后补齐: grid_id={watch.grid_id}")
+
+            deadline = min(pair.deadline, pair.error_deadline or pair.deadline)
+            if now >= deadline:
+                if self._rebalance(watch, pair):
+                    pair.done = True
+                else:
+                    pair.deadline = pair.error_deadline = now + self.error_timeout
+                changed = True
+
+        if changed:
+            self._save_state(watch)
+        return all(pair.done for pair in watch.pairs)
+
+    def _refresh_statuses(self, watch, open_orders=None):
+        """
+        批量刷新网格订单状态: 一次openOrders + 一次allOrders，返回是否有订单状态变化
+
+        参数:
+        - open_orders: 已查询的该交易对挂单列表(可选)，多个网格共用同一交易对时只查询一次
+        """
+        pending = {order.order_id: order for order in watch.orders() if not order.filled and not order.errored}
+        if not pending:
+            return False
+
+        streams = get_user_stream_manager()
+        if open_orders is None and streams.is_live(watch.email, 'um'):
+            # 用户数据流在线时直接读取推送缓存，没有推送的订单仍为挂单状态
+            updates = {}
+            for order_id in pending:
+                cached = streams.store.get(watch.email, watch.symbol, order_id)
+                if cached:
+                    updates[order_id] = cached
+        else:
+            updates = self._fetch_statuses(watch, pending, open_orders)
+            if updates is None:
+                return False
+
+        changed = []
+        for order_id, item in updates.items():
+            order = pending[order_id]
+            status = item.get('status') or order.status
+            executed_qty = float(item.get('executedQty', order.executed_qty) or 0)
+            if status != order.status or executed_qty != order.executed_qty:
+                order.status = status
+                order.executed_qty = executed_qty
+                changed.append(order)
+
+        if changed:
+            self._save_statuses(changed)
+        return bool(changed)
+
+    def _fetch_statuses(self, watch, pending, open_orders=None):
+        """
+        通过REST批量获取订单状态，查询失败时返回None
+        """
+        if open_orders is None:
+            open_orders = self._fetch_open_orders(watch.client, watch.symbol)
+            if open_orders is None:
+                logger.warning(f"批量查询挂单失败: grid_id={watch.grid_id}")
+                return None
+
+        updates = {}
+        open_ids = set()
+        for item in open_orders:
+            order_id = str(item.get('orderId'))
+            if order_id in pending:
+                open_ids.add(order_id)
+                updates[order_id] = item
+
+        closed_ids = [order_id for order_id in pending if order_id not in open_ids]
+        if closed_ids:
+            updates.update(self._fetch_closed_orders(watch, closed_ids))
+
+        return updates
+
+    def _fetch_open_orders(self, client, symbol):
+        """查询交易对当前挂单，失败时返回None"""
+        result = client._send_request('GET', '/fapi/v1/openOrders', signed=True, params={'symbol': symbol})
+        if not result.get('success'):
+            logger.warning(f"查询挂单失败: symbol={symbol}, 错误={result.get('error')}")
+            return None
+        return result.get('data') or []
+
+    def _fetch_closed_orders(self, watch, order_ids):
+        """
+        获取已不在挂单列表中的订单最终状态
+        """
+        client = watch.client
+        found = {}
+
+        try:
+            from_id = min(int(order_id) for order_id in order_ids)
+        except ValueError:
+            from_id = None
+
+        if from_id is not None:
+            result = client._send_request('GET', '/fapi/v1/allOrders', signed=True, params={
+                'symbol': watch.symbol,
+                'orderId': from_id,
+                'limit': 1000
+            })
+            if result.get('success'):
+                wanted = set(order_ids)
+                for item in result.get('data') or []:
+                    order_id = str(item.get('orderId'))
+                    if order_id in wanted:
+                        found[order_id] = item
+
+        # 超出allOrders返回范围的订单逐个查询
+        check_order_status = watch.actions.get('check_order_status')
+        for order_id in order_ids:
+            if order_id not in found and check_order_status:
+                status = check_order_status(client, watch.symbol, order_id)
+                if status.get('status') and status.get('status') != 'ERROR':
+                    found[order_id] = status
+
+        return found
+
+    def _save_statuses(self, orders):
+        """将订单最新状态写回订单历史"""
+        from app.models import db, OrderHistory
+
+        try:
+            records = OrderHistory.query.filter(
+                OrderHistory.order_id.in_([order.order_id for order in orders])
+            ).all()
+            by_id = {order.order_id: order for order in orders}
+            now = datetime.utcnow()
+            for record in records:
+                order = by_id[record.order_id]
+                record.status = order.status
+                record.executed_qty = order.executed_qty
+                record.last_checked = now
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"更新订单状态失败: {str(e)}")
+
+    def _rebalance(self, watch, pair):
+        """
+        截止时间到达: 取消未成交订单，并按剩余数量市价开仓补齐
+
+        返回:
+        - bool: 订单对是否处理完成；撤单后订单仍在挂单或补单失败时返回False，稍后重试
+        """
+        actions = watch.actions
+        handled = True
+        for order in pair.orders:
+            if order.filled:
+                continue
+
+            if order.status in OPEN_STATUSES:
+                logger.info(f"订单未在截止时间内成交，取消并市价补齐: grid_id={watch.grid_id}, orderId={order.order_id}")
+                cancel_result = actions['cancel_order'](watch.client, watch.symbol, order.order_id)
+
+                # 撤单前可能又有部分成交，以撤单后的状态为准；撤单失败(如订单已成交)时同样据此判断
+                status = actions['check_order_status'](watch.client, watch.symbol, order.order_id)
+                if status.get('status') and status.get('status') != 'ERROR':
+                    order.status = status.get('status')
+                    order.executed_qty = float(status.get('executedQty', order.executed_qty) or 0)
+                    if order.filled:
+                        continue
+
+                if order.status in OPEN_STATUSES:
+                    # 限价单可能仍在挂单，此时市价补单会重复成交
+                    error = cancel_result.get('error') if not cancel_result.get('success') else '撤单后订单状态未知'
+                    handled = self._rebalance_failed(watch, order, f"撤单失败: {error}") and handled
+                    continue
+
+            remaining = order.remaining
+            if remaining <= 0 or order.compensated:
+                continue
+
+            # 下单前记录补单进度，进程在下单过程中退出时接管方不会重复补单
+            order.compensating = True
+            self._save_state(watch)
+
+            if order.side == 'BUY':
+                result = actions['market_buy'](watch.client, watch.email, watch.symbol, remaining, watch.grid_id)
+            else:
+                result = actions['market_sell'](watch.client, watch.email, watch.symbol, remaining, watch.grid_id)
+            logger.info(f"市价补齐结果: grid_id={watch.grid_id}, side={order.side}, 数量={remaining}, 成功={result.get('success')}")
+
+            # 补单请求已返回结果，不再属于结果未知的补单
+            order.compensating = False
+            if result.get('success'):
+                order.compensated = True
+                order.error = None
+            else:
+                handled = self._rebalance_failed(watch, order, f"市价补单失败: {result.get('error')}") and handled
+            self._save_state(watch)
+
+        return handled
+
+    def _rebalance_failed(self, watch, order, error):
+        """
+        记录撤单/补单失败，返回是否已放弃重试
+        """
+        order.attempts += 1
+        order.error = str(error)[:200]
+        if order.attempts >= MAX_REBALANCE_ATTEMPTS:
+            logger.error(f"网格订单补齐失败次数过多，放弃补齐，请人工核对持仓: grid_id={watch.grid_id}, "
+                         f"orderId={order.order_id}, 错误={order.error}")
+            return True
+        logger.warning(f"网格订单补齐失败，{self.error_timeout}秒后重试({order.attempts}/{MAX_REBALANCE_ATTEMPTS}): "
+                       f"grid_id={watch.grid_id}, orderId={order.order_id}, 错误={order.error}")
+        return False
+
+    # ---------- 状态持久化与接管 ----------
+
+    def _lease_condition(self, claim, new=False):
+        """
+        续约/接管条件: 续约只能由当前监控进程进行；接管要求原监控进程超过 lease_ttl 未续约，
+        或网格没有监控进程且超过 lease_ttl 未更新(避免接管正在提交、尚未加入监控的新网格)；
+        提交网格的进程开始监控(new)时，没有监控进程的网格可以直接认领
+        """
+        from sqlalchemy import and_, or_
+        from app.models import GridTrading
+
+        if not claim:
+            return GridTrading.monitor_owner == self.owner
+        if new:
+            return or_(GridTrading.monitor_owner == self.owner, GridTrading.monitor_owner.is_(None))
+        expired = datetime.utcnow() - timedelta(seconds=self.lease_ttl)
+        return or_(
+            GridTrading.monitor_owner == self.owner,
+            and_(GridTrading.monitor_owner.isnot(None), GridTrading.monitor_heartbeat < expired),
+            and_(GridTrading.monitor_owner.is_(None), GridTrading.updated_at < expired)
+        )
+
+    def _save_state(self, watch, claim=False, new=False):
+        """
+        保存监控状态并续约，使用独立会话提交，不影响调用方会话
+
+        参数:
+        - claim: 是否为首次监控/接管，为False时只有当前监控进程可以写入
+        - new: 是否为提交网格后开始监控，见 _lease_condition
+
+        返回:
+        - bool: 本进程是否(仍)负责监控该网格；数据库异常时返回True，不中断监控
+        """
+        from sqlalchemy import update
+        from sqlalchemy.orm import Session
+        from app.models import db, GridTrading
+
+        values = {
+            'monitor_state': watch.to_state(),
+            'monitor_owner': self.owner,
+            'monitor_heartbeat': datetime.utcnow()
+        }
+        statement = update(GridTrading).where(
+            GridTrading.grid_id == watch.grid_id,
+            GridTrading.status == 'RUNNING',
+            self._lease_condition(claim, new)
+        ).values(**values)
+
+        try:
+            with Session(db.engine) as session:
+                result = session.execute(statement)
+                session.commit()
+                return result.rowcount > 0
+        except Exception as e:
+            logger.error(f"保存网格监控状态失败: grid_id={watch.grid_id}, 错误={str(e)}")
+            return True
+
+    def _release(self, grid_id):
+        """释放本进程对网格的监控"""
+        from sqlalchemy import update
+        from sqlalchemy.orm import Session
+        from app.models import db, GridTrading
+
+        try:
+            with Session(db.engine) as session:
+                session.execute(update(GridTrading).where(
+                    GridTrading.grid_id == grid_id,
+                    GridTrading.monitor_owner == self.owner
+                ).values(monitor_owner=None))
+                session.commit()
+        except Exception as e:
+            logger.error(f"释放网格监控失败: grid_id={grid_id}, 错误={str(e)}")
+
+    def _adopt(self):
+        """
+        接管无人监控的RUNNING网格(服务重启、原监控进程退出)，
+        按(子账号, 交易对)一次查询挂单核对订单状态后加入调度
+        """
+        from app.models import GridTrading
+        from app.services.record_writer import get_record_writer
+
+        with self._app.app_context():
+            try:
+                # 本进程缓冲中的订单记录先写入，旧网格据此恢复订单对
+                get_record_writer().flush()
+
+                with self._condition:
+                    watching = set(self._grids)
+                candidates = [
+                    grid for grid in GridTrading.query.filter(
+                        GridTrading.status == 'RUNNING',
+                        self._lease_condition(claim=True)
+                    ).all()
+                    if grid.grid_id not in watching
+                ]
+                if not candidates:
+                    return
+
+                claimed = []
+                grids = {grid.grid_id: grid for grid in candidates}
+                for grid in candidates:
+                    watch = self._restore_watch(grid)
+                    if watch is not None and self._save_state(watch, claim=True):
+                        claimed.append(watch)
+
+                groups = {}
+                for watch in claimed:
+                    groups.setdefault((watch.email, watch.symbol), []).append(watch)
+
+                watches = []
+                for (email, symbol), group in groups.items():
+                    open_orders = self._fetch_open_orders(group[0].client, symbol)
+                    # 已归属于其他网格的订单不参与按价格匹配
+                    known = {order.order_id for watch in group for pair in watch.pairs for order in pair.orders}
+                    for watch in group:
+                        if not watch.pairs:
+                            if open_orders is None:
+                                # 无法核对挂单，保持RUNNING并释放，下次接管检查时重试
+                                logger.warning(f"网格没有可恢复的订单对且挂单查询失败，暂不接管: grid_id={watch.grid_id}")
+                                self._release(watch.grid_id)
+                                continue
+                            watch.pairs = self._pairs_from_open_orders(grids[watch.grid_id], open_orders, known)
+                            if not watch.pairs:
+                                self._finish_grid(watch, error="无法恢复订单对: 没有监控状态、订单历史或匹配的挂单")
+                                continue
+                            known.update(order.order_id for pair in watch.pairs for order in pair.orders)
+                            logger.warning(f"网格根据挂单恢复了 {len(watch.pairs)} 个订单: grid_id={watch.grid_id}")
+                        elif open_orders is not None:
+                            self._refresh_statuses(watch, open_orders)
+                        self._save_state(watch)
+                        watches.append(watch)
+
+                now = time.time()
+                with self._condition:
+                    for watch in watches:
+                        if watch.grid_id not in self._grids:
+                            self._grids[watch.grid_id] = watch
+                            self._schedule(watch.grid_id, now)
+
+                if watches:
+                    logger.info(f"已接管RUNNING网格监控: {[watch.grid_id for watch in watches]}")
+            except Exception as e:
+                logger.error(f"接管网格监控失败: {str(e)}", exc_info=True)
+
+    def _restore_watch(self, grid):
+        """
+        根据保存的监控状态重建 GridWatch；没有保存状态的网格根据订单历史重建订单对
+        """
+        from app.models import OrderHistory
+        from app.services.binance_client import get_client_by_email
+        from app.api.trading import GRID_MONITOR_ACTIONS
+
+        client = get_client_by_email(grid.email)
+        if client is None:
+            logger.error(f"无法获取子账号客户端，暂不接管网格: grid_id={grid.grid_id}, email={grid.email}")
+            return None
+
+        pairs = None
+        if grid.monitor_state:
+            try:
+                state = json.loads(grid.monitor_state)
+                pairs = [WatchedPair.from_state(pair) for pair in state.get('pairs') or []]
+            except (TypeError, ValueError, KeyError) as e:
+                logger.warning(f"网格监控状态无法解析，根据订单历史恢复: grid_id={grid.grid_id}, 错误={str(e)}")
+
+        if pairs is None:
+            records = OrderHistory.query.filter(
+                OrderHistory.grid_id == grid.grid_id,
+                OrderHistory.order_type != 'MARKET'
+            ).order_by(OrderHistory.id).all()
+            orders = [
+                WatchedOrder(record.order_id, record.side, record.amount, record.status, record.executed_qty)
+                for record in records
+            ]
+            size = 2 if grid.is_bilateral else 1
+            deadline = time.time() + self.order_timeout
+            pairs = [WatchedPair(orders[i:i + size], deadline) for i in range(0, len(orders), size)]
+
+        for pair in pairs:
+            for order in pair.orders:
+                if order.compensating and not order.compensated:
+                    # 补单已发出但结果未记录，无法确认是否成交，不再重复补单
+                    logger.warning(f"网格订单补单结果未知，跳过补单，请人工核对持仓: "
+                                   f"grid_id={grid.grid_id}, orderId={order.order_id}, side={order.side}")
+                    order.compensated = True
+
+        return GridWatch(grid.grid_id, client, grid.email, grid.symbol, pairs, GRID_MONITOR_ACTIONS)
+
+    def _pairs_from_open_orders(self, grid, open_orders, known):
+        """
+        没有监控状态和订单历史的网格: 将价格与网格档位一致、且未归属其他网格的挂单恢复为单订单的订单对
+        """
+        try:
+            prices = [float(price) for price in json.loads(grid.grid_prices or '[]')]
+        except (TypeError, ValueError):
+            prices = []
+        if not prices:
+            return []
+
+        def on_grid(price):
+            return any(abs(price - level) <= max(abs(level), 1.0) * 1e-9 for level in prices)
+
+        deadline = time.time() + self.order_timeout
+        pairs = []
+        for item in open_orders:
+            order_id = str(item.get('orderId'))
+            if order_id in known or item.get('type', 'LIMIT') != 'LIMIT' or not on_grid(float(item.get('price') or 0)):
+                continue
+            order = WatchedOrder(order_id, item.get('side'), item.get('origQty'), item.get('status'), item.get('executedQty'))
+            pairs.append(WatchedPair([order], deadline))
+        return pairs
+
+    def _finish_grid(self, watch, error=None):
+        """网格处理完成，更新网格状态"""
+        from app.models import db, GridTrading
+
+        self.unwatch(watch.grid_id)
+
+        try:
+            # 监控状态由独立会话写入，重新读取避免会话中的旧值覆盖
+            grid = GridTrading.query.populate_existing().filter_by(grid_id=watch.grid_id).first()
+            if grid is None:
+                return
+            if error:
+                grid.status = 'ERROR'
+                grid.close_reason = f"监控异常: {error}"[:100]
+            elif grid.status not in ('ERROR', 'CLOSED'):
+                grid.status = 'COMPLETED'
+            grid.monitor_state = watch.to_state()
+            grid.monitor_owner = None
+            db.session.commit()
+            logger.info(f"网格订单监控完成: grid_id={watch.grid_id}, 状态={grid.status}")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"更新网格状态失败: {str(e)}")
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_grid_monitor():
+    """
+    获取进程级共享的网格监控调度器，首次调用时读取应用配置
+    """
+    global _monitor
+
+    if _monitor is not None:
+        return _monitor
+
+    with _monitor_lock:
+        if _monitor is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'workers': config.get('GRID_MONITOR_WORKERS', DEFAULT_WORKERS),
+                    'poll_interval': config.get('GRID_MONITOR_POLL_INTERVAL', DEFAULT_POLL_INTERVAL),
+                    'order_timeout': config.get('GRID_ORDER_TIMEOUT', DEFAULT_ORDER_TIMEOUT),
+                    'error_timeout': config.get('GRID_ERROR_TIMEOUT', DEFAULT_ERROR_TIMEOUT),
+                    'lease_ttl': config.get('GRID_MONITOR_LEASE_TTL', DEFAULT_LEASE_TTL)
+                }
+            _monitor = GridMonitor(**options)
+        return _monitor
+
+
+def init_app(app):
+    """
+    启动网格监控调度器，接管上次运行遗留的RUNNING网格(GRID_MONITOR_RESUME 关闭时不接管)
+    """
+    if not app.config.get('GRID_MONITOR_RESUME', True):
+        return
+    with app.app_context():
+        get_grid_monitor().start(app)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+网格规划模块
+
+一次性计算网格的全部价格档位和每档数量，并按交易对规则校验，供创建网格和预览使用。
+
+说明:
+1. 支持等比(geometric，默认，与原 calculate_grid_prices 相同)和等差(arithmetic)两种价格分布
+2. 交易规则(tickSize / stepSize / minQty / maxQty / minNotional)只查询一次；价格按 tickSize 四舍五入，
+   数量按 stepSize 向下取整，取整在整数档位上进行，不逐档调用 format_price / format_quantity
+3. 每档数量可直接指定(single_amount)，或由 total_investment x leverage 平均分配到每个订单后按价格换算
+4. 不满足最小/最大数量、最小名义价值，或取整后与前一档价格重复的档位放入 rejected，不参与下单
+"""
+
+import logging
+import math
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+GRID_MODES = ('geometric', 'arithmetic')
+
+# 最多档位数，避免预览请求生成过大的响应
+MAX_GRID_LEVELS = 5000
+
+# 浮点误差容差，避免 0.3 / 0.1 = 2.9999999999999996 这类结果被向下取整少一档
+_EPSILON = 1e-9
+
+
+def _ladder(lower_price, upper_price, grid_num, mode):
+    """生成未取整的价格档位(包含上下限)"""
+    if mode == 'arithmetic':
+        step = (upper_price - lower_price) / (grid_num - 1)
+        return [lower_price + step * i for i in range(grid_num)]
+    ratio = (upper_price / lower_price) ** (1 / (grid_num - 1))
+    return [lower_price * ratio ** i for i in range(grid_num)]
+
+
+def _snap_prices(prices, tick_size):
+    """按价格步长四舍五入，返回 Decimal 列表；没有步长时保留8位小数"""
+    if not tick_size:
+        return [Decimal(str(round(price, 8))) for price in prices]
+    tick = float(tick_size)
+    return [int(round(price / tick)) * tick_size for price in prices]
+
+
+def _snap_quantities(quantities, step_size):
+    """按数量步长向下取整，返回 Decimal 列表"""
+    if not step_size:
+        return [Decimal(str(quantity)) for quantity in quantities]
+    step = float(step_size)
+    return [int(math.floor(quantity / step + _EPSILON)) * step_size for quantity in quantities]
+
+
+def validate_grid_params(lower_price, upper_price, grid_num, mode='geometric'):
+    """
+    校验网格参数
+
+    异常:
+    - ValueError: 参数无效
+    """
+    if lower_price <= 0:
+        raise ValueError("下限价格必须大于0")
+    if upper_price <= lower_price:
+        raise ValueError("上限价格必须大于下限价格")
+    if grid_num < 2:
+        raise ValueError("网格数量必须大于或等于2")
+    if grid_num > MAX_GRID_LEVELS:
+        raise ValueError(f"网格数量不能超过{MAX_GRID_LEVELS}")
+    if mode not in GRID_MODES:
+        raise ValueError(f"不支持的网格类型: {mode}")
+
+
+def build_price_ladder(lower_price, upper_price, grid_num, symbol_info=None, mode='geometric'):
+    """
+    计算取整后的网格价格，去掉取整后重复的档位
+
+    参数:
+    - lower_price / upper_price: 价格区间
+    - grid_num: 网格数量(包含上下限)
+    - symbol_info: SymbolInfo(可选)，为空时保留8位小数
+    - mode: geometric / arithmetic
+
+    返回:
+    - list: 价格(float)列表，从低到高
+    """
+    validate_grid_params(lower_price, upper_price, grid_num, mode)
+    tick_size = symbol_info.tick_size if symbol_info else None
+    prices = _snap_prices(_ladder(lower_price, upper_price, grid_num, mode), tick_size)
+
+    ladder = []
+    for price in prices:
+        if price > 0 and (not ladder or price != ladder[-1]):
+            ladder.append(price)
+    return [float(price) for price in ladder]
+
+
+def plan_grid(lower_price, upper_price, grid_num, symbol_info=None, mode='geometric', single_amount=None,
+              total_investment=None, leverage=1, is_bilateral=False):
+    """
+    规划网格: 价格档位、每档数量、名义价值，以及不满足交易规则的档位
+
+    参数:
+    - lower_price / upper_price: 价格区间
+    - grid_num: 网格数量(包含上下限)
+    - symbol_info: SymbolInfo(可选)，为空时不校验交易规则
+    - mode: geometric / arithmetic
+    - single_amount: 每档数量(与 total_investment 二选一)
+    - total_investment: 总保证金，乘以杠杆后平均分配到每个订单
+    - leverage: 杠杆倍数
+    - is_bilateral: 是否双向(每个区间挂买卖两单)，影响按总投资分配时的订单数
+
+    返回:
+    - dict: levels / rejected / prices 及合计
+
+    异常:
+    - ValueError: 参数无效
+    """
+    validate_grid_params(lower_price, upper_price, grid_num, mode)
+    leverage = float(leverage or 1)
+    if leverage <= 0:
+        raise ValueError("杠杆倍数必须大于0")
+
+    raw_prices = _ladder(lower_price, upper_price, grid_num, mode)
+    if single_amount is not None:
+        if single_amount <= 0:
+            raise ValueError("单笔数量必须大于0")
+        raw_quantities = [single_amount] * grid_num
+    elif total_investment is not None:
+        if total_investment <= 0:
+            raise ValueError("总投资额必须大于0")
+        # 每个区间1个订单(单向)或2个订单(双向)
+        order_count = (grid_num - 1) * (2 if is_bilateral else 1)
+        order_notional = total_investment * leverage / order_count
+        raw_quantities = [order_notional / price for price in raw_prices]
+    else:
+        raise ValueError("请提供单笔数量或总投资额")
+
+    tick_size = symbol_info.tick_size if symbol_info else None
+    step_size = symbol_info.step_size if symbol_info else None
+    min_qty = symbol_info.min_qty if symbol_info else None
+    max_qty = symbol_info.max_qty if symbol_info else None
+    min_notional = symbol_info.min_notional if symbol_info else None
+
+    prices = _snap_prices(raw_prices, tick_size)
+    quantities = _snap_quantities(raw_quantities, step_size)
+
+    levels = []
+    rejected = []
+    previous_price = None
+    for index, (price, quantity) in enumerate(zip(prices, quantities)):
+        notional = price * quantity
+        reason = None
+        if price <= 0:
+            reason = '价格取整后为0'
+        elif price == previous_price:
+            reason = '价格取整后与前一档重复'
+        elif quantity <= 0 or (min_qty and quantity < min_qty):
+            reason = f"数量低于最小下单量{min_qty or step_size}"
+        elif max_qty and quantity > max_qty:
+            reason = f"数量超过最大下单量{max_qty}"
+        elif min_notional and notional < min_notional:
+            reason = f"名义价值低于最小值{min_notional}"
+
+        level = {
+            'index': index,
+            'price': float(price),
+            'quantity': float(quantity),
+            'notional': float(notional)
+        }
+        if reason:
+            level['reason'] = reason
+            rejected.append(level)
+        else:
+            levels.append(level)
+        if price > 0:
+            previous_price = price
+
+    total_notional = sum(level['notional'] for level in levels)
+    return {
+        'mode': mode,
+        'symbol': symbol_info.symbol if symbol_info else None,
+        'filters': symbol_info.to_dict() if symbol_info else None,
+        'levels': levels,
+        'rejected': rejected,
+        'prices': [level['price'] for level in levels],
+        'total_quantity': float(sum(Decimal(str(level['quantity'])) for level in levels)),
+        'total_notional': total_notional,
+        'margin_required': total_notional / leverage
+    }
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+币安HTTP传输层模块
+
+为进程内所有 BinanceClient 实例提供共享的 HTTP 连接池，避免每次请求都重新建立 TCP+TLS 连接。
+
+说明:
+1. 连接池按服务(api/fapi/dapi/papi/sapi)、主机和代理地址区分，同一个键只创建一个 requests.Session
+2. 每个服务的连接池大小可通过配置 BINANCE_HTTP_POOL_SIZE(全局默认) 和 BINANCE_HTTP_POOL_SIZES(按服务覆盖) 调整
+3. 代理地址是连接池键的一部分，直连和代理连接不会混用同一个连接池
+"""
+
+import logging
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# 默认每个服务的最大保持连接数
+DEFAULT_POOL_SIZE = 20
+
+# 币安服务名称
+SERVICES = ('api', 'fapi', 'dapi', 'papi', 'sapi')
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# 连接池注册表: (服务, 主机, 代理) -> requests.Session
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def resolve_service(url):
+    """
+    根据请求URL判断所属的币安服务
+
+    参数:
+    - url: 完整请求URL
+
+    返回:
+    - 服务名称: api / fapi / dapi / papi / sapi
+    """
+    parsed = urllib.parse.urlsplit(url)
+    host = parsed.netloc.lower()
+
+    if host.startswith('fapi.'):
+        return 'fapi'
+    if host.startswith('dapi.'):
+        return 'dapi'
+    if host.startswith('papi.'):
+        return 'papi'
+    if parsed.path.startswith('/sapi/'):
+        # SAPI与现货API同一主机，但权重和连接池单独计算
+        return 'sapi'
+    return 'api'
+
+
+def get_pool_size(service):
+    """
+    获取指定服务的连接池大小，优先使用按服务配置的值
+    """
+    pool_size = DEFAULT_POOL_SIZE
+
+    if has_app_context():
+        config = current_app.config
+        pool_size = config.get('BINANCE_HTTP_POOL_SIZE', pool_size)
+        pool_size = (config.get('BINANCE_HTTP_POOL_SIZES') or {}).get(service, pool_size)
+
+    try:
+        return max(1, int(pool_size))
+    except (TypeError, ValueError):
+        return DEFAULT_POOL_SIZE
+
+
+def _create_session(service, proxy):
+    """
+    创建带连接池的会话
+    """
+    pool_size = get_pool_size(service)
+
+    session = requests.Session()
+    # 不在适配器层自动重试，失败处理由调用方决定
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'User-Agent': DEFAULT_USER_AGENT})
+
+    if proxy:
+        session.proxies = {
+            'http': proxy,
+            'https': proxy
+        }
+
+    logger.info(f"创建HTTP连接池 - 服务: {service}, 连接数上限: {pool_size}, 代理: {proxy or '未使用'}")
+    return session
+
+
+def get_session(url, proxy=None):
+    """
+    获取请求URL对应的共享会话
+
+    参数:
+    - url: 完整请求URL
+    - proxy: 代理地址(可选)，不同代理使用不同的连接池
+
+    返回:
+    - requests.Session 实例
+    """
+    service = resolve_service(url)
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    key = (service, host, proxy or '')
+
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        # 双重检查，避免并发时重复创建
+        session = _sessions.get(key)
+        if session is None:
+            session = _create_session(service, proxy)
+            _sessions[key] = session
+        return session
+
+
+def get_pool_stats():
+    """
+    获取当前已创建的连接池信息
+
+    返回:
+    - list: 每个连接池的服务、主机、代理和连接数上限
+    """
+    stats = []
+    with _sessions_lock:
+        for (service, host, proxy), session in _sessions.items():
+            adapter = session.get_adapter(f"https://{host}")
+            stats.append({
+                'service': service,
+                'host': host,
+                'proxy': proxy or None,
+                'pool_size': getattr(adapter, '_pool_maxsize', None)
+            })
+    return stats
+
+
+def close_all():
+    """
+    关闭所有共享会话，释放连接
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            try:
+                session.close()
+            except Exception as e:
+                logger.warning(f"关闭HTTP会话失败: {str(e)}")
+        _sessions.clear()
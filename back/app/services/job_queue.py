@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+后台任务队列模块
+
+批量创建子账号、批量转账、批量测试API密钥、批量设置杠杆、网格下单等接口需要逐个账号调用币安API，
+耗时可能达到数分钟，在代理或负载均衡后面容易超时。这些接口可以提交为后台任务：
+请求立即返回任务ID，任务在有界线程池中执行，进度和已完成项的结果写入数据库，
+通过 /api/jobs/<id> 查询或 /api/jobs/<id>/stream (SSE) 订阅任务状态。
+
+说明:
+1. 视图使用 background_job 装饰器后，请求体(或查询参数)中 async 为 true 时提交为后台任务，否则照常同步执行
+2. 后台任务在新的请求上下文中以相同的请求参数执行原视图函数，视图的JSON响应作为任务最终结果
+3. 视图内调用 report_progress 报告总数和每一项的结果，不在后台任务中执行时调用无效
+4. 工作线程数由 JOB_QUEUE_WORKERS 配置，等待和执行中的任务数超过 JOB_QUEUE_MAX_PENDING 时拒绝提交
+5. 进度在内存中实时更新，按 JOB_PROGRESS_FLUSH_INTERVAL 间隔写入数据库；状态变化时立即写入
+6. 应用启动时，上次运行遗留的未完成任务标记为失败，超过 JOB_RETENTION_DAYS 天的已结束任务被清理
+"""
+
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context, jsonify, request
+from sqlalchemy.orm import Session
+
+from app.models import db
+from app.models.job import BackgroundJob, serialize_job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_RETENTION_DAYS = 7
+
+# 已结束的任务在内存中保留的时间(秒)，之后只从数据库查询
+FINISHED_STATE_TTL = 600
+
+# 后台执行视图时转发的请求头
+FORWARDED_HEADERS = ('Authorization', 'X-Requested-With')
+
+_current = threading.local()
+
+
+class JobState:
+    """
+    执行中任务的内存状态，查询和SSE推送直接读取，按间隔写入数据库
+    """
+
+    def __init__(self, job_id, job_type, user_id=None, total=None):
+        self.id = job_id
+        self.job_type = job_type
+        self.user_id = user_id
+        self.status = BackgroundJob.PENDING
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.results = []
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+
+        self.version = 0
+        self._flushed_at = 0
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in BackgroundJob.FINISHED_STATUSES
+
+    def update(self, **changes):
+        """更新任务状态并通知等待中的订阅者"""
+        with self._condition:
+            for key, value in changes.items():
+                setattr(self, key, value)
+            self.version += 1
+            self._condition.notify_all()
+
+    def add_result(self, item):
+        """追加一项已完成的结果"""
+        with self._condition:
+            self.results.append(item)
+            self.completed += 1
+            if isinstance(item, dict) and item.get('success') is False:
+                self.failed += 1
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait(self, version, timeout):
+        """
+        等待任务状态发生变化
+
+        返回:
+        - int: 当前版本号，超时未变化时与传入的版本号相同
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def to_dict(self, include_results=True):
+        with self._condition:
+            data = serialize_job(self, include_results=False)
+            if include_results:
+                data['results'] = list(self.results)
+                data['result'] = self.result
+            return data
+
+    def due_for_flush(self, interval):
+        return time.time() - self._flushed_at >= interval
+
+    def mark_flushed(self):
+        self._flushed_at = time.time()
+
+
+class JobQueue:
+    """
+    后台任务队列，进程内共享一个实例
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._states = {}
+        self._lock = threading.Lock()
+
+    # ---------- 提交 ----------
+
+    def submit(self, job_type, fn, *args, user_id=None, params=None, **kwargs):
+        """
+        提交后台任务
+
+        参数:
+        - job_type: 任务类型
+        - fn: 任务函数，在应用上下文中执行，返回值作为任务结果；返回 (result, success) 时由 success 决定任务状态
+        - user_id: 提交任务的用户ID(可选)
+        - params: 记录到数据库的任务参数(可选)
+
+        返回:
+        - JobState 实例，队列已满时返回None
+        """
+        with self._lock:
+            self._prune()
+            active = sum(1 for state in self._states.values() if not state.finished)
+            if self.max_pending and active >= self.max_pending:
+                logger.warning(f"后台任务队列已满({active}个)，拒绝提交任务: {job_type}")
+                return None
+
+            state = JobState(uuid.uuid4().hex, job_type, user_id=user_id)
+            self._states[state.id] = state
+
+        app = current_app._get_current_object()
+        with Session(db.engine) as session:
+            session.add(BackgroundJob(
+                id=state.id,
+                job_type=job_type,
+                status=state.status,
+                user_id=user_id,
+                params_json=json.dumps(params, ensure_ascii=False, default=str) if params is not None else None,
+                created_at=state.created_at
+            ))
+            session.commit()
+
+        self._executor.submit(self._run, app, state, fn, args, kwargs)
+        logger.info(f"已提交后台任务: {job_type} ({state.id})")
+        return state
+
+    def _run(self, app, state, fn, args, kwargs):
+        with app.app_context():
+            state.update(status=BackgroundJob.RUNNING, started_at=datetime.utcnow())
+            self.flush(state)
+
+            _current.state = state
+            try:
+                result = fn(*args, **kwargs)
+                success = True
+                if isinstance(result, tuple):
+                    result, success = result
+                error = None
+                if not success:
+                    if isinstance(result, dict):
+                        error = result.get('error') or result.get('message')
+                    error = error or '任务执行失败'
+                state.update(
+                    status=BackgroundJob.SUCCEEDED if success else BackgroundJob.FAILED,
+                    result=result,
+                    error=error,
+                    finished_at=datetime.utcnow()
+                )
+            except Exception as e:
+                logger.exception(f"后台任务执行出错: {state.job_type} ({state.id}): {str(e)}")
+                state.update(status=BackgroundJob.FAILED, error=str(e), finished_at=datetime.utcnow())
+            finally:
+                _current.state = None
+                self.flush(state)
+                db.session.remove()
+
+            logger.info(f"后台任务结束: {state.job_type} ({state.id}) - {state.status}, "
+                        f"完成 {state.completed}/{state.total if state.total is not None else '-'}")
+
+    # ---------- 进度 ----------
+
+    def flush(self, state):
+        """将任务的内存状态写入数据库"""
+        state.mark_flushed()
+        data = state.to_dict()
+        try:
+            with Session(db.engine) as session:
+                job = session.get(BackgroundJob, state.id)
+                if job is None:
+                    return
+                job.status = state.status
+                job.total = state.total
+                job.completed = state.completed
+                job.failed = state.failed
+                job.results_json = json.dumps(data['results'], ensure_ascii=False, default=str)
+                if data['result'] is not None:
+                    job.result_json = json.dumps(data['result'], ensure_ascii=False, default=str)
+                job.error = state.error
+                job.started_at = state.started_at
+                job.finished_at = state.finished_at
+                session.commit()
+        except Exception as e:
+            logger.error(f"保存后台任务进度失败 ({state.id}): {str(e)}")
+
+    def report(self, state, item=None, total=None):
+        if total is not None:
+            state.update(total=total)
+        if item is not None:
+            state.add_result(item)
+        if state.due_for_flush(self.flush_interval):
+            self.flush(state)
+
+    # ---------- 查询 ----------
+
+    def get_state(self, job_id):
+        """获取本进程中任务的内存状态，不存在时返回None"""
+        with self._lock:
+            return self._states.get(job_id)
+
+    def status(self):
+        """返回队列状态"""
+        with self._lock:
+            states = list(self._states.values())
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': sum(1 for state in states if state.status == BackgroundJob.PENDING),
+            'running': sum(1 for state in states if state.status == BackgroundJob.RUNNING)
+        }
+
+    def _prune(self):
+        now = datetime.utcnow()
+        for job_id, state in list(self._states.items()):
+            if state.finished and (now - state.finished_at).total_seconds() > FINISHED_STATE_TTL:
+                del self._states[job_id]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    获取进程级共享的后台任务队列，首次调用时读取应用配置
+    """
+    global _queue
+
+    if _queue is not None:
+        return _queue
+
+    with _queue_lock:
+        if _queue is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'workers': config.get('JOB_QUEUE_WORKERS', DEFAULT_WORKERS),
+                    'max_pending': config.get('JOB_QUEUE_MAX_PENDING', DEFAULT_MAX_PENDING),
+                    'flush_interval': config.get('JOB_PROGRESS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+                }
+            _queue = JobQueue(**options)
+        return _queue
+
+
+def init_app(app):
+    """
+    清理上次运行遗留的任务记录：未结束的任务标记为失败，删除超过保留期限的已结束任务
+    """
+    retention_days = app.config.get('JOB_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    with app.app_context():
+        try:
+            interrupted = BackgroundJob.query.filter(
+                BackgroundJob.status.in_([BackgroundJob.PENDING, BackgroundJob.RUNNING])
+            ).update({
+                'status': BackgroundJob.FAILED,
+                'error': '服务重启，任务已中断',
+                'finished_at': datetime.utcnow()
+            }, synchronize_session=False)
+
+            removed = 0
+            if retention_days:
+                removed = BackgroundJob.query.filter(
+                    BackgroundJob.created_at < datetime.utcnow() - timedelta(days=retention_days)
+                ).delete(synchronize_session=False)
+
+            db.session.commit()
+            if interrupted or removed:
+                logger.info(f"后台任务记录清理完成 - 中断: {interrupted}, 删除过期: {removed}")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"清理后台任务记录失败: {str(e)}")
+
+
+def report_progress(item=None, total=None):
+    """
+    在后台任务中报告进度，不在后台任务中执行时不做任何操作
+
+    参数:
+    - item: 已完成的单项结果，追加到任务的部分结果中；包含 success=False 时计为失败
+    - total: 任务总项数
+    """
+    state = getattr(_current, 'state', None)
+    if state is None:
+        return
+    get_job_queue().report(state, item=item, total=total)
+
+
+class ProgressList(list):
+    """
+    追加元素时同时报告后台任务进度的结果列表，用于通过结果列表逐项收集结果的批量函数
+    """
+
+    def __init__(self, total=None):
+        super().__init__()
+        report_progress(total=total)
+
+    def append(self, item):
+        super().append(item)
+        report_progress(item)
+
+
+def _async_requested():
+    data = request.get_json(silent=True) if request.is_json else None
+    value = data.get('async') if isinstance(data, dict) else None
+    if value is None:
+        value = request.args.get('async')
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def _run_view(view, args, kwargs, path, method, query_string, headers, body):
+    """在新的请求上下文中执行视图函数，返回 (JSON结果, 是否成功)"""
+    app = current_app._get_current_object()
+    with app.test_request_context(path, method=method, query_string=query_string, headers=headers, json=body):
+        # 视图参数中的数据库对象(如 token_required 传入的当前用户)重新关联到当前会话
+        args = [db.session.merge(arg) if isinstance(arg, db.Model) else arg for arg in args]
+        response = app.make_response(view(*args, **kwargs))
+        result = response.get_json(silent=True)
+        if result is None:
+            result = {'success': response.status_code < 400, 'data': response.get_data(as_text=True)}
+
+    success = response.status_code < 400 and not (isinstance(result, dict) and result.get('success') is False)
+    return result, success
+
+
+def background_job(job_type):
+    """
+    允许视图以后台任务方式执行的装饰器，需放在认证装饰器之后(靠近视图函数)
+
+    请求体或查询参数中 async 为 true 时，通过认证的请求立即返回 202 和任务ID，
+    视图在后台任务队列中以相同的请求参数执行。提交前不校验请求参数，
+    参数错误时视图返回的错误响应作为任务结果，任务状态为失败。
+
+    参数:
+    - job_type: 任务类型
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def decorated(*args, **kwargs):
+            if not _async_requested():
+                return view(*args, **kwargs)
+
+            body = request.get_json(silent=True) if request.is_json else None
+            if isinstance(body, dict):
+                body = {key: value for key, value in body.items() if key != 'async'}
+            query_string = {key: value for key, value in request.args.items() if key != 'async'}
+            headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+
+            user_id = body.get('user_id') if isinstance(body, dict) else None
+            for arg in args:
+                if isinstance(arg, db.Model) and arg.__tablename__ == 'users':
+                    user_id = arg.id
+
+            state = get_job_queue().submit(
+                job_type, _run_view, view, args, kwargs, request.path, request.method, query_string, headers, body,
+                user_id=user_id, params=body
+            )
+            if state is None:
+                return jsonify({
+                    'success': False,
+                    'error': '后台任务队列已满，请稍后重试'
+                }), 503
+
+            return jsonify({
+                'success': True,
+                'data': {
+                    'job_id': state.id,
+                    'type': job_type,
+                    'status': state.status,
+                    'status_url': f"/api/jobs/{state.id}",
+                    'stream_url': f"/api/jobs/{state.id}/stream"
+                },
+                'message': '任务已提交，正在后台执行'
+            }), 202
+
+        return decorated
+
+    return decorator
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+API密钥健康检查模块
+
+并发探测子账号API密钥(账户信息 + 交易权限)，结果写入 api_key_health 表，
+/subaccounts/batch-details 等接口直接读取表中结果，不再实时请求币安。
+
+说明:
+1. 每个密钥只请求一次 /api/v3/account，权限和手续费率由 check_trade_permission 从同一结果中提取
+2. 探测按 /api/v3/account 的权重和 api 服务剩余额度限制并发，客户端取自子账号客户端注册表
+3. 结果超过 KEY_HEALTH_TTL 秒视为过期；后台线程每隔 KEY_HEALTH_CHECK_INTERVAL 秒重新探测过期和缺失的密钥，
+   检查前重新读取表中时间，多进程部署时其他进程刚探测过的密钥会被跳过
+4. /subaccounts/api-keys 修改或删除密钥时调用 invalidate 删除对应结果，下一轮重新探测
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.models import db
+from app.models.account import ApiKeyHealth, SubAccountAPISettings
+from app.services.batch_executor import iter_batch, resolve_concurrency
+from app.services.client_registry import get_client_registry, validate_credentials
+from app.services.rate_limiter import estimate_weight
+
+logger = logging.getLogger(__name__)
+
+# 默认配置
+DEFAULT_TTL = 300
+DEFAULT_CHECK_INTERVAL = 60
+
+ACCOUNT_ENDPOINT = '/api/v3/account'
+
+HEALTH_COLUMNS = (
+    'email', 'status', 'healthy', 'can_trade', 'can_deposit', 'can_withdraw',
+    'maker_commission', 'taker_commission', 'message', 'latency_ms', 'checked_at'
+)
+
+
+def classify_error(error):
+    """
+    根据错误信息判断密钥状态
+
+    返回:
+    - str: INVALID_KEY / INVALID_SECRET / INSUFFICIENT_PERMISSIONS / ERROR
+    """
+    error = str(error or '')
+    if 'Invalid API-key' in error:
+        return 'INVALID_KEY'
+    if 'signature' in error.lower():
+        return 'INVALID_SECRET'
+    if 'permission' in error.lower():
+        return 'INSUFFICIENT_PERMISSIONS'
+    return 'ERROR'
+
+
+def _health_row(email, status, message, latency_ms=None, permissions=None):
+    permissions = permissions or {}
+    return {
+        'email': email,
+        'status': status,
+        'healthy': status == 'WORKING',
+        'can_trade': permissions.get('canTrade'),
+        'can_deposit': permissions.get('canDeposit'),
+        'can_withdraw': permissions.get('canWithdraw'),
+        'maker_commission': permissions.get('makerCommission'),
+        'taker_commission': permissions.get('takerCommission'),
+        'message': message,
+        'latency_ms': latency_ms,
+        'checked_at': datetime.utcnow()
+    }
+
+
+def probe_key(email):
+    """
+    探测单个子账号的API密钥
+
+    返回:
+    - dict: api_key_health 表的列值
+    """
+    registry = get_client_registry()
+    api_key, api_secret = registry.get_credentials(email)
+    if not api_key or not api_secret:
+        return _health_row(email, 'NOT_CONFIGURED', "未找到API设置")
+
+    format_error = validate_credentials(api_key, api_secret)
+    if format_error:
+        return _health_row(email, 'INVALID_FORMAT', format_error)
+
+    client = registry.get_client(email)
+    if client is None:
+        return _health_row(email, 'ERROR', "无法创建API客户端")
+
+    started = time.perf_counter()
+    result = client.check_trade_permission()
+    latency_ms = int((time.perf_counter() - started) * 1000)
+
+    if not result.get('success'):
+        error = result.get('error', '未知错误')
+        return _health_row(email, classify_error(error), str(error), latency_ms)
+    return _health_row(email, 'WORKING', "API密钥工作正常", latency_ms, result.get('data'))
+
+
+def to_result(row, cached=False):
+    """
+    将健康状态转换为批量测试接口的结果格式
+
+    参数:
+    - row: api_key_health 表的列值
+    - cached: 是否为缓存结果
+    """
+    result = {
+        'email': row['email'],
+        'success': bool(row['healthy']),
+        'status': row['status'],
+        'message': row['message'],
+        'latency_ms': row['latency_ms'],
+        'checked_at': row['checked_at'].isoformat() if row['checked_at'] else None,
+        'cached': cached
+    }
+    if row['healthy']:
+        result['account_details'] = {
+            'makerCommission': row['maker_commission'],
+            'takerCommission': row['taker_commission'],
+            'canTrade': bool(row['can_trade']),
+            'canDeposit': bool(row['can_deposit']),
+            'canWithdraw': bool(row['can_withdraw'])
+        }
+    return result
+
+
+def _row_from_model(health):
+    return {column: getattr(health, column) for column in HEALTH_COLUMNS}
+
+
+class KeyHealthService:
+    """
+    API密钥健康检查服务，进程内共享一个实例
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.ttl = float(ttl)
+        self.check_interval = float(check_interval)
+
+        self._app = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._check_lock = threading.Lock()
+
+    # ---------- 查询 ----------
+
+    def get_health(self, emails=None):
+        """
+        读取已保存的健康状态，不请求币安
+
+        参数:
+        - emails: 子账号邮箱列表，为空时返回全部
+
+        返回:
+        - dict: {email: 健康状态字典(含 stale 是否过期)}，未探测过的邮箱不包含在内
+        """
+        query = ApiKeyHealth.query
+        if emails is not None:
+            if not emails:
+                return {}
+            query = query.filter(ApiKeyHealth.email.in_(list(emails)))
+
+        deadline = datetime.utcnow() - timedelta(seconds=self.ttl)
+        health = {}
+        for row in query.all():
+            item = row.to_dict()
+            item['stale'] = row.checked_at is None or row.checked_at < deadline
+            health[row.email] = item
+        return health
+
+    # ---------- 探测 ----------
+
+    def check(self, emails, concurrency=None, max_age=None, on_result=None):
+        """
+        并发探测API密钥并保存结果
+
+        参数:
+        - emails: 子账号邮箱列表
+        - concurrency: 并发数(可选)
+        - max_age: 可直接复用的结果最长时间(秒，可选)，为空时全部重新探测
+        - on_result: 每得到一个结果时在调用线程中回调(可选)，用于报告后台任务进度
+
+        返回:
+        - list: 与 emails 顺序一致的结果(to_result 格式)
+        """
+        emails = list(emails)
+        results = [None] * len(emails)
+
+        cached = {}
+        if max_age:
+            deadline = datetime.utcnow() - timedelta(seconds=float(max_age))
+            for health in ApiKeyHealth.query.filter(ApiKeyHealth.email.in_(emails),
+                                                    ApiKeyHealth.checked_at >= deadline):
+                cached[health.email] = _row_from_model(health)
+
+        pending = []
+        for index, email in enumerate(emails):
+            if email in cached:
+                results[index] = to_result(cached[email], cached=True)
+                if on_result:
+                    on_result(results[index])
+            else:
+                pending.append(index)
+
+        if not pending:
+            return results
+
+        concurrency = resolve_concurrency(
+            concurrency, service='api', task_count=len(pending),
+            weight_per_task=estimate_weight(ACCOUNT_ENDPOINT))
+
+        rows = []
+        for position, row in iter_batch([emails[index] for index in pending], probe_key, concurrency):
+            if 'status' not in row:
+                # 工作线程异常，iter_batch 返回的是错误结果
+                row = _health_row(emails[pending[position]], 'ERROR', row.get('error'))
+            rows.append(row)
+            index = pending[position]
+            results[index] = to_result(row)
+            if on_result:
+                on_result(results[index])
+
+        self._store(rows)
+        return results
+
+    def check_stale(self):
+        """
+        探测全部已配置密钥中结果缺失或过期的部分，并删除已移除密钥的结果
+
+        返回:
+        - int: 本次探测的密钥数
+        """
+        with self._check_lock:
+            emails = [email for (email,) in db.session.query(SubAccountAPISettings.email).all() if email]
+            deadline = datetime.utcnow() - timedelta(seconds=self.ttl)
+            checked = {
+                health.email: health.checked_at
+                for health in ApiKeyHealth.query.with_entities(ApiKeyHealth.email, ApiKeyHealth.checked_at)
+            }
+            # 探测耗时较长，先结束读事务
+            db.session.rollback()
+
+            configured = set(emails)
+            removed = [email for email in checked if email not in configured]
+            if removed:
+                self._delete(removed)
+
+            stale = [email for email in emails if checked.get(email) is None or checked[email] < deadline]
+            if stale:
+                started = time.perf_counter()
+                results = self.check(stale)
+                healthy = sum(1 for result in results if result['success'])
+                logger.info(f"API密钥健康检查完成: {len(stale)} 个，正常 {healthy} 个，"
+                            f"耗时 {time.perf_counter() - started:.2f}秒")
+            return len(stale)
+
+    def invalidate(self, email):
+        """删除子账号的健康状态，下一轮检查时重新探测"""
+        self._delete([email])
+
+    # ---------- 存储 ----------
+
+    def _store(self, rows):
+        # 使用独立的数据库会话，不提交调用方会话中的其他修改
+        if not rows:
+            return
+        by_email = {row['email']: row for row in rows}
+        with Session(db.engine) as session:
+            try:
+                existing = session.scalars(select(ApiKeyHealth).where(ApiKeyHealth.email.in_(list(by_email))))
+                for health in existing:
+                    for column, value in by_email.pop(health.email).items():
+                        setattr(health, column, value)
+                session.add_all(ApiKeyHealth(**row) for row in by_email.values())
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"保存API密钥健康状态失败: {str(e)}")
+
+    def _delete(self, emails):
+        with Session(db.engine) as session:
+            try:
+                session.execute(delete(ApiKeyHealth).where(ApiKeyHealth.email.in_(list(emails))))
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"删除API密钥健康状态失败: {str(e)}")
+
+    # ---------- 后台检查 ----------
+
+    def start(self, app):
+        """启动后台定期检查线程，检查间隔为0时不启动"""
+        self._app = app
+        if not self.check_interval:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='key-health', daemon=True)
+        self._thread.start()
+        logger.info(f"API密钥健康检查已启动，间隔 {self.check_interval} 秒，结果有效期 {self.ttl} 秒")
+
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            with self._app.app_context():
+                try:
+                    self.check_stale()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"API密钥健康检查异常: {str(e)}", exc_info=True)
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        """停止后台检查线程"""
+        self._stop_event.set()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_key_health():
+    """
+    获取进程级共享的API密钥健康检查服务，首次调用时读取应用配置
+    """
+    global _service
+
+    if _service is not None:
+        return _service
+
+    with _service_lock:
+        if _service is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'ttl': config.get('KEY_HEALTH_TTL', DEFAULT_TTL),
+                    'check_interval': config.get('KEY_HEALTH_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+                }
+            _service = KeyHealthService(**options)
+        return _service
+
+
+def init_app(app):
+    """
+    在应用创建时调用，启动后台定期检查线程
+    """
+    with app.app_context():
+        get_key_health().start(app)
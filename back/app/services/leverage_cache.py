@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+杠杆倍数缓存模块
+
+记录每个 (子账号, 市场, 交易对) 已知的杠杆倍数，批量设置杠杆和带 leverage 参数的下单路径据此跳过重复的设置请求。
+
+说明:
+1. 设置成功或查询持仓风险(positionRisk)后写入缓存，设置失败时清除该项
+2. 缓存项超过 LEVERAGE_CACHE_TTL 秒后失效(杠杆可能在币安页面或其他程序中被修改)，失效后重新查询或设置
+3. 市场为 um(统一账户U本位) / cm(统一账户币本位)
+"""
+
+import logging
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存有效期(秒)
+DEFAULT_TTL = 600
+
+# 查询持仓风险的接口
+POSITION_RISK_ENDPOINTS = {
+    'um': '/papi/v1/um/positionRisk',
+    'cm': '/papi/v1/cm/positionRisk'
+}
+
+
+class LeverageCache:
+    """
+    进程内共享的杠杆倍数缓存
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = float(ttl)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, email, market, symbol):
+        """
+        返回已知的杠杆倍数，未知或已过期时返回None
+        """
+        key = (email, market, symbol.upper())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                self._entries.pop(key, None)
+                self._misses += 1
+                return None
+            self._hits += 1
+            return entry[0]
+
+    def set(self, email, market, symbol, leverage):
+        """记录杠杆倍数"""
+        with self._lock:
+            self._entries[(email, market, symbol.upper())] = (int(leverage), time.time())
+
+    def invalidate(self, email, market=None, symbol=None):
+        """清除子账号的缓存项，可按市场和交易对过滤"""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == email and market in (None, key[1]) and (symbol is None or key[2] == symbol.upper()):
+                    del self._entries[key]
+
+    def stats(self):
+        """返回缓存状态"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'ttl': self.ttl
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_leverage_cache():
+    """
+    获取进程级共享的杠杆倍数缓存，首次调用时读取应用配置
+    """
+    global _cache
+
+    if _cache is not None:
+        return _cache
+
+    with _cache_lock:
+        if _cache is None:
+            ttl = DEFAULT_TTL
+            if has_app_context():
+                ttl = current_app.config.get('LEVERAGE_CACHE_TTL', DEFAULT_TTL)
+            _cache = LeverageCache(ttl)
+        return _cache
+
+
+def fetch_leverage(client, email, symbol, market='um'):
+    """
+    查询交易对当前杠杆倍数并写入缓存
+
+    参数:
+    - client: 子账号的 BinanceClient 实例
+    - email: 子账号邮箱
+    - symbol: 交易对
+    - market: um / cm
+
+    返回:
+    - int 或 None(查询失败或接口未返回该交易对)
+    """
+    result = client._send_request('GET', POSITION_RISK_ENDPOINTS[market], signed=True, params={'symbol': symbol})
+    if not result.get('success'):
+        logger.warning(f"查询杠杆倍数失败: email={email}, symbol={symbol}, 错误={result.get('error')}")
+        return None
+
+    for position in result.get('data') or []:
+        if position.get('symbol') == symbol and position.get('leverage') not in (None, ''):
+            leverage = int(float(position['leverage']))
+            get_leverage_cache().set(email, market, symbol, leverage)
+            return leverage
+    return None
+
+
+def ensure_leverage(client, email, symbol, leverage, market='um', current=None):
+    """
+    将交易对杠杆设置为目标值，已知杠杆与目标相同时跳过请求
+
+    参数:
+    - client: 子账号的 BinanceClient 实例
+    - email: 子账号邮箱
+    - symbol: 交易对
+    - leverage: 目标杠杆倍数
+    - market: um / cm
+    - current: 调用方已查询到的当前杠杆(可选)，为空时使用缓存
+
+    返回:
+    - dict: {'success', 'data', 'error', 'skipped'}
+    """
+    leverage = int(leverage)
+    cache = get_leverage_cache()
+    if current is None:
+        current = cache.get(email, market, symbol)
+    if current == leverage:
+        return {'success': True, 'data': {'symbol': symbol, 'leverage': leverage}, 'error': None, 'skipped': True}
+
+    if market == 'cm':
+        result = client.set_coin_futures_leverage(symbol, leverage)
+    else:
+        result = client.set_um_leverage(symbol, leverage)
+
+    if result.get('success'):
+        cache.set(email, market, symbol, leverage)
+    else:
+        cache.invalidate(email, market, symbol)
+    return {'success': result.get('success', False), 'data': result.get('data'), 'error': result.get('error'), 'skipped': False}
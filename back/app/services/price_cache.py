@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+行情价格缓存模块
+
+在进程内缓存现货、U本位合约、币本位合约的最新价格以及合约标记价格，各接口从内存读取价格，
+不再每次请求都调用币安的 ticker/price 或 premiumIndex 接口。
+
+说明:
+1. 每个市场一次批量请求获取全部交易对价格，整体替换缓存快照
+2. 后台线程按 PRICE_CACHE_REFRESH_INTERVAL 定时刷新最近被访问过的市场，长时间未访问的市场不再刷新
+3. 读取时快照超过 max_age(默认 PRICE_CACHE_MAX_AGE 秒)则同步批量刷新；批量刷新失败时回退为单个交易对的REST查询
+4. 返回的价格带有缓存时间和已缓存时长(age_ms)，调用方可据此判断数据新鲜度
+"""
+
+import logging
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# 市场 -> (批量价格接口, 价格字段)
+PRICE_MARKETS = {
+    'spot': ('/api/v3/ticker/price', 'price'),
+    'um': ('/fapi/v1/ticker/price', 'price'),
+    'cm': ('/dapi/v1/ticker/price', 'price'),
+    'mark_um': ('/fapi/v1/premiumIndex', 'markPrice'),
+    'mark_cm': ('/dapi/v1/premiumIndex', 'markPrice')
+}
+
+DEFAULT_REFRESH_INTERVAL = 5
+DEFAULT_MAX_AGE = 10
+
+# 市场超过该时间(秒)未被访问后停止后台刷新
+IDLE_TIMEOUT = 300
+
+
+class PriceSnapshot:
+    """
+    单个市场的价格快照
+    """
+
+    __slots__ = ('prices', 'updated_at')
+
+    def __init__(self, prices, updated_at):
+        self.prices = prices
+        self.updated_at = updated_at
+
+    @property
+    def age(self):
+        return time.time() - self.updated_at
+
+
+class PriceCache:
+    """
+    行情价格缓存，进程内共享一个实例
+    """
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL, max_age=DEFAULT_MAX_AGE):
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+
+        self._snapshots = {}
+        self._last_access = {}
+        self._failed_at = {}
+        self._refresh_locks = {market: threading.Lock() for market in PRICE_MARKETS}
+        self._app = None
+        self._refresher = None
+        self._lock = threading.Lock()
+
+    # ---------- 查询 ----------
+
+    def get_prices(self, market='spot', max_age=None):
+        """
+        获取市场全部交易对价格
+
+        参数:
+        - market: spot / um / cm / mark_um / mark_cm
+        - max_age: 可接受的最长缓存时间(秒)，默认使用配置
+
+        返回:
+        - (prices, meta): prices 为 {交易对: 价格字符串}；meta 包含 updated_at(毫秒时间戳) 和 age_ms，无数据时为空字典和None
+        """
+        snapshot = self._snapshot(market, max_age)
+        if snapshot is None:
+            return {}, None
+        return snapshot.prices, self._meta(snapshot)
+
+    def get_price(self, symbol, market='spot', max_age=None):
+        """
+        获取单个交易对价格
+
+        返回:
+        - dict: {'symbol', 'price', 'updated_at', 'age_ms', 'source'}，获取失败返回None
+        """
+        if not symbol:
+            return None
+
+        symbol = symbol.upper()
+        snapshot = self._snapshot(market, max_age)
+        if snapshot is not None and symbol in snapshot.prices:
+            return dict(symbol=symbol, price=snapshot.prices[symbol], source='cache', **self._meta(snapshot))
+
+        # 批量数据不可用或不包含该交易对，单独查询一次
+        return self._fetch_single(symbol, market)
+
+    def status(self):
+        """返回各市场缓存状态"""
+        return {
+            market: dict(symbols=len(snapshot.prices), **self._meta(snapshot))
+            for market, snapshot in self._snapshots.items()
+        }
+
+    @staticmethod
+    def _meta(snapshot):
+        return {
+            'updated_at': int(snapshot.updated_at * 1000),
+            'age_ms': int(snapshot.age * 1000)
+        }
+
+    def _snapshot(self, market, max_age):
+        if market not in PRICE_MARKETS:
+            raise ValueError(f"不支持的价格市场: {market}")
+
+        self._last_access[market] = time.time()
+        self._ensure_refresher()
+
+        max_age = self.max_age if max_age is None else max_age
+        snapshot = self._snapshots.get(market)
+        recently_failed = time.time() - self._failed_at.get(market, 0) < max(self.refresh_interval, 1)
+        if (snapshot is None or snapshot.age > max_age) and not recently_failed:
+            self.refresh(market, max_age)
+            snapshot = self._snapshots.get(market)
+
+        # 超过可接受时长的快照不返回，由调用方回退为单个查询
+        if snapshot is not None and snapshot.age > max_age:
+            return None
+
+        return snapshot
+
+    # ---------- 刷新 ----------
+
+    def refresh(self, market, max_age=None):
+        """
+        批量刷新市场价格
+
+        参数:
+        - market: 市场
+        - max_age: 等待锁期间其他线程已刷新且未超过该时间时跳过本次请求
+
+        返回:
+        - bool: 是否刷新成功
+        """
+        with self._refresh_locks[market]:
+            snapshot = self._snapshots.get(market)
+            if max_age is not None and snapshot is not None and snapshot.age <= max_age:
+                return True
+
+            endpoint, field = PRICE_MARKETS[market]
+            result = self._client()._send_request('GET', endpoint)
+            if not result.get('success') or not isinstance(result.get('data'), list):
+                self._failed_at[market] = time.time()
+                logger.warning(f"批量刷新 {market} 价格失败: {result.get('error')}")
+                return False
+
+            prices = {
+                item['symbol']: item[field]
+                for item in result['data']
+                if item.get('symbol') and item.get(field) is not None
+            }
+            self._snapshots[market] = PriceSnapshot(prices, time.time())
+            return True
+
+    def _fetch_single(self, symbol, market):
+        endpoint, field = PRICE_MARKETS[market]
+        result = self._client()._send_request('GET', endpoint, params={'symbol': symbol})
+        if not result.get('success'):
+            logger.warning(f"获取 {symbol} 价格失败({market}): {result.get('error')}")
+            return None
+
+        data = result.get('data')
+        # 币本位接口带symbol时也返回列表
+        if isinstance(data, list):
+            data = data[0] if data else {}
+        if not data or data.get(field) is None:
+            return None
+
+        now = time.time()
+        return {
+            'symbol': symbol,
+            'price': data[field],
+            'updated_at': int(now * 1000),
+            'age_ms': 0,
+            'source': 'rest'
+        }
+
+    @staticmethod
+    def _client():
+        from app.services.binance_client import BinanceClient
+        # 价格为公开数据，使用无API密钥的客户端
+        return BinanceClient('', '')
+
+    # ---------- 后台刷新 ----------
+
+    def _ensure_refresher(self):
+        if not self.refresh_interval or not has_app_context():
+            return
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._app = current_app._get_current_object()
+            self._refresher = threading.Thread(target=self._refresh_loop, name='price-cache', daemon=True)
+            self._refresher.start()
+            logger.info(f"行情价格后台刷新已启动，间隔 {self.refresh_interval} 秒")
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            now = time.time()
+            with self._app.app_context():
+                for market, last_access in list(self._last_access.items()):
+                    if now - last_access > IDLE_TIMEOUT:
+                        continue
+                    try:
+                        self.refresh(market, max_age=self.refresh_interval / 2)
+                    except Exception as e:
+                        logger.error(f"后台刷新 {market} 价格异常: {str(e)}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_price_cache():
+    """
+    获取进程级共享的行情价格缓存，首次调用时读取应用配置
+    """
+    global _cache
+
+    if _cache is not None:
+        return _cache
+
+    with _cache_lock:
+        if _cache is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'refresh_interval': config.get('PRICE_CACHE_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL),
+                    'max_age': config.get('PRICE_CACHE_MAX_AGE', DEFAULT_MAX_AGE)
+                }
+            _cache = PriceCache(**options)
+        return _cache
+
+
+def get_price(symbol, market='spot', max_age=None):
+    """获取单个交易对价格的便捷函数，参见 PriceCache.get_price"""
+    return get_price_cache().get_price(symbol, market, max_age)
+
+
+def get_prices(market='spot', max_age=None):
+    """获取市场全部价格的便捷函数，参见 PriceCache.get_prices"""
+    return get_price_cache().get_prices(market, max_age)
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+币安请求频率控制模块
+
+在客户端层统一控制发往币安的请求频率，避免批量操作触发429/418封禁。
+
+说明:
+1. IP权重按服务(api/fapi/dapi/papi/sapi)分别使用令牌桶计数
+2. 下单频率按(服务, 账号)分别计数，支持多个时间窗口(如10秒、1分钟)
+3. 每次响应后读取 X-MBX-USED-WEIGHT-* / X-SAPI-USED-IP-WEIGHT-* / X-MBX-ORDER-COUNT-* 响应头校准令牌余量
+4. 收到429/418时按Retry-After暂停对应服务的全部请求
+5. 对外提供剩余额度(headroom)查询，批量接口可据此决定并发数
+6. 异步客户端使用 acquire_async，等待额度时不阻塞事件循环
+"""
+
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# 默认IP权重上限(每分钟)
+DEFAULT_WEIGHT_LIMITS = {
+    'api': 6000,
+    'sapi': 12000,
+    'fapi': 2400,
+    'dapi': 2400,
+    'papi': 6000
+}
+
+# 默认下单频率上限: [(次数, 窗口秒数), ...]
+DEFAULT_ORDER_LIMITS = {
+    'api': [(100, 10), (200000, 86400)],
+    'fapi': [(300, 10), (1200, 60)],
+    'dapi': [(1200, 60)],
+    'papi': [(1200, 60)]
+}
+
+# 默认安全系数，只使用上限的一部分，给其他进程和估算误差留余量
+DEFAULT_SAFETY = 0.9
+
+# 默认最长等待时间(秒)，超过则直接返回失败而不是无限阻塞
+DEFAULT_MAX_WAIT = 30
+
+# 常用接口的请求权重，未列出的接口按1计算
+ENDPOINT_WEIGHTS = {
+    '/api/v3/exchangeInfo': 20,
+    '/api/v3/account': 20,
+    '/api/v3/myTrades': 20,
+    '/fapi/v2/account': 5,
+    '/fapi/v2/positionRisk': 5,
+    '/fapi/v1/allOrders': 5,
+    '/fapi/v1/userTrades': 5,
+    '/fapi/v1/batchOrders': 5,
+    '/dapi/v1/batchOrders': 5,
+    '/dapi/v1/account': 5,
+    '/papi/v1/account': 20,
+    '/papi/v1/balance': 20,
+    '/papi/v1/um/account': 5,
+    '/papi/v1/cm/account': 5,
+    '/papi/v1/um/positionRisk': 5,
+    '/papi/v1/cm/positionRisk': 1,
+    '/papi/v1/um/userTrades': 5,
+    '/papi/v1/cm/userTrades': 20,
+    '/papi/v1/margin/myTrades': 5,
+    '/papi/v1/um/allOrders': 5,
+    '/sapi/v1/sub-account/spotSummary': 1,
+    '/sapi/v3/sub-account/assets': 60,
+    '/sapi/v4/sub-account/assets': 60
+}
+
+# 不带symbol参数时权重更高的接口: 路径 -> (带symbol权重, 不带symbol权重)
+SYMBOL_OPTIONAL_WEIGHTS = {
+    '/api/v3/ticker/price': (2, 4),
+    '/fapi/v1/ticker/price': (1, 2),
+    '/dapi/v1/ticker/price': (1, 2),
+    '/fapi/v1/premiumIndex': (1, 10),
+    '/api/v3/openOrders': (6, 80),
+    '/fapi/v1/openOrders': (1, 40),
+    '/papi/v1/um/openOrders': (1, 40),
+    '/papi/v1/margin/openOrders': (5, 40)
+}
+
+# 下单类接口路径后缀
+ORDER_PATH_SUFFIXES = ('/order', '/batchOrders', '/order/oco')
+
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_HEADER_PATTERN = re.compile(r'^x-(?:mbx-used-weight|sapi-used-ip-weight|mbx-order-count)-(\d+)([smhd])$')
+
+
+def parse_interval(value, unit):
+    """将响应头中的时间窗口(如1m、10s)转换为秒数"""
+    return int(value) * _INTERVAL_UNITS[unit.lower()]
+
+
+def estimate_weight(path, params=None):
+    """
+    估算请求的IP权重
+
+    参数:
+    - path: 请求路径，例如 /fapi/v1/order
+    - params: 请求参数
+
+    返回:
+    - int: 估算的权重
+    """
+    params = params or {}
+
+    if path in SYMBOL_OPTIONAL_WEIGHTS:
+        with_symbol, without_symbol = SYMBOL_OPTIONAL_WEIGHTS[path]
+        return with_symbol if params.get('symbol') else without_symbol
+
+    return ENDPOINT_WEIGHTS.get(path, 1)
+
+
+def count_orders(method, path, params=None):
+    """
+    计算请求包含的下单数量，非下单请求返回0
+    """
+    if method != 'POST' or not path.endswith(ORDER_PATH_SUFFIXES):
+        return 0
+
+    if path.endswith('/batchOrders'):
+        try:
+            return max(1, len(json.loads((params or {}).get('batchOrders', '[]'))))
+        except (TypeError, ValueError):
+            return 1
+
+    if path.endswith('/order/oco'):
+        return 2
+
+    return 1
+
+
+class TokenBucket:
+    """
+    令牌桶，按固定速率补充令牌
+    """
+
+    def __init__(self, capacity, period):
+        """
+        参数:
+        - capacity: 桶容量(窗口内允许的总量)
+        - period: 窗口长度(秒)，令牌在该时间内补满
+        """
+        self.capacity = float(capacity)
+        self.period = float(period)
+        self.rate = self.capacity / self.period
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def wait_time(self, amount, now):
+        """获取足够令牌需要等待的秒数，0表示可立即获取"""
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        # 单次请求超过容量时，只要桶满即放行，避免永远等待
+        needed = min(amount, self.capacity) - self.tokens
+        return max(0.0, needed / self.rate)
+
+    def consume(self, amount):
+        self.tokens -= amount
+
+    def sync_used(self, used, now):
+        """根据服务器返回的已用量校准余量(以服务器计数为准，窗口重置后余量随之恢复)"""
+        self._refill(now)
+        self.tokens = self.capacity - float(used)
+
+    def available(self, now):
+        self._refill(now)
+        return max(0.0, self.tokens)
+
+
+class RateGovernor:
+    """
+    请求频率调度器，所有 BinanceClient 共享同一个实例
+    """
+
+    def __init__(self, weight_limits=None, order_limits=None, safety=DEFAULT_SAFETY, max_wait=DEFAULT_MAX_WAIT, enabled=True):
+        self.safety = safety
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self.weight_limits = dict(DEFAULT_WEIGHT_LIMITS, **(weight_limits or {}))
+        self.order_limits = dict(DEFAULT_ORDER_LIMITS, **(order_limits or {}))
+
+        self._lock = threading.Lock()
+        self._weight_buckets = {}
+        self._order_buckets = {}
+        self._blocked_until = {}
+
+    # ---------- 内部辅助 ----------
+
+    def _weight_bucket(self, service):
+        bucket = self._weight_buckets.get(service)
+        if bucket is None:
+            limit = self.weight_limits.get(service, DEFAULT_WEIGHT_LIMITS['api'])
+            bucket = TokenBucket(limit * self.safety, 60)
+            self._weight_buckets[service] = bucket
+        return bucket
+
+    def _order_bucket_list(self, service, account):
+        key = (service, account)
+        buckets = self._order_buckets.get(key)
+        if buckets is None:
+            buckets = [
+                TokenBucket(max(1, int(limit * self.safety)), period)
+                for limit, period in self.order_limits.get(service, [])
+            ]
+            self._order_buckets[key] = buckets
+        return buckets
+
+    # ---------- 申请额度 ----------
+
+    def reserve(self, service, weight=1, account=None, orders=0):
+        """
+        尝试立即获取额度(不阻塞)
+
+        返回:
+        - float: 0表示已获取并扣除额度，大于0表示还需等待的秒数
+        """
+        if not self.enabled:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+
+            blocked_for = self._blocked_until.get(service, 0) - now
+            if blocked_for > 0:
+                return blocked_for
+
+            weight_bucket = self._weight_bucket(service)
+            wait = weight_bucket.wait_time(weight, now)
+
+            order_buckets = []
+            if orders and account:
+                order_buckets = self._order_bucket_list(service, account)
+                for bucket in order_buckets:
+                    wait = max(wait, bucket.wait_time(orders, now))
+
+            if wait > 0:
+                return wait
+
+            weight_bucket.consume(weight)
+            for bucket in order_buckets:
+                bucket.consume(orders)
+            return 0.0
+
+    def acquire(self, service, weight=1, account=None, orders=0, max_wait=None):
+        """
+        获取额度，额度不足时阻塞等待
+
+        返回:
+        - bool: 是否成功获取；超过最长等待时间返回False
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        waited = 0.0
+
+        while True:
+            wait = self.reserve(service, weight, account, orders)
+            if wait <= 0:
+                if waited > 0:
+                    logger.info(f"请求频率控制: {service} 等待 {waited:.2f}秒后获取额度")
+                return True
+
+            if waited + wait > max_wait:
+                logger.warning(f"请求频率控制: {service} 需等待 {wait:.2f}秒，超过最长等待时间 {max_wait}秒")
+                return False
+
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, service, weight=1, account=None, orders=0, max_wait=None):
+        """
+        acquire 的异步版本，额度不足时让出事件循环等待
+
+        返回:
+        - bool: 是否成功获取；超过最长等待时间返回False
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        waited = 0.0
+
+        while True:
+            wait = self.reserve(service, weight, account, orders)
+            if wait <= 0:
+                if waited > 0:
+                    logger.info(f"请求频率控制: {service} 等待 {waited:.2f}秒后获取额度")
+                return True
+
+            if waited + wait > max_wait:
+                logger.warning(f"请求频率控制: {service} 需等待 {wait:.2f}秒，超过最长等待时间 {max_wait}秒")
+                return False
+
+            await asyncio.sleep(wait)
+            waited += wait
+
+    # ---------- 响应反馈 ----------
+
+    def update_from_headers(self, service, headers, account=None, status_code=None):
+        """
+        根据响应头校准令牌余量
+
+        参数:
+        - service: 服务名称
+        - headers: 响应头
+        - account: 账号标识(用于下单计数)
+        - status_code: HTTP状态码，429/418时暂停该服务
+        """
+        if not self.enabled or headers is None:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+
+            for name, value in headers.items():
+                match = _HEADER_PATTERN.match(name.lower())
+                if not match:
+                    continue
+
+                try:
+                    used = float(value)
+                    period = parse_interval(match.group(1), match.group(2))
+                except (TypeError, ValueError, KeyError):
+                    continue
+
+                if 'order-count' in name.lower():
+                    if not account:
+                        continue
+                    for bucket in self._order_bucket_list(service, account):
+                        if bucket.period == period:
+                            bucket.sync_used(used, now)
+                elif period == 60:
+                    self._weight_bucket(service).sync_used(used, now)
+
+            if status_code in (418, 429):
+                retry_after = headers.get('Retry-After')
+                try:
+                    retry_after = float(retry_after) if retry_after else 60.0
+                except (TypeError, ValueError):
+                    retry_after = 60.0
+
+                self._blocked_until[service] = max(self._blocked_until.get(service, 0), now + retry_after)
+                self._weight_bucket(service).tokens = 0.0
+                logger.error(f"币安返回HTTP {status_code}，暂停 {service} 请求 {retry_after:.0f}秒")
+
+    # ---------- 额度查询 ----------
+
+    def headroom(self, service, account=None):
+        """
+        查询服务(及账号)当前的剩余额度
+
+        返回:
+        - dict: 权重上限、剩余权重、下单窗口剩余次数、暂停剩余秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            weight_bucket = self._weight_bucket(service)
+
+            result = {
+                'service': service,
+                'weight_limit': int(weight_bucket.capacity),
+                'weight_available': int(weight_bucket.available(now)),
+                'blocked_for': round(max(0.0, self._blocked_until.get(service, 0) - now), 2),
+                'orders': []
+            }
+
+            if account:
+                for bucket in self._order_bucket_list(service, account):
+                    result['orders'].append({
+                        'window_seconds': int(bucket.period),
+                        'limit': int(bucket.capacity),
+                        'available': int(bucket.available(now))
+                    })
+
+            return result
+
+    def suggest_concurrency(self, service, weight_per_task=1, maximum=20, minimum=1):
+        """
+        根据当前剩余权重建议批量操作的并发数
+
+        参数:
+        - service: 服务名称
+        - weight_per_task: 单个任务消耗的权重
+        - maximum: 并发上限
+        - minimum: 并发下限
+
+        返回:
+        - int: 建议并发数
+        """
+        headroom = self.headroom(service)
+        if headroom['blocked_for'] > 0:
+            return minimum
+
+        affordable = int(headroom['weight_available'] // max(1, weight_per_task))
+        return max(minimum, min(maximum, affordable))
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_rate_governor():
+    """
+    获取进程级共享的频率调度器，首次调用时读取应用配置
+    """
+    global _governor
+
+    if _governor is not None:
+        return _governor
+
+    with _governor_lock:
+        if _governor is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'enabled': config.get('BINANCE_RATE_LIMIT_ENABLED', True),
+                    'safety': config.get('BINANCE_RATE_LIMIT_SAFETY', DEFAULT_SAFETY),
+                    'max_wait': config.get('BINANCE_RATE_LIMIT_MAX_WAIT', DEFAULT_MAX_WAIT),
+                    'weight_limits': config.get('BINANCE_WEIGHT_LIMITS'),
+                    'order_limits': config.get('BINANCE_ORDER_LIMITS')
+                }
+            _governor = RateGovernor(**options)
+        return _governor
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+订单/成交记录批量写入模块
+
+网格监控线程和下单接口产生的 OrderHistory / TradeHistory / MarginTrade 记录先放入内存缓冲区，
+由后台线程按固定间隔合并为一次批量插入(executemany)和一次提交，避免每条记录单独提交。
+
+说明:
+1. 记录按唯一键(order_id / id / trade_id)去重: 缓冲区中同一键的记录以最后一次写入为准，
+   写入数据库时已存在的记录直接忽略
+2. 缓冲区达到 max_batch 条时立即写入；flush_interval 为0时不缓冲，直接写入
+3. 写入使用独立的数据库会话，不会提交调用方会话中的其他修改
+4. 写入失败的记录放回缓冲区，下次重试；进程退出时写入剩余记录
+5. 需要读取刚写入的记录时(如撤单后更新订单状态)，先调用 flush()
+"""
+
+import atexit
+import logging
+import threading
+
+from flask import current_app, has_app_context
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from app.models import db
+from app.models.trading import MarginTrade, OrderHistory, TradeHistory
+from app.utils.db import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+# 默认配置
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_MAX_BATCH = 500
+
+# 写入失败时缓冲区最多保留的记录数(每个模型)，超过后丢弃最早的记录
+MAX_PENDING_FACTOR = 20
+
+# 支持批量写入的模型及其唯一键
+CONFLICT_COLUMNS = {
+    OrderHistory: ['order_id'],
+    TradeHistory: ['id'],
+    MarginTrade: ['trade_id']
+}
+
+
+def _row_from_instance(instance):
+    """
+    将未保存的模型对象转换为插入用的字典，自增主键以外的每一列都包含在内，
+    未赋值的列使用列默认值，保证同一模型的所有记录键一致(executemany 要求)
+    """
+    row = {}
+    for column in inspect(type(instance)).columns:
+        value = getattr(instance, column.key)
+        if value is None and column.primary_key and isinstance(column.type, db.Integer):
+            # 自增主键由数据库生成
+            continue
+        if value is None and column.default is not None:
+            default = column.default
+            if default.is_callable:
+                value = default.arg(None)
+            elif default.is_scalar:
+                value = default.arg
+        row[column.key] = value
+    return row
+
+
+class RecordWriter:
+    """
+    订单/成交记录批量写入器
+    """
+
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL, max_batch=DEFAULT_MAX_BATCH):
+        self.flush_interval = float(flush_interval)
+        self.max_batch = max(1, int(max_batch))
+
+        self._app = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    # ---------- 对外接口 ----------
+
+    def add(self, instance):
+        """
+        加入一条待写入的记录
+
+        参数:
+        - instance: 未保存的 OrderHistory / TradeHistory / MarginTrade 对象
+        """
+        model = type(instance)
+        columns = CONFLICT_COLUMNS.get(model)
+        if columns is None:
+            raise ValueError(f"不支持批量写入的模型: {model.__name__}")
+
+        row = _row_from_instance(instance)
+        key = tuple(row[column] for column in columns)
+
+        with self._lock:
+            self._ensure_started()
+            pending = self._pending.setdefault(model, {})
+            pending[key] = row
+            full = len(pending) >= self.max_batch
+
+        if self.flush_interval <= 0:
+            self.flush()
+        elif full:
+            self._wakeup.set()
+
+    def pending(self, model, key):
+        """
+        返回缓冲区中尚未写入的记录(字典副本)，不存在时返回None
+
+        参数:
+        - model: 模型类
+        - key: 唯一键的值，单列唯一键可直接传入值
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        with self._lock:
+            row = self._pending.get(model, {}).get(key)
+            return dict(row) if row is not None else None
+
+    def flush(self):
+        """
+        立即写入缓冲区中的全部记录
+
+        返回:
+        - int: 本次提交的记录数(含因唯一键冲突被忽略的记录)
+        """
+        with self._flush_lock:
+            with self._lock:
+                batches, self._pending = self._pending, {}
+
+            if not batches:
+                return 0
+
+            app = self._app or (current_app._get_current_object() if has_app_context() else None)
+            if app is None:
+                logger.error("记录写入器未绑定应用，无法写入数据库")
+                self._requeue(batches)
+                return 0
+
+            with app.app_context():
+                written = 0
+                with Session(db.engine) as session:
+                    try:
+                        for model, rows in batches.items():
+                            insert_ignore(model, list(rows.values()), CONFLICT_COLUMNS[model], session=session)
+                            written += len(rows)
+                        session.commit()
+                    except Exception as e:
+                        session.rollback()
+                        logger.error(f"批量写入订单/成交记录失败，稍后重试: {str(e)}")
+                        self._requeue(batches)
+                        return 0
+
+            logger.debug(f"批量写入订单/成交记录: {written} 条")
+            return written
+
+    def close(self):
+        """停止后台线程并写入剩余记录"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        """返回缓冲区状态"""
+        with self._lock:
+            return {
+                'pending': {model.__tablename__: len(rows) for model, rows in self._pending.items()},
+                'flush_interval': self.flush_interval,
+                'max_batch': self.max_batch
+            }
+
+    # ---------- 内部实现 ----------
+
+    def _ensure_started(self):
+        # 后台线程在首次写入记录的应用上下文中运行
+        if self._app is None and has_app_context():
+            self._app = current_app._get_current_object()
+
+        if self.flush_interval <= 0 or self._stopped:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._thread = threading.Thread(target=self._run, name='record-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        logger.info(f"订单/成交记录批量写入已启动，写入间隔: {self.flush_interval}秒")
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"批量写入线程异常: {str(e)}", exc_info=True)
+
+    def _requeue(self, batches):
+        # 失败的记录放回缓冲区，期间新加入的同键记录更新，保留新记录
+        limit = self.max_batch * MAX_PENDING_FACTOR
+        with self._lock:
+            for model, rows in batches.items():
+                pending = self._pending.setdefault(model, {})
+                merged = dict(rows)
+                merged.update(pending)
+                if len(merged) > limit:
+                    dropped = len(merged) - limit
+                    logger.error(f"{model.__tablename__} 待写入记录过多，丢弃最早的 {dropped} 条")
+                    merged = dict(list(merged.items())[dropped:])
+                self._pending[model] = merged
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_record_writer():
+    """
+    获取进程级共享的记录写入器，首次调用时读取应用配置
+    """
+    global _writer
+
+    if _writer is not None:
+        return _writer
+
+    with _writer_lock:
+        if _writer is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'flush_interval': config.get('RECORD_WRITER_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                    'max_batch': config.get('RECORD_WRITER_MAX_BATCH', DEFAULT_MAX_BATCH)
+                }
+            _writer = RecordWriter(**options)
+        return _writer
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+子账号目录模块
+
+将主账号下的全部子账号(列表 + 功能状态)同步到 subaccounts 表，子账号列表、搜索和批量详情接口
+直接查询本地表，不再每次加载页面都请求 /sapi/v1/sub-account/list 和 /sapi/v1/sub-account/status。
+
+说明:
+1. 同步时按 SUBACCOUNT_DIRECTORY_PAGE_SIZE 分页读取完整的子账号列表，功能状态接口只请求一次
+2. 同步是增量写入: 与表中记录比较，只插入新增、更新变化、删除已不存在的子账号；
+   列表未完整读取时不删除记录，功能状态读取失败时保留原有的功能状态
+3. 目录按主账号API密钥的摘要(master_account)区分，不同主账号的子账号互不可见
+4. 接口首次访问某个主账号且表中没有记录时同步读取；之后由后台线程每隔
+   SUBACCOUNT_DIRECTORY_REFRESH_INTERVAL 秒刷新，创建子账号后调用 request_refresh 立即刷新
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from app.models import db
+from app.models.account import SubAccount
+
+logger = logging.getLogger(__name__)
+
+# 默认配置
+DEFAULT_REFRESH_INTERVAL = 300
+DEFAULT_PAGE_SIZE = 200
+
+# 批量详情中有未知邮箱时，距离上次同步超过该秒数才重新同步，避免重复请求
+MIN_RESYNC_INTERVAL = 30
+
+# 分页读取的最大页数，防止接口异常时无限翻页
+MAX_PAGES = 500
+
+LIST_ENDPOINT = '/sapi/v1/sub-account/list'
+STATUS_ENDPOINT = '/sapi/v1/sub-account/status'
+
+SYNC_COLUMNS = (
+    'subaccount_id', 'create_time', 'status', 'account_type',
+    'is_futures_enabled', 'is_margin_enabled', 'master_account', 'extra_info'
+)
+
+
+def master_id(client):
+    """
+    主账号标识: API密钥的摘要，不保存密钥本身
+    """
+    return hashlib.sha256(client.api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def _extract_list(data, *keys):
+    # 接口直接返回列表，或将列表放在 subAccounts / subAccountList / statusList 等字段中
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in keys:
+            if isinstance(data.get(key), list):
+                return data[key]
+    return None
+
+
+def load_extra(account):
+    """
+    读取子账号记录中保存的原始数据
+
+    返回:
+    - (列表数据 dict, 功能状态数据 dict)
+    """
+    try:
+        extra = json.loads(account.extra_info) if account.extra_info else {}
+    except ValueError:
+        extra = {}
+    return extra.get('account') or {'email': account.email}, extra.get('status') or {}
+
+
+def _row_values(mid, item, status_item):
+    create_time = item.get('createTime')
+    return {
+        'subaccount_id': str(item.get('subaccountId') or item.get('subAccountId') or '') or None,
+        'create_time': datetime.utcfromtimestamp(create_time / 1000) if create_time else None,
+        'status': 'FREEZE' if item.get('isFreeze') else 'ACTIVE',
+        'account_type': 'managed' if item.get('isManagedSubAccount') else 'standard',
+        'is_futures_enabled': bool(status_item.get('isFutureEnabled', status_item.get('futuresEnable', False))),
+        'is_margin_enabled': bool(status_item.get('isMarginEnabled', status_item.get('marginEnable', False))),
+        'master_account': mid,
+        'extra_info': json.dumps({'account': item, 'status': status_item}, sort_keys=True, ensure_ascii=False)
+    }
+
+
+class SubAccountDirectory:
+    """
+    子账号目录服务，进程内共享一个实例
+    """
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL, page_size=DEFAULT_PAGE_SIZE):
+        self.refresh_interval = float(refresh_interval)
+        self.page_size = max(1, int(page_size))
+
+        # 主账号标识 -> 客户端 / 最近一次同步时间，供后台线程刷新
+        self._clients = {}
+        self._synced_at = {}
+        self._sync_lock = threading.Lock()
+
+        self._app = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+    # ---------- 查询 ----------
+
+    def ensure_synced(self, client):
+        """
+        登记主账号；该主账号在表中没有记录时立即同步，否则交给后台线程刷新
+
+        返回:
+        - dict: 同步结果，未同步时为 {'success': True, 'synced': False}
+        """
+        mid = self._register(client)
+        if mid not in self._synced_at:
+            exists = db.session.query(SubAccount.id).filter(SubAccount.master_account == mid).first() is not None
+            if not exists:
+                return self._sync_if_stale(client, MIN_RESYNC_INTERVAL)
+            # 表中已有上次运行同步的记录，先使用，后台线程尽快刷新
+            self._synced_at.setdefault(mid, 0)
+            self._wakeup.set()
+        return {'success': True, 'synced': False}
+
+    def list_accounts(self, client, page=1, limit=10, search=None):
+        """
+        分页查询子账号，按创建时间排序
+
+        参数:
+        - client: 主账号客户端
+        - page / limit: 页码(从1开始)和每页数量
+        - search: 邮箱关键字(可选，不区分大小写)
+
+        返回:
+        - list: SubAccount 列表
+        """
+        query = SubAccount.query.filter(SubAccount.master_account == master_id(client))
+        if search:
+            query = query.filter(SubAccount.email.ilike(f"%{search.strip()}%"))
+        page = max(1, int(page or 1))
+        limit = max(1, int(limit or 10))
+        return query.order_by(SubAccount.create_time, SubAccount.id).offset((page - 1) * limit).limit(limit).all()
+
+    def get_accounts(self, client, emails, resync_missing=True):
+        """
+        按邮箱批量查询子账号
+
+        参数:
+        - client: 主账号客户端
+        - emails: 子账号邮箱列表
+        - resync_missing: 有邮箱不在表中且距离上次同步超过 MIN_RESYNC_INTERVAL 秒时，同步一次后重新查询
+
+        返回:
+        - dict: {email: SubAccount}，找不到的邮箱不包含在内
+        """
+        mid = master_id(client)
+
+        def query():
+            return {
+                account.email: account
+                for account in SubAccount.query.filter(SubAccount.email.in_(list(emails)),
+                                                       SubAccount.master_account == mid)
+            }
+
+        accounts = query()
+        if resync_missing and len(accounts) < len(set(emails)):
+            result = self._sync_if_stale(client, MIN_RESYNC_INTERVAL)
+            if result.get('synced'):
+                db.session.expire_all()
+                accounts = query()
+        return accounts
+
+    # ---------- 同步 ----------
+
+    def sync(self, client):
+        """
+        从币安读取完整的子账号列表和功能状态，增量写入 subaccounts 表
+
+        返回:
+        - dict: {'success', 'synced', 'error', 'added', 'updated', 'removed', 'total', 'pages', 'elapsed'}
+        """
+        mid = self._register(client)
+        with self._sync_lock:
+            return self._sync(client, mid)
+
+    def request_refresh(self, client):
+        """登记主账号并让后台线程尽快刷新(如创建子账号后)"""
+        mid = self._register(client)
+        self._synced_at[mid] = 0
+        self._wakeup.set()
+
+    def _sync_if_stale(self, client, max_age):
+        mid = self._register(client)
+        with self._sync_lock:
+            # 等待锁期间其他线程可能已经完成同步
+            synced_at = self._synced_at.get(mid)
+            if synced_at and time.time() - synced_at < max_age:
+                return {'success': True, 'synced': False}
+            return self._sync(client, mid)
+
+    def _sync(self, client, mid):
+        started = time.perf_counter()
+
+        items = []
+        complete = False
+        pages = 0
+        for page in range(1, MAX_PAGES + 1):
+            response = client._send_request('GET', LIST_ENDPOINT, signed=True,
+                                            params={'page': page, 'limit': self.page_size})
+            pages += 1
+            batch = _extract_list(response.get('data'), 'subAccounts', 'subAccountList') \
+                if isinstance(response, dict) and response.get('success') else None
+            if batch is None:
+                error = response.get('error', '未知错误') if isinstance(response, dict) else str(response)
+                logger.error(f"同步子账号列表失败(第{page}页): {error}")
+                if not items:
+                    return {'success': False, 'synced': False, 'error': f"获取子账号列表失败: {error}"}
+                break
+            items.extend(item for item in batch if isinstance(item, dict) and item.get('email'))
+            if len(batch) < self.page_size:
+                complete = True
+                break
+
+        statuses = None
+        response = client._send_request('GET', STATUS_ENDPOINT, signed=True)
+        if isinstance(response, dict) and response.get('success'):
+            status_list = _extract_list(response.get('data'), 'statusList') or []
+            statuses = {item['email']: item for item in status_list if isinstance(item, dict) and item.get('email')}
+        else:
+            error = response.get('error', '未知错误') if isinstance(response, dict) else str(response)
+            logger.warning(f"获取子账号功能状态失败，保留原有功能状态: {error}")
+
+        fetched = {item['email']: item for item in items}
+        added = updated = removed = 0
+        with Session(db.engine) as session:
+            try:
+                existing = {
+                    account.email: account
+                    for account in session.scalars(select(SubAccount).where(
+                        or_(SubAccount.master_account == mid, SubAccount.email.in_(list(fetched)))))
+                }
+                for email, item in fetched.items():
+                    account = existing.get(email)
+                    if statuses is not None:
+                        status_item = statuses.get(email, {})
+                    else:
+                        status_item = load_extra(account)[1] if account is not None else {}
+                    values = _row_values(mid, item, status_item)
+
+                    if account is None:
+                        session.add(SubAccount(email=email, **values))
+                        added += 1
+                    elif any(getattr(account, column) != values[column] for column in SYNC_COLUMNS):
+                        for column, value in values.items():
+                            setattr(account, column, value)
+                        updated += 1
+
+                if complete:
+                    for email, account in existing.items():
+                        if email not in fetched and account.master_account == mid:
+                            session.delete(account)
+                            removed += 1
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"保存子账号目录失败: {str(e)}")
+                return {'success': False, 'synced': False, 'error': f"保存子账号目录失败: {str(e)}"}
+
+        self._synced_at[mid] = time.time()
+        elapsed = round(time.perf_counter() - started, 3)
+        logger.info(f"子账号目录已同步: 共 {len(fetched)} 个，新增 {added}，更新 {updated}，删除 {removed}，"
+                    f"{pages} 页，耗时 {elapsed}秒")
+        return {
+            'success': True,
+            'synced': True,
+            'error': None,
+            'added': added,
+            'updated': updated,
+            'removed': removed,
+            'total': len(fetched),
+            'pages': pages,
+            'elapsed': elapsed
+        }
+
+    def _register(self, client):
+        mid = master_id(client)
+        self._clients[mid] = client
+        self._ensure_started()
+        return mid
+
+    # ---------- 后台刷新 ----------
+
+    def bind_app(self, app):
+        """记录应用实例，后台刷新线程在该应用的上下文中运行"""
+        self._app = app
+
+    def _ensure_started(self):
+        if self._app is None or not self.refresh_interval or self._stopped:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._thread = threading.Thread(target=self._run, name='subaccount-directory', daemon=True)
+        self._thread.start()
+        logger.info(f"子账号目录后台刷新已启动，间隔 {self.refresh_interval} 秒")
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            with self._app.app_context():
+                for mid, client in list(self._clients.items()):
+                    try:
+                        # 唤醒时间有误差，超过半个间隔即刷新；request_refresh 登记的主账号总会刷新
+                        self._sync_if_stale(client, self.refresh_interval / 2)
+                    except Exception as e:
+                        logger.error(f"刷新子账号目录异常: {str(e)}", exc_info=True)
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stopped = True
+        self._wakeup.set()
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_subaccount_directory():
+    """
+    获取进程级共享的子账号目录服务，首次调用时读取应用配置
+    """
+    global _directory
+
+    if _directory is not None:
+        return _directory
+
+    with _directory_lock:
+        if _directory is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'refresh_interval': config.get('SUBACCOUNT_DIRECTORY_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL),
+                    'page_size': config.get('SUBACCOUNT_DIRECTORY_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+                }
+            _directory = SubAccountDirectory(**options)
+        return _directory
+
+
+def init_app(app):
+    """
+    在应用创建时调用，绑定后台刷新线程使用的应用实例
+    """
+    with app.app_context():
+        get_subaccount_directory().bind_app(app)
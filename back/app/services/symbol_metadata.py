@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+交易对元数据模块
+
+统一加载并缓存现货、U本位合约、币本位合约的 exchangeInfo，为所有下单路径提供精度和取整查询。
+
+说明:
+1. 每个市场的 exchangeInfo 只在首次使用时下载一次，按交易对建立索引，查询为O(1)
+2. 每个交易对只保留下单需要的过滤器字段(PRICE_FILTER / LOT_SIZE / MIN_NOTIONAL)，不保存完整响应
+3. 后台线程定时刷新已加载的市场；响应内容(去掉serverTime)的摘要未变化时跳过重建索引，
+   服务器返回ETag时同时使用 If-None-Match 条件请求
+4. 刷新间隔通过配置 SYMBOL_METADATA_REFRESH_INTERVAL 调整，设为0时不启动后台线程，改为访问时按间隔重新加载
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP, InvalidOperation
+
+from flask import current_app, has_app_context
+
+from app.services.http_transport import get_session, resolve_service
+from app.services.rate_limiter import get_rate_governor, estimate_weight
+
+logger = logging.getLogger(__name__)
+
+# 各市场的交易规则接口
+MARKET_ENDPOINTS = {
+    'spot': 'https://api.binance.com/api/v3/exchangeInfo',
+    'um': 'https://fapi.binance.com/fapi/v1/exchangeInfo',
+    'cm': 'https://dapi.binance.com/dapi/v1/exchangeInfo'
+}
+
+# 默认刷新间隔(秒)
+DEFAULT_REFRESH_INTERVAL = 600
+
+# 加载失败后多久再重试(秒)，避免每次下单都重新下载
+RETRY_INTERVAL = 30
+
+_SERVER_TIME_PATTERN = re.compile(rb'"serverTime"\s*:\s*\d+')
+
+
+def _to_decimal(value):
+    """将过滤器中的字符串数值转换为Decimal，无效值返回None"""
+    if value in (None, ''):
+        return None
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def _decimals(step):
+    """根据步长计算小数位数，例如 0.001 -> 3"""
+    if not step:
+        return None
+    return max(0, -step.normalize().as_tuple().exponent)
+
+
+def _format_decimal(value):
+    """将Decimal格式化为不带科学计数法和尾部0的字符串"""
+    text = format(value, 'f')
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text or '0'
+
+
+class SymbolInfo:
+    """
+    单个交易对的下单规则
+    """
+
+    __slots__ = ('symbol', 'market', 'status', 'tick_size', 'step_size', 'min_qty', 'max_qty',
+                 'min_notional', 'price_precision', 'quantity_precision')
+
+    def __init__(self, symbol, market, status=None, tick_size=None, step_size=None, min_qty=None,
+                 max_qty=None, min_notional=None):
+        self.symbol = symbol
+        self.market = market
+        self.status = status
+        self.tick_size = tick_size
+        self.step_size = step_size
+        self.min_qty = min_qty
+        self.max_qty = max_qty
+        self.min_notional = min_notional
+        self.price_precision = _decimals(tick_size)
+        self.quantity_precision = _decimals(step_size)
+
+    @classmethod
+    def from_exchange_info(cls, market, item):
+        """根据 exchangeInfo 中的单个交易对数据创建"""
+        tick_size = step_size = min_qty = max_qty = min_notional = None
+
+        for filter_item in item.get('filters', []):
+            filter_type = filter_item.get('filterType')
+            if filter_type == 'PRICE_FILTER':
+                tick_size = _to_decimal(filter_item.get('tickSize'))
+            elif filter_type == 'LOT_SIZE':
+                step_size = _to_decimal(filter_item.get('stepSize'))
+                min_qty = _to_decimal(filter_item.get('minQty'))
+                max_qty = _to_decimal(filter_item.get('maxQty'))
+            elif filter_type in ('MIN_NOTIONAL', 'NOTIONAL'):
+                # 现货使用minNotional字段，U本位合约使用notional字段
+                min_notional = _to_decimal(filter_item.get('minNotional', filter_item.get('notional')))
+
+        return cls(
+            symbol=item.get('symbol'),
+            market=market,
+            status=item.get('status') or item.get('contractStatus'),
+            tick_size=tick_size,
+            step_size=step_size,
+            min_qty=min_qty,
+            max_qty=max_qty,
+            min_notional=min_notional
+        )
+
+    def round_quantity(self, quantity):
+        """按数量步长向下取整，避免超过可用余额"""
+        value = Decimal(str(quantity))
+        if self.step_size:
+            value = (value / self.step_size).to_integral_value(rounding=ROUND_DOWN) * self.step_size
+        return value
+
+    def round_price(self, price):
+        """按价格步长四舍五入"""
+        value = Decimal(str(price))
+        if self.tick_size:
+            value = (value / self.tick_size).to_integral_value(rounding=ROUND_HALF_UP) * self.tick_size
+        return value
+
+    def format_quantity(self, quantity):
+        """返回符合交易所要求的数量字符串"""
+        return _format_decimal(self.round_quantity(quantity))
+
+    def format_price(self, price):
+        """返回符合交易所要求的价格字符串"""
+        return _format_decimal(self.round_price(price))
+
+    def to_filters(self):
+        """转换为与 exchangeInfo 相同结构的过滤器字典"""
+        filters = {}
+        if self.tick_size:
+            filters['PRICE_FILTER'] = {'filterType': 'PRICE_FILTER', 'tickSize': _format_decimal(self.tick_size)}
+        if self.step_size or self.min_qty:
+            filters['LOT_SIZE'] = {
+                'filterType': 'LOT_SIZE',
+                'stepSize': _format_decimal(self.step_size or Decimal('0')),
+                'minQty': _format_decimal(self.min_qty or Decimal('0')),
+                'maxQty': _format_decimal(self.max_qty or Decimal('0'))
+            }
+        if self.min_notional:
+            filters['MIN_NOTIONAL'] = {'filterType': 'MIN_NOTIONAL', 'minNotional': _format_decimal(self.min_notional)}
+        return filters
+
+    def to_dict(self):
+        return {
+            'symbol': self.symbol,
+            'market': self.market,
+            'status': self.status,
+            'tickSize': _format_decimal(self.tick_size) if self.tick_size else None,
+            'stepSize': _format_decimal(self.step_size) if self.step_size else None,
+            'minQty': _format_decimal(self.min_qty) if self.min_qty else None,
+            'maxQty': _format_decimal(self.max_qty) if self.max_qty else None,
+            'minNotional': _format_decimal(self.min_notional) if self.min_notional else None,
+            'pricePrecision': self.price_precision,
+            'quantityPrecision': self.quantity_precision
+        }
+
+
+class SymbolMetadataService:
+    """
+    交易对元数据服务，进程内共享一个实例
+    """
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL, proxy=None):
+        self.refresh_interval = refresh_interval
+        self.proxy = proxy
+
+        # 市场 -> {交易对: SymbolInfo}，刷新时整体替换，读取无需加锁
+        self._indexes = {}
+        self._loaded_at = {}
+        self._fingerprints = {}
+        self._etags = {}
+        self._retry_at = {}
+
+        self._load_lock = threading.Lock()
+        self._app = None
+        self._refresher = None
+        self._stop_event = threading.Event()
+
+    # ---------- 查询 ----------
+
+    def get(self, symbol, market='spot'):
+        """
+        获取交易对规则
+
+        参数:
+        - symbol: 交易对，例如 BTCUSDT
+        - market: 市场 spot / um / cm
+
+        返回:
+        - SymbolInfo 或 None(交易对不存在或加载失败)
+        """
+        if not symbol:
+            return None
+
+        index = self._indexes.get(market)
+        if (index is None or self._is_expired(market)) and time.time() >= self._retry_at.get(market, 0):
+            self.refresh(market)
+            index = self._indexes.get(market)
+
+        if not index:
+            return None
+        return index.get(symbol.upper())
+
+    def status(self):
+        """返回各市场的加载状态"""
+        now = time.time()
+        return {
+            market: {
+                'symbols': len(index),
+                'age_seconds': round(now - self._loaded_at.get(market, now), 1),
+                'fingerprint': self._fingerprints.get(market)
+            }
+            for market, index in self._indexes.items()
+        }
+
+    def _is_expired(self, market):
+        # 后台线程运行时由线程负责刷新，访问路径不做同步刷新
+        if self._refresher is not None and self._refresher.is_alive():
+            return False
+        if not self.refresh_interval:
+            return False
+        return time.time() - self._loaded_at.get(market, 0) > self.refresh_interval
+
+    # ---------- 加载 ----------
+
+    def refresh(self, market):
+        """
+        下载并重建指定市场的索引
+
+        返回:
+        - bool: 索引是否发生变化
+        """
+        url = MARKET_ENDPOINTS.get(market)
+        if not url:
+            raise ValueError(f"不支持的市场类型: {market}")
+
+        with self._load_lock:
+            # 等待锁期间其他线程可能已经完成加载
+            if market in self._indexes and not self._is_expired(market) and not self._refreshing():
+                return False
+
+            try:
+                return self._download(market, url)
+            except Exception as e:
+                self._retry_at[market] = time.time() + RETRY_INTERVAL
+                logger.error(f"加载 {market} 交易规则失败: {str(e)}")
+                return False
+            finally:
+                self._ensure_refresher()
+
+    def _refreshing(self):
+        return threading.current_thread() is self._refresher
+
+    def _download(self, market, url):
+        service = resolve_service(url)
+        path = url.split('binance.com', 1)[-1]
+        governor = get_rate_governor()
+        if not governor.acquire(service, estimate_weight(path)):
+            logger.warning(f"请求频率超出限制，跳过本次 {market} 交易规则加载")
+            return False
+
+        headers = {}
+        if self._etags.get(market) and market in self._indexes:
+            headers['If-None-Match'] = self._etags[market]
+
+        response = get_session(url, self.proxy).get(url, headers=headers, timeout=15)
+        governor.update_from_headers(service, response.headers, status_code=response.status_code)
+
+        if response.status_code == 304:
+            self._loaded_at[market] = time.time()
+            return False
+
+        response.raise_for_status()
+
+        if response.headers.get('ETag'):
+            self._etags[market] = response.headers['ETag']
+
+        # serverTime每次都会变化，计算摘要时排除
+        fingerprint = hashlib.sha1(_SERVER_TIME_PATTERN.sub(b'', response.content)).hexdigest()
+        if fingerprint == self._fingerprints.get(market) and market in self._indexes:
+            self._loaded_at[market] = time.time()
+            logger.debug(f"{market} 交易规则未变化")
+            return False
+
+        index = {}
+        for item in response.json().get('symbols', []):
+            info = SymbolInfo.from_exchange_info(market, item)
+            if info.symbol:
+                index[info.symbol] = info
+
+        self._indexes[market] = index
+        self._fingerprints[market] = fingerprint
+        self._loaded_at[market] = time.time()
+        logger.info(f"已加载 {market} 交易规则: {len(index)} 个交易对")
+        return True
+
+    # ---------- 后台刷新 ----------
+
+    def bind_app(self, app):
+        """记录应用实例，后台刷新线程在该应用的上下文中运行"""
+        self._app = app
+
+    def _ensure_refresher(self):
+        if self._app is None or not self.refresh_interval:
+            return
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name='symbol-metadata', daemon=True)
+        self._refresher.start()
+        logger.info(f"交易规则后台刷新已启动，间隔 {self.refresh_interval} 秒")
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            with self._app.app_context():
+                for market in list(self._indexes.keys()):
+                    self.refresh(market)
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stop_event.set()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_symbol_metadata():
+    """
+    获取进程级共享的交易对元数据服务，首次调用时读取应用配置
+    """
+    global _service
+
+    if _service is not None:
+        return _service
+
+    with _service_lock:
+        if _service is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'refresh_interval': config.get('SYMBOL_METADATA_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL),
+                    'proxy': config.get('BINANCE_PROXY')
+                }
+            _service = SymbolMetadataService(**options)
+        return _service
+
+
+def init_app(app):
+    """
+    在应用创建时调用，绑定后台刷新线程使用的应用实例
+    """
+    with app.app_context():
+        get_symbol_metadata().bind_app(app)
+
+
+def get_symbol_info(symbol, market='spot'):
+    """
+    获取交易对规则的便捷函数
+
+    参数:
+    - symbol: 交易对
+    - market: 市场 spot / um / cm
+
+    返回:
+    - SymbolInfo 或 None
+    """
+    return get_symbol_metadata().get(symbol, market)
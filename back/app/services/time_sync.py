@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+服务器时间同步模块
+
+在进程内维护一个与币安服务器的时间偏移量，所有 BinanceClient 签名时共用，
+不再依赖每个客户端实例单独调用 sync_time，也不再需要 60 秒的 recvWindow。
+
+说明:
+1. 每次同步连续请求 /api/v3/time 多次，以请求往返时间的中点作为本地时间计算偏移(RTT补偿)，取各次偏移的中位数
+2. 首次获取偏移量时同步测量一次，之后后台线程按 TIME_SYNC_INTERVAL 定时重新测量
+3. 签名请求返回 -1021(时间戳超出recvWindow)时由客户端调用 sync(force=True) 立即重新测量
+4. 测量失败时保留上一次的偏移量，并在一个同步间隔内不再重复尝试
+"""
+
+import logging
+import statistics
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from app.services.http_transport import get_session
+
+logger = logging.getLogger(__name__)
+
+TIME_URL = 'https://api.binance.com/api/v3/time'
+
+DEFAULT_INTERVAL = 60
+DEFAULT_SAMPLES = 5
+
+# 强制同步的最短间隔(秒)，避免大量 -1021 同时触发重复测量
+MIN_FORCE_INTERVAL = 2
+
+
+class TimeSync:
+    """
+    币安服务器时间偏移量，进程内共享一个实例
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, samples=DEFAULT_SAMPLES, proxy=None):
+        self.interval = interval
+        self.samples = max(1, samples)
+        self.proxy = proxy
+
+        self._offset = 0
+        self._rtt = None
+        self._synced_at = 0
+        self._attempted_at = 0
+        self._sync_lock = threading.Lock()
+        self._refresher = None
+        self._stop_event = threading.Event()
+
+    @property
+    def offset(self):
+        """
+        当前时间偏移量(毫秒)，服务器时间 = 本地时间 + 偏移量
+        """
+        if not self._attempted_at:
+            self.sync()
+        self._ensure_refresher()
+        return self._offset
+
+    @property
+    def attempted(self):
+        """是否已尝试过同步，未尝试时首次读取偏移量会同步测量"""
+        return bool(self._attempted_at)
+
+    def now(self):
+        """返回校正后的当前时间戳(毫秒)"""
+        return int(time.time() * 1000 + self.offset)
+
+    def sync(self, force=False):
+        """
+        测量并更新时间偏移量
+
+        参数:
+        - force: 是否立即重新测量，为False时距上次尝试不足一个同步间隔则跳过
+
+        返回:
+        - dict: {'success': True, 'data': {'offset', 'rtt', 'samples', 'server_time', 'local_time', 'synchronized'}}
+                或 {'success': False, 'error': ...}
+        """
+        with self._sync_lock:
+            since_attempt = time.time() - self._attempted_at
+            if since_attempt < (MIN_FORCE_INTERVAL if force else self.interval):
+                return {'success': True, 'data': self._status()}
+
+            self._attempted_at = time.time()
+            try:
+                offset, rtt, count = self._measure()
+            except Exception as e:
+                logger.warning(f"同步币安服务器时间失败，继续使用偏移量 {self._offset}ms: {str(e)}")
+                return {'success': False, 'error': f"同步币安服务器时间失败: {str(e)}"}
+
+            if self._synced_at and abs(offset - self._offset) > 1000:
+                logger.warning(f"币安服务器时间偏移量变化较大: {self._offset}ms -> {offset}ms")
+
+            self._offset = offset
+            self._rtt = rtt
+            self._synced_at = time.time()
+            logger.info(f"时间同步成功 - 偏移量: {offset}ms, 往返时间: {rtt}ms, 样本数: {count}")
+            return {'success': True, 'data': self._status()}
+
+    def _measure(self):
+        session = get_session(TIME_URL, self.proxy)
+        offsets = []
+        rtts = []
+        errors = []
+
+        for _ in range(self.samples):
+            try:
+                sent = time.time() * 1000
+                response = session.get(TIME_URL, timeout=5)
+                received = time.time() * 1000
+                response.raise_for_status()
+                server_time = response.json()['serverTime']
+            except Exception as e:
+                errors.append(str(e))
+                continue
+
+            # 服务器时间对应请求往返的中点
+            offsets.append(server_time - (sent + received) / 2)
+            rtts.append(received - sent)
+
+        if not offsets:
+            raise RuntimeError(errors[-1] if errors else '没有可用的时间样本')
+
+        return int(round(statistics.median(offsets))), int(round(statistics.median(rtts))), len(offsets)
+
+    def _status(self):
+        now = int(time.time() * 1000)
+        return {
+            'offset': self._offset,
+            'rtt': self._rtt,
+            'samples': self.samples,
+            'local_time': now,
+            'server_time': now + self._offset,
+            'synced_at': int(self._synced_at * 1000) if self._synced_at else None,
+            'synchronized': bool(self._synced_at)
+        }
+
+    def status(self):
+        """返回同步状态"""
+        return self._status()
+
+    # ---------- 后台同步 ----------
+
+    def _ensure_refresher(self):
+        if not self.interval:
+            return
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+
+        with self._sync_lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._stop_event.clear()
+            self._refresher = threading.Thread(target=self._refresh_loop, name='time-sync', daemon=True)
+            self._refresher.start()
+            logger.info(f"服务器时间后台同步已启动，间隔 {self.interval} 秒")
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.interval):
+            self.sync(force=True)
+
+    def stop(self):
+        """停止后台同步线程"""
+        self._stop_event.set()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_time_sync():
+    """
+    获取进程级共享的时间同步服务，首次调用时读取应用配置
+    """
+    global _service
+
+    if _service is not None:
+        return _service
+
+    with _service_lock:
+        if _service is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'interval': config.get('TIME_SYNC_INTERVAL', DEFAULT_INTERVAL),
+                    'samples': config.get('TIME_SYNC_SAMPLES', DEFAULT_SAMPLES),
+                    'proxy': config.get('BINANCE_PROXY')
+                }
+            _service = TimeSync(**options)
+        return _service
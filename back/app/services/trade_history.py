@@ -0,0 +1,212 @@
+"""
+本地订单/成交历史查询服务
+
+说明:
+1. 成交记录来自 trade_sync 同步的 MarginTrade(杠杆) 和 TradeHistory(U本位/币本位合约)，订单来自 OrderHistory
+2. 使用游标分页: 每张表按 (email, symbol, trade_time) 复合索引取下一页，再按 (成交时间, 主键) 倒序合并，
+   翻到第几页都只读取 limit+1 行，不使用 OFFSET
+3. 游标为上一页最后一行的 (时间, 主键)，同一游标对各张表通用
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, select
+
+from app.models import db, MarginTrade, OrderHistory, TradeHistory
+from app.utils.db import encode_cursor, keyset_paginate
+
+logger = logging.getLogger(__name__)
+
+# 支持查询的成交市场
+TRADE_MARKETS = ('margin', 'um', 'cm')
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 500
+
+
+def parse_local_date(value, end=False):
+    """
+    将本地日期 YYYY-MM-DD 转换为UTC时间(数据库中时间以UTC保存)
+
+    参数:
+    - value: 日期字符串，为空时返回None
+    - end: 是否为结束日期，为True时返回次日零点，以包含当天
+
+    异常:
+    - ValueError: 日期格式无效
+    """
+    if not value:
+        return None
+    day = datetime.strptime(value, '%Y-%m-%d')
+    if end:
+        day += timedelta(days=1)
+    return day.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def format_local_time(value):
+    """将UTC时间转换为本地时间字符串"""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).astimezone().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def clamp_page_size(value):
+    """限制每页数量在 1 到 MAX_PAGE_SIZE 之间"""
+    try:
+        value = int(value) if value is not None else DEFAULT_PAGE_SIZE
+    except (TypeError, ValueError):
+        value = DEFAULT_PAGE_SIZE
+    return max(1, min(value, MAX_PAGE_SIZE))
+
+
+def serialize_trade(trade):
+    """
+    将 MarginTrade / TradeHistory 记录转换为统一格式
+    """
+    if isinstance(trade, MarginTrade):
+        key, market, qty = trade.trade_id, 'MARGIN', trade.quantity
+    else:
+        key, market, qty = trade.id, trade.market, trade.qty
+
+    parts = key.split(':')
+    return {
+        'id': parts[2] if len(parts) > 2 else key,
+        'key': key,
+        'email': trade.email,
+        'orderId': trade.order_id,
+        'symbol': trade.symbol,
+        'market': market,
+        'side': trade.side,
+        'price': trade.price,
+        'qty': qty,
+        'commission': trade.commission,
+        'commissionAsset': trade.commission_asset,
+        'isMaker': trade.is_maker,
+        'realizedPnl': getattr(trade, 'realized_pnl', None),
+        'time': int(trade.trade_time.replace(tzinfo=timezone.utc).timestamp() * 1000),
+        'localTime': format_local_time(trade.trade_time)
+    }
+
+
+def _trade_sort_key(trade):
+    if isinstance(trade, MarginTrade):
+        return trade.trade_time, trade.trade_id
+    return trade.trade_time, trade.id
+
+
+def query_trades(email, markets=None, symbol=None, side=None, start=None, end=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    按游标分页查询本地成交记录，按成交时间倒序
+
+    参数:
+    - email: 子账号邮箱
+    - markets: 市场列表，margin / um / cm，默认全部
+    - symbol: 交易对(可选)
+    - side: BUY / SELL(可选)
+    - start: 开始时间(UTC，包含)
+    - end: 结束时间(UTC，不包含)
+    - cursor: 上一页返回的 next_cursor
+    - limit: 每页数量
+
+    返回:
+    - (trades, next_cursor): trades 为 MarginTrade / TradeHistory 对象列表
+
+    异常:
+    - ValueError: 游标格式无效
+    """
+    markets = [market for market in (markets or TRADE_MARKETS) if market in TRADE_MARKETS]
+    pages = []
+
+    if 'margin' in markets:
+        query = select(MarginTrade).where(MarginTrade.email == email)
+        query = _apply_filters(query, MarginTrade.symbol, MarginTrade.side, MarginTrade.trade_time, symbol, side, start, end)
+        pages.append(keyset_paginate(
+            query, [MarginTrade.trade_time, MarginTrade.trade_id], cursor, limit, scalars=True
+        ))
+
+    futures_markets = [market.upper() for market in markets if market != 'margin']
+    if futures_markets:
+        query = select(TradeHistory).where(TradeHistory.email == email, TradeHistory.market.in_(futures_markets))
+        query = _apply_filters(query, TradeHistory.symbol, TradeHistory.side, TradeHistory.trade_time, symbol, side, start, end)
+        pages.append(keyset_paginate(
+            query, [TradeHistory.trade_time, TradeHistory.id], cursor, limit, scalars=True
+        ))
+
+    # 合并各表的下一页，任一张表还有剩余或合并后超出 limit 都需要返回游标
+    trades = sorted((trade for rows, _ in pages for trade in rows), key=_trade_sort_key, reverse=True)
+    has_more = len(trades) > limit or any(next_cursor for _, next_cursor in pages)
+    trades = trades[:limit]
+
+    next_cursor = None
+    if has_more and trades:
+        next_cursor = encode_cursor(list(_trade_sort_key(trades[-1])))
+    return trades, next_cursor
+
+
+def count_trades(email, markets=None, symbol=None, side=None, start=None, end=None):
+    """
+    统计本地成交记录数(按页码翻页时使用，游标分页不需要)
+
+    参数同 query_trades
+    """
+    markets = [market for market in (markets or TRADE_MARKETS) if market in TRADE_MARKETS]
+    total = 0
+
+    if 'margin' in markets:
+        query = select(func.count()).select_from(MarginTrade).where(MarginTrade.email == email)
+        query = _apply_filters(query, MarginTrade.symbol, MarginTrade.side, MarginTrade.trade_time, symbol, side, start, end)
+        total += db.session.execute(query).scalar() or 0
+
+    futures_markets = [market.upper() for market in markets if market != 'margin']
+    if futures_markets:
+        query = select(func.count()).select_from(TradeHistory).where(
+            TradeHistory.email == email, TradeHistory.market.in_(futures_markets)
+        )
+        query = _apply_filters(query, TradeHistory.symbol, TradeHistory.side, TradeHistory.trade_time, symbol, side, start, end)
+        total += db.session.execute(query).scalar() or 0
+
+    return total
+
+
+def query_orders(email=None, symbol=None, statuses=None, side=None, grid_id=None, start=None, end=None,
+                 cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    按游标分页查询本地订单记录(OrderHistory)，按创建时间倒序
+
+    参数:
+    - email: 子账号邮箱(可选)
+    - symbol: 交易对(可选)
+    - statuses: 订单状态列表(可选)
+    - side: BUY / SELL(可选)
+    - grid_id: 网格ID(可选)
+    - start / end: 创建时间范围(UTC)
+    - cursor: 上一页返回的 next_cursor
+    - limit: 每页数量
+
+    返回:
+    - (orders, next_cursor)
+
+    异常:
+    - ValueError: 游标格式无效
+    """
+    query = select(OrderHistory)
+    if email:
+        query = query.where(OrderHistory.email == email)
+    if statuses:
+        query = query.where(OrderHistory.status.in_(statuses))
+    if grid_id:
+        query = query.where(OrderHistory.grid_id == grid_id)
+    query = _apply_filters(query, OrderHistory.symbol, OrderHistory.side, OrderHistory.created_at, symbol, side, start, end)
+
+    return keyset_paginate(query, [OrderHistory.created_at, OrderHistory.id], cursor, limit, scalars=True)
+
+
+def _apply_filters(query, symbol_column, side_column, time_column, symbol, side, start, end):
+    if symbol:
+        query = query.where(symbol_column == symbol)
+    if side:
+        query = query.where(side_column == side)
+    if start:
+        query = query.where(time_column >= start)
+    if end:
+        query = query.where(time_column < end)
+    return query
@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+"""
+成交记录同步模块
+
+按子账号、市场(杠杆 margin / U本位 um / 币本位 cm)、交易对增量拉取成交记录，写入本地数据库:
+杠杆成交写入 MarginTrade，合约成交写入 TradeHistory，每笔成交的手续费写入 FeeRecord 并累加到日汇总 FeeRollup。
+手续费统计和成交历史接口直接查询本地数据库，不再每次访问都从币安下载。
+
+说明:
+1. 同步进度保存在 TradeSyncState 中，下次从已同步的最大成交ID之后继续拉取(fromId)；
+   首次同步按天查询最近 TRADE_SYNC_INITIAL_DAYS 天，找到第一批成交后改为按成交ID翻页
+2. 优先使用统一账户(papi)接口，被交易所拒绝时改用普通账户接口(sapi/fapi/dapi)，并记住该账号的判断结果
+3. 成交按唯一键写入并忽略冲突，只为实际新写入的成交生成手续费记录，重复同步不会产生重复数据
+4. 多个账号、交易对的同步任务通过批量执行器并发执行，同一账号、市场、交易对同时只有一个同步任务
+5. 未指定交易对时，同步该账号已同步过的交易对和交易对列表(TradingPair)中的交易对
+6. 查询接口不在请求中同步: sync_status 只读取同步进度判断是否过期，过期时由 request_refresh 提交后台同步任务，
+   相同参数的同步任务未结束前不会重复提交
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+from app.models import db
+from app.models.trading import MarginTrade, TradeHistory, TradeSyncState
+from app.services.batch_executor import iter_batch, resolve_concurrency
+from app.services.client_registry import get_client_registry
+from app.services.fee_rollup import record_fees
+from app.services.job_queue import get_job_queue, report_progress
+from app.services.rate_limiter import estimate_weight
+from app.utils.db import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+# 市场 -> 成交接口和手续费来源
+SYNC_MARKETS = {
+    'margin': {
+        'papi': '/papi/v1/margin/myTrades',
+        'classic': '/sapi/v1/margin/myTrades',
+        'source': 'MARGIN'
+    },
+    'um': {
+        'papi': '/papi/v1/um/userTrades',
+        'classic': '/fapi/v1/userTrades',
+        'source': 'UM'
+    },
+    'cm': {
+        'papi': '/papi/v1/cm/userTrades',
+        'classic': '/dapi/v1/userTrades',
+        'source': 'CM'
+    }
+}
+
+# 单次请求的最大成交数
+PAGE_LIMIT = 1000
+
+DAY_MS = 86400 * 1000
+
+DEFAULT_INITIAL_DAYS = 7
+DEFAULT_MAX_PAGES = 20
+DEFAULT_MAX_AGE = 60
+
+# (子账号邮箱, 市场) -> 'papi' / 'classic'
+_account_modes = {}
+
+
+def trade_key(market, symbol, trade_id, side):
+    """
+    成交唯一键: 同一笔成交的买卖双方可能都是本系统管理的子账号，因此包含方向
+    """
+    return f"{market.upper()}:{symbol}:{trade_id}:{side}"
+
+
+def _to_datetime(timestamp):
+    return datetime.utcfromtimestamp(int(timestamp) / 1000) if timestamp else None
+
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class TradeSyncEngine:
+    """
+    成交记录同步器，进程内共享一个实例
+    """
+
+    def __init__(self, initial_days=DEFAULT_INITIAL_DAYS, max_pages=DEFAULT_MAX_PAGES, max_age=DEFAULT_MAX_AGE):
+        self.initial_days = initial_days
+        self.max_pages = max_pages
+        self.max_age = max_age
+
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._refresh_jobs = {}
+
+    # ---------- 批量同步 ----------
+
+    def sync_accounts(self, emails, markets=None, symbols=None, max_age=None, concurrency=None):
+        """
+        并发同步多个子账号的成交记录
+
+        参数:
+        - emails: 子账号邮箱列表
+        - markets: 市场列表，默认全部(margin, um, cm)
+        - symbols: 交易对列表(可选)，币本位合约可传标的(如BTCUSD)或合约(如BTCUSD_PERP)
+        - max_age: 距上次同步不足该秒数的交易对跳过，默认每次都同步
+        - concurrency: 并发数(可选)
+
+        返回:
+        - dict: {'success', 'data': {'results', 'inserted', 'failed', 'skipped'}}
+        """
+        tasks, results = self._tasks(emails, markets, symbols)
+
+        skipped = 0
+        if max_age:
+            fresh = self._fresh_keys(tasks, max_age)
+            skipped = len(fresh)
+            tasks = [task for task in tasks if task not in fresh]
+
+        report_progress(total=len(tasks) + len(results))
+        for result in results:
+            report_progress(result)
+
+        if tasks:
+            weight = max(estimate_weight(SYNC_MARKETS[market]['papi']) for _, market, _ in tasks)
+            concurrency = resolve_concurrency(concurrency, service='papi', task_count=len(tasks), weight_per_task=weight)
+            started = time.perf_counter()
+            for _, result in iter_batch(tasks, self.sync_one, concurrency):
+                results.append(result)
+                report_progress(result)
+            logger.info(f"成交同步完成: 任务数={len(tasks)}, 并发={concurrency}, 耗时={round(time.perf_counter() - started, 2)}秒")
+
+        inserted = sum(result.get('inserted', 0) for result in results)
+        failed = sum(1 for result in results if not result.get('success'))
+        return {
+            'success': failed < len(results) or not results,
+            'data': {
+                'results': results,
+                'inserted': inserted,
+                'failed': failed,
+                'skipped': skipped
+            }
+        }
+
+    def sync_status(self, emails, markets=None, symbols=None, max_age=None):
+        """
+        读取同步进度，不请求币安
+
+        参数:
+        - max_age: 距上次同步超过该秒数视为过期，默认使用 TRADE_SYNC_MAX_AGE
+
+        返回:
+        - dict: {'stale': 是否有过期或从未同步的交易对, 'syncedAt': 最早的同步时间, 'errors': 最近一次同步的错误}
+        """
+        max_age = self.max_age if max_age is None else max_age
+        tasks, results = self._tasks(emails, markets, symbols)
+        states = {}
+        if tasks:
+            emails = {email for email, _, _ in tasks}
+            for state in TradeSyncState.query.filter(TradeSyncState.email.in_(emails)).all():
+                states[(state.email, state.market, state.symbol)] = state
+
+        now = datetime.utcnow()
+        stale = False
+        synced_at = None
+        errors = [result['error'] for result in results]
+        for task in tasks:
+            state = states.get(task)
+            if state is None or state.synced_at is None:
+                stale = True
+                continue
+            if state.error:
+                errors.append(state.error)
+            if (now - state.synced_at).total_seconds() >= max_age:
+                stale = True
+            if synced_at is None or state.synced_at < synced_at:
+                synced_at = state.synced_at
+
+        return {
+            'stale': stale,
+            'syncedAt': synced_at.isoformat() if synced_at else None,
+            'errors': errors
+        }
+
+    def request_refresh(self, emails, markets=None, symbols=None, max_age=None):
+        """
+        提交后台同步任务，不等待同步完成；相同参数的任务未结束时直接返回该任务
+
+        返回:
+        - JobState 实例，队列已满时返回None
+        """
+        max_age = self.max_age if max_age is None else max_age
+        key = (tuple(sorted(emails)), tuple(sorted(markets or SYNC_MARKETS)), tuple(sorted(symbols or ())))
+        with self._lock:
+            for finished in [item for item, job in self._refresh_jobs.items() if job.finished]:
+                del self._refresh_jobs[finished]
+            job = self._refresh_jobs.get(key)
+            if job is not None:
+                return job
+            job = get_job_queue().submit(
+                'trade_sync.refresh', self.sync_accounts, list(emails),
+                markets=markets, symbols=symbols, max_age=max_age,
+                params={'emails': list(emails), 'markets': markets, 'symbols': symbols}
+            )
+            if job is not None:
+                self._refresh_jobs[key] = job
+            return job
+
+    def _tasks(self, emails, markets=None, symbols=None):
+        """
+        返回:
+        - (同步任务列表 [(email, market, symbol)], 未配置API的子账号结果列表)
+        """
+        markets = [market for market in (markets or SYNC_MARKETS) if market in SYNC_MARKETS]
+        registry = get_client_registry()
+
+        tasks = []
+        results = []
+        for email in emails:
+            if not registry.has_credentials(email):
+                results.append({'email': email, 'success': False, 'error': '子账号API未配置'})
+                continue
+            for market in markets:
+                for symbol in self.resolve_symbols(email, market, symbols):
+                    tasks.append((email, market, symbol))
+        return tasks, results
+
+    def resolve_symbols(self, email, market, symbols=None):
+        """
+        获取需要同步的交易对
+
+        参数:
+        - symbols: 指定的交易对，为空时使用已同步过的交易对和交易对列表
+        """
+        if symbols:
+            return sorted({self._market_symbol(market, symbol) for symbol in symbols if symbol})
+
+        from app.models.trading_pair import TradingPair
+
+        resolved = {
+            state.symbol for state in TradeSyncState.query.filter_by(email=email, market=market).all()
+        }
+        for pair in TradingPair.query.all():
+            resolved.add(self._market_symbol(market, pair.symbol))
+        return sorted(symbol for symbol in resolved if symbol)
+
+    @staticmethod
+    def _market_symbol(market, symbol):
+        symbol = symbol.upper()
+        # 币本位合约按标的同步，BTCUSDT -> BTCUSD
+        if market == 'cm' and '_' not in symbol and symbol.endswith('USDT'):
+            return symbol[:-1]
+        return symbol
+
+    @staticmethod
+    def _fresh_keys(tasks, max_age):
+        emails = {email for email, _, _ in tasks}
+        if not emails:
+            return set()
+        now = datetime.utcnow()
+        fresh = set()
+        for state in TradeSyncState.query.filter(TradeSyncState.email.in_(emails)).all():
+            if state.synced_at and (now - state.synced_at).total_seconds() < max_age:
+                fresh.add((state.email, state.market, state.symbol))
+        return fresh
+
+    # ---------- 单个交易对同步 ----------
+
+    def sync_one(self, task):
+        """
+        同步一个子账号、市场、交易对的新成交
+
+        参数:
+        - task: (email, market, symbol)
+
+        返回:
+        - dict: {'email', 'market', 'symbol', 'success', 'fetched', 'inserted', 'last_trade_id', 'error'}
+        """
+        email, market, symbol = task
+        result = {'email': email, 'market': market, 'symbol': symbol, 'success': False, 'fetched': 0, 'inserted': 0}
+
+        with self._key_lock(task):
+            client = get_client_registry().get_client(email)
+            if client is None:
+                result['error'] = '子账号API未配置或不可用'
+                return result
+
+            state = TradeSyncState.query.filter_by(email=email, market=market, symbol=symbol).first()
+            if state is None:
+                state = TradeSyncState(email=email, market=market, symbol=symbol, trade_count=0)
+                db.session.add(state)
+
+            base_params = {self._symbol_param(market, symbol): symbol, 'limit': PAGE_LIMIT}
+            error = None
+            more = True
+
+            if state.last_trade_id is None:
+                # 首次同步: 按时间窗口向后查找第一批成交，之后按成交ID翻页
+                more = False
+                for window_start, window_end in self._initial_windows(state):
+                    params = dict(base_params, startTime=window_start, endTime=window_end)
+                    trades, error = self._fetch_trades(client, email, market, params)
+                    if error:
+                        break
+                    self._apply(email, market, state, trades, result)
+                    if len(trades) >= PAGE_LIMIT:
+                        more = True
+                        break
+
+            pages = 0
+            while more and error is None and state.last_trade_id is not None and pages < self.max_pages:
+                params = dict(base_params, fromId=state.last_trade_id + 1)
+                trades, error = self._fetch_trades(client, email, market, params)
+                pages += 1
+                if error:
+                    break
+                self._apply(email, market, state, trades, result)
+                more = len(trades) >= PAGE_LIMIT
+
+            state.trade_count = (state.trade_count or 0) + result['inserted']
+            state.error = error
+            if error is None:
+                state.synced_at = datetime.utcnow()
+            db.session.commit()
+
+        result['success'] = error is None
+        result['last_trade_id'] = state.last_trade_id
+        if error:
+            result['error'] = error
+            logger.warning(f"同步成交失败: {email} {market}:{symbol} - {error}")
+        return result
+
+    def _initial_windows(self, state):
+        """
+        首次同步的查询时间窗口(毫秒)，杠杆成交接口单次查询不能超过24小时，因此按天划分；
+        之前同步过但没有成交时，只查询上次同步之后的时间
+        """
+        now = int(time.time() * 1000)
+        start = now - self.initial_days * DAY_MS
+        if state.synced_at:
+            start = max(start, int((state.synced_at - datetime(1970, 1, 1)).total_seconds() * 1000) - 60000)
+
+        windows = []
+        while start < now:
+            windows.append((start, min(start + DAY_MS - 1, now)))
+            start += DAY_MS
+        return windows
+
+    def _fetch_trades(self, client, email, market, params):
+        """
+        返回:
+        - (按成交ID排序的成交列表, 错误信息)
+        """
+        response = self._fetch(client, email, market, params)
+        if not response.get('success'):
+            return [], response.get('error') or '获取成交记录失败'
+        data = response.get('data')
+        if not isinstance(data, list):
+            return [], f"成交记录格式错误: {str(data)[:100]}"
+        return sorted(data, key=lambda trade: int(trade['id'])), None
+
+    def _apply(self, email, market, state, trades, result):
+        """写入一页成交并更新同步进度"""
+        if not trades:
+            return
+        result['fetched'] += len(trades)
+        result['inserted'] += self._store(email, market, trades)
+        state.last_trade_id = int(trades[-1]['id'])
+        state.last_trade_time = _to_datetime(trades[-1].get('time'))
+
+    @staticmethod
+    def _symbol_param(market, symbol):
+        # 币本位合约按标的查询时使用 pair 参数
+        return 'pair' if market == 'cm' and '_' not in symbol else 'symbol'
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _fetch(self, client, email, market, params):
+        """优先使用统一账户接口，被拒绝时改用普通账户接口"""
+        endpoints = SYNC_MARKETS[market]
+        mode = _account_modes.get((email, market))
+
+        if mode != 'classic':
+            response = client._send_request('GET', endpoints['papi'], signed=True, params=dict(params))
+            if response.get('success') or mode == 'papi' or response.get('code') is None:
+                if response.get('success'):
+                    _account_modes[(email, market)] = 'papi'
+                return response
+            logger.info(f"子账号 {email} 的统一账户成交接口不可用({response.get('error')})，改用普通账户接口")
+
+        response = client._send_request('GET', endpoints['classic'], signed=True, params=dict(params))
+        if response.get('success'):
+            _account_modes[(email, market)] = 'classic'
+        return response
+
+    # ---------- 写入 ----------
+
+    def record_trades(self, email, market, trades):
+        """
+        写入调用方已获取的成交(如下单后查询到的成交)，与同步使用相同的唯一键，之后同步到同一成交时不会重复记录
+
+        参数:
+        - trades: 币安成交接口返回的成交列表
+
+        返回:
+        - int: 新写入的成交数
+        """
+        if not trades:
+            return 0
+        return self._store(email, market, trades)
+
+    def _store(self, email, market, trades):
+        """
+        写入成交和手续费记录，返回新写入的成交数
+        """
+        source = SYNC_MARKETS[market]['source']
+        fees = {}
+
+        if market == 'margin':
+            rows = []
+            for trade in trades:
+                side = 'BUY' if trade.get('isBuyer') else 'SELL'
+                key = trade_key(market, trade['symbol'], trade['id'], side)
+                rows.append({
+                    'trade_id': key,
+                    'email': email,
+                    'symbol': trade['symbol'],
+                    'order_id': str(trade.get('orderId')),
+                    'side': side,
+                    'price': _to_float(trade.get('price')),
+                    'quantity': _to_float(trade.get('qty')),
+                    'commission': _to_float(trade.get('commission')),
+                    'commission_asset': trade.get('commissionAsset') or '',
+                    'is_buyer': bool(trade.get('isBuyer')),
+                    'is_maker': bool(trade.get('isMaker')),
+                    'trade_time': _to_datetime(trade.get('time')),
+                    'created_at': datetime.utcnow()
+                })
+                fees[key] = trade
+            inserted = insert_ignore(MarginTrade, rows, ['trade_id'], returning='trade_id')
+        else:
+            rows = []
+            for trade in trades:
+                side = trade.get('side') or ('BUY' if trade.get('buyer') else 'SELL')
+                key = trade_key(market, trade['symbol'], trade['id'], side)
+                now = datetime.utcnow()
+                rows.append({
+                    'id': key,
+                    'email': email,
+                    'symbol': trade['symbol'],
+                    'side': side,
+                    'price': _to_float(trade.get('price')),
+                    'qty': _to_float(trade.get('qty')),
+                    # 币本位合约没有 quoteQty，使用标的数量
+                    'quote_qty': _to_float(trade.get('quoteQty', trade.get('baseQty'))),
+                    'commission': _to_float(trade.get('commission')),
+                    'commission_asset': trade.get('commissionAsset') or '',
+                    'is_maker': bool(trade.get('maker')),
+                    'trade_time': _to_datetime(trade.get('time')),
+                    'market': market.upper(),
+                    'trade_id': int(trade['id']),
+                    'order_id': str(trade.get('orderId')),
+                    'realized_pnl': _to_float(trade.get('realizedPnl'), None),
+                    'created_at': now,
+                    'updated_at': now
+                })
+                fees[key] = trade
+            inserted = insert_ignore(TradeHistory, rows, ['id'], returning='id')
+
+        fee_rows = []
+        for key in inserted:
+            trade = fees[key]
+            fee_amount = _to_float(trade.get('commission'))
+            if not fee_amount:
+                continue
+            fee_rows.append({
+                'email': email,
+                'symbol': trade['symbol'],
+                'order_id': str(trade.get('orderId')),
+                'fee_amount': fee_amount,
+                'fee_asset': trade.get('commissionAsset') or '',
+                'source': source,
+                'description': key,
+                'trade_time': _to_datetime(trade.get('time')),
+                'created_at': datetime.utcnow()
+            })
+        record_fees(fee_rows)
+
+        db.session.commit()
+        return len(inserted)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_trade_sync():
+    """
+    获取进程级共享的成交同步器，首次调用时读取应用配置
+    """
+    global _engine
+
+    if _engine is not None:
+        return _engine
+
+    with _engine_lock:
+        if _engine is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'initial_days': config.get('TRADE_SYNC_INITIAL_DAYS', DEFAULT_INITIAL_DAYS),
+                    'max_pages': config.get('TRADE_SYNC_MAX_PAGES', DEFAULT_MAX_PAGES),
+                    'max_age': config.get('TRADE_SYNC_MAX_AGE', DEFAULT_MAX_AGE)
+                }
+            _engine = TradeSyncEngine(**options)
+        return _engine
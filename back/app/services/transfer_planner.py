@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+批量转账规划模块
+
+将批量转账请求整理为转账腿(from -> to, 资产, 金额)，预检、轧差后并发执行，返回统一的转账明细。
+
+说明:
+1. 主账号在转账腿中以 None 表示；子账号转主账号使用子账号自己的API(客户端注册表中复用)，其余使用主账号API
+2. 同一对账号之间同一资产存在相反方向的转账时合并为一笔净额转账，净额为0时不发起请求
+3. 执行前一次性并发查询所有转出账号的现货余额快照，按顺序扣减可用余额，余额不足的转账直接拒绝；
+   同一分组中排在前面的转入金额计入可用余额(如 主账号->A 后接 A->B)；
+   账号还会收到其他分组的转入时执行顺序不确定，余额不足也不拒绝；查询失败的账号不做预检，由交易所校验
+4. 转出子账号相同的转账串行执行(主账号转入子账号的按收款子账号分组)，不同分组并发执行，
+   主账号转出的总额已在预检中按快照扣减
+5. 每笔转账记录开始/完成时间(相对于规划开始的毫秒数)
+"""
+
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+
+from app.services.batch_executor import iter_batch, resolve_concurrency, run_batch
+from app.services.rate_limiter import estimate_weight
+
+logger = logging.getLogger(__name__)
+
+MASTER_LABEL = '主账号'
+
+# 余额快照接口
+SUB_ASSETS_ENDPOINT = '/sapi/v3/sub-account/assets'
+MASTER_ACCOUNT_ENDPOINT = '/api/v3/account'
+
+
+def _format_amount(amount):
+    return format(amount.normalize(), 'f')
+
+
+class TransferLeg:
+    """
+    一笔待执行的转账
+
+    属性:
+    - sources: 合并到该笔转账的请求序号
+    """
+
+    __slots__ = ('from_email', 'to_email', 'asset', 'amount', 'sources', 'success', 'message', 'tx_id',
+                 'started_ms', 'finished_ms')
+
+    def __init__(self, from_email, to_email, asset, amount, sources):
+        self.from_email = from_email or None
+        self.to_email = to_email or None
+        self.asset = asset
+        self.amount = amount
+        self.sources = sources
+        self.success = None
+        self.message = None
+        self.tx_id = None
+        self.started_ms = None
+        self.finished_ms = None
+
+    @property
+    def lane(self):
+        """串行执行分组: 转出子账号，主账号转出时为收款子账号"""
+        return self.from_email or self.to_email
+
+    def to_dict(self):
+        return {
+            'fromEmail': self.from_email or MASTER_LABEL,
+            'toEmail': self.to_email or MASTER_LABEL,
+            'asset': self.asset,
+            'amount': _format_amount(self.amount),
+            'sources': self.sources,
+            'success': self.success,
+            'message': self.message,
+            'txID': self.tx_id,
+            'started_ms': self.started_ms,
+            'finished_ms': self.finished_ms
+        }
+
+
+class TransferPlan:
+    """
+    批量转账规划与执行
+
+    参数:
+    - master_client: 主账号 BinanceClient
+    - entries: 转账请求列表，每项包含 fromEmail / toEmail(为空表示主账号) / asset / amount，
+      可附带 email 等字段，原样返回到对应结果中
+    """
+
+    def __init__(self, master_client, entries):
+        self.master_client = master_client
+        self.entries = list(entries)
+        self.results = [None] * len(self.entries)
+        self.legs = []
+        self.executable = None
+        self.netted = 0
+        self.rejected = 0
+        self.timings = {}
+        self._started = time.perf_counter()
+
+    # ---------- 规划 ----------
+
+    def build(self):
+        """校验请求并合并相反方向的转账"""
+        groups = {}
+        order = []
+        for index, entry in enumerate(self.entries):
+            from_email = entry.get('fromEmail') or None
+            to_email = entry.get('toEmail') or None
+            asset = entry.get('asset')
+            try:
+                amount = Decimal(str(entry.get('amount')))
+            except (InvalidOperation, ValueError):
+                amount = None
+
+            if not asset or amount is None or amount <= 0:
+                self._finish_entry(index, False, "缺少必要参数或金额无效: asset, amount")
+                continue
+            if not from_email and not to_email:
+                self._finish_entry(index, False, "源账号和目标账号邮箱不能为空")
+                continue
+            if from_email == to_email:
+                self._finish_entry(index, False, "源账号和目标账号不能相同")
+                continue
+
+            key = (frozenset((from_email or '', to_email or '')), asset)
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append((index, from_email, to_email, amount))
+
+        for key in order:
+            items = groups[key]
+            directions = {(from_email, to_email) for _, from_email, to_email, _ in items}
+            if len(directions) == 1:
+                self.legs.extend(
+                    TransferLeg(from_email, to_email, key[1], amount, [index])
+                    for index, from_email, to_email, amount in items
+                )
+                continue
+
+            # 相反方向的转账轧差为一笔
+            forward = (items[0][1], items[0][2])
+            net = sum(amount if (from_email, to_email) == forward else -amount
+                      for _, from_email, to_email, amount in items)
+            sources = [index for index, _, _, _ in items]
+            self.netted += len(items)
+            if net == 0:
+                for index in sources:
+                    self._finish_entry(index, True, "与反向转账完全抵消，无需转账")
+                continue
+            from_email, to_email = forward if net > 0 else (forward[1], forward[0])
+            self.legs.append(TransferLeg(from_email, to_email, key[1], abs(net), sources))
+            logger.info(f"转账轧差: {len(items)} 笔合并为 {from_email or MASTER_LABEL} -> {to_email or MASTER_LABEL} {abs(net)} {key[1]}")
+        return self
+
+    def validate(self, concurrency=None):
+        """
+        查询转出账号余额快照，余额不足的转账标记为拒绝
+        """
+        started = time.perf_counter()
+        accounts = list(dict.fromkeys(leg.from_email for leg in self.legs))
+
+        def load_balance(account):
+            if account is None:
+                response = self.master_client._send_request('GET', MASTER_ACCOUNT_ENDPOINT, signed=True)
+            else:
+                response = self.master_client._send_request('GET', SUB_ASSETS_ENDPOINT, signed=True, params={'email': account})
+            if not response.get('success'):
+                logger.warning(f"获取 {account or MASTER_LABEL} 余额快照失败，跳过预检: {response.get('error')}")
+                return {'success': False, 'error': response.get('error')}
+            data = response.get('data') or {}
+            balances = data.get('balances', []) if isinstance(data, dict) else data
+            return {
+                'success': True,
+                'balances': {item.get('asset'): Decimal(str(item.get('free', '0') or '0')) for item in balances}
+            }
+
+        concurrency = resolve_concurrency(
+            concurrency, service='sapi', task_count=len(accounts),
+            weight_per_task=estimate_weight(SUB_ASSETS_ENDPOINT))
+        snapshots, _ = run_batch(accounts, load_balance, concurrency)
+        available = {
+            account: snapshot['balances'] for account, snapshot in zip(accounts, snapshots) if snapshot.get('success')
+        }
+
+        # 各账号、资产的转入来自哪些分组
+        incoming = {}
+        for leg in self.legs:
+            incoming.setdefault((leg.to_email, leg.asset), set()).add(leg.lane)
+
+        # (分组, 账号, 资产) -> 本分组中已排在前面的转入金额
+        credits = {}
+        executable = []
+        for leg in self.legs:
+            balances = available.get(leg.from_email)
+            if balances is not None:
+                credit_key = (leg.lane, leg.from_email, leg.asset)
+                free = balances.get(leg.asset, Decimal('0'))
+                credit = credits.get(credit_key, Decimal('0'))
+                if free + credit < leg.amount:
+                    if incoming.get((leg.from_email, leg.asset), set()) - {leg.lane}:
+                        # 其他分组的转入可能先到账，交由交易所校验
+                        balances[leg.asset] = Decimal('0')
+                        credits[credit_key] = Decimal('0')
+                    else:
+                        leg.success = False
+                        leg.message = f"余额不足: 可用 {_format_amount(free + credit)} {leg.asset}，需要 {_format_amount(leg.amount)}"
+                        self.rejected += 1
+                        self._finish_leg(leg)
+                        continue
+                else:
+                    used = min(credit, leg.amount)
+                    credits[credit_key] = credit - used
+                    balances[leg.asset] = free - (leg.amount - used)
+            credit_key = (leg.lane, leg.to_email, leg.asset)
+            credits[credit_key] = credits.get(credit_key, Decimal('0')) + leg.amount
+            executable.append(leg)
+
+        self.executable = executable
+        self.timings['snapshot_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return self
+
+    # ---------- 执行 ----------
+
+    def execute(self, concurrency=None, on_result=None):
+        """
+        按分组并发执行转账
+
+        参数:
+        - concurrency: 并发分组数(可选)
+        - on_result: 每笔请求有结果时调用(在调用线程中执行)，参数为结果字典
+        """
+        started = time.perf_counter()
+        legs = self.executable if self.executable is not None else self.legs
+        lanes = {}
+        for leg in legs:
+            lanes.setdefault(leg.lane, []).append(leg)
+        lanes = list(lanes.values())
+
+        # 构建前已完成的请求(参数错误、完全抵消、余额不足)
+        if on_result:
+            for result in self.results:
+                if result is not None:
+                    on_result(result)
+
+        concurrency = resolve_concurrency(concurrency, service='sapi', task_count=len(lanes))
+        for _, lane in iter_batch(lanes, self._run_lane, concurrency):
+            for leg in lane:
+                for index in self._finish_leg(leg):
+                    if on_result:
+                        on_result(self.results[index])
+
+        self.timings['execute_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        self.timings['total_ms'] = round((time.perf_counter() - self._started) * 1000, 1)
+        logger.info(f"批量转账完成: 请求 {len(self.entries)} 笔，实际转账 {len(legs)} 笔，分组 {len(lanes)} 个，"
+                    f"轧差 {self.netted} 笔，拒绝 {self.rejected} 笔，耗时 {self.timings['total_ms']}ms")
+        return self
+
+    def _run_lane(self, lane):
+        for leg in lane:
+            leg.started_ms = self._elapsed_ms()
+            try:
+                response = self._transfer(leg)
+                leg.success = bool(response.get('success'))
+                leg.message = "转账成功" if leg.success else response.get('error', "转账失败")
+                leg.tx_id = (response.get('data') or {}).get('txID') or (response.get('data') or {}).get('tranId')
+            except Exception as e:
+                logger.exception(f"转账异常: {str(e)}")
+                leg.success = False
+                leg.message = f"处理异常: {str(e)}"
+            leg.finished_ms = self._elapsed_ms()
+        return lane
+
+    def _transfer(self, leg):
+        amount = _format_amount(leg.amount)
+        if leg.to_email is None:
+            # 子账号转主账号使用子账号自己的API
+            from app.services.binance_client import get_client_by_email
+
+            sub_client = get_client_by_email(leg.from_email)
+            if not sub_client:
+                return {'success': False, 'error': f"子账号 {leg.from_email} 未配置API密钥，无法执行向主账号的转账"}
+            return sub_client._send_request(
+                'POST', '/sapi/v1/sub-account/transfer/subToMaster', signed=True,
+                params={'asset': leg.asset, 'amount': amount}
+            )
+        if leg.from_email is None:
+            return self.master_client.sub_account_transfer(
+                from_email='', to_email=leg.to_email, asset=leg.asset, amount=amount, transfer_type='MASTER_TO_SUB')
+        return self.master_client.sub_account_transfer(
+            from_email=leg.from_email, to_email=leg.to_email, asset=leg.asset, amount=amount, transfer_type='SUB_TO_SUB')
+
+    # ---------- 结果 ----------
+
+    def _elapsed_ms(self):
+        return round((time.perf_counter() - self._started) * 1000, 1)
+
+    def _finish_entry(self, index, success, message, leg=None):
+        entry = self.entries[index]
+        result = {key: value for key, value in entry.items() if key not in ('fromEmail', 'toEmail', 'asset', 'amount')}
+        result.update({
+            'index': index,
+            'fromEmail': entry.get('fromEmail') or MASTER_LABEL,
+            'toEmail': entry.get('toEmail') or MASTER_LABEL,
+            'asset': entry.get('asset'),
+            'amount': entry.get('amount'),
+            'success': success,
+            'message': message
+        })
+        if leg is not None:
+            result['txID'] = leg.tx_id
+            result['started_ms'] = leg.started_ms
+            result['finished_ms'] = leg.finished_ms
+            if len(leg.sources) > 1:
+                result['nettedWith'] = [source for source in leg.sources if source != index]
+        self.results[index] = result
+
+    def _finish_leg(self, leg):
+        """将转账结果写入其合并的每个请求，返回请求序号"""
+        message = leg.message
+        if leg.success and len(leg.sources) > 1:
+            message = f"已轧差，实际转账 {leg.from_email or MASTER_LABEL} -> {leg.to_email or MASTER_LABEL} {_format_amount(leg.amount)} {leg.asset}"
+        for index in leg.sources:
+            self._finish_entry(index, leg.success, message, leg)
+        return leg.sources
+
+    def ledger(self):
+        """
+        返回统一的转账明细
+
+        返回:
+        - dict: results(与请求顺序一致) / legs(实际转账) / 统计 / 耗时
+        """
+        results = [result for result in self.results if result is not None]
+        success_count = sum(1 for result in results if result.get('success'))
+        return {
+            'results': results,
+            'legs': [leg.to_dict() for leg in self.legs],
+            'total': len(results),
+            'success': success_count,
+            'fail': len(results) - success_count,
+            'transfers': sum(1 for leg in self.legs if leg.started_ms is not None),
+            'netted': self.netted,
+            'rejected': self.rejected,
+            'timings': self.timings
+        }
+
+
+def execute_transfers(master_client, entries, check_balance=True, concurrency=None, on_result=None):
+    """
+    规划并执行批量转账
+
+    参数:
+    - master_client: 主账号 BinanceClient
+    - entries: 转账请求列表
+    - check_balance: 是否查询余额快照预检
+    - concurrency: 并发数(可选)
+    - on_result: 每笔请求有结果时调用
+
+    返回:
+    - dict: 转账明细，见 TransferPlan.ledger
+    """
+    plan = TransferPlan(master_client, entries).build()
+    if check_balance and plan.legs:
+        plan.validate(concurrency)
+    plan.execute(concurrency, on_result)
+    return plan.ledger()
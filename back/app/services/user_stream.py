@@ -0,0 +1,565 @@
+# -*- coding: utf-8 -*-
+"""
+用户数据流模块
+
+为子账号建立币安用户数据流(WebSocket)，把订单推送写入进程内的订单状态缓存，
+查询订单状态时优先读取缓存，不再反复调用REST接口轮询。
+
+说明:
+1. 每个(子账号, 市场)一条数据流，在独立线程的事件循环中运行
+2. 通过REST创建listenKey，并按 USER_STREAM_KEEPALIVE_INTERVAL 定时延期
+3. 处理 ORDER_TRADE_UPDATE(U本位合约/统一账户UM) 和 executionReport(现货/杠杆) 事件
+4. 连接断开或listenKey过期后自动重连，重连后用REST补齐缓存中未完结订单的状态；
+   连续失败时等待时间从 USER_STREAM_RECONNECT_DELAY 开始指数增长(带随机抖动)，最长 USER_STREAM_RECONNECT_MAX_DELAY 秒
+5. listenKey接口返回密钥无效(-2015/-2014)时停止重连，同一密钥不再重新启动数据流
+6. 账号没有RUNNING网格且超过 USER_STREAM_IDLE_TIMEOUT 秒未调用 ensure_stream 时，后台线程停止该账号的数据流
+7. WebSocket地址可通过配置 USER_STREAM_WS_URLS 覆盖，便于连接本地模拟服务测试
+"""
+
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+try:
+    import websockets
+except ImportError:  # pragma: no cover - 未安装时用户数据流不可用，自动回退为REST查询
+    websockets = None
+
+logger = logging.getLogger(__name__)
+
+# 各市场的listenKey接口、WebSocket地址和单个订单查询接口
+STREAM_MARKETS = {
+    'um': {
+        'listen_key': '/fapi/v1/listenKey',
+        'ws_url': 'wss://fstream.binance.com/ws/',
+        'order': '/fapi/v1/order'
+    },
+    'papi': {
+        'listen_key': '/papi/v1/listenKey',
+        'ws_url': 'wss://fstream.binance.com/pm/ws/',
+        'order': '/papi/v1/um/order'
+    },
+    'margin': {
+        'listen_key': '/sapi/v1/userDataStream',
+        'ws_url': 'wss://stream.binance.com:9443/ws/',
+        'order': '/sapi/v1/margin/order'
+    }
+}
+
+# 订单终态
+FINAL_STATUSES = ('FILLED', 'CANCELED', 'REJECTED', 'EXPIRED', 'EXPIRED_IN_MATCH')
+
+DEFAULT_KEEPALIVE_INTERVAL = 1800
+DEFAULT_RECONNECT_DELAY = 5
+DEFAULT_RECONNECT_MAX_DELAY = 300
+DEFAULT_IDLE_TIMEOUT = 600
+DEFAULT_STORE_SIZE = 10000
+
+# 连接保持超过该秒数后断开，视为正常断线，重连等待时间重新从初始值开始
+STABLE_CONNECTION_SECONDS = 60
+
+# listenKey接口返回这些错误码时密钥本身无效，重连没有意义
+FATAL_LISTEN_KEY_CODES = (-2015, -2014)
+
+
+class ListenKeyError(RuntimeError):
+    """listenKey创建或延期失败"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+    @property
+    def fatal(self):
+        return self.code in FATAL_LISTEN_KEY_CODES
+
+
+def reconnect_backoff(failures, base_delay, max_delay):
+    """
+    连续失败 failures 次后的重连等待时间(秒)
+
+    等待上限按 base_delay * 2^(failures-1) 增长到 max_delay 为止，实际等待取上限的一半再加随机抖动，
+    避免大量数据流在同一时刻断开后同时重连
+    """
+    ceiling = min(max_delay, base_delay * 2 ** max(0, failures - 1))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class OrderStateStore:
+    """
+    订单状态缓存，按(账号, 交易对, 订单号)索引，数据格式与REST订单查询接口一致
+    """
+
+    def __init__(self, max_size=DEFAULT_STORE_SIZE):
+        self.max_size = max_size
+        self._orders = OrderedDict()
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def _key(account, symbol, order_id):
+        return (account or '', (symbol or '').upper(), str(order_id))
+
+    def update(self, account, order):
+        """
+        写入订单状态，旧推送(更新时间更早)不会覆盖新状态
+
+        参数:
+        - account: 账号标识(子账号邮箱)
+        - order: 订单字典，至少包含 symbol / orderId / status
+        """
+        key = self._key(account, order.get('symbol'), order.get('orderId'))
+        with self._condition:
+            current = self._orders.get(key)
+            if current and int(current.get('updateTime') or 0) > int(order.get('updateTime') or 0):
+                return
+            self._orders[key] = order
+            self._orders.move_to_end(key)
+            while len(self._orders) > self.max_size:
+                self._orders.popitem(last=False)
+            self._condition.notify_all()
+
+    def get(self, account, symbol, order_id):
+        """获取订单状态，未缓存时返回None"""
+        with self._condition:
+            return self._orders.get(self._key(account, symbol, order_id))
+
+    def pending(self, account):
+        """获取账号下未完结的订单"""
+        with self._condition:
+            return [
+                order for (order_account, _, _), order in self._orders.items()
+                if order_account == (account or '') and order.get('status') not in FINAL_STATUSES
+            ]
+
+    def wait_for_order(self, account, symbol, order_id, statuses=FINAL_STATUSES, timeout=5):
+        """
+        等待订单进入指定状态
+
+        返回:
+        - 订单字典；超时仍未进入指定状态时返回最后一次的状态(可能为None)
+        """
+        deadline = time.monotonic() + timeout
+        key = self._key(account, symbol, order_id)
+        with self._condition:
+            while True:
+                order = self._orders.get(key)
+                if order and order.get('status') in statuses:
+                    return order
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return order
+                self._condition.wait(remaining)
+
+
+def parse_order_event(event):
+    """
+    将用户数据流的订单事件转换为REST订单格式
+
+    返回:
+    - 订单字典；非订单事件返回None
+    """
+    event_type = event.get('e')
+
+    if event_type == 'ORDER_TRADE_UPDATE':
+        data = event.get('o') or {}
+        return {
+            'symbol': data.get('s'),
+            'orderId': data.get('i'),
+            'clientOrderId': data.get('c'),
+            'side': data.get('S'),
+            'type': data.get('o'),
+            'status': data.get('X'),
+            'price': data.get('p'),
+            'avgPrice': data.get('ap'),
+            'origQty': data.get('q'),
+            'executedQty': data.get('z'),
+            'positionSide': data.get('ps'),
+            'lastFilledQty': data.get('l'),
+            'commission': data.get('n'),
+            'commissionAsset': data.get('N'),
+            'updateTime': data.get('T') or event.get('E')
+        }
+
+    if event_type == 'executionReport':
+        return {
+            'symbol': event.get('s'),
+            'orderId': event.get('i'),
+            'clientOrderId': event.get('c'),
+            'side': event.get('S'),
+            'type': event.get('o'),
+            'status': event.get('X'),
+            'price': event.get('p'),
+            'origQty': event.get('q'),
+            'executedQty': event.get('z'),
+            'cummulativeQuoteQty': event.get('Z'),
+            'lastFilledQty': event.get('l'),
+            'commission': event.get('n'),
+            'commissionAsset': event.get('N'),
+            'updateTime': event.get('T') or event.get('E')
+        }
+
+    return None
+
+
+class UserDataStream:
+    """
+    单个子账号在单个市场上的用户数据流
+    """
+
+    def __init__(self, account, client, market, store, ws_url, app,
+                 keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL, reconnect_delay=DEFAULT_RECONNECT_DELAY,
+                 reconnect_max_delay=DEFAULT_RECONNECT_MAX_DELAY):
+        self.account = account
+        self.client = client
+        self.market = market
+        self.store = store
+        self.ws_url = ws_url
+        self.app = app
+        self.keepalive_interval = keepalive_interval
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+
+        self.endpoints = STREAM_MARKETS[market]
+        self.listen_key = None
+        self.connected = False
+        self.connected_at = None
+        self.last_event_at = None
+        self.reconnects = 0
+        self.failures = 0
+        self.error = None
+        self.last_used = time.monotonic()
+
+        self._stop_event = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def live(self):
+        """数据流是否已连接，已连接时缓存中的订单状态可直接使用"""
+        return self.connected and not self._stop_event.is_set()
+
+    def start(self, wait=5):
+        """启动数据流线程，并最多等待 wait 秒直到首次连接成功"""
+        self._thread = threading.Thread(
+            target=self._run, name=f"user-stream-{self.market}-{self.account}", daemon=True)
+        self._thread.start()
+        self._ready.wait(wait)
+        return self.live
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def fatal(self):
+        """是否因密钥无效而停止"""
+        return self.error is not None
+
+    def status(self):
+        return {
+            'account': self.account,
+            'market': self.market,
+            'connected': self.live,
+            'connected_at': self.connected_at,
+            'last_event_at': self.last_event_at,
+            'reconnects': self.reconnects,
+            'error': self.error
+        }
+
+    # ---------- listenKey ----------
+
+    def _create_listen_key(self):
+        result = self.client._send_request('POST', self.endpoints['listen_key'])
+        if not result.get('success'):
+            raise ListenKeyError(f"创建listenKey失败: {result.get('error')}", result.get('code'))
+        return result['data']['listenKey']
+
+    def _keepalive(self):
+        params = {'listenKey': self.listen_key} if self.market == 'margin' else None
+        result = self.client._send_request('PUT', self.endpoints['listen_key'], params=params)
+        if not result.get('success'):
+            if result.get('code') in FATAL_LISTEN_KEY_CODES:
+                raise ListenKeyError(f"listenKey延期失败: {result.get('error')}", result.get('code'))
+            logger.warning(f"listenKey延期失败: 账号={self.account}, 市场={self.market}, 错误={result.get('error')}")
+        return result.get('success', False)
+
+    # ---------- 补齐 ----------
+
+    def _backfill(self):
+        """重连后用REST补齐缓存中未完结订单的状态，避免断线期间丢失推送"""
+        for order in self.store.pending(self.account):
+            result = self.client._send_request('GET', self.endpoints['order'], signed=True, params={
+                'symbol': order.get('symbol'),
+                'orderId': order.get('orderId')
+            })
+            if result.get('success') and isinstance(result.get('data'), dict):
+                self.store.update(self.account, result['data'])
+
+    # ---------- 主循环 ----------
+
+    def _run(self):
+        with self.app.app_context():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self._run_forever())
+            finally:
+                loop.close()
+                self.connected = False
+                self._ready.set()
+
+    async def _run_forever(self):
+        first = True
+        while not self._stop_event.is_set():
+            previous_connected_at = self.connected_at
+            try:
+                self.listen_key = self._create_listen_key()
+                if not first:
+                    self._backfill()
+                await self._consume()
+            except ListenKeyError as e:
+                if e.fatal:
+                    self.error = str(e)
+                    logger.error(f"用户数据流已停止，API密钥无效: 账号={self.account}, 市场={self.market}, 错误={str(e)}")
+                    self._stop_event.set()
+                else:
+                    logger.warning(f"用户数据流断开: 账号={self.account}, 市场={self.market}, 错误={str(e)}")
+            except Exception as e:
+                logger.warning(f"用户数据流断开: 账号={self.account}, 市场={self.market}, 错误={str(e)}")
+            finally:
+                self.connected = False
+                # 首次连接失败也要放行等待方，由调用方回退到REST查询
+                self._ready.set()
+
+            if self._stop_event.is_set():
+                break
+
+            # 连接保持了足够长时间才断开时重新计算失败次数
+            connected_at = self.connected_at if self.connected_at != previous_connected_at else None
+            if connected_at and time.time() - connected_at >= STABLE_CONNECTION_SECONDS:
+                self.failures = 0
+            self.failures += 1
+            first = False
+            self.reconnects += 1
+            await self._sleep(reconnect_backoff(self.failures, self.reconnect_delay, self.reconnect_max_delay))
+
+    async def _sleep(self, seconds):
+        """等待重连，停止时立即返回"""
+        deadline = time.monotonic() + seconds
+        while not self._stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, 1))
+
+    async def _consume(self):
+        url = self.ws_url.rstrip('/') + '/' + self.listen_key
+        async with websockets.connect(url, ping_interval=60, open_timeout=10) as ws:
+            self.connected = True
+            self.connected_at = time.time()
+            self._ready.set()
+            logger.info(f"用户数据流已连接: 账号={self.account}, 市场={self.market}")
+
+            next_keepalive = time.monotonic() + self.keepalive_interval
+            while not self._stop_event.is_set():
+                if time.monotonic() >= next_keepalive:
+                    self._keepalive()
+                    next_keepalive = time.monotonic() + self.keepalive_interval
+
+                try:
+                    message = await asyncio.wait_for(ws.recv(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+
+                self._handle(message)
+
+    def _handle(self, message):
+        try:
+            event = json.loads(message)
+        except (TypeError, ValueError):
+            return
+
+        # 组合流格式 {"stream": ..., "data": {...}}
+        if 'data' in event and 'e' not in event:
+            event = event['data']
+
+        self.last_event_at = time.time()
+
+        if event.get('e') == 'listenKeyExpired':
+            raise RuntimeError("listenKey已过期")
+
+        order = parse_order_event(event)
+        if order and order.get('orderId') is not None:
+            self.store.update(self.account, order)
+
+
+class UserStreamManager:
+    """
+    管理所有子账号的用户数据流，进程内共享一个实例
+    """
+
+    def __init__(self, enabled=True, ws_urls=None, keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL,
+                 reconnect_delay=DEFAULT_RECONNECT_DELAY, reconnect_max_delay=DEFAULT_RECONNECT_MAX_DELAY,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.enabled = enabled and websockets is not None
+        self.ws_urls = ws_urls or {}
+        self.keepalive_interval = keepalive_interval
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.idle_timeout = idle_timeout
+        self.store = OrderStateStore()
+
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._app = None
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+
+    def ensure_stream(self, account, client, market='um', wait=5):
+        """
+        确保账号在指定市场上的数据流已启动
+
+        参数:
+        - account: 账号标识(子账号邮箱)
+        - client: 该账号的 BinanceClient 实例
+        - market: um / papi / margin
+        - wait: 首次启动时等待连接的秒数
+
+        返回:
+        - bool: 数据流是否已连接
+        """
+        if not self.enabled or not account or market not in STREAM_MARKETS:
+            return False
+
+        key = (account, market)
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is not None:
+                stream.last_used = time.monotonic()
+                if stream.running:
+                    return stream.live
+                if stream.fatal and getattr(stream.client, 'api_key', None) == getattr(client, 'api_key', None):
+                    # 密钥无效，更换密钥前不再重试
+                    return False
+
+            self._app = current_app._get_current_object()
+            stream = UserDataStream(
+                account, client, market, self.store,
+                ws_url=self.ws_urls.get(market) or STREAM_MARKETS[market]['ws_url'],
+                app=self._app,
+                keepalive_interval=self.keepalive_interval,
+                reconnect_delay=self.reconnect_delay,
+                reconnect_max_delay=self.reconnect_max_delay
+            )
+            self._streams[key] = stream
+            self._start_reaper()
+
+        return stream.start(wait)
+
+    def is_live(self, account, market='um'):
+        """账号在指定市场上的数据流是否已连接"""
+        stream = self._streams.get((account, market))
+        return stream is not None and stream.live
+
+    def stop(self, account, market=None):
+        """停止账号的数据流"""
+        with self._lock:
+            for key in list(self._streams.keys()):
+                if key[0] == account and (market is None or key[1] == market):
+                    self._streams.pop(key).stop()
+
+    def status(self):
+        with self._lock:
+            return [stream.status() for stream in self._streams.values()]
+
+    # ---------- 空闲释放 ----------
+
+    def release_idle(self, active_accounts):
+        """
+        停止不再需要的数据流: 账号没有运行中的网格，且超过 idle_timeout 秒未调用 ensure_stream
+
+        参数:
+        - active_accounts: 有RUNNING网格的账号集合
+
+        返回:
+        - list: 已停止的 (账号, 市场)
+        """
+        now = time.monotonic()
+        released = []
+        with self._lock:
+            for key, stream in list(self._streams.items()):
+                if key[0] in active_accounts or now - stream.last_used < self.idle_timeout:
+                    continue
+                if stream.fatal and not stream.running:
+                    # 保留密钥无效的记录，避免 ensure_stream 用同一密钥反复重试
+                    continue
+                self._streams.pop(key).stop()
+                released.append(key)
+        if released:
+            logger.info(f"已停止空闲的用户数据流: {released}")
+        return released
+
+    def _start_reaper(self):
+        if not self.idle_timeout or (self._reaper is not None and self._reaper.is_alive()):
+            return
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(target=self._reap, name='user-stream-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        from app.models import db
+        from app.models.trading import GridTrading
+
+        interval = max(1.0, min(60.0, self.idle_timeout / 2))
+        while not self._reaper_stop.wait(interval):
+            with self._app.app_context():
+                try:
+                    rows = db.session.query(GridTrading.email).filter(GridTrading.status == 'RUNNING').distinct()
+                    self.release_idle({email for (email,) in rows})
+                except Exception as e:
+                    logger.error(f"检查空闲用户数据流失败: {str(e)}")
+                finally:
+                    db.session.remove()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_user_stream_manager():
+    """
+    获取进程级共享的用户数据流管理器，首次调用时读取应用配置
+    """
+    global _manager
+
+    if _manager is not None:
+        return _manager
+
+    with _manager_lock:
+        if _manager is None:
+            options = {}
+            if has_app_context():
+                config = current_app.config
+                options = {
+                    'enabled': config.get('USER_STREAM_ENABLED', True),
+                    'ws_urls': config.get('USER_STREAM_WS_URLS'),
+                    'keepalive_interval': config.get('USER_STREAM_KEEPALIVE_INTERVAL', DEFAULT_KEEPALIVE_INTERVAL),
+                    'reconnect_delay': config.get('USER_STREAM_RECONNECT_DELAY', DEFAULT_RECONNECT_DELAY),
+                    'reconnect_max_delay': config.get('USER_STREAM_RECONNECT_MAX_DELAY', DEFAULT_RECONNECT_MAX_DELAY),
+                    'idle_timeout': config.get('USER_STREAM_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT)
+                }
+            _manager = UserStreamManager(**options)
+        return _manager
+
+
+def get_order_store():
+    """获取共享的订单状态缓存"""
+    return get_user_stream_manager().store
@@ -0,0 +1,226 @@
+"""
+数据库工具模块
+
+说明:
+1. upgrade_schema: db.create_all 只创建不存在的表，已有表新增的可空列和索引由这里补充(ALTER TABLE ADD COLUMN / CREATE INDEX)
+2. insert_ignore: 批量插入并忽略唯一键冲突，SQLite 和 PostgreSQL 使用 ON CONFLICT DO NOTHING，
+   可返回实际插入的行，用于保证重复同步时结果不变
+3. keyset_paginate: 按排序列的游标翻页(WHERE (time, id) < 上一页最后一行)，页面加载时间与翻页深度无关
+"""
+import base64
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import and_, inspect, insert, or_, select
+
+from app.models import db
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_schema():
+    """
+    为已存在的表补充模型中新增的可空列，需在应用上下文中调用
+
+    返回:
+    - list: 新增的列(格式为 "表名.列名")和新创建的索引名
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable or column.primary_key:
+                    logger.warning(f"表 {table.name} 缺少非空列 {column.name}，无法自动添加")
+                    continue
+
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+                added.append(f"{table.name}.{column.name}")
+
+    if added:
+        logger.info(f"数据库结构已更新，新增列: {', '.join(added)}")
+
+    created = ensure_indexes(existing_tables)
+    return added + created
+
+
+def ensure_indexes(tables=None):
+    """
+    创建模型中定义但数据库中不存在的索引
+
+    参数:
+    - tables: 需要检查的表名集合(可选)，默认全部表
+
+    返回:
+    - list: 新创建的索引名
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables or (tables is not None and table.name not in tables):
+            continue
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            index.create(bind=engine, checkfirst=True)
+            created.append(index.name)
+
+    if created:
+        logger.info(f"已创建索引: {', '.join(created)}")
+    return created
+
+
+def insert_ignore(model, rows, conflict_columns, returning=None, session=None):
+    """
+    批量插入记录，唯一键冲突的记录跳过，不提交事务
+
+    参数:
+    - model: 模型类
+    - rows: 字典列表，键为列名
+    - conflict_columns: 唯一键列名列表
+    - returning: 需要返回的列名(可选)，返回实际插入的记录中该列的值
+    - session: 使用的会话(可选)，默认 db.session
+
+    返回:
+    - list: 指定 returning 时为实际插入记录的该列值，否则为空列表
+    """
+    if not rows:
+        return []
+
+    session = session or db.session
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        # 通过连接执行(不经过ORM批量插入)，冲突跳过的行不会被当作插入失败
+        connection = session.connection()
+        statement = dialect_insert(model.__table__).on_conflict_do_nothing(index_elements=conflict_columns)
+        if returning:
+            statement = statement.returning(model.__table__.c[returning])
+            return list(connection.execute(statement, rows).scalars())
+
+        connection.execute(statement, rows)
+        return []
+
+    # 其他数据库: 先查询已存在的唯一键，只插入新记录
+    key_columns = [getattr(model, column) for column in conflict_columns]
+    keys = {tuple(row[column] for column in conflict_columns) for row in rows}
+    existing = set()
+    if len(conflict_columns) == 1:
+        existing = {(value,) for value in session.execute(
+            select(key_columns[0]).where(key_columns[0].in_([key[0] for key in keys]))
+        ).scalars()}
+    else:
+        for key in keys:
+            if session.execute(select(*key_columns).filter_by(**dict(zip(conflict_columns, key)))).first():
+                existing.add(key)
+
+    new_rows = []
+    for row in rows:
+        key = tuple(row[column] for column in conflict_columns)
+        if key not in existing:
+            existing.add(key)
+            new_rows.append(row)
+
+    if new_rows:
+        session.execute(insert(model), new_rows)
+    return [row[returning] for row in new_rows] if returning else []
+
+
+def encode_cursor(values):
+    """将上一页最后一行的排序列值编码为游标字符串"""
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """
+    解析游标字符串
+
+    返回:
+    - list: 与 columns 对应的值，日期时间列转换为 datetime
+
+    异常:
+    - ValueError: 游标格式无效
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('无效的分页游标')
+
+    decoded = []
+    for column, value in zip(columns, values):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = None
+        if python_type is datetime and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        decoded.append(value)
+    return decoded
+
+
+def keyset_paginate(query, order_columns, cursor=None, limit=20, descending=True, scalars=False):
+    """
+    按游标翻页查询
+
+    参数:
+    - query: select 语句，不含排序和分页
+    - order_columns: 排序列列表，最后一列必须唯一(如 (trade_time, id))
+    - cursor: 上一页返回的 next_cursor，为空时查询第一页
+    - limit: 每页数量
+    - descending: 是否倒序(新的在前)
+    - scalars: 查询的是模型对象时为True
+
+    返回:
+    - (rows, next_cursor): 没有下一页时 next_cursor 为None
+
+    异常:
+    - ValueError: 游标格式无效
+    """
+    if cursor:
+        values = decode_cursor(cursor, order_columns)
+        query = query.where(_keyset_condition(order_columns, values, descending))
+
+    ordering = [column.desc() if descending else column.asc() for column in order_columns]
+    result = db.session.execute(query.order_by(*ordering).limit(limit + 1))
+    rows = result.scalars().all() if scalars else result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in order_columns])
+    return rows, next_cursor
+
+
+def _keyset_condition(columns, values, descending):
+    # (a, b) < (x, y) 展开为 a < x OR (a = x AND b < y)，兼容不支持行值比较的数据库
+    conditions = []
+    for index, (column, value) in enumerate(zip(columns, values)):
+        compare = column < value if descending else column > value
+        equals = [prior == prior_value for prior, prior_value in zip(columns[:index], values[:index])]
+        conditions.append(and_(*equals, compare) if equals else compare)
+    return or_(*conditions)
@@ -0,0 +1,131 @@
+"""
+数据库引擎配置模块
+
+说明:
+1. SQLite: 每个连接建立时设置 WAL 日志、synchronous=NORMAL、busy_timeout 和 mmap_size，
+   读写可以并发进行，写入冲突时等待而不是立即报 "database is locked"
+2. PostgreSQL 等其他数据库: 使用连接池(pool_size / max_overflow)，并在取出连接前检测连接是否有效
+3. 数据库地址优先使用环境变量 DATABASE_URL，未设置时使用数据目录下的 app.db
+"""
+import logging
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# SQLite 默认参数
+DEFAULT_SQLITE_JOURNAL_MODE = 'WAL'
+DEFAULT_SQLITE_SYNCHRONOUS = 'NORMAL'
+DEFAULT_SQLITE_BUSY_TIMEOUT = 15000  # 毫秒
+DEFAULT_SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+# 连接池默认参数
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+
+
+def resolve_database_uri(data_dir):
+    """
+    获取数据库地址，环境变量 DATABASE_URL 优先
+
+    参数:
+    - data_dir: 数据目录，未设置 DATABASE_URL 时使用其中的 app.db
+    """
+    uri = os.environ.get('DATABASE_URL')
+    if not uri:
+        return 'sqlite:///' + os.path.join(data_dir, 'app.db')
+    # 部分托管平台提供的地址使用 postgres:// 前缀，SQLAlchemy 只识别 postgresql://
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def is_sqlite_memory(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def build_engine_options(uri, config):
+    """
+    根据数据库类型生成 SQLALCHEMY_ENGINE_OPTIONS
+
+    参数:
+    - uri: 数据库地址
+    - config: 应用配置
+    """
+    url = make_url(uri)
+    if is_sqlite_memory(url):
+        return {}
+
+    options = {
+        'pool_size': config.get('DATABASE_POOL_SIZE', DEFAULT_POOL_SIZE),
+        'max_overflow': config.get('DATABASE_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW),
+        'pool_timeout': config.get('DATABASE_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)
+    }
+
+    if url.get_backend_name() == 'sqlite':
+        # 连接在网格监控、后台任务等线程间复用；busy_timeout 同时作为驱动层的等待时间
+        options['connect_args'] = {
+            'check_same_thread': False,
+            'timeout': config.get('SQLITE_BUSY_TIMEOUT', DEFAULT_SQLITE_BUSY_TIMEOUT) / 1000.0
+        }
+    else:
+        options['pool_pre_ping'] = True
+        options['pool_recycle'] = config.get('DATABASE_POOL_RECYCLE', DEFAULT_POOL_RECYCLE)
+
+    return options
+
+
+def apply_sqlite_pragmas(engine, config):
+    """
+    为 SQLite 引擎注册连接事件，每个新连接执行 PRAGMA 设置
+    """
+    if engine.dialect.name != 'sqlite' or is_sqlite_memory(engine.url):
+        return
+
+    pragmas = [
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE', DEFAULT_SQLITE_JOURNAL_MODE)),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS', DEFAULT_SQLITE_SYNCHRONOUS)),
+        ('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT', DEFAULT_SQLITE_BUSY_TIMEOUT))),
+        ('mmap_size', int(config.get('SQLITE_MMAP_SIZE', DEFAULT_SQLITE_MMAP_SIZE)))
+    ]
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                if value is not None and value != '':
+                    cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def configure_database(app, data_dir):
+    """
+    设置数据库地址和引擎参数，需在 db.init_app 之前调用
+
+    参数:
+    - app: Flask应用
+    - data_dir: 数据目录
+    """
+    uri = resolve_database_uri(data_dir)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+
+    options = build_engine_options(uri, app.config)
+    # 配置中显式设置的引擎参数优先
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def init_engine(app, db):
+    """
+    db.init_app 之后调用，为 SQLite 引擎注册 PRAGMA 设置
+    """
+    with app.app_context():
+        engine = db.engine
+        apply_sqlite_pragmas(engine, app.config)
+        logger.info(f"数据库: {engine.url.render_as_string(hide_password=True)}")
@@ -6,6 +6,7 @@ import os
 import logging
 from flask import Flask
 from app.models import db
+from app.utils.db_engine import configure_database, init_engine
 
 # 配置日志 - 提高级别以减少日志输出
 logging.basicConfig(
@@ -28,10 +29,10 @@ def init_db():
     # 加载配置
     app.config.from_mapping(
         SECRET_KEY='dev',
-        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(data_dir, 'app.db'),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
         DATA_DIR=data_dir
     )
+    configure_database(app, data_dir)
     
     # 确保实例文件夹存在
     try:
@@ -41,10 +42,13 @@ def init_db():
     
     # 初始化数据库
     db.init_app(app)
+    init_engine(app, db)
     
     # 在应用上下文中创建所有表
     with app.app_context():
         db.create_all()
+        from app.utils.db import upgrade_schema
+        upgrade_schema()
         logger.warning('数据库表创建成功！')  # 从info改为warning
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+网格监控测试: 使用临时SQLite数据库和模拟客户端，不访问币安
+
+运行: cd back && python -m pytest tests/test_grid_monitor.py
+"""
+
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+from flask import Flask
+
+from app.models import db, GridTrading
+from app.services.grid_monitor import GridMonitor
+
+
+class FakeClient:
+    """挂单查询始终返回监控中的订单(未成交)"""
+
+    def __init__(self, order_ids):
+        self.order_ids = order_ids
+
+    def _send_request(self, method, path, signed=False, params=None):
+        if path.endswith('/openOrders'):
+            return {'success': True, 'data': [
+                {'orderId': order_id, 'symbol': 'BTCUSDT', 'status': 'NEW', 'executedQty': '0'}
+                for order_id in self.order_ids
+            ]}
+        return {'success': True, 'data': []}
+
+
+class GridMonitorWatchTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = Flask(__name__)
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI=f'sqlite:///{self.db_path}',
+            USER_STREAM_ENABLED=False
+        )
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.monitor = GridMonitor(workers=1, poll_interval=60, order_timeout=60)
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.context.pop()
+        os.remove(self.db_path)
+
+    def add_grid(self, grid_id, **values):
+        # 与 submit_and_monitor_grid 相同: 刚提交的网格为RUNNING，updated_at 为当前时间
+        grid = GridTrading(
+            grid_id=grid_id, email='a@test.com', symbol='BTCUSDT', total_investment=100, grid_levels=2,
+            upper_price=2, lower_price=1, grid_prices='[1, 2]', status='RUNNING', updated_at=datetime.utcnow(),
+            **values
+        )
+        db.session.add(grid)
+        db.session.commit()
+
+    def watch(self, grid_id):
+        order_pairs = [[
+            {'order_id': '1', 'side': 'BUY', 'amount': 1},
+            {'order_id': '2', 'side': 'SELL', 'amount': 1}
+        ]]
+        return self.monitor.watch(grid_id, FakeClient(['1', '2']), 'a@test.com', 'BTCUSDT', order_pairs, {})
+
+    def owner_of(self, grid_id):
+        db.session.expire_all()
+        return GridTrading.query.filter_by(grid_id=grid_id).one().monitor_owner
+
+    def test_new_grid_stays_watched(self):
+        self.add_grid('g1')
+
+        self.assertTrue(self.watch('g1'))
+        self.assertEqual(self.owner_of('g1'), self.monitor.owner)
+
+        watch = self.monitor._grids['g1']
+        self.assertFalse(self.monitor._check_grid(watch))
+        self.assertIn('g1', self.monitor._grids)
+        self.assertEqual(self.owner_of('g1'), self.monitor.owner)
+
+        # 调度器的首次检查之后仍在监控中
+        time.sleep(0.5)
+        self.assertIn('g1', self.monitor._grids)
+
+    def test_grid_owned_by_other_monitor_not_watched(self):
+        self.add_grid('g2', monitor_owner='other', monitor_heartbeat=datetime.utcnow())
+
+        self.assertFalse(self.watch('g2'))
+        self.assertNotIn('g2', self.monitor._grids)
+        self.assertEqual(self.owner_of('g2'), 'other')
+
+
+if __name__ == '__main__':
+    unittest.main()
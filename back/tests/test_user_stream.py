@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+用户数据流测试: 连接本地模拟的WebSocket服务，不访问币安
+
+运行: cd back && python -m pytest tests/test_user_stream.py
+"""
+
+import asyncio
+import json
+import threading
+import time
+import unittest
+
+from flask import Flask
+
+from app.services import user_stream
+from app.services.user_stream import OrderStateStore, UserDataStream, UserStreamManager, reconnect_backoff
+
+
+class FakeClient:
+    """只实现listenKey接口的客户端，按顺序返回预设结果"""
+
+    def __init__(self, responses=None, api_key='key'):
+        self.api_key = api_key
+        self.responses = list(responses or [])
+        self.calls = []
+
+    def _send_request(self, method, path, signed=False, params=None):
+        self.calls.append((method, path))
+        if method == 'POST':
+            if self.responses:
+                return self.responses.pop(0)
+            return {'success': True, 'data': {'listenKey': f'key{len(self.calls)}'}}
+        return {'success': True, 'data': {}}
+
+
+class LocalStreamServer:
+    """
+    本地模拟的用户数据流服务: 每个连接推送 messages 中的消息，close_after 为True时推送后立即断开
+    """
+
+    def __init__(self, messages=(), close_after=False):
+        self.messages = list(messages)
+        self.close_after = close_after
+        self.paths = []
+        self.port = None
+
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._stop = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    async def _handler(self, ws):
+        # websockets 13 之前的版本没有 ws.request
+        request = getattr(ws, 'request', None)
+        self.paths.append(request.path if request is not None else ws.path)
+        for message in self.messages:
+            await ws.send(json.dumps(message))
+        if self.close_after:
+            return
+        await ws.wait_closed()
+
+    async def _serve(self):
+        self._stop = asyncio.Event()
+        async with user_stream.websockets.serve(self._handler, '127.0.0.1', 0) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self._ready.set()
+            await self._stop.wait()
+
+    def _run(self):
+        self._loop.run_until_complete(self._serve())
+
+    @property
+    def url(self):
+        return f'ws://127.0.0.1:{self.port}/ws/'
+
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def __exit__(self, *args):
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(5)
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+@unittest.skipIf(user_stream.websockets is None, '未安装 websockets')
+class UserDataStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.store = OrderStateStore()
+
+    def make_stream(self, client, url, **options):
+        return UserDataStream('a@test.com', client, 'um', self.store, url, self.app, **options)
+
+    def test_order_update_written_to_store(self):
+        event = {'e': 'ORDER_TRADE_UPDATE', 'E': 1, 'o': {
+            's': 'BTCUSDT', 'i': 42, 'X': 'FILLED', 'S': 'BUY', 'z': '1', 'T': 2
+        }}
+        with LocalStreamServer([event]) as server:
+            stream = self.make_stream(FakeClient(), server.url)
+            self.assertTrue(stream.start(wait=5))
+            order = self.store.wait_for_order('a@test.com', 'BTCUSDT', 42, timeout=5)
+            stream.stop()
+
+        self.assertEqual(order['status'], 'FILLED')
+        self.assertEqual(server.paths, ['/ws/key1'])
+
+    def test_reconnect_delay_grows(self):
+        with LocalStreamServer(close_after=True) as server:
+            stream = self.make_stream(FakeClient(), server.url, reconnect_delay=0.1, reconnect_max_delay=0.4)
+            stream.start(wait=5)
+            self.assertTrue(wait_until(lambda: len(server.paths) >= 4))
+            stream.stop()
+
+        self.assertGreaterEqual(stream.failures, 3)
+        self.assertTrue(wait_until(lambda: not stream.running))
+
+    def test_invalid_key_stops_stream(self):
+        client = FakeClient([{'success': False, 'error': 'API密钥错误: Invalid API-key', 'code': -2015}])
+        with LocalStreamServer() as server:
+            stream = self.make_stream(client, server.url, reconnect_delay=0.1)
+            self.assertFalse(stream.start(wait=5))
+            self.assertTrue(wait_until(lambda: not stream.running))
+
+        self.assertTrue(stream.fatal)
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(server.paths, [])
+
+
+class ReconnectBackoffTest(unittest.TestCase):
+
+    def test_backoff_is_capped_with_jitter(self):
+        for failures in range(1, 20):
+            ceiling = min(300, 5 * 2 ** (failures - 1))
+            delay = reconnect_backoff(failures, 5, 300)
+            self.assertGreaterEqual(delay, ceiling / 2)
+            self.assertLessEqual(delay, ceiling)
+
+
+@unittest.skipIf(user_stream.websockets is None, '未安装 websockets')
+class UserStreamManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_release_idle_streams(self):
+        with LocalStreamServer() as server:
+            manager = UserStreamManager(ws_urls={'um': server.url}, idle_timeout=0)
+            with self.app.app_context():
+                self.assertTrue(manager.ensure_stream('grid@test.com', FakeClient(), 'um'))
+                self.assertTrue(manager.ensure_stream('idle@test.com', FakeClient(), 'um'))
+
+            released = manager.release_idle({'grid@test.com'})
+            self.assertEqual(released, [('idle@test.com', 'um')])
+            self.assertTrue(manager.is_live('grid@test.com'))
+            self.assertFalse(manager.is_live('idle@test.com'))
+            manager.stop('grid@test.com')
+
+    def test_invalid_key_not_restarted(self):
+        manager = UserStreamManager(ws_urls={'um': 'ws://127.0.0.1:9/ws/'}, idle_timeout=0)
+        client = FakeClient([{'success': False, 'error': 'API密钥错误', 'code': -2014}])
+        with self.app.app_context():
+            self.assertFalse(manager.ensure_stream('bad@test.com', client, 'um'))
+            wait_until(lambda: not manager._streams[('bad@test.com', 'um')].running)
+            self.assertFalse(manager.ensure_stream('bad@test.com', client, 'um'))
+
+        self.assertEqual(len(client.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()